@@ -24,6 +24,7 @@ pages = {
         st.Page("pages/36_📈_Retro_data.py", title="Retro Data", icon="🛰️"),
         st.Page("pages/37_🌿_Dashboard_biodiv.py", title="Biodiv", icon="🌿"),
         st.Page("pages/38_usser_path.py", title="User Path", icon="🛤️"),
+        st.Page("pages/43_📡_Telemetrie_LLM.py", title="Télémétrie LLM", icon="📡"),
     ],
     "Indicateurs Open Data": [
         st.Page("pages/09_🌀_Import_indicateurs.py", title="Import Indicateurs", icon="🌀"),
@@ -1,16 +1,29 @@
 import json
 import logging
-import re
+from contextlib import closing
 from pathlib import Path
 from typing import Callable, Optional
 
 import pandas as pd
 import streamlit as st
 from openai import OpenAI
-from sqlalchemy import text
 
 from utils.db import get_engine
-from utils.db_text import tables_text
+from utils.artefacts_conversation import ArtefactExpire, MagasinArtefacts, TableauStocke
+from utils.db_text import relations_text, tables_text
+from utils.llm_cache import responses_stream
+from utils.schema_retriever import RetrieverSchema
+from utils.sql_lecture import (
+    COUT_MAX,
+    TIMEOUT_MS,
+    CacheResultats,
+    JetonAnnulation,
+    RequeteAnnulee,
+    RequeteRefusee,
+    ResultatSQL,
+    en_parallele,
+    executer_lecture,
+)
 
 st.set_page_config(layout="wide", page_title="IA Transitos", page_icon="🧠")
 
@@ -29,24 +42,24 @@ MAX_TOOL_ITERATIONS = 10
 PREVIEW_ROWS = 20      # apercu renvoye au modele (protege le contexte)
 MAX_TABLE_ROWS = 1000  # plafond d'affichage d'un tableau
 MAX_CHART_ROWS = 1000  # plafond d'affichage d'un graphe
+# Une requete est executee une seule fois, a ce plafond et avec son total ;
+# apercu, tableau et graphe en sont des tranches (cache de la conversation).
+MAX_FETCH_ROWS = max(PREVIEW_ROWS, MAX_TABLE_ROWS, MAX_CHART_ROWS)
 
-# Garde-fous en dur : mots-cles interdits (detection par word-boundary pour ne
-# pas matcher des colonnes comme "created_at" qui contient "create").
-
-FORBIDDEN = (
-    "insert",
-    "update",
-    "delete",
-    "drop",
-    "alter",
-    "create",
-    "truncate",
-    "grant",
-    "revoke",
-)
-_FORBIDDEN_REGEX = re.compile(
-    r"\b(" + "|".join(FORBIDDEN) + r")\b", re.IGNORECASE
-)
+# Documentation OLAP : seules les sections des tables pertinentes pour la
+# question sont envoyees (utils.schema_retriever), dans ce budget de caracteres.
+# None : documentation complete a chaque conversation.
+SCHEMA_BUDGET_CHARS: Optional[int] = 6000
+
+# Garde-fous SQL (mots-cles interdits, timeout TIMEOUT_MS, plafond de cout
+# EXPLAIN COUT_MAX) : voir utils.sql_lecture.
+
+# Appels d'outils d'un meme tour executes en parallele (connexions du pool de
+# get_engine, 5 par defaut : on en laisse pour le reste de l'application).
+MAX_TOOL_CALLS_PARALLELES = 4
+# Delai maximal d'un appel d'outil, au-dela duquel la requete est annulee
+# (le statement_timeout de la base coupe normalement avant).
+TOOL_CALL_TIMEOUT_S = TIMEOUT_MS / 1000 + 10
 
 
 @st.cache_resource(show_spinner=False)
@@ -69,10 +82,54 @@ def load_olap_doc() -> str:
 OLAP_DOC = load_olap_doc()
 
 
+@st.cache_resource(show_spinner=False)
+def get_schema_retriever() -> RetrieverSchema:
+    """Index des sections de la doc OLAP et des cles etrangeres, construit une fois."""
+    return RetrieverSchema(OLAP_DOC, relations_text)
+
+
+def schema_context(user_request: str, schema_envoye: set[str]) -> Optional[str]:
+    """
+    Documentation OLAP a joindre a ce tour : socle + tables pertinentes au
+    premier tour, puis uniquement les sections pas encore envoyees au modele.
+    Met a jour `schema_envoye` (cles des sections et relations transmises).
+    """
+    premier_tour = not schema_envoye
+    if SCHEMA_BUDGET_CHARS is None:
+        schema_envoye.add("*")
+        return OLAP_DOC if premier_tour else None
+
+    retriever = get_schema_retriever()
+    if premier_tour:
+        contexte = retriever.document_initial(user_request, budget_caracteres=SCHEMA_BUDGET_CHARS)
+    else:
+        contexte = retriever.selectionner(
+            user_request, budget_caracteres=SCHEMA_BUDGET_CHARS, deja_envoyees=schema_envoye
+        )
+    schema_envoye.update(contexte.sections, contexte.relations)
+    schema_envoye.add("*")
+    logger.info(
+        "schema_context complet=%s score=%.2f sections=%s relations=%s (%s caracteres)",
+        contexte.complet,
+        contexte.score_max,
+        len(contexte.sections),
+        len(contexte.relations),
+        len(contexte.texte),
+    )
+    return contexte.texte or None
+
+
 # === GARDE-FOUS + EXECUTION SQL ===
-def safe_run_sql(sql: str, limit: int) -> tuple[Optional[pd.DataFrame], Optional[str]]:
+def safe_run_sql(
+    sql: str,
+    limit: int,
+    *,
+    avec_total: bool = False,
+    cache: Optional[CacheResultats] = None,
+    annulation: Optional[JetonAnnulation] = None,
+) -> tuple[Optional[ResultatSQL], Optional[str]]:
     """
-    Valide puis execute une requete SELECT en lecture seule.
+    Valide puis execute une requete SELECT en lecture seule (utils.sql_lecture).
 
     Regles de securite (en dur) :
     - Aucun mot-cle de modification (FORBIDDEN), detecte par word-boundary.
@@ -80,61 +137,39 @@ def safe_run_sql(sql: str, limit: int) -> tuple[Optional[pd.DataFrame], Optional
     - Une seule instruction (pas de ';' en milieu de requete).
     - Emballage systematique dans un sous-select avec LIMIT pour garantir le
       plafond de lignes meme si le modele oublie le LIMIT.
+    - statement_timeout par requete et refus si le cout estime (EXPLAIN)
+      depasse COUT_MAX.
 
-    Retourne (dataframe, None) en cas de succes, (None, message_erreur) sinon.
-    """
-    if not sql or not sql.strip():
-        return None, "Requete SQL vide."
-
-    cleaned = sql.strip()
-
-    # Retirer un eventuel formatage markdown (```sql ... ```)
-    if cleaned.startswith("```"):
-        cleaned = re.sub(r"^```[a-zA-Z]*", "", cleaned).strip()
-        if cleaned.endswith("```"):
-            cleaned = cleaned[:-3].strip()
-
-    # Strip du ';' final eventuel
-    cleaned = cleaned.rstrip().rstrip(";").rstrip()
-
-    # Anti multi-statement : un ';' restant signifie plusieurs instructions
-    if ";" in cleaned:
-        return None, "Plusieurs instructions SQL detectees : une seule requete SELECT est autorisee."
-
-    # Doit commencer par SELECT ou WITH
-    if not re.match(r"^\s*(select|with)\b", cleaned, re.IGNORECASE):
-        return None, "Seules les requetes SELECT (ou WITH ... SELECT) sont autorisees."
-
-    # Mots-cles interdits
-    match = _FORBIDDEN_REGEX.search(cleaned)
-    if match:
-        return None, (
-            f"Requete refusee : commande de modification non autorisee ({match.group(1).upper()})."
-        )
-
-    # Emballage pour garantir le plafond de lignes
-    wrapped = f"SELECT * FROM (\n{cleaned}\n) AS _sub LIMIT {int(limit)}"
+    `avec_total` renvoie aussi le nombre total de lignes, dans la meme requete.
+    `cache` (un par conversation) evite de relancer une requete deja executee.
+    `annulation` interrompt la requete en cours (delai, nouveau message).
 
+    Retourne (resultat, None) en cas de succes, (None, message_erreur) sinon.
+    """
     try:
-        engine = get_engine()
-        with engine.connect() as conn:
-            df = pd.read_sql_query(text(wrapped), conn)
-        return df, None
+        resultat = executer_lecture(
+            get_engine(),
+            sql,
+            limit,
+            avec_total=avec_total,
+            timeout_ms=TIMEOUT_MS,
+            cout_max=COUT_MAX,
+            cache=cache,
+            annulation=annulation,
+        )
+    except RequeteRefusee as exc:
+        return None, str(exc)
+    except RequeteAnnulee:
+        return None, "Requete annulee."
     except Exception as exc:  # noqa: BLE001
         return None, f"Erreur d'execution : {exc}"
-
-
-def _count_rows(sql: str) -> Optional[int]:
-    """Compte le nombre total de lignes du sous-select (best-effort)."""
-    cleaned = sql.strip().rstrip(";").rstrip()
-    count_sql = f"SELECT count(*) AS n FROM (\n{cleaned}\n) AS _sub"
-    try:
-        engine = get_engine()
-        with engine.connect() as conn:
-            row = conn.execute(text(count_sql)).mappings().first()
-        return int(row["n"]) if row is not None else None
-    except Exception:  # noqa: BLE001
-        return None
+    logger.info(
+        "SQL %s : %d ligne(s) en %.2fs",
+        "cache" if resultat.depuis_cache else "base",
+        len(resultat.df),
+        resultat.duree_s,
+    )
+    return resultat, None
 
 
 # === DEFINITION DES OUTILS (function calling) ===
@@ -252,7 +287,9 @@ Regles de choix du schema :
 {tables_text}
 
 ### Documentation detaillee des tables de statistiques (schema public / OLAP) :
-{OLAP_DOC}
+(Extraits retenus pour la question ; des complements peuvent t'etre fournis aux tours suivants.
+La liste des tables et colonnes ci-dessus reste la reference complete.)
+{{doc_olap}}
 
 ### Outils a ta disposition :
 - run_sql_query(sql) : execute une requete SELECT et te renvoie un APERCU (au maximum {PREVIEW_ROWS} lignes)
@@ -316,30 +353,43 @@ def _stream_and_collect(
     **create_kwargs,
 ) -> tuple[object, str]:
     """
-    Execute client.responses.create en streaming.
+    Execute client.responses.create en streaming, via le cache LLM partage.
     Retourne (final_response, accumulated_text).
     """
-    accumulated_text = ""
-    final_response = None
-    tool_call_signaled = False
-
-    stream = client.responses.create(stream=True, **create_kwargs)
-    for event in stream:
-        event_type = getattr(event, "type", "")
-        if event_type == "response.output_text.delta":
-            delta = getattr(event, "delta", "") or ""
-            if delta:
-                accumulated_text += delta
-                if on_text_chunk:
-                    on_text_chunk(accumulated_text)
-        elif event_type == "response.output_item.added":
-            item = getattr(event, "item", None)
-            if item is not None and getattr(item, "type", "") == "function_call":
-                if on_tool_call_started and not tool_call_signaled:
-                    on_tool_call_started()
-                    tool_call_signaled = True
-        elif event_type == "response.completed":
-            final_response = getattr(event, "response", None)
+    def consommer(stream) -> tuple[object, str]:
+        accumulated_text = ""
+        final_response = None
+        tool_call_signaled = False
+        for event in stream:
+            event_type = getattr(event, "type", "")
+            if event_type == "response.output_text.delta":
+                delta = getattr(event, "delta", "") or ""
+                if delta:
+                    accumulated_text += delta
+                    if on_text_chunk:
+                        on_text_chunk(accumulated_text)
+            elif event_type == "response.output_item.added":
+                item = getattr(event, "item", None)
+                if item is not None and getattr(item, "type", "") == "function_call":
+                    if on_tool_call_started and not tool_call_signaled:
+                        on_tool_call_started()
+                        tool_call_signaled = True
+            elif event_type == "response.completed":
+                final_response = getattr(event, "response", None)
+        return final_response, accumulated_text
+
+    final_response, accumulated_text, depuis_cache = responses_stream(
+        client, feature="06_ai_stats_assistant", consommer=consommer, **create_kwargs
+    )
+    if depuis_cache:
+        # Reponse servie par le cache LLM : on rejoue les callbacks du stream.
+        if on_tool_call_started and any(
+            getattr(item, "type", "") == "function_call"
+            for item in (final_response.output or [])
+        ):
+            on_tool_call_started()
+        if on_text_chunk and accumulated_text:
+            on_text_chunk(accumulated_text)
 
     return final_response, accumulated_text.strip()
 
@@ -394,105 +444,171 @@ def _execute_tool_calls(
     render_container,
     on_status: Optional[Callable[[str], None]] = None,
     key_prefix: str = "",
+    resultats_sql: Optional[CacheResultats] = None,
+    annulation: Optional[JetonAnnulation] = None,
+    magasin: Optional[MagasinArtefacts] = None,
 ) -> list[dict]:
     """
-    Execute chaque function_call, rend les artifacts en live, les accumule pour
+    Execute les function_calls, rend les artifacts en live, les accumule pour
     la persistance, et renvoie les function_call_output a renvoyer au modele.
+
+    Les requetes SQL des appels sont lancees en parallele (au plus
+    MAX_TOOL_CALLS_PARALLELES) ; le rendu et les sorties suivent l'ordre des
+    appels, chacun des que sa requete est terminee (Streamlit n'est appele que
+    depuis le thread du script).
+
+    Chaque requete est executee au plus une fois par conversation
+    (MAX_FETCH_ROWS lignes et total) ; chaque outil en recoit sa tranche.
+
+    `resultats_sql` : cache des resultats de la conversation (SQL normalise).
+    `annulation` : jeton du tour, declenche par un nouveau message.
+    `magasin` : stockage (borne en memoire) des tableaux des artifacts.
     """
     tool_outputs: list[dict] = []
 
-    for idx, call in enumerate(function_calls):
+    appels = []
+    for call in function_calls:
         name = getattr(call, "name", "")
         try:
             args = json.loads(getattr(call, "arguments", "") or "{}")
         except json.JSONDecodeError:
             args = {}
-
         sql = args.get("sql", "")
         if sql:
             sql_queries.append(sql)
+        appels.append((call, name, args, sql))
 
-        if name == "run_sql_query":
-            if on_status:
-                on_status("Querying the database...")
-            df, err = safe_run_sql(sql, limit=PREVIEW_ROWS)
-            if err:
-                payload = {"error": err}
-            else:
-                total = _count_rows(sql)
-                payload = {
-                    "columns": list(df.columns),
-                    "column_count": len(df.columns),
-                    "total_row_count": total if total is not None else len(df),
-                    "preview_row_count": len(df),
-                    "preview_rows": json.loads(df.to_json(orient="records", date_format="iso")),
-                    "note": (
-                        f"Apercu limite a {PREVIEW_ROWS} lignes. Pour afficher plus de lignes "
-                        "a l'utilisateur, utilise display_table."
-                    ),
-                }
+    limites = {"run_sql_query": PREVIEW_ROWS, "display_table": MAX_TABLE_ROWS, "display_chart": MAX_CHART_ROWS}
 
-        elif name == "display_table":
-            if on_status:
-                on_status("Preparing the table...")
-            df, err = safe_run_sql(sql, limit=MAX_TABLE_ROWS)
-            if err:
-                payload = {"error": err}
-                render_container.error(err)
-            else:
-                key_suffix = f"{key_prefix}_{idx}"
-                _render_table_artifact(render_container, df, sql, key_suffix)
-                artifacts.append({"kind": "table", "df": df, "sql": sql})
-                payload = {
-                    "status": "tableau affiche a l'utilisateur",
-                    "row_count": len(df),
-                    "column_count": len(df.columns),
-                }
+    def _tache(name: str, sql: str) -> Callable[[JetonAnnulation], tuple]:
+        if name not in limites:
+            return lambda jeton: (None, None)
 
-        elif name == "display_chart":
-            if on_status:
-                on_status("Preparing the chart...")
-            x_column = args.get("x_column", "")
-            y_columns = args.get("y_columns", []) or []
-            df, err = safe_run_sql(sql, limit=MAX_CHART_ROWS)
-            if err:
-                payload = {"error": err}
-                render_container.error(err)
-            else:
-                try:
-                    _render_chart_artifact(render_container, df, x_column, y_columns)
-                    artifacts.append(
-                        {
-                            "kind": "chart",
-                            "df": df,
-                            "sql": sql,
-                            "x_column": x_column,
-                            "y_columns": y_columns,
-                        }
-                    )
-                    payload = {
-                        "status": "graphique affiche a l'utilisateur",
-                        "row_count": len(df),
-                        "x_column": x_column,
-                        "y_columns": y_columns,
-                    }
-                except Exception as exc:  # noqa: BLE001
-                    err = f"Erreur d'affichage du graphique : {exc}"
-                    render_container.error(err)
-                    payload = {"error": err}
+        def executer(jeton: JetonAnnulation) -> tuple:
+            resultat, err = safe_run_sql(
+                sql, limit=MAX_FETCH_ROWS, avec_total=True, cache=resultats_sql, annulation=jeton
+            )
+            return (resultat.tranche(limites[name]) if resultat else None), err
+
+        return executer
 
+    nb_requetes = sum(1 for _, name, _, _ in appels if name in limites)
+    if on_status and nb_requetes:
+        on_status("Querying the database..." if nb_requetes == 1 else f"Running {nb_requetes} queries in parallel...")
+
+    executions = en_parallele(
+        [_tache(name, sql) for _, name, _, sql in appels],
+        max_paralleles=MAX_TOOL_CALLS_PARALLELES,
+        timeout_s=TOOL_CALL_TIMEOUT_S,
+        annulation=annulation,
+    )
+    # closing : si le tour est interrompu (nouveau message), les requetes restantes sont annulees.
+    with closing(executions):
+        for idx, ((call, name, args, sql), (sortie, exc)) in enumerate(zip(appels, executions)):
+            resultat, err = sortie if exc is None else (None, f"Erreur d'execution : {exc}")
+            tool_outputs.append(
+                _tool_output(
+                    call, name, args, sql, resultat, err,
+                    artifacts=artifacts,
+                    render_container=render_container,
+                    on_status=on_status,
+                    key_suffix=f"{key_prefix}_{idx}",
+                    magasin=magasin,
+                )
+            )
+
+    return tool_outputs
+
+
+def _tool_output(
+    call,
+    name: str,
+    args: dict,
+    sql: str,
+    resultat: Optional[ResultatSQL],
+    err: Optional[str],
+    *,
+    artifacts: list,
+    render_container,
+    on_status: Optional[Callable[[str], None]],
+    key_suffix: str,
+    magasin: Optional[MagasinArtefacts] = None,
+) -> dict:
+    """Rend l'artifact d'un appel deja execute et construit son function_call_output."""
+    conserver = magasin.stocker if magasin is not None else TableauStocke
+    if name == "run_sql_query":
+        if err:
+            payload = {"error": err}
         else:
-            payload = {"error": f"Outil inconnu : {name}"}
+            df = resultat.df
+            payload = {
+                "columns": list(df.columns),
+                "column_count": len(df.columns),
+                "total_row_count": resultat.total,
+                "preview_row_count": len(df),
+                "preview_rows": json.loads(df.to_json(orient="records", date_format="iso")),
+                "note": (
+                    f"Apercu limite a {PREVIEW_ROWS} lignes. Pour afficher plus de lignes "
+                    "a l'utilisateur, utilise display_table."
+                ),
+            }
 
-        tool_outputs.append(
-            {
-                "type": "function_call_output",
-                "call_id": call.call_id,
-                "output": json.dumps(payload, ensure_ascii=False, default=str),
+    elif name == "display_table":
+        if on_status:
+            on_status("Preparing the table...")
+        if err:
+            payload = {"error": err}
+            render_container.error(err)
+        else:
+            df = resultat.df
+            _render_table_artifact(render_container, df, sql, key_suffix)
+            artifacts.append({"kind": "table", "donnees": conserver(df), "sql": sql})
+            payload = {
+                "status": "tableau affiche a l'utilisateur",
+                "row_count": len(df),
+                "column_count": len(df.columns),
             }
-        )
 
-    return tool_outputs
+    elif name == "display_chart":
+        if on_status:
+            on_status("Preparing the chart...")
+        x_column = args.get("x_column", "")
+        y_columns = args.get("y_columns", []) or []
+        if err:
+            payload = {"error": err}
+            render_container.error(err)
+        else:
+            df = resultat.df
+            try:
+                _render_chart_artifact(render_container, df, x_column, y_columns)
+                artifacts.append(
+                    {
+                        "kind": "chart",
+                        "donnees": conserver(df),
+                        "sql": sql,
+                        "x_column": x_column,
+                        "y_columns": y_columns,
+                    }
+                )
+                payload = {
+                    "status": "graphique affiche a l'utilisateur",
+                    "row_count": len(df),
+                    "x_column": x_column,
+                    "y_columns": y_columns,
+                }
+            except Exception as exc:  # noqa: BLE001
+                err = f"Erreur d'affichage du graphique : {exc}"
+                render_container.error(err)
+                payload = {"error": err}
+
+    else:
+        payload = {"error": f"Outil inconnu : {name}"}
+
+    return {
+        "type": "function_call_output",
+        "call_id": call.call_id,
+        "output": json.dumps(payload, ensure_ascii=False, default=str),
+    }
 
 
 def run_stats_agent(
@@ -503,21 +619,41 @@ def run_stats_agent(
     key_prefix: str,
     on_status: Optional[Callable[[str], None]] = None,
     on_text_chunk: Optional[Callable[[str], None]] = None,
+    schema_envoye: Optional[set[str]] = None,
+    resultats_sql: Optional[CacheResultats] = None,
+    annulation: Optional[JetonAnnulation] = None,
+    magasin: Optional[MagasinArtefacts] = None,
 ) -> tuple[str, list, list, Optional[str]]:
     """
     Execute un tour de conversation de l'agent.
 
+    `schema_envoye` (persistant sur la conversation) trace les sections de
+    documentation deja transmises au modele ; `resultats_sql` garde les
+    resultats des requetes deja executees dans la conversation ; `annulation`
+    interrompt les requetes du tour encore en cours ; `magasin` conserve les
+    tableaux des artifacts de la conversation.
+
     Retourne (texte_final, artifacts, sql_queries, nouveau_response_id).
     """
     client = get_openai_client()
+    if schema_envoye is None:
+        schema_envoye = set()
+    if not previous_response_id:
+        schema_envoye.clear()
+    doc_olap = schema_context(user_request, schema_envoye)
 
     # Chainage via previous_response_id pour garder le contexte cote serveur.
     if previous_response_id:
         initial_input: list[dict] = [{"role": "user", "content": user_request}]
+        if doc_olap:
+            initial_input.insert(0, {
+                "role": "system",
+                "content": "Documentation complementaire des tables de statistiques (schema public / OLAP) :\n" + doc_olap,
+            })
         chain_kwargs: dict = {"previous_response_id": previous_response_id}
     else:
         initial_input = [
-            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "system", "content": SYSTEM_PROMPT.replace("{doc_olap}", doc_olap or "")},
             {"role": "user", "content": user_request},
         ]
         chain_kwargs = {}
@@ -560,6 +696,9 @@ def run_stats_agent(
             render_container=render_container,
             on_status=on_status,
             key_prefix=f"{key_prefix}_it{iteration}",
+            resultats_sql=resultats_sql,
+            annulation=annulation,
+            magasin=magasin,
         )
         if not tool_outputs:
             break
@@ -592,17 +731,22 @@ def render_assistant_message(message: dict, *, key_prefix: str) -> None:
         st.markdown(message["content"])
 
     for idx, artifact in enumerate(message.get("artifacts", [])):
+        try:
+            df = artifact["donnees"].df
+        except ArtefactExpire:
+            st.info("⌛ Resultat expire : relancez la question pour le reafficher.")
+            continue
         if artifact["kind"] == "table":
             _render_table_artifact(
                 st.container(),
-                artifact["df"],
+                df,
                 artifact.get("sql", ""),
                 key_suffix=f"{key_prefix}_{idx}",
             )
         elif artifact["kind"] == "chart":
             _render_chart_artifact(
                 st.container(),
-                artifact["df"],
+                df,
                 artifact.get("x_column", ""),
                 artifact.get("y_columns", []),
             )
@@ -619,6 +763,14 @@ if "messages" not in st.session_state:
     st.session_state.messages = []
 if "previous_response_id" not in st.session_state:
     st.session_state.previous_response_id = None
+if "schema_envoye" not in st.session_state:
+    st.session_state.schema_envoye = set()
+if "resultats_sql" not in st.session_state:
+    st.session_state.resultats_sql = CacheResultats()
+if "artefacts" not in st.session_state:
+    st.session_state.artefacts = MagasinArtefacts()
+# Conversation affichee : son dossier d'artefacts ne doit pas etre purge.
+st.session_state.artefacts.toucher()
 
 # En-tete minimaliste
 st.markdown(
@@ -639,8 +791,14 @@ with col1:
         st.caption(f"💬 {num_messages} message(s) dans la conversation")
 with col2:
     if st.button("🔄 Nouvelle conversation", use_container_width=True):
+        if st.session_state.get("annulation_tour") is not None:
+            st.session_state.annulation_tour.annuler()
         st.session_state.messages = []
         st.session_state.previous_response_id = None
+        st.session_state.schema_envoye = set()
+        st.session_state.resultats_sql = CacheResultats()
+        st.session_state.artefacts.vider()
+        st.session_state.artefacts = MagasinArtefacts()
         st.rerun()
 
 # Avertissement si le contexte devient trop long
@@ -666,6 +824,11 @@ user_request = st.chat_input(
 
 # === TRAITEMENT DE LA REQUETE ===
 if user_request:
+    # Un nouveau message abandonne le tour precedent : ses requetes encore en
+    # cours sont annulees cote base plutot que de monopoliser le pool.
+    if st.session_state.get("annulation_tour") is not None:
+        st.session_state.annulation_tour.annuler()
+    st.session_state.annulation_tour = JetonAnnulation()
     st.session_state.messages.append({"role": "user", "content": user_request})
 
     with st.chat_message("user"):
@@ -695,6 +858,10 @@ if user_request:
                 key_prefix=key_prefix,
                 on_status=update_status,
                 on_text_chunk=update_text,
+                schema_envoye=st.session_state.schema_envoye,
+                resultats_sql=st.session_state.resultats_sql,
+                annulation=st.session_state.annulation_tour,
+                magasin=st.session_state.artefacts,
             )
 
             response_placeholder.markdown(final_text)
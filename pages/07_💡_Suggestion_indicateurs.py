@@ -2,9 +2,25 @@ import streamlit as st
 import pandas as pd
 from openai import OpenAI
 import io
+import re
+
+from utils.llm_cache import responses_create
+from utils.recherche_texte import IndexBM25
 
 st.set_page_config(layout="wide", page_title="Suggestions d'indicateurs", page_icon="🤖")
 
+MODELE = "gpt-5-mini"
+FEATURE_LLM = "07_suggestion_indicateurs"
+# Pré-sélection lexicale (BM25 sur les libellés) : seuls les candidats les
+# mieux classés sont envoyés au modèle au lieu des ~300 indicateurs.
+TOP_K = 40
+# En dessous de ce nombre de candidats trouvés, on envoie la liste complète
+# (action formulée sans mot commun avec les libellés).
+MIN_CANDIDATS = 5
+# Mode plan : actions par requête et plafond de candidats (union des top-K).
+ACTIONS_PAR_REQUETE = 25
+MAX_CANDIDATS_PLAN = 150
+
 # En-tête minimaliste
 st.markdown("""
 <div style='text-align: center; padding: 1rem 0 2rem 0;'>
@@ -25,11 +41,166 @@ def load_indicators():
     """Charge la liste des indicateurs depuis le CSV"""
     try:
         df = pd.read_csv('utils/indicateurs_v2.csv')
-        return df['indicateur'].tolist()
+        return df['indicateur'].str.strip().tolist()
     except Exception as e:
         st.error(f"Erreur lors du chargement des indicateurs : {e}")
         return []
 
+
+@st.cache_resource
+def load_index():
+    """Index BM25 des libellés d'indicateurs, construit une fois par process"""
+    index = IndexBM25()
+    index.ajouter_tous(enumerate(load_indicators()))
+    return index
+
+
+def preselectionner(actions, k=TOP_K, plafond=None):
+    """Indicateurs candidats pour une ou plusieurs actions (liste complète si trop peu de résultats)"""
+    indicateurs = load_indicators()
+    index = load_index()
+    meilleurs = {}
+    for texte in actions:
+        for i, score in index.rechercher(texte, k):
+            meilleurs[i] = max(score, meilleurs.get(i, 0.0))
+    if len(meilleurs) < MIN_CANDIDATS:
+        return indicateurs
+    retenus = sorted(meilleurs, key=meilleurs.get, reverse=True)[:plafond]
+    # Ordre du CSV conservé : les indicateurs d'une même thématique restent groupés.
+    return [indicateurs[i] for i in sorted(retenus)]
+
+
+def build_prompt(indicateurs, action):
+    return f"""
+                        Vous êtes un expert en politiques publiques locales et en suivi des plans d'actions climat-air-énergie (PCAET).
+                        Votre rôle est de suggérer des indicateurs pertinents à une collectivité pour suivre la mise en œuvre d'une action donnée.
+
+                        ### Données disponibles
+                        Voici la liste des indicateurs possibles :
+                        <<<
+                        {indicateurs}
+                        >>>
+
+                        ### Tâche
+                        À partir du titre de l'action ci-dessous, propose entre **0 et 5** indicateurs **parmi ceux de la liste**, qui seraient les plus pertinents pour évaluer l'avancement ou les résultats de cette action.
+
+                        ### Contraintes :
+                        - Retournez uniquement les libellés exacts des indicateurs issus de la liste.
+                        - Séparez les indicateurs par des ";".
+                        - Ne proposez rien si aucun indicateur ne correspond clairement.
+                        - Ne reformulez pas les indicateurs.
+
+                        ### Exemple de sortie attendue :
+                        "Consommation d'énergie du patrimoine communal; Part de la surface agricole utile en agriculture biologique"
+
+                        ### Action à analyser :
+                        <<<
+                        {action}
+                        >>>
+                        """
+
+
+def build_prompt_plan(indicateurs, actions):
+    actions_numerotees = "\n".join(f"{i}. {a}" for i, a in enumerate(actions, 1))
+    return f"""
+                        Vous êtes un expert en politiques publiques locales et en suivi des plans d'actions climat-air-énergie (PCAET).
+                        Votre rôle est de suggérer des indicateurs pertinents à une collectivité pour suivre la mise en œuvre de chaque action de son plan.
+
+                        ### Données disponibles
+                        Voici la liste des indicateurs possibles :
+                        <<<
+                        {indicateurs}
+                        >>>
+
+                        ### Tâche
+                        Pour chacune des actions numérotées ci-dessous, propose entre **0 et 5** indicateurs **parmi ceux de la liste**, qui seraient les plus pertinents pour évaluer l'avancement ou les résultats de cette action.
+
+                        ### Contraintes :
+                        - Une ligne par action, au format "<numéro>: <indicateurs>".
+                        - Retournez uniquement les libellés exacts des indicateurs issus de la liste.
+                        - Séparez les indicateurs par des ";".
+                        - Laissez la ligne vide après les ":" si aucun indicateur ne correspond clairement.
+                        - Ne reformulez pas les indicateurs.
+
+                        ### Exemple de sortie attendue :
+                        1: Consommation d'énergie du patrimoine communal; Part de la surface agricole utile en agriculture biologique
+                        2:
+
+                        ### Actions à analyser :
+                        <<<
+                        {actions_numerotees}
+                        >>>
+                        """
+
+
+def parse_reponse_plan(texte, nb_actions):
+    """Lignes "<numéro>: a; b" -> {numéro: [a, b]} (numéros hors plage ignorés)"""
+    suggestions = {i: [] for i in range(1, nb_actions + 1)}
+    for ligne in texte.splitlines():
+        m = re.match(r"\s*\**\s*(\d+)\s*[:.)-]\**\s*(.*)$", ligne)
+        if m and int(m.group(1)) in suggestions:
+            suggestions[int(m.group(1))] = [
+                ind.strip().strip('"') for ind in m.group(2).split(';') if ind.strip().strip('"')
+            ]
+    return suggestions
+
+
+def suggerer(prompt, etape):
+    """Appel au modèle, servi par le cache LLM si le même prompt a déjà été traité"""
+    client = OpenAI(
+        api_key=st.secrets.get("OPENAI_API_KEY", "")
+    )
+    response = responses_create(
+        client,
+        feature=FEATURE_LLM,
+        etape=etape,
+        model=MODELE,
+        input=prompt,
+        max_output_tokens=10000,
+        reasoning={"effort":"low"}
+    )
+    return response.output_text.strip()
+
+
+mode = st.radio("Mode", ["Une action", "Plan complet"], horizontal=True, label_visibility="collapsed")
+
+if mode == "Plan complet":
+    actions_plan = st.text_area(
+        "Actions du plan (une par ligne)",
+        height=250,
+        placeholder="Développement du photovoltaïque sur les toitures publiques\nPlan vélo communal\n...",
+    )
+    if st.button("🚀 Générer pour le plan", type="secondary"):
+        actions = [a.strip() for a in actions_plan.splitlines() if a.strip()]
+        if not actions:
+            st.error("⚠️ Veuillez saisir au moins une action")
+            st.stop()
+        lignes = []
+        barre = st.progress(0.0, text="Génération des suggestions...")
+        try:
+            # Un appel par lot d'actions, avec l'union de leurs candidats
+            for debut in range(0, len(actions), ACTIONS_PAR_REQUETE):
+                lot = actions[debut:debut + ACTIONS_PAR_REQUETE]
+                candidats = preselectionner(lot, plafond=MAX_CANDIDATS_PLAN)
+                reponse = suggerer(build_prompt_plan(candidats, lot), "plan")
+                for i, indicateurs in parse_reponse_plan(reponse, len(lot)).items():
+                    lignes.append({"action": lot[i - 1], "indicateurs": "; ".join(indicateurs)})
+                barre.progress(min(1.0, (debut + len(lot)) / len(actions)))
+        except Exception as e:
+            st.error(f"❌ Erreur de génération : {str(e)}")
+        barre.empty()
+        if lignes:
+            df_plan = pd.DataFrame(lignes)
+            st.markdown(f"### ✅ Suggestions pour {len(df_plan)} actions")
+            st.dataframe(df_plan, use_container_width=True, hide_index=True)
+            st.download_button(
+                "📥 Télécharger (CSV)",
+                df_plan.to_csv(index=False).encode("utf-8-sig"),
+                file_name="suggestions_indicateurs.csv",
+                mime="text/csv",
+            )
+    st.stop()
+
 # Zone de saisie avec layout amélioré
 col1, col2 = st.columns([4, 1])
 
@@ -61,53 +232,10 @@ if generate_button or action_changed:
                 if not indicateurs_list:
                     st.error("❌ Impossible de charger la liste des indicateurs")
                 else:
-                    # Création du DataFrame pour le prompt
-                    df = pd.DataFrame({'indicateur': indicateurs_list})
-                    
-                    # Construction du prompt
-                    user_prompt = f"""
-                        Vous êtes un expert en politiques publiques locales et en suivi des plans d'actions climat-air-énergie (PCAET).
-                        Votre rôle est de suggérer des indicateurs pertinents à une collectivité pour suivre la mise en œuvre d'une action donnée.
+                    # Pré-sélection des indicateurs candidats pour réduire le prompt
+                    candidats = preselectionner([action])
+                    suggestions = suggerer(build_prompt(candidats, action), "action")
 
-                        ### Données disponibles
-                        Voici la liste complète des indicateurs possibles :
-                        <<<
-                        {list(df.indicateur)}
-                        >>>
-
-                        ### Tâche
-                        À partir du titre de l'action ci-dessous, propose entre **0 et 5** indicateurs **parmi ceux de la liste**, qui seraient les plus pertinents pour évaluer l'avancement ou les résultats de cette action.
-
-                        ### Contraintes :
-                        - Retournez uniquement les libellés exacts des indicateurs issus de la liste.
-                        - Séparez les indicateurs par des ";".
-                        - Ne proposez rien si aucun indicateur ne correspond clairement.
-                        - Ne reformulez pas les indicateurs.
-
-                        ### Exemple de sortie attendue :
-                        "Consommation d'énergie du patrimoine communal; Part de la surface agricole utile en agriculture biologique"
-
-                        ### Action à analyser :
-                        <<<
-                        {action}
-                        >>>
-                        """
-                    
-                    # Appel à l'API OpenAI
-                    client = OpenAI(
-                        api_key=st.secrets.get("OPENAI_API_KEY", "")
-                    )
-                    
-                    response = client.responses.create(
-                        model="gpt-5-mini",
-                        input=user_prompt,
-                        max_output_tokens=10000,
-                        reasoning={"effort":"low"}
-                    )
-                    
-                    # Extraction de la réponse
-                    suggestions = response.output_text.strip()
-                    
                     # Affichage des résultats
                     st.markdown("---")
                     
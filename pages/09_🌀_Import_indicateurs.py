@@ -1,6 +1,5 @@
 import streamlit as st
 import pandas as pd
-import requests
 import json
 import yaml
 from sqlalchemy import text
@@ -17,6 +16,7 @@ from utils.db import (
     get_engine_prod,
     get_engine_pre_prod
 )
+from utils.http_client import get_client
 
 # Configuration de la page
 st.set_page_config(layout="wide")
@@ -92,7 +92,7 @@ def recuperer_metadonnees_api():
         "Authorization": f"Bearer {api_indicateurs_token}",
     }
 
-    response = requests.get(URL_META, headers=HEADERS)
+    response = get_client().get(URL_META, headers=HEADERS)
     response.raise_for_status()
     data = response.json()
 
@@ -501,7 +501,7 @@ def recuperer_donnees_api(
                     
                     data_post = {"query": query}
                     
-                    response = requests.post(url_post, headers=headers_post, data=json.dumps(data_post), timeout=60)
+                    response = get_client().post(url_post, headers=headers_post, data=json.dumps(data_post), timeout=60, rejouer=True)
                     
                     if response.status_code == 200:
                         rows = response.json().get("data", [])
@@ -575,7 +575,7 @@ def recuperer_donnees_api(
                 
                 data_post = {"query": query}
                 
-                response = requests.post(url_post, headers=headers_post, data=json.dumps(data_post), timeout=60)
+                response = get_client().post(url_post, headers=headers_post, data=json.dumps(data_post), timeout=60, rejouer=True)
                 
                 if response.status_code == 200:
                     rows = response.json().get("data", [])
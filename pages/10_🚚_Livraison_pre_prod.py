@@ -1,9 +1,11 @@
 import streamlit as st
 import pandas as pd
-import requests
-import time
 from sqlalchemy import text
 from utils.db import get_engine, get_engine_pre_prod
+from utils.livraison_api import ClientLivraison
+from utils.livraison_doublons import MAX_LIGNES_APERCU, apercu_conflits, detecter_doublons
+from utils.livraison_payload import construire_valeurs, log_echantillon
+from utils.livraison_journal import livrer_et_journaliser, render_rejeu_livraisons
 
 # Configuration de la page
 st.set_page_config(layout="wide")
@@ -40,60 +42,37 @@ def check_and_handle_duplicates(df):
     # Définir la clé primaire
     pk_cols = ['indicateur_id', 'collectivite_id', 'date_valeur']
     
-    # 1. Vérifier les doublons complets (toutes colonnes identiques)
-    duplicates_full = df.duplicated(keep='first')
-    nb_duplicates_full = duplicates_full.sum()
-    
-    if nb_duplicates_full > 0:
-        st.info(f"ℹ️ {nb_duplicates_full} ligne(s) complètement dupliquée(s) détectée(s) et supprimée(s)")
-        df = df[~duplicates_full].copy()
-    
-    # 2. Vérifier les doublons partiels (même clé primaire, valeurs différentes)
-    duplicates_pk = df.duplicated(subset=pk_cols, keep=False)
-    
-    if duplicates_pk.any():
-        # Il y a des doublons sur la clé primaire
-        df_duplicates = df[duplicates_pk].copy()
-        
-        # Vérifier s'il y a des conflits (valeurs différentes pour la même clé)
-        conflicts = []
-        for _, group in df_duplicates.groupby(pk_cols):
-            if len(group) > 1:
-                # Vérifier si les valeurs sont différentes
-                other_cols = [col for col in df.columns if col not in pk_cols]
-                for col in other_cols:
-                    if group[col].nunique() > 1:
-                        # Conflit détecté
-                        conflicts.append(group)
-                        break
-        
-        if conflicts:
-            st.error("❌ **ERREUR : Doublons avec valeurs conflictuelles détectés !**")
-            st.markdown("""
-            Des lignes avec la même clé primaire (indicateur_id, collectivite_id, date_valeur) 
-            mais des valeurs différentes ont été trouvées. Cela indique un problème dans les données sources.
-            """)
-            
-            # Afficher les lignes en conflit
-            df_conflicts = pd.concat(conflicts).sort_values(pk_cols)
-            st.dataframe(
-                df_conflicts.style.apply(
-                    lambda x: ['background-color: #ffcccc' if x.name in df_conflicts.index else '' for _ in x],
-                    axis=1
-                ),
-                use_container_width=True
-            )
-            
-            # Statistiques sur les conflits
-            st.markdown(f"""
-            **📊 Statistiques des conflits :**
-            - Nombre de groupes en conflit : {len(conflicts)}
-            - Nombre total de lignes concernées : {len(df_conflicts)}
-            """)
-            
-            return df, True
+    # Doublons complets supprimés, conflits (même clé, valeurs différentes) détectés
+    # par groupby/nunique sur toutes les colonnes hors clé
+    rapport = detecter_doublons(df, pk_cols)
+    
+    if rapport.nb_doublons_complets > 0:
+        st.info(f"ℹ️ {rapport.nb_doublons_complets} ligne(s) complètement dupliquée(s) détectée(s) et supprimée(s)")
+    
+    if rapport.has_conflicts:
+        st.error("❌ **ERREUR : Doublons avec valeurs conflictuelles détectés !**")
+        st.markdown("""
+        Des lignes avec la même clé primaire (indicateur_id, collectivite_id, date_valeur) 
+        mais des valeurs différentes ont été trouvées. Cela indique un problème dans les données sources.
+        """)
+        
+        # Rapport compact : une ligne par clé en conflit
+        st.dataframe(rapport.conflits, use_container_width=True, hide_index=True)
+        
+        # Aperçu des lignes en conflit, borné pour ne pas figer la page
+        with st.expander(f"🔍 Lignes en conflit (aperçu des {MAX_LIGNES_APERCU} premières)"):
+            st.dataframe(apercu_conflits(rapport, pk_cols), use_container_width=True)
+        
+        # Statistiques sur les conflits
+        st.markdown(f"""
+        **📊 Statistiques des conflits :**
+        - Nombre de groupes en conflit : {len(rapport.conflits)}
+        - Nombre total de lignes concernées : {rapport.nb_lignes_en_conflit}
+        """)
+        
+        return rapport.df, True
     
-    return df, False
+    return rapport.df, False
 
 
 def load_staged_data():
@@ -310,112 +289,28 @@ def livrer_en_preprod(comparison, df_staged, progress_container=None):
                 'message': 'Configuration API manquante dans secrets.toml'
             }
         
-        headers = {
-            "Authorization": f"Bearer {api_token}",
-            "Content-Type": "application/json"
-        }
-        
-        # 1. Préparer la liste de dicts à partir du DataFrame
-        df_to_insert = df_to_send.copy()
-        df_to_insert['date_valeur'] = pd.to_datetime(df_to_insert['date_valeur'])
-        
-        valeurs_payload = df_to_insert.apply(lambda row: {
-            "collectiviteId": int(row["collectivite_id"]),
-            "indicateurId": int(row["indicateur_id"]),
-            "dateValeur": row["date_valeur"].isoformat(),
-            "metadonneeId": int(row["metadonnee_id"]),
-            "resultat": float(row["resultat"]) if pd.notnull(row["resultat"]) else None,
-        }, axis=1).tolist()
-
-        print(f"{valeurs_payload}")
-        
-        # 2. Paramétrage du batch
-        batch_size = 500
-        total_rows = len(valeurs_payload)
-        total_inserted = 0
-        failed_batches = 0
-        
-        max_batches_per_minute = 90
-        pause_seconds = 60
-        
-        # Calculer le nombre total de batches
-        total_batches = (total_rows + batch_size - 1) // batch_size
-        
-        if progress_container:
-            progress_bar = progress_container.progress(0)
-            status_text = progress_container.empty()
-        
-        # 3. Envoi des batchs
-        for batch_start in range(0, total_rows, batch_size):
-            batch_num = batch_start // batch_size + 1
-            
-            # Pause si on atteint un multiple de 90 (sauf au tout début)
-            if batch_num > 1 and (batch_num - 1) % max_batches_per_minute == 0:
-                if progress_container:
-                    status_text.info(f"⏸️ Pause de {pause_seconds}s pour respecter la limite de 90 requêtes/minute...")
-                time.sleep(pause_seconds)
-            
-            batch = valeurs_payload[batch_start : batch_start + batch_size]
-            payload = {"valeurs": batch}
-            
-            if progress_container:
-                status_text.text(f"📤 Envoi du batch {batch_num}/{total_batches} ({len(batch)} lignes)...")
-            
-            response = requests.post(api_url, headers=headers, json=payload)
-            
-            if response.status_code == 201:
-                # Si l'API renvoie un objet { "valeurs": [...] }
-                try:
-                    inserted = len(response.json().get("valeurs", []))
-                except ValueError:
-                    inserted = len(batch)
-                total_inserted += inserted
-                
-                if progress_container:
-                    status_text.success(f"✅ Batch {batch_num}/{total_batches} OK ({inserted} lignes)")
-            else:
-                failed_batches += 1
-                
-                # Logger l'erreur dans la console
-                print(f"\n{'='*80}")
-                print(f"❌ ERREUR - Batch {batch_num}/{total_batches} échoué (HTTP {response.status_code})")
-                print(f"{'='*80}")
-                
-                try:
-                    error_json = response.json()
-                    print("Réponse API (JSON):")
-                    import json
-                    print(json.dumps(error_json, indent=2, ensure_ascii=False))
-                except:
-                    print("Réponse serveur (texte):")
-                    print(response.text)
-                
-                print(f"{'='*80}\n")
-                
-                if progress_container:
-                    status_text.error(f"❌ Batch {batch_num}/{total_batches} échoué (HTTP {response.status_code}) - voir console pour détails")
-                
-                # On continue même en cas d'erreur sur un batch
-            
-            # Mettre à jour la barre de progression
-            if progress_container:
-                progress_bar.progress(batch_num / total_batches)
+        # 1. Préparer la liste de dicts à partir du DataFrame (conversion par colonne)
+        valeurs_payload = construire_valeurs(
+            df_to_send[['collectivite_id', 'indicateur_id', 'date_valeur', 'metadonnee_id', 'resultat']]
+        )
+        log_echantillon(valeurs_payload)
         
-        if progress_container:
-            status_text.empty()
-            progress_bar.empty()
+        # 2. Envoi par batches concurrents, cadencés à 90 requêtes/minute et journalisés
+        client = ClientLivraison(api_url, api_token)
+        stats = livrer_et_journaliser(client, valeurs_payload, "Pré-production", progress_container)
         
-        success = failed_batches == 0
-        message = 'Livraison réussie' if success else f'Livraison partielle ({failed_batches} batch(s) échoué(s))'
+        success = stats['success']
+        message = 'Livraison réussie' if success else f"Livraison partielle ({stats['failed_batches']} batch(s) échoué(s))"
         
         return {
-            'nb_total': total_rows,
-            'nb_inserted': total_inserted,
-            'nb_batches': total_batches,
+            'nb_total': stats['nb_total'],
+            'nb_inserted': stats['nb_inserted'],
+            'nb_batches': stats['nb_batches'],
             'nb_filtered': nb_lignes_filtrees,
-            'failed_batches': failed_batches,
+            'failed_batches': stats['failed_batches'],
             'success': success,
-            'message': message
+            'message': message,
+            'run_id': stats['run_id']
         }
         
     except Exception as e:
@@ -841,5 +736,8 @@ if st.session_state.analysis_done and st.session_state.df_staged is not None:
                 if result.get('failed_batches', 0) > 0:
                     st.warning(f"⚠️ {result['failed_batches']} batch(s) ont échoué sur {result.get('nb_batches', 0)} total")
                     st.info(f"💡 {result['nb_inserted']:,} lignes ont quand même été insérées avec succès")
+                    st.info(f"🧾 Run `{result['run_id']}` journalisé : les batches en échec peuvent être rejoués depuis le journal ci-dessous")
 
-
+# Journal des livraisons : rejeu des batches en échec sans refaire la comparaison
+st.markdown("---")
+render_rejeu_livraisons("Pré-production", st.secrets.get("api_pre_prod_token", ""), key="rejeu_preprod")
@@ -1,14 +1,16 @@
 import streamlit as st
 from datetime import datetime
 import pandas as pd
-import requests
-import time
 from sqlalchemy import text
 from utils.db import (
     get_engine_prod,
     get_engine_prod_writing,
-    get_engine_pre_prod
+    get_engine_pre_prod,
+    bulk_insert
 )
+from utils.livraison_api import ClientLivraison
+from utils.livraison_payload import construire_valeurs, log_echantillon
+from utils.livraison_journal import livrer_et_journaliser, render_rejeu_livraisons
 
 # Configuration de la page
 st.set_page_config(layout="wide")
@@ -138,26 +140,23 @@ def charger_groupements(engine):
 
 
 def inserer_collectivites_groupement(groupement_nom, collectivite_ids, engine):
-    """Insère les collectivités associées à un groupement."""
+    """Insère les collectivités associées à un groupement (COPY en une passe)."""
     try:
-        # Construire la requête avec les IDs des collectivités
-        values_str = ",\n        ".join([f"({cid})" for cid in collectivite_ids])
-        
-        query_str = f"""
-            INSERT INTO groupement_collectivite (groupement_id, collectivite_id)
-            SELECT g.id as groupement_id, c.id as collectivite_id
-            FROM (
-                VALUES 
-                    {values_str}
-                ) as c(id)
-            JOIN groupement g ON g.nom = :nom_groupement
-        """
-        
-        query = text(query_str)
-        
         with engine.begin() as conn:
-            result = conn.execute(query, {"nom_groupement": groupement_nom})
-            return True, result.rowcount
+            groupement_id = conn.execute(
+                text("SELECT id FROM groupement WHERE nom = :nom_groupement"),
+                {"nom_groupement": groupement_nom}
+            ).scalar()
+            
+            if groupement_id is None:
+                return True, 0
+            
+            df_associations = pd.DataFrame({
+                'groupement_id': int(groupement_id),
+                'collectivite_id': [int(cid) for cid in collectivite_ids]
+            })
+            bulk_insert(conn, 'groupement_collectivite', df_associations, method='copy')
+            return True, len(df_associations)
     except Exception as e:
         st.error(f"❌ Erreur lors de l'insertion des collectivités : {str(e)}")
         return False, 0
@@ -184,35 +183,18 @@ def charger_collectivites_groupement(groupement_id, engine):
 
 
 def importer_indicateurs_groupement(df, engine):
-    """Importe les indicateurs d'un groupement dans la table indicateur_definition."""
+    """Importe les indicateurs d'un groupement dans la table indicateur_definition.
+    
+    Returns:
+        list: ids des indicateurs insérés, None en cas d'erreur
+    """
     try:
-        # Convertir le dataframe en liste de dictionnaires pour l'insertion
-        records = df.to_dict('records')
-        
-        # Construire la liste des colonnes pour l'insertion
-        colonnes = df.columns.tolist()
-        colonnes_str = ', '.join(colonnes)
-        
-        # Construire les placeholders pour les valeurs
-        placeholders = ', '.join([f":{col}" for col in colonnes])
-        
-        query_str = f"""
-            INSERT INTO indicateur_definition ({colonnes_str})
-            VALUES ({placeholders})
-        """
-        
-        query = text(query_str)
-        
+        # Insertion multi-lignes (NaN -> NULL convertis en une fois) avec RETURNING des ids
         with engine.begin() as conn:
-            for record in records:
-                # Convertir les valeurs NaN en None pour PostgreSQL
-                record_clean = {k: (None if pd.isna(v) else v) for k, v in record.items()}
-                conn.execute(query, record_clean)
-        
-        return True
+            return bulk_insert(conn, 'indicateur_definition', df, returning=['id'])
     except Exception as e:
         st.error(f"❌ Erreur lors de l'import : {str(e)}")
-        return False
+        return None
 
 
 def associer_indicateurs_categorie_tag(groupement_id, groupement_nom, engine):
@@ -292,116 +274,26 @@ def importer_valeurs_via_api(df, env_label, progress_container=None):
                 'message': f'Token API manquant pour {env_label} dans secrets.toml'
             }
         
-        headers = {
-            "Authorization": f"Bearer {api_token}",
-            "Content-Type": "application/json"
-        }
-        
-        # Préparer la liste de dicts à partir du DataFrame
-        df_to_insert = df.copy()
-        df_to_insert['date_valeur'] = pd.to_datetime(df_to_insert['date_valeur'])
-        
-        # Construire le payloads
-        if 'metadonnee_id' in df_to_insert.columns:
-            valeurs_payload = df_to_insert.apply(lambda row: {
-                "collectiviteId": int(row["collectivite_id"]),
-                "indicateurId": int(row["indicateur_id"]),
-                "dateValeur": row["date_valeur"].isoformat(),
-                "metadonneeId": int(row["metadonnee_id"]),
-                "resultat": float(row["resultat"]) if pd.notnull(row["resultat"]) else None,
-            }, axis=1).tolist()
-        else:
-            valeurs_payload = df_to_insert.apply(lambda row: {
-                "collectiviteId": int(row["collectivite_id"]),
-                "indicateurId": int(row["indicateur_id"]),
-                "dateValeur": row["date_valeur"].isoformat(),
-                "resultat": float(row["resultat"]) if pd.notnull(row["resultat"]) else None,
-            }, axis=1).tolist()
-        
-        # Paramétrage du batch
-        batch_size = 500
-        total_rows = len(valeurs_payload)
-        total_inserted = 0
-        failed_batches = 0
-        
-        max_batches_per_minute = 90
-        pause_seconds = 60
+        # Préparer la liste de dicts à partir du DataFrame (conversion par colonne,
+        # metadonneeId inclus seulement si la colonne est présente)
+        valeurs_payload = construire_valeurs(df)
+        log_echantillon(valeurs_payload)
         
-        # Calculer le nombre total de batches
-        total_batches = (total_rows + batch_size - 1) // batch_size
+        # Envoi par batches concurrents, cadencés à 90 requêtes/minute et journalisés
+        client = ClientLivraison(api_url, api_token)
+        stats = livrer_et_journaliser(client, valeurs_payload, env_label, progress_container)
         
-        if progress_container:
-            progress_bar = progress_container.progress(0)
-            status_text = progress_container.empty()
-        
-        # Envoi des batchs
-        for batch_start in range(0, total_rows, batch_size):
-            batch_num = batch_start // batch_size + 1
-            
-            # Pause si on atteint un multiple de 90 (sauf au tout début)
-            if batch_num > 1 and (batch_num - 1) % max_batches_per_minute == 0:
-                if progress_container:
-                    status_text.info(f"⏸️ Pause de {pause_seconds}s pour respecter la limite de 90 requêtes/minute...")
-                time.sleep(pause_seconds)
-            
-            batch = valeurs_payload[batch_start : batch_start + batch_size]
-            payload = {"valeurs": batch}
-            
-            if progress_container:
-                status_text.text(f"📤 Envoi du batch {batch_num}/{total_batches} ({len(batch)} lignes)...")
-            
-            response = requests.post(api_url, headers=headers, json=payload)
-            
-            if response.status_code == 201:
-                # Si l'API renvoie un objet { "valeurs": [...] }
-                try:
-                    inserted = len(response.json().get("valeurs", []))
-                except ValueError:
-                    inserted = len(batch)
-                total_inserted += inserted
-                
-                if progress_container:
-                    status_text.success(f"✅ Batch {batch_num}/{total_batches} OK ({inserted} lignes)")
-            else:
-                failed_batches += 1
-                
-                # Logger l'erreur dans la console
-                print(f"\n{'='*80}")
-                print(f"❌ ERREUR - Batch {batch_num}/{total_batches} échoué (HTTP {response.status_code})")
-                print(f"{'='*80}")
-                
-                try:
-                    error_json = response.json()
-                    print("Réponse API (JSON):")
-                    import json
-                    print(json.dumps(error_json, indent=2, ensure_ascii=False))
-                except:
-                    print("Réponse serveur (texte):")
-                    print(response.text)
-                
-                print(f"{'='*80}\n")
-                
-                if progress_container:
-                    status_text.error(f"❌ Batch {batch_num}/{total_batches} échoué (HTTP {response.status_code}) - voir console pour détails")
-            
-            # Mettre à jour la barre de progression
-            if progress_container:
-                progress_bar.progress(batch_num / total_batches)
-        
-        if progress_container:
-            status_text.empty()
-            progress_bar.empty()
-        
-        success = failed_batches == 0
-        message = 'Import réussi' if success else f'Import partiel ({failed_batches} batch(s) échoué(s))'
+        success = stats['success']
+        message = 'Import réussi' if success else f"Import partiel ({stats['failed_batches']} batch(s) échoué(s))"
         
         return {
-            'nb_total': total_rows,
-            'nb_inserted': total_inserted,
-            'nb_batches': total_batches,
-            'failed_batches': failed_batches,
+            'nb_total': stats['nb_total'],
+            'nb_inserted': stats['nb_inserted'],
+            'nb_batches': stats['nb_batches'],
+            'failed_batches': stats['failed_batches'],
             'success': success,
-            'message': message
+            'message': message,
+            'run_id': stats['run_id']
         }
         
     except Exception as e:
@@ -657,10 +549,10 @@ with center:
                     with col_oui:
                         if st.button("✅ OUI - Importer les indicateurs", use_container_width=True, type="primary"):
                             with st.spinner(f"Import des indicateurs en cours vers {env_label}..."):
-                                success_import = importer_indicateurs_groupement(df_final, engine_ecriture)
+                                ids_importes = importer_indicateurs_groupement(df_final, engine_ecriture)
                             
-                            if success_import:
-                                st.success(f"✅ {len(df_final)} indicateur(s) importé(s) avec succès en {env_label} !")
+                            if ids_importes is not None:
+                                st.success(f"✅ {len(ids_importes)} indicateur(s) importé(s) avec succès en {env_label} !")
                                 
                                 # Associer les indicateurs à leur catégorie_tag
                                 with st.spinner(f"Association des indicateurs à la catégorie tag '{groupement_nom_import}'..."):
@@ -946,6 +838,7 @@ with center:
                         if result.get('failed_batches', 0) > 0:
                             st.warning(f"⚠️ {result['failed_batches']} batch(s) ont échoué sur {result.get('nb_batches', 0)} total")
                             st.info(f"💡 {result['nb_inserted']:,} lignes ont quand même été insérées avec succès")
+                            st.info(f"🧾 Run `{result['run_id']}` journalisé : les batches en échec peuvent être rejoués depuis le journal ci-dessous")
             
             with col_non_valeurs:
                 if st.button("❌ NON - Annuler l'import", use_container_width=True, key="btn_annuler_valeurs"):
@@ -956,3 +849,11 @@ with center:
             st.error(f"❌ Erreur lors du traitement du fichier : {str(e)}")
             import traceback
             st.code(traceback.format_exc())
+    
+    # Journal des imports : rejeu des batches en échec sans recharger le fichier
+    st.markdown("---")
+    render_rejeu_livraisons(
+        env_label,
+        st.secrets.get("api_prod_token" if environnement else "api_pre_prod_token", ""),
+        key="rejeu_groupement"
+    )
@@ -3,7 +3,6 @@ import anthropic
 import openai
 from google import genai
 from google.genai import types
-from pypdf import PdfReader
 import asyncio
 import os
 import io
@@ -12,6 +11,11 @@ from datetime import datetime
 import json
 import pandas as pd
 
+from utils.course_llm import MODE_PREMIER, MODE_TOUS, courir
+from utils.extraction_pdf import extraire_texte_pdf
+from utils.llm_cache import appel_cache_async
+from utils.llm_telemetrie import signaler_premier_token, signaler_usage
+
 st.set_page_config(layout="wide")
 st.title("✨ Import des plans :blue-badge[:material/experiment: Beta]")
 
@@ -185,15 +189,13 @@ Voici le texte à analyser :
 """
 
 def extract_text_from_pdf(pdf_file):
-    """Extrait le texte d'un fichier PDF"""
+    """Extrait le texte d'un fichier PDF (pages en parallèle, cache par contenu du fichier)"""
     try:
-        pdf_reader = PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        resultat = extraire_texte_pdf(pdf_file.getvalue())
     except Exception as e:
         return f"Erreur lors de l'extraction du PDF : {str(e)}"
+    st.caption(f"📄 {resultat.resume()}")
+    return resultat.texte
 
 def extract_text_from_csv(csv_file):
     """Extrait le texte d'un fichier CSV"""
@@ -254,135 +256,188 @@ def display_result(result_text, mode_json):
         # Mode normal : afficher le texte tel quel
         st.markdown(result_text)
 
-async def query_claude(user_prompt):
-    """Interroge Claude avec streaming asynchrone"""
+CLAUDE_MODEL = "claude-sonnet-4-5-20250929"
+CHATGPT_MODEL = "gpt-5"
+CLAUDE_PARAMS = {"max_tokens": 64000, "temperature": 0.2}
+CHATGPT_PARAMS = {"max_output_tokens": 128000}
+GEMINI_PARAMS = {"temperature": 0.2, "max_output_tokens": 64000}
+FEATURE_LLM = "18_import_des_plans"
+
+
+def _log(message):
+    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] {message}")
+
+
+async def _query_cached(provider, model, user_prompt, params, appel, label):
+    """Réponse du cache LLM ou de `appel()` -> (réponse, temps, tokens).
+
+    Les erreurs ne sont pas mises en cache et sont renvoyées sous forme de
+    texte « Erreur <label>: ... », comme avant.
+    """
     start_time = time.time()
-    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 🤖 Claude START")
     try:
-        async with claude_client.messages.stream(
-            model="claude-sonnet-4-5-20250929",
-            max_tokens=64000,
-            temperature=0.2,
-            messages=[{"role": "user", "content": user_prompt}]
-        ) as stream:
-            parts = []
-            async for text in stream.text_stream:
-                parts.append(text)  # Récupération des chunks au fur et à mesure
-            reponse = "".join(parts)  # Assemblage de la réponse complète
-            
-            # Récupérer les tokens utilisés
-            final_message = await stream.get_final_message()
-            tokens = final_message.usage.output_tokens if hasattr(final_message, 'usage') else 0
-            
-        elapsed = time.time() - start_time
-        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ Claude END ({elapsed:.1f}s, {tokens} tokens)")
-        return reponse, elapsed, tokens
+        reponse, tokens = await appel_cache_async(
+            provider, model, user_prompt, params, appel,
+            feature=FEATURE_LLM, etape=label.lower(), rafraichir=rafraichir_cache_llm,
+        )
+        return reponse, time.time() - start_time, tokens
     except Exception as e:
-        elapsed = time.time() - start_time
-        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ❌ Claude ERROR")
-        return f"Erreur Claude: {str(e)}", elapsed, 0
+        _log(f"❌ {label} ERROR: {str(e)}")
+        return f"Erreur {label}: {str(e)}", time.time() - start_time, 0
 
-async def query_chatgpt(user_prompt):
-    """Interroge ChatGPT avec streaming asynchrone"""
+
+async def _query_claude_api(user_prompt, on_fragment=None):
+    """Interroge Claude avec streaming asynchrone -> (réponse, tokens)"""
     start_time = time.time()
-    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 💬 ChatGPT START")
-    if False:
-        # Utiliser le streaming pour la réponse -> SKIP POUR L'INSTANT CAR IL FAUT UNE VERIFICATION SUR OPEN AI DE L'ORG
-        stream = await openai_client.responses.create(
-            model="gpt-5",
-            input=user_prompt,
-            max_output_tokens=128000,
-            stream=True
-        )
-        
+    _log("🤖 Claude START")
+    async with claude_client.messages.stream(
+        model=CLAUDE_MODEL,
+        messages=[{"role": "user", "content": user_prompt}],
+        **CLAUDE_PARAMS,
+    ) as stream:
         parts = []
-        tokens = 0
-        async for chunk in stream:
-            if hasattr(chunk, 'output_text') and chunk.output_text:
-                parts.append(chunk.output_text)
-            elif hasattr(chunk, 'delta') and hasattr(chunk.delta, 'content') and chunk.delta.content:
-                parts.append(chunk.delta.content)
-            # Récupérer les tokens si disponible dans le dernier chunk
-            if hasattr(chunk, 'usage') and hasattr(chunk.usage, 'output_tokens'):
-                tokens = chunk.usage.output_tokens
-        
-        reponse = "".join(parts)
-        elapsed = time.time() - start_time
-        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ ChatGPT END ({elapsed:.1f}s, {tokens} tokens)")
-        return reponse, elapsed, tokens
-    else:
-        #print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ❌ ChatGPT ERROR: {str(e)}")
-        # Si le streaming ne fonctionne pas, fallback sur l'API standard
-        try:
-            response = await openai_client.responses.create(
-                model="gpt-5",
-                input=user_prompt,
-                max_output_tokens=128000
-            )
-            elapsed = time.time() - start_time
-            tokens = response.usage.output_tokens if hasattr(response, 'usage') and hasattr(response.usage, 'output_tokens') else 0
-            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ ChatGPT END ({elapsed:.1f}s, {tokens} tokens)")
-            return str(response.output_text), elapsed, tokens
-        except Exception as e2:
-            elapsed = time.time() - start_time
-            return f"Erreur ChatGPT: {str(e2)}", elapsed, 0
-
-async def query_gemini(user_prompt, model='gemini-3-pro-preview'):
-    """Interroge Gemini avec streaming asynchrone"""
+        async for text in stream.text_stream:
+            signaler_premier_token()
+            parts.append(text)  # Récupération des chunks au fur et à mesure
+            if on_fragment:
+                on_fragment(text)
+        reponse = "".join(parts)  # Assemblage de la réponse complète
+
+        # Récupérer les tokens utilisés
+        final_message = await stream.get_final_message()
+        tokens = final_message.usage.output_tokens if hasattr(final_message, 'usage') else 0
+        signaler_usage(getattr(getattr(final_message, 'usage', None), 'input_tokens', None), tokens)
+
+    _log(f"✅ Claude END ({time.time() - start_time:.1f}s, {tokens} tokens)")
+    return reponse, tokens
+
+
+async def _query_chatgpt_api(user_prompt):
+    """Interroge ChatGPT -> (réponse, tokens)"""
     start_time = time.time()
-    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✨ Gemini START ({model})")
+    _log("💬 ChatGPT START")
+    # Le streaming est désactivé pour l'instant : il faut une vérification sur OpenAI de l'org
+    response = await openai_client.responses.create(
+        model=CHATGPT_MODEL,
+        input=user_prompt,
+        **CHATGPT_PARAMS,
+    )
+    tokens = response.usage.output_tokens if hasattr(response, 'usage') and hasattr(response.usage, 'output_tokens') else 0
+    signaler_usage(getattr(getattr(response, 'usage', None), 'input_tokens', None), tokens)
+    _log(f"✅ ChatGPT END ({time.time() - start_time:.1f}s, {tokens} tokens)")
+    return str(response.output_text), tokens
+
+
+async def _query_gemini_api(user_prompt, model, on_fragment=None):
+    """Interroge Gemini avec streaming asynchrone (fallback sans streaming) -> (réponse, tokens)"""
+    start_time = time.time()
+    _log(f"✨ Gemini START ({model})")
+    config = types.GenerateContentConfig(**GEMINI_PARAMS)
     try:
         # Utiliser le streaming pour la réponse
         stream = await gemini_client.aio.models.generate_content_stream(
             model=model,
             contents=user_prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.2,
-                max_output_tokens=64000
-            )
+            config=config,
         )
-        
+
         parts = []
         tokens = 0
         last_chunk = None
         async for chunk in stream:
             if hasattr(chunk, 'text') and chunk.text:
+                signaler_premier_token()
                 parts.append(chunk.text)
+                if on_fragment:
+                    on_fragment(chunk.text)
             last_chunk = chunk
-        
+
         # Récupérer les tokens du dernier chunk
         if last_chunk and hasattr(last_chunk, 'usage_metadata'):
             tokens = last_chunk.usage_metadata.candidates_token_count if hasattr(last_chunk.usage_metadata, 'candidates_token_count') else 0
-        
+            signaler_usage(getattr(last_chunk.usage_metadata, 'prompt_token_count', None), tokens)
+
         reponse = "".join(parts)
-        elapsed = time.time() - start_time
-        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ Gemini END ({elapsed:.1f}s, {tokens} tokens)")
-        return reponse, elapsed, tokens
+        _log(f"✅ Gemini END ({time.time() - start_time:.1f}s, {tokens} tokens)")
+        return reponse, tokens
     except Exception as e:
-        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ❌ Gemini ERROR: {str(e)}")
+        _log(f"❌ Gemini ERROR: {str(e)}")
         # Si le streaming ne fonctionne pas, fallback sur l'API standard
-        try:
-            response = await gemini_client.aio.models.generate_content(
-                model=model,
-                contents=user_prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.2,
-                    max_output_tokens=64000
-                )
-            )
-            elapsed = time.time() - start_time
-            tokens = response.usage_metadata.candidates_token_count if hasattr(response, 'usage_metadata') and hasattr(response.usage_metadata, 'candidates_token_count') else 0
-            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ Gemini END (fallback) ({elapsed:.1f}s, {tokens} tokens)")
-            return str(response.text), elapsed, tokens
-        except Exception as e2:
-            elapsed = time.time() - start_time
-            return f"Erreur Gemini: {str(e2)}", elapsed, 0
+        response = await gemini_client.aio.models.generate_content(
+            model=model,
+            contents=user_prompt,
+            config=config,
+        )
+        tokens = response.usage_metadata.candidates_token_count if hasattr(response, 'usage_metadata') and hasattr(response.usage_metadata, 'candidates_token_count') else 0
+        signaler_usage(getattr(getattr(response, 'usage_metadata', None), 'prompt_token_count', None), tokens)
+        _log(f"✅ Gemini END (fallback) ({time.time() - start_time:.1f}s, {tokens} tokens)")
+        return str(response.text), tokens
+
+
+async def query_claude(user_prompt, on_fragment=None):
+    """Interroge Claude (via le cache LLM) -> (réponse, temps, tokens)"""
+    return await _query_cached(
+        "anthropic", CLAUDE_MODEL, user_prompt, CLAUDE_PARAMS,
+        lambda: _query_claude_api(user_prompt, on_fragment), "Claude",
+    )
+
+
+async def query_chatgpt(user_prompt, on_fragment=None):
+    """Interroge ChatGPT (via le cache LLM) -> (réponse, temps, tokens) ; pas de streaming."""
+    return await _query_cached(
+        "openai", CHATGPT_MODEL, user_prompt, CHATGPT_PARAMS,
+        lambda: _query_chatgpt_api(user_prompt), "ChatGPT",
+    )
+
+
+async def query_gemini(user_prompt, model='gemini-3-pro-preview', on_fragment=None):
+    """Interroge Gemini (via le cache LLM) -> (réponse, temps, tokens)"""
+    return await _query_cached(
+        "gemini", model, user_prompt, GEMINI_PARAMS,
+        lambda: _query_gemini_api(user_prompt, model, on_fragment), "Gemini",
+    )
+
+
+# Fournisseurs comparables : nom -> (icône, libellé de l'onglet)
+FOURNISSEURS = {
+    "Claude": ("🌀", "Claude Sonnet 4.5"),
+    "ChatGPT": ("💬", "ChatGPT (GPT-5)"),
+    "Gemini": ("💫", "Gemini"),
+}
+# Rafraîchissement de l'aperçu streamé (s) et nombre de caractères affichés.
+APERCU_INTERVALLE_S = 0.5
+APERCU_CARACTERES = 2000
+
+
+def _libelle(nom, gemini_model):
+    return f"Gemini ({gemini_model})" if nom == "Gemini" else FOURNISSEURS[nom][1]
+
+
+def _concurrents(user_prompt, fournisseurs, gemini_model):
+    """Fonctions de `courir` pour les fournisseurs sélectionnés."""
+    appels = {
+        "Claude": lambda on_fragment: query_claude(user_prompt, on_fragment),
+        "ChatGPT": lambda on_fragment: query_chatgpt(user_prompt, on_fragment),
+        "Gemini": lambda on_fragment: query_gemini(user_prompt, gemini_model, on_fragment),
+    }
+    return {nom: appels[nom] for nom in fournisseurs}
+
+
+def _reponse_valide(reponse):
+    # _query_cached renvoie les erreurs sous forme de texte « Erreur <label>: ... ».
+    return bool(reponse) and not reponse.startswith("Erreur ")
 
 
 # ==========================
 # Interface utilisateur
 # ==========================
 
+rafraichir_cache_llm = st.sidebar.toggle(
+    "♻️ Régénérer les réponses IA",
+    value=False,
+    help="Ignore les réponses déjà en cache pour ces prompts et les remplace.",
+)
+
 # Toggle pour le type de fichier
 file_type = st.segmented_control(
     "Type de fichier à importer",
@@ -418,6 +473,24 @@ gemini_model = st.segmented_control(
     default="gemini-2.5-pro"
 )
 
+col_fournisseurs, col_mode, col_delai = st.columns([2, 2, 1])
+with col_fournisseurs:
+    fournisseurs = st.multiselect(
+        "Modèles interrogés",
+        options=list(FOURNISSEURS),
+        default=list(FOURNISSEURS),
+    )
+with col_mode:
+    mode_course = st.segmented_control(
+        "Mode",
+        options=[MODE_TOUS, MODE_PREMIER],
+        format_func={MODE_TOUS: "⚖️ Comparer (toutes les réponses)", MODE_PREMIER: "🏁 Course (première réponse)"}.get,
+        default=MODE_TOUS,
+        help="En course, la première réponse valide l'emporte et les autres appels sont annulés.",
+    )
+with col_delai:
+    delai_min = st.number_input("Délai max (min)", min_value=1, max_value=60, value=15)
+
 mode_json = True # Avant on pouvait choisir, maintenant on force à True. On pourra revenir dessus si besoin
 
 if uploaded_file is not None:
@@ -441,100 +514,96 @@ if uploaded_file is not None:
             
             user_prompt = selected_prompt.replace("{precisions}", precisions).replace("{texte_pdf_a_analyser}", extracted_text)
 
+            if not fournisseurs:
+                st.warning("Sélectionnez au moins un modèle.")
+                st.stop()
+
+            # Une colonne par modèle : indicateurs puis aperçu du texte streamé.
+            st.markdown("### 🌀 Réponses en cours")
+            colonnes = dict(zip(fournisseurs, st.columns(len(fournisseurs))))
+            indicateurs, apercus, derniers_rafraichissements = {}, {}, {}
+            for nom, colonne in colonnes.items():
+                colonne.markdown(f"**{FOURNISSEURS[nom][0]} {_libelle(nom, gemini_model)}**")
+                indicateurs[nom] = colonne.empty()
+                indicateurs[nom].info("⏳ En attente...")
+                apercus[nom] = colonne.empty()
+
+            def afficher_fragment(resultat):
+                maintenant = time.perf_counter()
+                if maintenant - derniers_rafraichissements.get(resultat.nom, 0) < APERCU_INTERVALLE_S:
+                    return
+                derniers_rafraichissements[resultat.nom] = maintenant
+                indicateurs[resultat.nom].info(
+                    f"✍️ {len(resultat.reponse):,} caractères reçus (1er fragment {resultat.premier_fragment_s:.1f} s)"
+                )
+                apercus[resultat.nom].code(resultat.reponse[-APERCU_CARACTERES:], language="json")
+
+            def afficher_fin(resultat):
+                if resultat.valide:
+                    indicateurs[resultat.nom].success(f"✅ {resultat.resume()}")
+                else:
+                    indicateurs[resultat.nom].warning(f"⚠️ {resultat.resume()}")
+                apercus[resultat.nom].empty()
+
             with st.spinner("🌀 Interrogation des modèles en parallèle. Cela peut prendre quelques minutes..."):
-                # Fonction async pour exécuter les trois modèles en parallèle
-                async def run_all_models():
-                    # Lancer les trois requêtes en parallèle
-                    print(f"\n[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 🚀 Démarrage de l'analyse parallèle")
-                    results_tuple = await asyncio.gather(
-                        query_claude(user_prompt),
-                        query_chatgpt(user_prompt),
-                        query_gemini(user_prompt, gemini_model),
-                        return_exceptions=True
-                    )
-                    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] 🏁 Tous les modèles ont terminé\n")
-                    
-                    # Décomposer les tuples (réponse, temps, tokens)
-                    results = {}
-                    times = {}
-                    tokens = {}
-                    
-                    for idx, model_name in enumerate(["Claude", "ChatGPT", "Gemini"]):
-                        if isinstance(results_tuple[idx], Exception):
-                            results[model_name] = f"Erreur : {str(results_tuple[idx])}"
-                            times[model_name] = 0
-                            tokens[model_name] = 0
-                        elif isinstance(results_tuple[idx], tuple) and len(results_tuple[idx]) == 3:
-                            results[model_name] = results_tuple[idx][0]
-                            times[model_name] = results_tuple[idx][1]
-                            tokens[model_name] = results_tuple[idx][2]
-                        else:
-                            results[model_name] = str(results_tuple[idx])
-                            times[model_name] = 0
-                            tokens[model_name] = 0
-                    
-                    return results, times, tokens
-                
-                # Exécuter les requêtes async
-                results, times, tokens = asyncio.run(run_all_models())
-                
-                # Afficher les temps et tokens individuels
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.info(f"🤖 Claude : {times['Claude']:.1f}s | {tokens['Claude']:,} tokens")
-                with col2:
-                    st.info(f"💬 ChatGPT : {times['ChatGPT']:.1f}s | {tokens['ChatGPT']:,} tokens")
-                with col3:
-                    st.info(f"✨ Gemini : {times['Gemini']:.1f}s | {tokens['Gemini']:,} tokens")
-            
+                _log(f"🚀 Démarrage de l'analyse parallèle ({mode_course}) : {', '.join(fournisseurs)}")
+                debut_course = time.perf_counter()
+                resultats_course = asyncio.run(courir(
+                    _concurrents(user_prompt, fournisseurs, gemini_model),
+                    mode=mode_course or MODE_TOUS,
+                    timeout_s=delai_min * 60,
+                    valide=_reponse_valide,
+                    on_fragment=afficher_fragment,
+                    on_termine=afficher_fin,
+                ))
+                duree_course = time.perf_counter() - debut_course
+                _log(f"🏁 Analyse terminée en {duree_course:.1f}s")
+
+            results = {nom: r.reponse for nom, r in resultats_course.items() if r.valide}
+            duree_cumulee = sum(r.duree_s for r in resultats_course.values())
+            st.caption(
+                f"⏱️ {duree_course:.1f} s au total pour {len(fournisseurs)} modèle(s) "
+                f"(contre {duree_cumulee:.1f} s en les interrogeant l'un après l'autre)"
+            )
+
             # Afficher les résultats
             if results:
                 st.success("✅ Analyse terminée !")
-                
+
                 # Affichage des résultats dans des onglets
                 st.markdown("---")
                 st.markdown("## ✨ Résultats")
-                
-                tab1, tab2, tab3 = st.tabs(["🌀 Claude", "💬 ChatGPT", "💫 Gemini"])
-                
-                with tab1:
-                    st.markdown("### Claude Sonnet 4.5")    
-                    claude_result = results.get("Claude", "Pas de réponse")
-                    
-                    # Afficher selon le mode
-                    display_result(claude_result, mode_json)
-                
-                with tab2:
-                    st.markdown("### ChatGPT (GPT-5)")
-                    chatgpt_result = results.get("ChatGPT", "Pas de réponse")
-                    
-                    # Afficher selon le mode
-                    display_result(chatgpt_result, mode_json)
-                
-                with tab3:
-                    st.markdown(f"### Gemini ({gemini_model})")
-                    gemini_result = results.get("Gemini", "Pas de réponse")
-                    
-                    # Afficher selon le mode
-                    display_result(gemini_result, mode_json)
-                
+
+                onglets = st.tabs([f"{FOURNISSEURS[nom][0]} {nom}" for nom in results])
+                for onglet, (nom, reponse) in zip(onglets, results.items()):
+                    with onglet:
+                        st.markdown(f"### {_libelle(nom, gemini_model)}")
+                        display_result(reponse, mode_json)
+
                 # Statistiques de comparaison
                 st.markdown("---")
                 st.markdown("### 📈 Statistiques")
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    claude_words = len(results.get("Claude", "").split())
-                    st.metric("Mots (Claude)", claude_words)
-                
-                with col2:
-                    gpt_words = len(results.get("ChatGPT", "").split())
-                    st.metric("Mots (ChatGPT)", gpt_words)
-                
-                with col3:
-                    gemini_words = len(results.get("Gemini", "").split())
-                    st.metric("Mots (Gemini)", gemini_words)
-        
+                st.dataframe(
+                    pd.DataFrame([
+                        {
+                            "Modèle": nom,
+                            "Statut": r.statut,
+                            "Latence (s)": round(r.duree_s, 1),
+                            "1er fragment (s)": None if r.premier_fragment_s is None else round(r.premier_fragment_s, 1),
+                            "Tokens": r.tokens,
+                            "Mots": len(r.reponse.split()) if r.valide else 0,
+                        }
+                        for nom, r in resultats_course.items()
+                    ]),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+            else:
+                st.error("❌ Aucun modèle n'a renvoyé de réponse exploitable.")
+                for nom, r in resultats_course.items():
+                    if r.reponse or r.erreur:
+                        st.markdown(f"**{nom}** : {r.erreur or r.reponse[:500]}")
+
         else:
             st.error(f"❌ Erreur lors de l'extraction du texte du {file_type}")
             st.error(extracted_text)
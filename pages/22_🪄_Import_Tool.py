@@ -4,7 +4,6 @@ from google.genai import types
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseUpload
-from pypdf import PdfReader
 import asyncio
 import os
 import io
@@ -15,7 +14,14 @@ import pandas as pd
 import re
 import nest_asyncio
 import pandas as pd
-from openpyxl import load_workbook
+
+from utils.extraction_pdf import extraire_texte_pdf
+from utils.import_decoupage import CONCURRENCE_MAX, decouper_document, fusionner_actions, rassembler
+from utils.import_excel import remplir_fichier_import
+from utils.llm_cache import appel_cache_async
+from utils.llm_telemetrie import signaler_premier_token, signaler_usage
+from utils.tableau_prompt import BUDGET_TOKENS, encoder_csv, encoder_excel
+
 nest_asyncio.apply()
 
 # ID du dossier Google Drive de destination pour les fichiers d'import générés
@@ -474,61 +480,43 @@ Exemple de format attendu
 """
 
 def extract_text_from_pdf(pdf_file):
-    """Extrait le texte d'un fichier PDF"""
+    """Extrait le texte d'un fichier PDF (pages en parallèle, cache par contenu du fichier)"""
     try:
-        pdf_reader = PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text
+        resultat = extraire_texte_pdf(pdf_file.getvalue())
     except Exception as e:
         return f"Erreur lors de l'extraction du PDF : {str(e)}"
+    st.caption(f"📄 {resultat.resume()}")
+    return resultat.texte
 
 def extract_text_from_csv(csv_file):
+    """Contenu du CSV en enregistrements délimités compacts (utils.tableau_prompt)"""
     try:
-        df = pd.read_csv(csv_file, sep=';').fillna('')
-
-        text = "# Fichier CSV\n\n"
-        text += f"**Dimensions :** {len(df)} lignes × {len(df.columns)} colonnes\n\n"
-        text += f"**Colonnes :** {', '.join(df.columns)}\n\n"
-        text += "**Contenu complet :**\n\n"
-
-        raw = df.to_string(index=False)
-        raw = re.sub(r'\s+', ' ', raw)
-
-        text += raw
-        
-        return text
-
+        text, rapport = encoder_csv(csv_file, sep=';')
     except Exception as e:
         return f"Erreur lors de la lecture du CSV : {str(e)}"
+    afficher_rapport_tableau(rapport)
+    return text
 
 def extract_text_from_excel(excel_file):
+    """Onglets pertinents du classeur, lus un à un, en enregistrements délimités compacts"""
     try:
-        sheets = pd.read_excel(excel_file, sheet_name=None, engine='openpyxl')
-
-        parts = []
-        total_rows = 0
-        for sheet_name, df in sheets.items():
-            df = df.fillna('')
-            total_rows += len(df)
-
-            part = f"## Onglet : {sheet_name}\n\n"
-            part += f"**Dimensions :** {len(df)} lignes × {len(df.columns)} colonnes\n\n"
-            part += f"**Colonnes :** {', '.join(str(c) for c in df.columns)}\n\n"
-            part += "**Contenu :**\n\n"
-
-            raw = df.to_string(index=False)
-            raw = re.sub(r'\s+', ' ', raw)
-            part += raw
-
-            parts.append(part)
-
-        header = f"# Fichier Excel — {len(sheets)} onglet(s), {total_rows} lignes au total\n\n"
-        return header + "\n\n---\n\n".join(parts)
-
+        text, rapport = encoder_excel(excel_file)
     except Exception as e:
         return f"Erreur lors de la lecture du fichier Excel : {str(e)}"
+    afficher_rapport_tableau(rapport)
+    return text
+
+def afficher_rapport_tableau(rapport):
+    """Résumé de l'encodage : colonnes vides, onglets écartés, troncature au budget de tokens"""
+    details = [f"~{rapport.tokens:,} tokens"]
+    vides = sum(len(t.colonnes_vides) for t in rapport.tableaux)
+    if vides:
+        details.append(f"{vides} colonne(s) vide(s) ignorée(s)")
+    if rapport.onglets_ignores:
+        details.append("onglets ignorés : " + ", ".join(rapport.onglets_ignores))
+    st.caption("📊 " + " | ".join(details))
+    if rapport.tronque:
+        st.warning(f"✂️ Fichier tronqué au budget de {BUDGET_TOKENS:,} tokens : {rapport.resume()}")
 
 def df_to_compact_text(df: pd.DataFrame, show_index: bool = True) -> str:
     """Convertit un dataframe en texte compact pour l'envoyer à Gemini.
@@ -727,47 +715,6 @@ def strip_numbering_from_df(df: pd.DataFrame) -> pd.DataFrame:
     return df_copy
 
 
-def remplir_fichier_import(df: pd.DataFrame) -> io.BytesIO:
-    """Remplit le fichier import avec les données du dataframe et retourne un BytesIO"""
-    
-    # 1 Charger le fichier source directement (sans copie sur disque)
-    src = "utils/template_pa.xlsx"
-    wb = load_workbook(src)
-    ws = wb["Fichier dimport"]
-
-    # 2 Mapping des colonnes Excel (lettre → nom de colonne df)
-    mapping = {
-        "A": "axe",
-        "B": "sous-axe",
-        "D": "titre",
-        "E": "titre de la sous-action",
-        "F": "description",
-        "H": "objectifs",
-        "J": "structure pilote",
-        "M": "direction ou service pilote",
-        "N": "personne pilote",
-        "X": "budget",
-        "Y": "statut",
-        "AA": "date de début",
-        "AB": "date de fin",
-    }
-
-    # 3 Écrire les données à partir de la ligne 5
-    start_row = 5
-
-    for i, (_, row) in enumerate(df.iterrows(), start=start_row):
-        for col_letter, df_col in mapping.items():
-            value = row.get(df_col, "")
-            ws[f"{col_letter}{i}"] = "" if pd.isna(value) else value
-
-    # 4 Sauvegarder dans un BytesIO (en mémoire, pas sur disque)
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    return output
-
-
 def upload_excel_to_drive(excel_bytes: io.BytesIO, filename: str, folder_id: str = DRIVE_FOLDER_ID):
     """Upload un fichier Excel (BytesIO) sur Google Drive dans le dossier configuré.
 
@@ -918,71 +865,106 @@ def display_df_markdown(df: pd.DataFrame):
     st.dataframe(df_a_afficher, use_container_width=True, height=600)
 
 
-async def query_gemini(user_prompt, model='gemini-3.1-pro-preview'):
-    """Interroge Gemini avec streaming asynchrone"""
+GEMINI_PARAMS = {"temperature": 0.2, "max_output_tokens": 64000}
+
+
+def _usage_gemini(obj):
+    """[tokens sortie, tokens entrée] d'une réponse (ou du dernier chunk) Gemini.
+
+    Renseigne aussi la télémétrie de l'appel en cours.
+    """
+    usage = getattr(obj, 'usage_metadata', None)
+    if hasattr(usage, 'candidates_token_count') and hasattr(usage, 'prompt_token_count'):
+        signaler_usage(usage.prompt_token_count, usage.candidates_token_count)
+        return [usage.candidates_token_count, usage.prompt_token_count]
+    return [0, 0]
+
+
+async def _query_gemini_api(user_prompt, model):
+    """Interroge Gemini avec streaming asynchrone (fallback sans streaming) -> (réponse, tokens)"""
     start_time = time.time()
-    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✨ Gemini START ({model})")
+    config = types.GenerateContentConfig(**GEMINI_PARAMS)
     try:
         # Utiliser le streaming pour la réponse
         stream = await gemini_client.aio.models.generate_content_stream(
             model=model,
             contents=user_prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.2,
-                max_output_tokens=64000
-            )
+            config=config,
         )
-        
+
         parts = []
-        tokens = [0,0]
         last_chunk = None
 
         async for chunk in stream:
             if hasattr(chunk, 'text') and chunk.text:
+                signaler_premier_token()
                 parts.append(chunk.text)
             last_chunk = chunk
-        
+
         # Récupérer les tokens du dernier chunk
-        if hasattr(last_chunk, 'usage_metadata') and hasattr(last_chunk.usage_metadata, 'candidates_token_count') and hasattr(last_chunk.usage_metadata, 'prompt_token_count'):
-            tokens = [last_chunk.usage_metadata.candidates_token_count, last_chunk.usage_metadata.prompt_token_count]
-        else:
-            tokens = [0, 0]
-        
+        tokens = _usage_gemini(last_chunk)
         reponse = "".join(parts)
-        elapsed = time.time() - start_time
-        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ Gemini END ({elapsed:.1f}s, {tokens} tokens)")
-        return reponse, elapsed, tokens
+        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ Gemini END ({time.time() - start_time:.1f}s, {tokens} tokens)")
+        return reponse, tokens
 
     except Exception as e:
         print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ❌ Gemini ERROR: {str(e)}")
         # Si le streaming ne fonctionne pas, fallback sur l'API standard
-        try:
-            response = await gemini_client.aio.models.generate_content(
-                model=model,
-                contents=user_prompt,
-                config=types.GenerateContentConfig(
-                    temperature=0.2,
-                    max_output_tokens=64000
-                )
-            )
-            elapsed = time.time() - start_time
-            #Calcul des tokens
-            if hasattr(response, 'usage_metadata') and hasattr(response.usage_metadata, 'candidates_token_count') and hasattr(response.usage_metadata, 'prompt_token_count'):
-                tokens = [response.usage_metadata.candidates_token_count, response.usage_metadata.prompt_token_count]
-            else:
-                tokens = [0, 0]
-            print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ Gemini END (fallback) ({elapsed:.1f}s, {tokens[0]} tokens, {tokens[1]} tokens)")
-            return str(response.text), elapsed, tokens
-        
-        except Exception as e2:
-            elapsed = time.time() - start_time
-            return f"Erreur Gemini: {str(e2)}", elapsed, [0, 0]
+        response = await gemini_client.aio.models.generate_content(
+            model=model,
+            contents=user_prompt,
+            config=config,
+        )
+        tokens = _usage_gemini(response)
+        print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✅ Gemini END (fallback) ({time.time() - start_time:.1f}s, {tokens[0]} tokens, {tokens[1]} tokens)")
+        return str(response.text), tokens
+
+
+async def query_gemini(user_prompt, model='gemini-3.1-pro-preview'):
+    """Interroge Gemini -> (réponse, temps, [tokens sortie, tokens entrée]).
+
+    Les prompts déjà traités (même fichier, même modèle) sont servis par le
+    cache LLM partagé ; les erreurs ne sont pas mises en cache.
+    """
+    start_time = time.time()
+    print(f"[{datetime.now().strftime('%H:%M:%S.%f')[:-3]}] ✨ Gemini START ({model})")
+    try:
+        reponse, tokens = await appel_cache_async(
+            "gemini", model, user_prompt, GEMINI_PARAMS,
+            lambda: _query_gemini_api(user_prompt, model),
+            feature="22_import_tool",
+            etape="extraction",
+            rafraichir=rafraichir_cache_llm,
+        )
+        return reponse, time.time() - start_time, tokens
+    except Exception as e2:
+        elapsed = time.time() - start_time
+        return f"Erreur Gemini: {str(e2)}", elapsed, [0, 0]
+
+
+def query_gemini_parallele(prompts, model):
+    """Interroge Gemini sur plusieurs prompts (au plus CONCURRENCE_MAX à la fois)
+    -> ([(réponse, temps, tokens)] dans l'ordre des prompts, temps max, [tokens sortie, tokens entrée])."""
+    resultats = asyncio.run(rassembler([query_gemini(prompt, model) for prompt in prompts], CONCURRENCE_MAX))
+    resultats = [
+        (f"Erreur Gemini: {str(r)}", 0.0, [0, 0]) if isinstance(r, Exception) else r
+        for r in resultats
+    ]
+    temps = max((r[1] for r in resultats), default=0.0)
+    tokens = [sum(r[2][0] for r in resultats), sum(r[2][1] for r in resultats)]
+    return resultats, temps, tokens
 
 
 # ==========================
 # Interface utilisateur
 # ==========================
 
+rafraichir_cache_llm = st.sidebar.toggle(
+    "♻️ Régénérer les réponses IA",
+    value=False,
+    help="Ignore les réponses déjà en cache pour ces prompts et les remplace.",
+)
+
 # Toggle pour le type de fichier
 file_type = st.segmented_control(
     "Type de fichier à importer",
@@ -1082,18 +1064,44 @@ if uploaded_file is not None:
             st.markdown("## 🪄 Étape 1 : Définition de la structure et créations des fiches actions")
             
             ignore_directive = build_ignore_directive(disabled_columns)
-            user_prompt = ignore_directive + custom_prompt.replace("{precisions}", precisions).replace("{texte_pdf_a_analyser}", extracted_text).replace("{date_du_jour}", datetime.now().strftime("%d/%m/%Y"))
+            # Les longs documents sont découpés par axes et extraits en parallèle
+            morceaux = decouper_document(extracted_text)
+            prompts_extraction = [
+                ignore_directive + custom_prompt.replace("{precisions}", precisions).replace("{texte_pdf_a_analyser}", morceau.texte_prompt(k + 1, len(morceaux))).replace("{date_du_jour}", datetime.now().strftime("%d/%m/%Y"))
+                for k, morceau in enumerate(morceaux)
+            ]
+            if len(morceaux) > 1:
+                st.info(f"📑 Document long : découpé en {len(morceaux)} parties (par axes), extraites et vérifiées en parallèle")
 
             with st.spinner("🌀 Étape 1/5 : Définition de la structure et créations des fiches actions..."):
-                gemini_result, elapsed_time, tokens_count = asyncio.run(query_gemini(user_prompt, gemini_model))
+                resultats_extraction, elapsed_time, tokens_count = query_gemini_parallele(prompts_extraction, gemini_model)
                 total_tokens_consumed[0] += tokens_count[0]
                 total_tokens_consumed[1] += tokens_count[1]
                 st.info(f"✨ Extraction : {elapsed_time:.1f}s | Entrée : {tokens_count[1]:,} tokens | Sortie : {tokens_count[0]:,} tokens")
-            
-            if gemini_result and not gemini_result.startswith("Erreur"):
+
+            parties_extraites = [
+                (k, r[0]) for k, r in enumerate(resultats_extraction) if r[0] and not r[0].startswith("Erreur")
+            ]
+            gemini_result = "\n\n".join(r for _, r in parties_extraites) or resultats_extraction[0][0]
+
+            if parties_extraites:
                 try:
-                    # Parser le JSON et créer le dataframe
-                    data = parse_json_response(gemini_result)
+                    # Parser le JSON de chaque partie puis fusionner (doublons aux frontières)
+                    extractions = []
+                    indices_extraits = {k for k, _ in parties_extraites}
+                    for k, (resultat, _, _) in enumerate(resultats_extraction):
+                        if k not in indices_extraits:
+                            st.warning(f"⚠️ Partie {k + 1}/{len(morceaux)} non extraite : {resultat}")
+                            continue
+                        try:
+                            extractions.append((k, parse_json_response(resultat)))
+                        except Exception as e:
+                            if len(morceaux) == 1:
+                                raise
+                            st.warning(f"⚠️ Partie {k + 1}/{len(morceaux)} : réponse illisible ({str(e)})")
+                    if not extractions:
+                        raise ValueError("aucune partie du document n'a pu être extraite")
+                    data, origines = fusionner_actions(extractions)
                     df_actions = pd.DataFrame(data)
                     if not avec_sous_actions:
                         df_actions["sous-actions"] = [[] for _ in range(len(df_actions))]
@@ -1126,14 +1134,33 @@ if uploaded_file is not None:
                         st.markdown("---")
                         st.markdown("## 🔍 Étape 2 : Vérification de la qualité des fiches actions")
                         
-                        reponse_ia = df_to_compact_text(df_actions)
-                        user_prompt_verif = prompt_verif_1.replace("{texte_pdf_a_analyser}", extracted_text).replace("{reponse_ia}", reponse_ia or "")
-                        
+                        # Chaque partie est vérifiée sur son propre texte ; les index
+                        # locaux (ordre axe / sous-axe de la partie) renvoient aux index globaux
+                        prompts_verif = []
+                        index_globaux = []
+                        for k, morceau in enumerate(morceaux):
+                            indices = [i for i, origine in enumerate(origines) if origine == k]
+                            if not indices:
+                                continue
+                            df_partie = df_actions.loc[indices].sort_values(by=["axe", "sous-axe"])
+                            index_globaux.append(list(df_partie.index))
+                            reponse_ia = df_to_compact_text(df_partie.reset_index(drop=True))
+                            prompts_verif.append(prompt_verif_1.replace("{texte_pdf_a_analyser}", morceau.texte).replace("{reponse_ia}", reponse_ia or ""))
+
                         with st.spinner("🌀 Étape 2/5 : Vérification de la qualité des fiches actions..."):
-                            verif_result, elapsed_time, tokens_count = asyncio.run(query_gemini(user_prompt_verif, gemini_model))
+                            resultats_verif, elapsed_time, tokens_count = query_gemini_parallele(prompts_verif, gemini_model)
                             total_tokens_consumed[0] += tokens_count[0]
                             total_tokens_consumed[1] += tokens_count[1]
                             st.info(f"✨ Vérification : {elapsed_time:.1f}s | Entrée : {tokens_count[1]:,} tokens | Sortie : {tokens_count[0]:,} tokens")
+
+                        verifs_ok = [
+                            (globaux, r[0]) for globaux, r in zip(index_globaux, resultats_verif)
+                            if r[0] and not r[0].startswith("Erreur")
+                        ]
+                        for r in resultats_verif:
+                            if verifs_ok and r[0].startswith("Erreur"):
+                                st.warning(f"⚠️ Vérification partielle : {r[0]}")
+                        verif_result = "\n\n".join(r for _, r in verifs_ok) or (resultats_verif[0][0] if resultats_verif else "Erreur : aucune action à vérifier")
                     else:
                         st.markdown("---")
                         st.info("⏭️ Vérifications désactivées — étapes 2 et 3 ignorées.")
@@ -1145,7 +1172,11 @@ if uploaded_file is not None:
                                 # ========================================
                                 # ÉTAPE 3 : Ajout des scores au dataframe
                                 # ========================================
-                                scores_data = parse_json_response(verif_result)
+                                scores_data = {}
+                                for globaux, texte_verif in verifs_ok:
+                                    for idx_str, score_info in parse_json_response(texte_verif).items():
+                                        if int(idx_str) < len(globaux):
+                                            scores_data[str(globaux[int(idx_str)])] = score_info
                                 
                                 df_actions["score"] = None
                                 df_actions["explication"] = ""
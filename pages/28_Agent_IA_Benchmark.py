@@ -8,9 +8,12 @@ from typing import Callable, Optional
 
 import streamlit as st
 from openai import OpenAI
-from sqlalchemy import text
 
 from utils.db import get_engine_pre_prod
+from utils.llm_cache import responses_create, responses_stream
+from utils.recherche_fiches import IndexFiches
+
+FEATURE_LLM = "28_agent_ia_benchmark"
 
 
 @st.cache_resource(show_spinner=False)
@@ -235,7 +238,7 @@ def clean_search_keywords(keywords: list[str], max_keywords: int = 25) -> list[s
     On se contente :
     - De strip / normalise / deduplique (insensible a la casse/accents).
     - D'ajouter un bigramme court si l'expression d'origine fait 4+ tokens
-      (raccourci utile pour le matching ILIKE).
+      (raccourci utile pour la recherche texte).
     """
     cleaned: list[str] = []
     seen: set[str] = set()
@@ -269,15 +272,21 @@ def clean_search_keywords(keywords: list[str], max_keywords: int = 25) -> list[s
     return cleaned[:max_keywords]
 
 
+@st.cache_resource(show_spinner=False)
+def get_index_fiches() -> IndexFiches:
+    """Index plein texte des fiches action pre-prod, partage entre sessions."""
+    return IndexFiches(get_engine_pre_prod())
+
+
 def search_fiches_action(keywords: list[str]) -> list[dict]:
     """
-    Cherche dans public.fiche_action les lignes ou titre/description matchent
-    au moins un mot-cle (ILIKE), en base pre-prod, avec un score de pertinence.
+    Cherche les fiches action (pre-prod) dont le titre ou la description
+    contient les mots-cles, via l'index BM25 en memoire (utils.recherche_fiches).
 
-    Scoring :
-    - Titre match : +3
-    - Description match : +1
-    Le score est la somme sur tous les mots-cles. Resultats tries par score desc.
+    Les mots sont desaccentues et racinises (pluriels, suffixes courants) ;
+    un terme trouve dans le titre pese 3 fois plus que dans la description.
+    L'index est resynchronise au plus toutes les 5 minutes sur modified_at.
+    Resultats tries par score desc (50 max).
     """
     cleaned_input = []
     for keyword in keywords:
@@ -297,51 +306,11 @@ def search_fiches_action(keywords: list[str]) -> list[dict]:
     if not search_keywords:
         return []
 
-    match_clauses = []
-    title_score_parts = []
-    desc_score_parts = []
-    params: dict[str, str] = {}
-    for idx, keyword in enumerate(search_keywords):
-        param_name = f"kw_{idx}"
-        params[param_name] = f"%{keyword}%"
-        match_clauses.append(
-            f"(fa.titre ILIKE :{param_name} OR COALESCE(fa.description, '') ILIKE :{param_name})"
-        )
-        title_score_parts.append(f"CASE WHEN fa.titre ILIKE :{param_name} THEN 3 ELSE 0 END")
-        desc_score_parts.append(
-            f"CASE WHEN COALESCE(fa.description, '') ILIKE :{param_name} THEN 1 ELSE 0 END"
-        )
-
-    where_clause = " OR ".join(match_clauses)
-    score_expr = " + ".join(title_score_parts + desc_score_parts)
-
-    sql_query = f"""
-        SELECT
-            c.nom AS collectivite,
-            fa.titre AS titre,
-            COALESCE(fa.description, '') AS description,
-            ({score_expr}) AS score
-        FROM public.fiche_action fa
-        JOIN public.collectivite c ON c.id = fa.collectivite_id
-        WHERE c.type != 'test'
-          AND ({where_clause})
-        ORDER BY score DESC, fa.titre ASC
-        LIMIT 50
-    """
-
-    engine = get_engine_pre_prod()
-    with engine.connect() as conn:
-        rows = conn.execute(text(sql_query), params).mappings().all()
-
-    results = [
-        {
-            "collectivite": str(row["collectivite"] or ""),
-            "titre": str(row["titre"] or ""),
-            "description": str(row["description"] or ""),
-            "score": int(row["score"] or 0),
-        }
-        for row in rows
-    ]
+    index = get_index_fiches()
+    nb_lues = index.synchroniser()
+    if nb_lues:
+        logger.info("search_fiches_action index synchronise (%s fiches lues)", nb_lues)
+    results = index.rechercher(search_keywords, limite=50)
     logger.info(
         "search_fiches_action returned %s results (top score=%s, bottom score=%s)",
         len(results),
@@ -476,7 +445,8 @@ def _stream_and_collect(
     **create_kwargs,
 ) -> tuple[object, str]:
     """
-    Execute client.responses.create en streaming. Retourne (final_response, accumulated_text).
+    Execute client.responses.create en streaming, via le cache LLM partage.
+    Retourne (final_response, accumulated_text).
 
     Gere les events :
     - response.output_text.delta : relaye dans on_text_chunk.
@@ -484,27 +454,40 @@ def _stream_and_collect(
       pour rafraichir le status UI.
     - response.completed : recupere l'objet response final.
     """
-    accumulated_text = ""
-    final_response = None
-    tool_call_signaled = False
-
-    stream = client.responses.create(stream=True, **create_kwargs)
-    for event in stream:
-        event_type = getattr(event, "type", "")
-        if event_type == "response.output_text.delta":
-            delta = getattr(event, "delta", "") or ""
-            if delta:
-                accumulated_text += delta
-                if on_text_chunk:
-                    on_text_chunk(strip_meta_verification(accumulated_text))
-        elif event_type == "response.output_item.added":
-            item = getattr(event, "item", None)
-            if item is not None and getattr(item, "type", "") == "function_call":
-                if on_tool_call_started and not tool_call_signaled:
-                    on_tool_call_started()
-                    tool_call_signaled = True
-        elif event_type == "response.completed":
-            final_response = getattr(event, "response", None)
+    def consommer(stream) -> tuple[object, str]:
+        accumulated_text = ""
+        final_response = None
+        tool_call_signaled = False
+        for event in stream:
+            event_type = getattr(event, "type", "")
+            if event_type == "response.output_text.delta":
+                delta = getattr(event, "delta", "") or ""
+                if delta:
+                    accumulated_text += delta
+                    if on_text_chunk:
+                        on_text_chunk(strip_meta_verification(accumulated_text))
+            elif event_type == "response.output_item.added":
+                item = getattr(event, "item", None)
+                if item is not None and getattr(item, "type", "") == "function_call":
+                    if on_tool_call_started and not tool_call_signaled:
+                        on_tool_call_started()
+                        tool_call_signaled = True
+            elif event_type == "response.completed":
+                final_response = getattr(event, "response", None)
+        return final_response, accumulated_text
+
+    final_response, accumulated_text, depuis_cache = responses_stream(
+        client, feature=FEATURE_LLM, consommer=consommer, **create_kwargs
+    )
+    if depuis_cache:
+        # Reponse servie par le cache LLM : on rejoue les callbacks du stream.
+        if on_tool_call_started and any(
+            getattr(item, "type", "") == "function_call"
+            for item in (final_response.output or [])
+        ):
+            on_tool_call_started()
+        if on_text_chunk and accumulated_text:
+            on_text_chunk(strip_meta_verification(accumulated_text))
 
     return final_response, strip_meta_verification(accumulated_text).strip()
 
@@ -533,7 +516,11 @@ def _non_stream_retry(
 ) -> str:
     """Retry non-streaming quand le stream n'a produit aucun texte."""
     logger.info("Fallback non-stream (%s) triggered", label)
-    response = client.responses.create(**create_kwargs)
+    # rafraichir : la meme requete en streaming n'a rien produit, on ne la
+    # resert pas depuis le cache et on remplace l'entree.
+    response = responses_create(
+        client, feature=FEATURE_LLM, etape="sans_stream", rafraichir=True, **create_kwargs
+    )
     text_out = strip_meta_verification(
         getattr(response, "output_text", "") or ""
     ).strip()
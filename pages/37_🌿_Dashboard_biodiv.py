@@ -12,48 +12,20 @@ from streamlit_elements import elements, mui, nivo
 
 from utils.db import get_engine_prod, read_table
 from utils.retro_charts import THEME_NIVO
+from utils.themes_fiches import THEMES, StoreThemes
 
-# Mots-clés inclusifs pour détecter une action biodiversité (titre ou description)
-BIODIV_KEYWORDS = [
-    "trame verte",
-    "trame bleue",
-    "trame bleu",
-    "trame noire",
-    "haie",
-    "pollution sonore",
-    "biodiversité",
-    "biodiversite",
-    "biodiv",
-    "artificialisation",
-    "phytosanitaire",
-    "pesticide",
-    "engrais",
-    "espèce exotique",
-    "espece exotique",
-    "exotique envahissant",
-    "captage d'eau",
-    "zone de captage",
-    "renaturation",
-    "restauration de milieu",
-    "milieux naturels",
-    "aire protégée",
-    "aires protégées",
-    "natura 2000",
-]
+# Mots-clés inclusifs pour détecter une action biodiversité (titre ou description),
+# classés une fois par fiche dans utils.themes_fiches.
+THEME_BIODIV = "biodiversite"
+BIODIV_KEYWORDS = THEMES[THEME_BIODIV]
 
 PLAN_BIODIV_TYPE = 13
 CHART_START = pd.Timestamp("2023-01-01")
 
 
-def _build_keyword_conditions(column: str) -> str:
-    return " OR ".join(
-        f"lower(coalesce({column}, '')) LIKE '%' || :kw_{i} || '%'"
-        for i in range(len(BIODIV_KEYWORDS))
-    )
-
-
-def _keyword_params() -> dict[str, str]:
-    return {f"kw_{i}": kw for i, kw in enumerate(BIODIV_KEYWORDS)}
+@st.cache_resource(show_spinner=False)
+def get_store_themes() -> StoreThemes:
+    return StoreThemes()
 
 
 @st.cache_data(ttl="3d", show_spinner="Chargement des collectivités…")
@@ -93,9 +65,10 @@ def load_actions_biodiv_statut(fiche_ids: tuple[int, ...]) -> pd.DataFrame:
 
 @st.cache_data(ttl="3d", show_spinner="Chargement des actions biodiversité…")
 def load_actions_biodiv() -> pd.DataFrame:
-    titre_cond = _build_keyword_conditions("fa.titre")
-    desc_cond = _build_keyword_conditions("fa.description")
-    params = _keyword_params()
+    # Seules les fiches modifiées depuis le dernier passage sont reclassées.
+    store = get_store_themes()
+    store.synchroniser(get_engine_prod())
+    params = {"fiche_ids_mots_cles": store.fiches(THEME_BIODIV)}
 
     sql = f"""
         SELECT DISTINCT
@@ -120,8 +93,7 @@ def load_actions_biodiv() -> pd.DataFrame:
               WHERE faa.fiche_id = fa.id
                 AND (a.type = {PLAN_BIODIV_TYPE} OR plan_root.type = {PLAN_BIODIV_TYPE})
             )
-            OR ({titre_cond})
-            OR ({desc_cond})
+            OR fa.id = ANY(:fiche_ids_mots_cles)
             OR EXISTS (
               SELECT 1
               FROM fiche_action_action faa2
@@ -322,7 +294,7 @@ with st.expander("Critères de détection des actions biodiversité"):
     st.markdown("""
     Une action est comptée si **au moins une** des conditions suivantes est vraie :
     - elle est rattachée à un plan biodiversité (`axe.type = 13`, y compris via un sous-axe) ;
-    - son **titre** ou sa **description** contient l'un des mots-clés ci-dessous ;
+    - son **titre** ou sa **description** contient l'un des mots-clés ci-dessous (sans tenir compte des accents ni de la casse) ;
     - elle est liée au référentiel CAE via `fiche_action_action` avec `action_id` commençant par `3.3.4`.
     """)
     st.markdown("**Mots-clés recherchés :** " + ", ".join(f"*{kw}*" for kw in BIODIV_KEYWORDS))
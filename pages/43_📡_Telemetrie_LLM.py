@@ -0,0 +1,128 @@
+import streamlit as st
+
+st.set_page_config(
+    page_title="Télémétrie LLM",
+    page_icon="📡",
+    layout="wide",
+)
+
+from datetime import timedelta
+
+import plotly.express as px
+
+from utils.http_client import get_client
+from utils.llm_cache import get_cache
+from utils.llm_telemetrie import ISSUE_ANNULE, ISSUE_CACHE, ISSUE_ERREUR, cout_usd, get_telemetrie, resume
+
+PERIODES = {
+    "24 heures": timedelta(days=1),
+    "7 jours": timedelta(days=7),
+    "30 jours": timedelta(days=30),
+    "Tout": None,
+}
+
+# ==========================
+# Données
+# ==========================
+
+st.title("📡 Télémétrie LLM")
+st.caption(
+    "Appels LLM des pages IA (06, 07, 18, 22, 26, 28) : latence, tokens et coût estimé "
+    "par page et par étape. Mesures locales à l'instance (.cache/llm_telemetrie.sqlite)."
+)
+
+col_periode, col_feature = st.columns([1, 3])
+with col_periode:
+    periode = st.selectbox("Période", list(PERIODES), index=1)
+
+df = get_telemetrie().charger(PERIODES[periode])
+if df.empty:
+    st.info("Aucun appel LLM mesuré sur la période.")
+    st.stop()
+
+with col_feature:
+    features = st.multiselect("Pages", sorted(df["feature"].unique()), default=sorted(df["feature"].unique()))
+df = df[df["feature"].isin(features)]
+if df.empty:
+    st.stop()
+
+df = df.assign(cout_usd=cout_usd(df), etape=df["etape"].fillna("—"))
+reels = df[~df["issue"].isin([ISSUE_CACHE, ISSUE_ANNULE])]
+
+# ==========================
+# Indicateurs
+# ==========================
+
+c1, c2, c3, c4, c5 = st.columns(5)
+c1.metric("Appels", f"{len(df):,}".replace(",", " "))
+c2.metric("Hits cache", f"{(df['issue'] == ISSUE_CACHE).mean():.0%}")
+c3.metric("Erreurs", int((df["issue"] == ISSUE_ERREUR).sum()))
+c4.metric("Coût estimé", f"{df['cout_usd'].sum():.2f} $")
+c5.metric(
+    "Latence p95",
+    f"{reels['latence_ms'].quantile(0.95) / 1000:.1f} s" if not reels.empty else "—",
+)
+
+# ==========================
+# Par page et par étape
+# ==========================
+
+st.subheader("Par page")
+st.dataframe(resume(df), use_container_width=True, hide_index=True)
+
+st.subheader("Par étape")
+st.dataframe(resume(df, par=["feature", "etape", "modele"]), use_container_width=True, hide_index=True)
+
+col_gauche, col_droite = st.columns(2)
+with col_gauche:
+    if not reels.empty:
+        fig = px.box(
+            reels.assign(latence_s=reels["latence_ms"] / 1000),
+            x="feature", y="latence_s", color="provider", points=False,
+            title="Latence des appels réels (s)",
+        )
+        st.plotly_chart(fig, use_container_width=True)
+with col_droite:
+    cout_jour = (
+        df.assign(jour=df["ts"].dt.floor("D"))
+        .groupby(["jour", "feature"], as_index=False)["cout_usd"].sum()
+    )
+    fig = px.bar(cout_jour, x="jour", y="cout_usd", color="feature", title="Coût estimé par jour ($)")
+    st.plotly_chart(fig, use_container_width=True)
+
+erreurs = df[df["issue"] == ISSUE_ERREUR]
+if not erreurs.empty:
+    with st.expander(f"❌ Dernières erreurs ({len(erreurs)})"):
+        st.dataframe(
+            erreurs.sort_values("ts", ascending=False)
+            [["ts", "feature", "etape", "provider", "modele", "tentative", "erreur"]].head(200),
+            use_container_width=True,
+            hide_index=True,
+        )
+
+# ==========================
+# Cache LLM
+# ==========================
+
+st.subheader("Cache LLM")
+cache = get_cache()
+st.caption(f"Mode : `{cache.mode}` — compteurs de session depuis le démarrage du process.")
+st.dataframe(cache.stats(), use_container_width=True, hide_index=True)
+compteurs = cache.compteurs()
+if compteurs:
+    st.dataframe(
+        [{"feature": feature, **valeurs} for feature, valeurs in sorted(compteurs.items())],
+        use_container_width=True,
+        hide_index=True,
+    )
+
+# ==========================
+# Appels HTTP
+# ==========================
+
+st.subheader("Appels HTTP")
+st.caption(
+    "API externes (TET, indicateurs, SNBC) via le client partagé — compteurs du process "
+    "Streamlit depuis son démarrage (les tâches de fond ont leur propre process)."
+)
+st.dataframe(get_client().mesures.resume(), use_container_width=True, hide_index=True)
@@ -0,0 +1,73 @@
+"""Tests du stockage des tableaux d'artefacts de l'assistant stats.
+
+Exécutable avec pytest ou directement : `python tests/test_artefacts_conversation.py`.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.artefacts_conversation import ArtefactExpire, MagasinArtefacts, purger_abandonnes
+
+
+def _df(n: int) -> pd.DataFrame:
+    return pd.DataFrame({"annee": range(n), "commune": [f"Commune {i % 37}" for i in range(n)], "valeur": [i / 3 for i in range(n)]})
+
+
+def test_deversement_au_dela_du_budget():
+    with tempfile.TemporaryDirectory() as tmp:
+        magasin = MagasinArtefacts(tmp, budget_octets=50_000)
+        tableaux = [magasin.stocker(_df(1000)) for _ in range(4)]
+        # ~ 35 ko chacun : seul le dernier reste en memoire.
+        assert [t.en_memoire for t in tableaux] == [False, False, False, True]
+        assert magasin.octets_en_memoire <= 50_000
+        deverse = tableaux[0]
+        assert deverse.chemin.stat().st_size < deverse.octets / 2
+        pd.testing.assert_frame_equal(deverse.df, _df(1000))
+        magasin.vider()
+        assert not magasin.dossier.exists()
+
+
+def test_purge_des_conversations_abandonnees():
+    with tempfile.TemporaryDirectory() as tmp:
+        ancien = Path(tmp) / "ancienne"
+        ancien.mkdir()
+        il_y_a_deux_jours = time.time() - 2 * 24 * 3600
+        os.utime(ancien, (il_y_a_deux_jours, il_y_a_deux_jours))
+        (Path(tmp) / "active").mkdir()
+        assert purger_abandonnes(Path(tmp)) == 1
+        assert sorted(p.name for p in Path(tmp).iterdir()) == ["active"]
+
+
+def test_session_inactive_touchee_puis_artefact_expire():
+    with tempfile.TemporaryDirectory() as tmp:
+        magasin = MagasinArtefacts(tmp, budget_octets=0)
+        deverse = magasin.stocker(_df(100))
+        magasin.stocker(_df(100))
+        il_y_a_deux_jours = time.time() - 2 * 24 * 3600
+        os.utime(magasin.dossier, (il_y_a_deux_jours, il_y_a_deux_jours))
+        magasin.toucher()  # rendu de la page : la conversation reste active
+        assert purger_abandonnes(Path(tmp)) == 0
+
+        os.utime(magasin.dossier, (il_y_a_deux_jours, il_y_a_deux_jours))
+        assert purger_abandonnes(Path(tmp)) == 1
+        magasin.toucher()
+        try:
+            deverse.df
+        except ArtefactExpire:
+            pass
+        else:
+            raise AssertionError("ArtefactExpire attendue")
+
+
+if __name__ == "__main__":
+    test_deversement_au_dela_du_budget()
+    test_purge_des_conversations_abandonnees()
+    test_session_inactive_touchee_puis_artefact_expire()
+    print("OK - artefacts de conversation")
@@ -0,0 +1,63 @@
+"""Tests de la mise en concurrence des modèles (page 18), avec de faux fournisseurs.
+
+Exécutable avec pytest ou directement : `python tests/test_course_llm.py`.
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.course_llm import ANNULE, DELAI, ERREUR, MODE_PREMIER, MODE_TOUS, TERMINE, courir
+
+
+def _faux(fragments, pause, erreur=False):
+    async def concurrent(on_fragment):
+        for fragment in fragments:
+            await asyncio.sleep(pause)
+            on_fragment(fragment)
+        return ("Erreur X: quota" if erreur else "".join(fragments)), 0.0, len(fragments)
+
+    return concurrent
+
+
+def test_comparaison_parallele_avec_delai():
+    partiels = []
+    debut = time.perf_counter()
+    resultats = asyncio.run(courir(
+        {"lent": _faux(["a"] * 10, 0.1), "rapide": _faux(["b", "c"], 0.05), "ko": _faux([], 0, erreur=True)},
+        mode=MODE_TOUS,
+        timeout_s=0.5,
+        valide=lambda r: not r.startswith("Erreur"),
+        on_fragment=lambda r: partiels.append((r.nom, r.reponse)),
+    ))
+    # Le temps est celui du delai (0,5 s), pas la somme des appels.
+    assert time.perf_counter() - debut < 0.8
+    assert list(resultats) == ["lent", "rapide", "ko"]
+    assert resultats["rapide"].statut == TERMINE and resultats["rapide"].reponse == "bc"
+    assert resultats["rapide"].tokens == 2 and resultats["rapide"].premier_fragment_s is not None
+    assert resultats["ko"].statut == ERREUR
+    assert resultats["lent"].statut == DELAI and resultats["lent"].reponse.startswith("aaa")
+    assert ("rapide", "b") in partiels
+
+
+def test_course_premiere_reponse_valide():
+    termines = []
+    resultats = asyncio.run(courir(
+        {"ko": _faux([], 0, erreur=True), "rapide": _faux(["x"], 0.05), "lent": _faux(["y"], 1)},
+        mode=MODE_PREMIER,
+        valide=lambda r: not r.startswith("Erreur"),
+        on_termine=lambda r: termines.append(r.nom),
+    ))
+    # Une erreur rapide ne gagne pas la course.
+    assert resultats["rapide"].statut == TERMINE and resultats["ko"].statut == ERREUR
+    assert resultats["lent"].statut == ANNULE and resultats["lent"].duree_s < 0.5
+    assert sorted(termines) == ["ko", "lent", "rapide"]
+
+
+if __name__ == "__main__":
+    test_comparaison_parallele_avec_delai()
+    test_course_premiere_reponse_valide()
+    print("OK - course entre modèles")
@@ -0,0 +1,70 @@
+"""Tests des helpers d'insertion en masse de utils.db (SQLite en mémoire).
+
+Exécutable avec pytest ou directement : `python tests/test_db.py`.
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.db import bulk_insert, dataframe_to_records
+
+
+def _df():
+    return pd.DataFrame({
+        "nom": ["a", None, "c"],
+        "valeur": [1.5, np.nan, 3.0],
+        "quantite": pd.array([1, None, 3], dtype="Int64"),
+        "date": pd.to_datetime(["2024-01-01", None, "2024-03-01"]),
+    })
+
+
+def test_records_nan_nat_en_none():
+    records = dataframe_to_records(_df())
+    assert records[1] == {"nom": None, "valeur": None, "quantite": None, "date": None}
+    assert records[0]["valeur"] == 1.5 and records[0]["quantite"] == 1
+    assert records[2]["date"] == pd.Timestamp("2024-03-01")
+
+
+def test_bulk_insert_executemany_et_returning():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE mesure (id INTEGER PRIMARY KEY AUTOINCREMENT, nom TEXT, valeur REAL)"
+        ))
+        df = _df()[["nom", "valeur"]]
+        ids = bulk_insert(conn, "mesure", df, returning=["id"])
+        assert ids == [1, 2, 3]
+        assert bulk_insert(conn, "mesure", df.head(1)) == []
+        assert bulk_insert(conn, "mesure", df.iloc[:0], returning=["id"]) == []
+        lignes = bulk_insert(conn, "mesure", df.tail(1), returning=["id", "nom"])
+        assert lignes == [(5, "c")]
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, nom, valeur FROM mesure ORDER BY id")).all()
+    assert [tuple(r) for r in rows] == [
+        (1, "a", 1.5), (2, None, None), (3, "c", 3.0), (4, "a", 1.5), (5, "c", 3.0),
+    ]
+
+
+def test_methode_inconnue_ou_copy_avec_returning():
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        for kwargs in ({"method": "autre"}, {"method": "copy", "returning": ["id"]}):
+            try:
+                bulk_insert(conn, "mesure", _df(), **kwargs)
+            except ValueError:
+                continue
+            raise AssertionError(f"ValueError attendue pour {kwargs}")
+
+
+if __name__ == "__main__":
+    test_records_nan_nat_en_none()
+    test_bulk_insert_executemany_et_returning()
+    test_methode_inconnue_ou_copy_avec_returning()
+    print("OK - insertions en masse")
@@ -0,0 +1,83 @@
+"""Tests de l'extraction PDF : cache (texte fourni directement) et pool de processus.
+
+Le test du pool construit un PDF minimal et est sauté sans pypdf.
+
+Exécutable avec pytest ou directement : `python tests/test_extraction_pdf.py`.
+"""
+
+import importlib.util
+import random
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import extraction_pdf as ep
+from utils.extraction_pdf import CacheExtraction, ResultatExtraction
+
+
+def _pdf(nb_pages: int) -> bytes:
+    """PDF minimal d'une ligne de texte par page."""
+    objets = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>"
+        % (b" ".join(b"%d 0 R" % (4 + 2 * i) for i in range(nb_pages)), nb_pages),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i in range(nb_pages):
+        flux = b"BT /F1 12 Tf 72 720 Td (Page %d du plan) Tj ET" % (i + 1)
+        objets.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % (5 + 2 * i)
+        )
+        objets.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(flux), flux))
+    pdf = b"%PDF-1.4\n"
+    positions = []
+    for numero, objet in enumerate(objets, 1):
+        positions.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (numero, objet)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objets) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % p for p in positions)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objets) + 1, xref)
+    return pdf
+
+
+def test_cache_lru_borne():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = CacheExtraction(Path(tmp) / "pdf.sqlite", max_octets=3000)
+        durees = [0.01, 2.5, 0.2]
+        cache.ecrire("a", ResultatExtraction("page 1\npage 2\n", durees, 1.0))
+        lu = cache.lire("a")
+        assert lu.depuis_cache and lu.texte == "page 1\npage 2\n" and lu.durees_pages == durees
+        assert lu.pages_lentes(1) == [(2, 2.5)] and "p. 2" in lu.resume()
+
+        # Textes peu compressibles : chacun occupe ~1,8 ko une fois compressé.
+        rng = random.Random(0)
+        bruit = lambda: "".join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for _ in range(3000))
+        cache.ecrire("b", ResultatExtraction(bruit(), [0.1]))
+        cache.lire("a")  # "a" devient la plus récemment lue
+        assert cache.ecrire("c", ResultatExtraction(bruit(), [0.1])) >= 1
+        assert cache.lire("b") is None
+        assert cache.lire("a") is not None and cache.lire("c") is not None
+
+
+def test_pool_identique_au_sequentiel():
+    pytest.importorskip("pypdf")
+    contenu = _pdf(ep.SEUIL_PAGES_PARALLELE + 5)
+    sequentiel = ep.extraire_texte_pdf(contenu, workers=1, utiliser_cache=False)
+    parallele = ep.extraire_texte_pdf(contenu, workers=2, utiliser_cache=False)
+    assert parallele.texte == sequentiel.texte
+    assert len(parallele.durees_pages) == ep.SEUIL_PAGES_PARALLELE + 5
+    pages = sequentiel.texte.split("\n")
+    assert pages[0] == "Page 1 du plan" and pages[-2] == f"Page {ep.SEUIL_PAGES_PARALLELE + 5} du plan"
+
+
+if __name__ == "__main__":
+    test_cache_lru_borne()
+    if importlib.util.find_spec("pypdf"):
+        test_pool_identique_au_sequentiel()
+    print("OK - cache extraction PDF")
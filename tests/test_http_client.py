@@ -0,0 +1,116 @@
+"""Tests du client HTTP partagé (faux transport et serveur local, sans réseau externe).
+
+Exécutable avec pytest ou directement : `python tests/test_http_client.py`.
+"""
+
+import gzip
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import requests
+from requests.adapters import BaseAdapter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import http_client as hc
+
+
+class _FauxTransport(BaseAdapter):
+    """Renvoie les codes de `scenario` dans l'ordre, puis 200."""
+
+    def __init__(self, scenario=()):
+        super().__init__()
+        self.scenario = list(scenario)
+        self.timeouts = []
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        self.timeouts.append(timeout)
+        response = requests.Response()
+        response.status_code = self.scenario.pop(0) if self.scenario else 200
+        response._content = b'{"ok": true}'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def _client(scenario=()):
+    client = hc.ClientHTTP(_FauxTransport(scenario), timeout=(1, 2))
+    client._backoff = lambda tentative, response=None: 0
+    return client
+
+
+def test_rejeux_idempotents_et_mesures():
+    client = _client([503, 502])
+    response = client.get("http://api.test/a")
+    assert response.status_code == 200 and response.json() == {"ok": True}
+    assert client.transport.timeouts == [(1, 2)] * 3
+
+    # Un POST n'est rejoué que sur demande explicite.
+    client.transport.scenario = [503]
+    assert client.post("http://api.test/b", data="x").status_code == 503
+    client.transport.scenario = [429]
+    assert client.post("http://api.test/b", data="x", rejouer=True).status_code == 200
+
+    ligne = client.mesures.resume().set_index("hote").loc["api.test"]
+    assert (ligne.requetes, ligne.erreurs, ligne.rejeux) == (6, 4, 3)
+
+
+def test_limite_par_hote():
+    client = _client()
+    client.limiter("http://lent.test", 1200, capacite=1)
+    for _ in range(3):
+        client.get("http://lent.test/x")
+        client.get("http://rapide.test/x")
+    attentes = client.mesures.resume().set_index("hote")["attente_limite_s"]
+    assert attentes["lent.test"] > 0 and attentes["rapide.test"] == 0
+
+
+def test_keep_alive_et_gzip_serveur_local():
+    ports = set()
+    corps = gzip.compress(b"valeur;" * 5000)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            ports.add(self.client_address[1])
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(corps)))
+            self.end_headers()
+            self.wfile.write(corps)
+
+        def log_message(self, *args):
+            pass
+
+    serveur = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=serveur.serve_forever, daemon=True).start()
+    client = hc.ClientHTTP()
+    try:
+        url = f"http://127.0.0.1:{serveur.server_port}/donnees"
+        for _ in range(5):
+            assert client.get(url).text.startswith("valeur;")
+        session = client.session_dediee({"Authorization": "Bearer x"})
+        session.get(url)
+        session.close()
+        client.get(url)
+    finally:
+        client.fermer()
+        serveur.shutdown()
+        serveur.server_close()
+
+    assert len(ports) == 1
+    ligne = client.mesures.resume().iloc[0]
+    assert ligne.requetes == 7 and ligne.ko_reseau < ligne.ko_recus
+
+
+if __name__ == "__main__":
+    test_rejeux_idempotents_et_mesures()
+    test_limite_par_hote()
+    test_keep_alive_et_gzip_serveur_local()
+    print("OK - client HTTP")
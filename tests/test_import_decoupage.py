@@ -0,0 +1,95 @@
+"""Tests du découpage par axes et de la fusion des extractions de l'Import Tool.
+
+Exécutable avec pytest ou directement : `python tests/test_import_decoupage.py`.
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.import_decoupage import decouper_document, estimer_tokens, fusionner_actions, rassembler
+
+
+def _plan():
+    lignes = ["Plan climat de la commune", ""]
+    for axe in range(1, 4):
+        lignes.append(f"Axe {axe} : Orientation numéro {axe}")
+        for sous_axe in range(1, 3):
+            lignes.append(f"{axe}.{sous_axe} Sous-axe {axe}.{sous_axe}")
+            for action in range(1, 4):
+                lignes.append(f"{axe}.{sous_axe}.{action} Action {action}")
+                lignes.extend(["Description de l'action sur plusieurs lignes."] * 20)
+    return "\n".join(lignes)
+
+
+def test_decoupage_sur_les_titres():
+    texte = _plan()
+    assert len(decouper_document(texte, budget_tokens=estimer_tokens(texte))) == 1
+
+    morceaux = decouper_document(texte, budget_tokens=2000)
+    assert len(morceaux) > 2
+    assert all(estimer_tokens(m.texte) <= 2000 for m in morceaux)
+    for m in morceaux[1:]:
+        premiere = m.texte.splitlines()[0]
+        # Coupure sur un titre ; l'axe en cours est rappelé hors début d'axe.
+        assert premiere.startswith("Axe ") or premiere[0].isdigit()
+        assert bool(m.axe_en_cours) == (not premiere.startswith("Axe "))
+    assert "Partie 2/" in morceaux[1].texte_prompt(2, len(morceaux))
+    assert sum(len(m.texte) for m in morceaux) >= len(texte.strip()) - len(morceaux) * 2
+
+
+def test_fusion_et_concurrence_bornee():
+    actions, origines = fusionner_actions([
+        (0, [
+            {"axe": "Axe 1 : A", "sous-axe": "1.1 S", "titre": "1.1.1 Réduire l'autosolisme", "description": "",
+             "sous-actions": ["Covoiturage"]},
+            {"axe": "Axe 1 : A", "sous-axe": "1.1 S", "titre": "1.1.2 Plan vélo", "description": "d"},
+        ]),
+        (1, [
+            {"axe": "Axe 1 : A", "sous-axe": "1.1 S", "titre": "1.1.1 Reduire l'autosolisme",
+             "description": "Développer le covoiturage", "sous-actions": ["covoiturage", "Autopartage"]},
+            {"axe": "Axe 2 : B", "sous-axe": "2.1 T", "titre": "2.1.1 Haies", "description": ""},
+        ]),
+    ])
+    assert [a["titre"] for a in actions] == ["1.1.1 Réduire l'autosolisme", "1.1.2 Plan vélo", "2.1.1 Haies"]
+    assert origines == [0, 0, 1]
+    assert actions[0]["description"] == "Développer le covoiturage"
+    assert actions[0]["sous-actions"] == ["Covoiturage", "Autopartage"]
+
+    # Homonymes hors chevauchement : axes différents, même morceau, morceaux non contigus.
+    def action(axe, sous_axe, titre):
+        return {"axe": axe, "sous-axe": sous_axe, "titre": titre}
+
+    ateliers = [
+        action("Axe 1", "1.1 Sensibilisation", "1.1.1 Organiser des ateliers"),
+        action("Axe 3", "3.1 Sensibilisation", "3.1.1 Organiser des ateliers"),
+    ]
+    assert len(fusionner_actions([(0, ateliers)])[0]) == 2
+    assert len(fusionner_actions([(0, ateliers[:1]), (1, ateliers[1:])])[0]) == 2
+    assert len(fusionner_actions([(0, ateliers[:1] * 2)])[0]) == 2
+    assert len(fusionner_actions([(0, ateliers[:1]), (2, ateliers[:1])])[0]) == 2
+    assert len(fusionner_actions([(0, ateliers[:1]), (1, ateliers[:1])])[0]) == 1
+
+    en_cours, maximum = 0, 0
+
+    async def appel(i):
+        nonlocal en_cours, maximum
+        en_cours += 1
+        maximum = max(maximum, en_cours)
+        await asyncio.sleep(0.01)
+        en_cours -= 1
+        if i == 3:
+            raise ValueError("échec")
+        return i
+
+    resultats = asyncio.run(rassembler([appel(i) for i in range(8)], limite=2))
+    assert maximum == 2
+    assert resultats[:3] == [0, 1, 2] and isinstance(resultats[3], ValueError)
+
+
+if __name__ == "__main__":
+    test_decoupage_sur_les_titres()
+    test_fusion_et_concurrence_bornee()
+    print("OK - découpage Import Tool")
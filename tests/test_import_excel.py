@@ -0,0 +1,42 @@
+"""Tests de la génération du fichier d'import TET (équivalence avec le remplissage openpyxl).
+
+Exécutable avec pytest ou directement : `python tests/test_import_excel.py`.
+"""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.import_excel import _plan_factice, _remplir_openpyxl, _valeurs, remplir_fichier_import
+
+
+def test_meme_contenu_que_openpyxl():
+    df = _plan_factice(250)
+    df.loc[3, "description"] = "  espaces conservés \x0b"
+    df = df.drop(columns=["objectifs"])
+    nouveau = remplir_fichier_import(df)
+    attendu = _valeurs(_remplir_openpyxl(df.assign(description=df["description"].str.replace("\x0b", ""))))
+    assert _valeurs(nouveau) == attendu
+
+    ws = load_workbook(nouveau)["Fichier dimport"]
+    assert ws["D5"].value == df.loc[0, "titre"] and ws["F8"].value == "  espaces conservés "
+    assert ws["X5"].value in (None, "") and ws["X6"].value == 100
+    assert len(ws.data_validations.dataValidation) == 4 and ws.max_row == 254
+    # Lignes préformatées du modèle : le style est conservé sous les valeurs.
+    modele = load_workbook("utils/template_pa.xlsx")["Fichier dimport"]
+    assert repr(ws["A5"].fill) == repr(modele["A5"].fill) and ws["AA6"].number_format == modele["AA6"].number_format
+
+
+def test_plan_vide():
+    ws = load_workbook(remplir_fichier_import(pd.DataFrame()))["Fichier dimport"]
+    assert ws["D2"].value == "Titre de l'action" and ws["A5"].value is None
+
+
+if __name__ == "__main__":
+    test_meme_contenu_que_openpyxl()
+    test_plan_vide()
+    print("OK - fichier d'import")
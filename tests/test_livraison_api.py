@@ -0,0 +1,224 @@
+"""Tests du client de livraison indicateurs-valeurs (sans réseau).
+
+Les envois passent par une fausse session qui rejoue des codes HTTP
+prédéfinis. Exécutable avec pytest ou directement :
+`python tests/test_livraison_api.py`.
+"""
+
+import json
+import math
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import livraison_api as la
+from utils import livraison_journal as lj
+from utils import livraison_payload as lp
+
+
+class _FakeResponse:
+    def __init__(self, status_code, nb_valeurs=0):
+        self.status_code = status_code
+        self.headers = {}
+        self.text = "erreur"
+        self._nb_valeurs = nb_valeurs
+
+    def json(self):
+        if self.status_code == 201:
+            return {"valeurs": [{}] * self._nb_valeurs}
+        return {"message": f"HTTP {self.status_code}"}
+
+
+class _FakeSession:
+    """Renvoie les codes (ou réponses) de `scenario` dans l'ordre, ou lève les exceptions, puis 201."""
+
+    def __init__(self, scenario=()):
+        self.headers = {}
+        self.scenario = list(scenario)
+        self.appels = 0
+        self._lock = threading.Lock()
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def post(self, url, data=None, timeout=None):
+        with self._lock:
+            self.appels += 1
+            code = self.scenario.pop(0) if self.scenario else 201
+        if isinstance(code, BaseException):
+            raise code
+        if isinstance(code, _FakeResponse):
+            return code
+        return _FakeResponse(code, len(json.loads(data)["valeurs"]))
+
+
+def _client(session, **kwargs):
+    client = la.ClientLivraison(
+        "http://api.test/indicateurs-valeurs", "token",
+        requetes_par_minute=6000, session=session, **kwargs,
+    )
+    client._backoff = lambda tentative, response=None: 0
+    return client
+
+
+def _valeurs(n):
+    return [
+        {"collectiviteId": i, "indicateurId": 1, "dateValeur": "2020-01-01T00:00:00",
+         "resultat": float(i)}
+        for i in range(n)
+    ]
+
+
+def test_token_bucket_respecte_la_limite():
+    """Capacité + recharge sur une fenêtre ne dépassent pas la limite annoncée."""
+    seau = la.TokenBucket.pour_limite(90, fenetre=60, capacite=4)
+    assert seau.capacite + seau.debit * 60 == 90
+
+
+def test_taille_batch_adaptee_aux_octets():
+    """Des lignes lourdes réduisent la taille des batches."""
+    valeurs = _valeurs(1000)
+    assert la.taille_batch_adaptee(valeurs) == la.MAX_LIGNES_PAR_BATCH
+    assert la.taille_batch_adaptee(valeurs, max_octets=10_000) < 200
+
+
+def test_livraison_complete_et_ordonnee():
+    session = _FakeSession()
+    stats = _client(session, max_lignes_par_batch=100).livrer(_valeurs(1050))
+    assert stats["success"]
+    assert stats["nb_batches"] == 11
+    assert stats["nb_inserted"] == 1050
+    assert [r.index for r in stats["resultats"]] == list(range(1, 12))
+
+
+def test_retry_erreur_transitoire_uniquement():
+    """503 est rejoué ; 400 (erreur de contenu) ne l'est pas."""
+    session = _FakeSession([503])
+    stats = _client(session, max_concurrence=1).livrer(_valeurs(10))
+    assert stats["success"] and stats["resultats"][0].tentatives == 2
+
+    session = _FakeSession([400])
+    stats = _client(session, max_concurrence=1).livrer(_valeurs(10))
+    assert stats["failed_batches"] == 1
+    assert session.appels == 1
+
+
+def test_pas_de_rejeu_apres_delai_de_lecture():
+    """Connexion impossible : rejouée ; délai de lecture : échec sans renvoi (doublon possible)."""
+    session = _FakeSession([requests.ConnectTimeout("connexion"), requests.ConnectionError("refus")])
+    stats = _client(session, max_concurrence=1).livrer(_valeurs(10))
+    assert stats["success"] and session.appels == 3
+
+    session = _FakeSession([requests.ReadTimeout("lecture")])
+    stats = _client(session, max_concurrence=1).livrer(_valeurs(10))
+    assert stats["failed_batches"] == 1 and session.appels == 1
+    assert "ReadTimeout" in stats["resultats"][0].erreur
+
+
+def test_journal_et_rejeu_des_echecs():
+    """Seuls les batches en échec sont rejoués, puis le run est soldé."""
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = lj.JournalLivraison(Path(tmp) / "journal.sqlite")
+        client = _client(_FakeSession([400]), max_concurrence=1, max_lignes_par_batch=10)
+        stats = lj.livrer_et_journaliser(client, _valeurs(30), "Test", journal=journal)
+        assert stats["failed_batches"] == 1
+        assert [index for index, _ in journal.batches_en_echec(stats["run_id"])] == [1]
+        assert journal.runs("Test")["batches_en_echec"].tolist() == [1]
+
+        session = _FakeSession()
+        rejeu = lj.rejouer_echecs(_client(session), stats["run_id"], journal=journal)
+        assert rejeu["success"] and session.appels == 1
+        assert journal.batches_en_echec(stats["run_id"]) == []
+        assert journal.runs("Test")["batches_en_echec"].tolist() == [0]
+
+
+class _Arret(BaseException):
+    """Arrêt brutal du process (crash, page rafraîchie) pendant un envoi."""
+
+
+def test_reprise_des_batches_jamais_envoyes():
+    """Un run interrompu garde ses batches non envoyés en attente, puis les rejoue."""
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = lj.JournalLivraison(Path(tmp) / "journal.sqlite")
+        client = _client(_FakeSession([201, _Arret()]), max_concurrence=1, max_lignes_par_batch=10)
+        try:
+            lj.livrer_et_journaliser(client, _valeurs(20), "Test", journal=journal)
+        except _Arret:
+            pass
+        run_id = journal.runs("Test")["run_id"].iloc[0]
+        assert journal.batches(run_id)["statut"].tolist() == [lj.SUCCES, lj.EN_ATTENTE]
+        assert [index for index, _ in journal.batches_en_echec(run_id)] == [2]
+        assert journal.runs("Test")["batches_en_echec"].tolist() == [1]
+
+        session = _FakeSession()
+        rejeu = lj.rejouer_echecs(_client(session), run_id, journal=journal)
+        assert rejeu["success"] and rejeu["nb_total"] == 10 and session.appels == 1
+        assert journal.batches_en_echec(run_id) == []
+        assert journal.runs("Test")["batches_en_echec"].tolist() == [0]
+
+
+def test_payload_identique_a_l_encodage_ligne_a_ligne():
+    """Le builder colonne par colonne reproduit l'ancien `apply` ligne à ligne."""
+    import pandas as pd
+
+    df = pd.DataFrame({
+        "collectivite_id": [1, 2, 3],
+        "indicateur_id": [10, 10, 11],
+        "date_valeur": pd.to_datetime(["2020-01-01", "2021-01-01", "2022-06-15"]),
+        "metadonnee_id": [5, 5, 6],
+        "resultat": [1.5, float("nan"), 3.0],
+    })
+    attendu = df.apply(lambda row: {
+        "collectiviteId": int(row["collectivite_id"]),
+        "indicateurId": int(row["indicateur_id"]),
+        "dateValeur": row["date_valeur"].isoformat(),
+        "metadonneeId": int(row["metadonnee_id"]),
+        "resultat": float(row["resultat"]) if pd.notnull(row["resultat"]) else None,
+    }, axis=1).tolist()
+    assert lp.construire_valeurs(df) == attendu
+    assert json.loads(lp.serialiser({"valeurs": attendu}))["valeurs"] == attendu
+
+    sans_meta = lp.construire_valeurs(df.drop(columns=["metadonnee_id"]))
+    assert "metadonneeId" not in sans_meta[0]
+    assert not any(isinstance(v["resultat"], float) and math.isnan(v["resultat"]) for v in sans_meta)
+
+
+def test_pas_de_rejeu_apres_5xx_ambigu():
+    """500/502/504 : le batch a pu être inséré, envoyé une seule fois et laissé en échec."""
+    for code in (500, 502, 504):
+        session = _FakeSession([code])
+        stats = _client(session, max_concurrence=1).livrer(_valeurs(10))
+        assert stats["failed_batches"] == 1 and session.appels == 1, code
+        assert stats["resultats"][0].status_code == code
+
+
+def test_rejeu_429_selon_retry_after():
+    """429 : renvoyé après le délai Retry-After de la réponse."""
+    reponse_429 = _FakeResponse(429)
+    reponse_429.headers["Retry-After"] = "0"
+    session = _FakeSession([reponse_429])
+    client = _client(session, max_concurrence=1)
+    delais = []
+    client._backoff = lambda tentative, response=None: delais.append(la.delai_backoff(tentative, response)) or 0
+    stats = client.livrer(_valeurs(10))
+    assert stats["success"] and session.appels == 2
+    assert delais == [0.0]
+
+
+if __name__ == "__main__":
+    test_token_bucket_respecte_la_limite()
+    test_taille_batch_adaptee_aux_octets()
+    test_livraison_complete_et_ordonnee()
+    test_retry_erreur_transitoire_uniquement()
+    test_pas_de_rejeu_apres_delai_de_lecture()
+    test_pas_de_rejeu_apres_5xx_ambigu()
+    test_rejeu_429_selon_retry_after()
+    test_journal_et_rejeu_des_echecs()
+    test_reprise_des_batches_jamais_envoyes()
+    test_payload_identique_a_l_encodage_ligne_a_ligne()
+    print("OK - client de livraison")
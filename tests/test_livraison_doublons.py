@@ -0,0 +1,35 @@
+"""Tests de la détection des doublons avant livraison (sans base).
+
+Exécutable avec pytest ou directement : `python tests/test_livraison_doublons.py`.
+"""
+
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import livraison_doublons as ld
+
+
+def test_doublons_complets_et_conflits():
+    """Doublons identiques supprimés ; seule la clé aux valeurs divergentes est en conflit."""
+    pk = ["indicateur_id", "collectivite_id", "date_valeur"]
+    df = pd.DataFrame({
+        "indicateur_id": [1, 1, 1, 2, 2, 3],
+        "collectivite_id": [7, 7, 7, 7, 7, 7],
+        "date_valeur": ["2020"] * 6,
+        "resultat": [1.0, 1.0, 2.0, 5.0, 5.0, 9.0],
+    })
+    rapport = ld.detecter_doublons(df, pk)
+    assert rapport.nb_doublons_complets == 2
+    assert rapport.conflits[pk + ["nb_lignes"]].values.tolist() == [[1, 7, "2020", 2]]
+    assert rapport.conflits["colonnes_en_conflit"].tolist() == ["resultat"]
+    assert rapport.nb_lignes_en_conflit == 2
+    assert not ld.detecter_doublons(df.drop_duplicates(pk), pk).has_conflicts
+
+
+if __name__ == "__main__":
+    test_doublons_complets_et_conflits()
+    print("OK - doublons de livraison")
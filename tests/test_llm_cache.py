@@ -0,0 +1,99 @@
+"""Tests du cache LLM partagé (sans réseau).
+
+Exécutable avec pytest ou directement : `python tests/test_llm_cache.py`.
+"""
+
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import llm_cache as lc
+from utils import llm_telemetrie as lt
+
+# Les appels mesurés par `appel_cache` vont dans un store temporaire, pas dans .cache/.
+_TELEMETRIE = tempfile.TemporaryDirectory()
+os.environ[lt.ENV_TELEMETRIE_PATH] = str(Path(_TELEMETRIE.name) / "telemetrie.sqlite")
+
+
+class _Appel:
+    """Faux modèle : compte les appels et renvoie une réponse numérotée."""
+
+    def __init__(self):
+        self.nb = 0
+
+    def __call__(self):
+        self.nb += 1
+        return {"texte": f"réponse {self.nb}"}
+
+
+def _appel(cache, appel, prompt="prompt", **kwargs):
+    return lc.appel_cache(
+        "openai", "gpt-test", prompt, {"temperature": 0}, appel,
+        feature="test", cache=cache, **kwargs,
+    )
+
+
+def test_cle_stable_et_sensible_aux_parametres():
+    cle = lc.cle_requete("openai", "m", "p", {"a": 1, "b": 2})
+    assert cle == lc.cle_requete("openai", "m", "p", {"b": 2, "a": 1})
+    assert cle != lc.cle_requete("openai", "m", "p", {"a": 1, "b": 3})
+    assert cle != lc.cle_requete("gemini", "m", "p", {"a": 1, "b": 2})
+
+
+def test_hit_miss_et_rafraichir():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = lc.CacheLLM(Path(tmp) / "cache.sqlite")
+        appel = _Appel()
+        assert _appel(cache, appel) == {"texte": "réponse 1"}
+        assert _appel(cache, appel) == {"texte": "réponse 1"}
+        assert appel.nb == 1
+        assert _appel(cache, appel, rafraichir=True) == {"texte": "réponse 2"}
+        assert _appel(cache, appel) == {"texte": "réponse 2"}
+        assert cache.compteurs()["test"] == {"hits": 2, "misses": 1, "ecritures": 2, "evictions": 0}
+
+
+def test_ttl_et_eviction_lru():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = lc.CacheLLM(Path(tmp) / "cache.sqlite", ttl_heures=1 / 3600)
+        appel = _Appel()
+        _appel(cache, appel)
+        time.sleep(1.1)
+        _appel(cache, appel)
+        assert appel.nb == 2
+
+        # Taille max très basse : les entrées les moins récemment lues partent.
+        cache = lc.CacheLLM(Path(tmp) / "petit.sqlite", max_octets=300)
+        for i in range(20):
+            _appel(cache, _Appel(), prompt=f"prompt {i} " + "x" * 200)
+        total = sum(ligne["octets"] for ligne in cache.stats())
+        assert total <= 300
+        assert cache.compteurs()["test"]["evictions"] > 0
+
+
+def test_replay_sans_reseau():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "cache.sqlite"
+        _appel(lc.CacheLLM(path), _Appel())
+
+        replay = lc.CacheLLM(path, mode=lc.MODE_REPLAY)
+        appel = _Appel()
+        assert _appel(replay, appel) == {"texte": "réponse 1"}
+        try:
+            _appel(replay, appel, prompt="inconnu")
+        except lc.CacheMiss:
+            pass
+        else:
+            raise AssertionError("CacheMiss attendu en mode replay")
+        assert appel.nb == 0
+
+
+if __name__ == "__main__":
+    test_cle_stable_et_sensible_aux_parametres()
+    test_hit_miss_et_rafraichir()
+    test_ttl_et_eviction_lru()
+    test_replay_sans_reseau()
+    print("OK - cache LLM")
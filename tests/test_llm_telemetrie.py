@@ -0,0 +1,84 @@
+"""Tests de la télémétrie des appels LLM (sans réseau).
+
+Exécutable avec pytest ou directement : `python tests/test_llm_telemetrie.py`.
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import llm_cache as lc
+from utils import llm_telemetrie as lt
+
+
+# Les appels mesurés hors `_avec_telemetrie` vont aussi dans un store temporaire.
+_TELEMETRIE = tempfile.TemporaryDirectory()
+_CHEMIN = str(Path(_TELEMETRIE.name) / "telemetrie.sqlite")
+os.environ[lt.ENV_TELEMETRIE_PATH] = _CHEMIN
+
+
+def _avec_telemetrie(tmp):
+    """Redirige le store partagé vers un fichier temporaire propre au test."""
+    os.environ[lt.ENV_TELEMETRIE_PATH] = str(Path(tmp) / "telemetrie.sqlite")
+    return lt.get_telemetrie()
+
+
+def test_mesure_usage_cache_et_erreur():
+    with tempfile.TemporaryDirectory() as tmp:
+        telemetrie = _avec_telemetrie(tmp)
+        try:
+            cache = lc.CacheLLM(Path(tmp) / "cache.sqlite")
+
+            def appel():
+                lt.signaler_premier_token()
+                lt.signaler_usage(1000, 200)
+                return {"texte": "ok"}
+
+            for _ in range(2):
+                lc.appel_cache(
+                    "openai", "gpt-5.1-2025-11-13", "prompt", {}, appel,
+                    feature="test", etape="notation", cache=cache,
+                )
+            try:
+                with lt.mesurer("openai", "gpt-5.1", feature="test", tentative=2):
+                    raise TimeoutError("trop long")
+            except TimeoutError:
+                pass
+
+            df = telemetrie.charger()
+            assert df["issue"].tolist() == [lt.ISSUE_OK, lt.ISSUE_CACHE, lt.ISSUE_ERREUR]
+            assert df["tokens_entree"].iloc[0] == 1000 and df["ttft_ms"].notna().iloc[0]
+            assert df["etape"].iloc[1] == "notation"
+            assert "TimeoutError" in df["erreur"].iloc[2]
+        finally:
+            os.environ[lt.ENV_TELEMETRIE_PATH] = _CHEMIN
+
+
+def test_resume_percentiles_et_cout():
+    with tempfile.TemporaryDirectory() as tmp:
+        telemetrie = lt.TelemetrieLLM(Path(tmp) / "telemetrie.sqlite")
+        for i in range(1, 11):
+            mesure = lt.MesureAppel("openai", "gpt-5-mini", "page", "", 1)
+            mesure.usage(1_000_000, 100_000)
+            telemetrie.enregistrer(mesure, i / 10)
+        hit = lt.MesureAppel("openai", "gpt-5-mini", "page", "", 1)
+        hit.issue = lt.ISSUE_CACHE
+        hit.usage(1_000_000, 100_000)
+        telemetrie.enregistrer(hit, 0.001)
+
+        ligne = lt.resume(telemetrie.charger()).iloc[0]
+        assert ligne["appels"] == 11 and ligne["hits_cache"] == 1
+        # Le hit de cache ne coûte rien et n'entre pas dans les percentiles.
+        assert abs(ligne["cout_usd"] - 10 * (0.25 + 0.2)) < 1e-9
+        assert abs(ligne["latence_p50_s"] - 0.55) < 1e-9
+        assert ligne["latence_p95_s"] > 0.9
+        assert lt._tarif("modele-inconnu") is None
+
+
+if __name__ == "__main__":
+    test_mesure_usage_cache_et_erreur()
+    test_resume_percentiles_et_cout()
+    print("OK - télémétrie LLM")
@@ -0,0 +1,269 @@
+"""Tests du runner batch de priorisation (hors ligne, mocks uniquement).
+
+Aucun accès base, API ni LLM : plans en mémoire, sortie CSV. Exécutable
+avec pytest ou directement : `python tests/test_priorisation_impact_batch.py`.
+"""
+
+import json
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import priorisation_impact as pi
+from utils import priorisation_impact_batch as batch
+
+
+def _contexte(ids=(1, 2, 3)):
+    plans = {
+        cid: pd.DataFrame({
+            "id": [cid * 100 + i for i in range(4)],
+            "titre": [f"Action {i}" for i in range(4)],
+            "description": ["Description"] * 4,
+        })
+        for cid in ids
+    }
+    return batch.ContexteBatch(
+        df_leviers_ref=pi.load_leviers_ref(),
+        plans=plans,
+        collectivites={cid: {"nom": f"C{cid}", "population": 1000} for cid in ids},
+        mock=True,
+    )
+
+
+def test_chunk_plan_respecte_le_budget():
+    """Lots consécutifs sous le budget, une action trop longue reste seule."""
+    plan = pd.DataFrame({
+        "id": range(5),
+        "titre": ["t"] * 5,
+        "description": ["x" * 400, "x" * 400, "x" * 4000, "x" * 40, "x" * 40],
+    })
+    chunks = pi.chunk_plan(plan, max_tokens=250)
+    assert [c["id"].tolist() for c in chunks] == [[0, 1], [2], [3, 4]]
+
+
+def test_batch_hors_ligne_et_reprise_sur_checkpoint():
+    """Le run écrit toutes les collectivités, la relance n'en refait aucune."""
+    with tempfile.TemporaryDirectory() as tmp:
+        checkpoint = batch.Checkpoint(Path(tmp) / "checkpoint.sqlite")
+        sortie = Path(tmp) / "sortie"
+        rapport = batch.executer_batch(
+            _contexte(), [1, 2, 3], checkpoint=checkpoint, flush_every=2, sortie_csv=sortie
+        )
+        assert rapport["statut"].tolist() == ["ok"] * 3
+        df = pd.read_csv(sortie / "priorisation.csv")
+        assert sorted(df["collectivite_id"].unique()) == [1, 2, 3]
+        assert len(df) == 3 * 6 * len(pi.load_leviers_ref())
+
+        relance = batch.executer_batch(
+            _contexte(), [1, 2, 3, 4], checkpoint=checkpoint, sortie_csv=sortie
+        )
+        # Seule la collectivité 4 (sans plan) est tentée, et reste en échec.
+        assert relance["collectivite_id"].tolist() == [4]
+        assert relance["statut"].tolist() == ["echec"]
+
+
+def test_mock_reproductible():
+    """Même graine, mêmes résultats : le mock est utilisable en CI."""
+    with tempfile.TemporaryDirectory() as tmp:
+        resultats = []
+        for essai in range(2):
+            sortie = Path(tmp) / f"sortie{essai}"
+            batch.executer_batch(
+                _contexte(), [1, 2],
+                checkpoint=batch.Checkpoint(Path(tmp) / f"ck{essai}.sqlite"),
+                sortie_csv=sortie,
+            )
+            df = pd.read_csv(sortie / "priorisation.csv").drop(columns="created_at")
+            resultats.append(df.sort_values(["collectivite_id", "levier", "categorie"]).reset_index(drop=True))
+        pd.testing.assert_frame_equal(resultats[0], resultats[1])
+
+
+class _Statut:
+    def __init__(self):
+        self.messages = []
+
+    def write(self, message):
+        self.messages.append(message)
+
+
+class _FauxLLM:
+    """`ClientLLM` sans réseau : répond via `repondre(prompt, label, rafraichir)`, journalise les appels."""
+
+    def __init__(self, repondre):
+        self.repondre = repondre
+        self.appels = []
+        self._lock = threading.Lock()
+
+    def appeler_json(self, prompt, label, status_container, max_retries=3, max_output_tokens=None,
+                     rafraichir=False, etape="", tentative=1):
+        with self._lock:
+            self.appels.append((label, rafraichir))
+        return self.repondre(prompt, label, rafraichir)
+
+
+def test_classification_par_lots_fusion_et_rejeu_du_seul_lot_invalide():
+    """Les lots sont fusionnés en une carte ; seul le lot invalide est rejoué, sans cache."""
+    # Une action par lot : chaque description dépasse le budget d'un lot.
+    plan = pd.DataFrame({
+        "id": [11, 12, 13],
+        "titre": ["A", "B", "C"],
+        "description": ["x" * (4 * pi.CLASSIF_CHUNK_TOKENS)] * 3,
+    })
+    leviers = dict(zip(plan["id"], pi.LEVIERS_LIST))
+    invalide_servi = []
+
+    def repondre(prompt, label, rafraichir):
+        (action_id,) = [i for i in leviers if f"{i}:" in prompt]
+        if action_id == 12 and not invalide_servi:
+            invalide_servi.append(label)
+            return "pas un objet JSON"
+        return {str(action_id): {leviers[action_id]: [action_id % 6 + 1]}}
+
+    llm = _FauxLLM(repondre)
+    classification = pi.classify_actions(llm, plan, _Statut(), chunked=True, max_concurrence=3)
+
+    assert classification == {
+        11: {leviers[11]: [6]}, 12: {leviers[12]: [1]}, 13: {leviers[13]: [2]},
+    }
+    assert len(llm.appels) == 4
+    (lot_invalide,) = invalide_servi
+    assert sorted(r for label, r in llm.appels if label == lot_invalide) == [False, True]
+    assert all(not r for label, r in llm.appels if label != lot_invalide)
+
+
+def test_notation_concurrente_ordre_rejeu_et_annulation():
+    """Notation LLM : ordre des leviers malgré des fins désordonnées, rejeu par levier, arrêt sur erreur."""
+    plan = pd.DataFrame({"id": [1], "titre": ["Action"], "description": ["Description"]})
+    leviers = pi.LEVIERS_LIST[:6]
+    actions = {levier: {cat: [1] for cat in range(1, 7)} for levier in leviers}
+    rang = {levier: i for i, levier in enumerate(leviers)}
+
+    def levier_du(label):
+        return label.removeprefix("activation_")
+
+    def repondre(prompt, label, rafraichir):
+        i = rang[levier_du(label)]
+        time.sleep(0.02 * (len(leviers) - i))  # le premier levier finit le dernier
+        if i == 2 and not rafraichir:
+            return {"1": 9}  # invalide : notes et catégories manquantes
+        return {str(cat): (i + cat) % 4 for cat in range(1, 7)}
+
+    llm = _FauxLLM(repondre)
+    notes = pi.score_all_levers(llm, plan, actions, "C", 1000, _Statut(), max_concurrence=6)
+    assert list(notes) == leviers
+    assert notes == {l: {cat: (i + cat) % 4 for cat in range(1, 7)} for i, l in enumerate(leviers)}
+    assert [r for label, r in llm.appels if levier_du(label) == leviers[2]] == [False, True]
+    assert len(llm.appels) == len(leviers) + 1
+
+    # Un levier toujours invalide : l'erreur est relevée, les leviers en file ne sont pas appelés.
+    def premier_invalide(prompt, label, rafraichir):
+        if rang[levier_du(label)] == 0:
+            return {"1": 9}
+        return repondre(prompt, label, rafraichir)
+
+    llm = _FauxLLM(premier_invalide)
+    try:
+        pi.score_all_levers(llm, plan, actions, "C", 1000, _Statut(), max_concurrence=1)
+    except RuntimeError as e:
+        assert leviers[0] in str(e)
+    else:
+        raise AssertionError("l'erreur du premier levier doit être relevée")
+    appeles = {levier_du(label) for label, _ in llm.appels}
+    assert leviers[0] in appeles and len(appeles) <= 2
+
+
+class _FauxEngine:
+    """Engine SQLAlchemy minimal : compte les transactions et leurs issues."""
+
+    def __init__(self):
+        self.transactions = []
+
+    @contextmanager
+    def begin(self):
+        self.transactions.append("ouverte")
+        try:
+            yield self
+        except Exception:
+            self.transactions[-1] = "annulee"
+            raise
+        self.transactions[-1] = "validee"
+
+
+def test_paquet_ecrit_en_une_seule_transaction():
+    """Réductions et priorisation d'un paquet : une transaction, annulée en entier si une écriture échoue."""
+    r = batch.traiter_collectivite(_contexte(), 1)
+    ecrites = []
+
+    def remplacer(conn, table, df):
+        ecrites.append(table)
+        if table == "priorisation" and echec:
+            raise RuntimeError("COPY interrompu")
+
+    original = pi._remplacer
+    pi._remplacer = remplacer
+    try:
+        echec = False
+        engine = _FauxEngine()
+        batch.ecrire_paquet([r], engine)
+        assert engine.transactions == ["validee"]
+        assert ecrites == ["priorisation_reduction_levier", "priorisation"]
+
+        echec = True
+        engine = _FauxEngine()
+        try:
+            batch.ecrire_paquet([r], engine)
+        except RuntimeError:
+            pass
+        assert engine.transactions == ["annulee"]
+    finally:
+        pi._remplacer = original
+
+
+class _ReductionsFixes:
+    """Service de réductions sans réseau : une réponse API incomplète."""
+
+    def reductions(self, collectivite_id):
+        return pd.DataFrame({"levier": ["Covoiturage"], "reduction": [12.5]}), ["cae_2.a"]
+
+
+def test_mock_avec_reductions_api_et_tableaux_de_controle():
+    """Mode débogage de la page : vraies réductions (et manquants), étapes 1 et 2 exposées."""
+    ctx = _contexte()
+    ctx.reductions = _ReductionsFixes()
+    r = batch.traiter_collectivite(ctx, 1)
+    assert r.statut == "ok", r.erreur
+    assert r.df_reductions["reduction"].tolist() == [12.5]
+    assert r.identifiants_manquants == ["cae_2.a"]
+
+    classification = pi.classification_debug(r.lever_category_actions)
+    notes = pi.scores_debug(r.lever_scores)
+    assert set(classification["Levier"]) <= set(r.lever_scores)
+    assert classification["Nb actions"].sum() == sum(
+        len(ids) for cats in r.lever_category_actions.values() for ids in cats.values()
+    )
+    assert list(notes.columns) == ["Levier", *pi.CATEGORIES.values()]
+    assert len(notes) == len(r.lever_scores)
+    # Résultat de tâche stocké en JSON : les tableaux doivent se sérialiser.
+    json.dumps(json.loads(classification.to_json(orient="records")))
+
+    ligne = batch.rapport([r]).iloc[0]
+    assert ligne["identifiants_manquants"] == "cae_2.a"
+    assert "lever_scores" not in ligne
+
+
+if __name__ == "__main__":
+    test_chunk_plan_respecte_le_budget()
+    test_batch_hors_ligne_et_reprise_sur_checkpoint()
+    test_mock_reproductible()
+    test_mock_avec_reductions_api_et_tableaux_de_controle()
+    test_classification_par_lots_fusion_et_rejeu_du_seul_lot_invalide()
+    test_notation_concurrente_ordre_rejeu_et_annulation()
+    test_paquet_ecrit_en_une_seule_transaction()
+    print("OK - batch priorisation")
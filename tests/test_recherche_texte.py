@@ -0,0 +1,71 @@
+"""Tests de l'index BM25 local (tokenisation française, mise à jour incrémentale).
+
+Exécutable avec pytest ou directement : `python tests/test_recherche_texte.py`.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pandas as pd
+
+from utils.recherche_fiches import IndexFiches
+from utils.recherche_texte import IndexBM25, tokeniser
+
+
+def test_tokenisation_accents_pluriels_mots_vides():
+    assert tokeniser("Mobilités douces") == tokeniser("mobilite douce")
+    assert tokeniser("Les réseaux de chaleur") == tokeniser("reseau chaleur")
+    assert tokeniser("") == []
+
+
+def test_classement_et_boost_du_titre():
+    index = IndexBM25({"titre": 3.0, "description": 1.0})
+    index.ajouter(1, {"titre": "Plan vélo", "description": "Pistes cyclables et stationnement"})
+    index.ajouter(2, {"titre": "Éclairage public", "description": "Extinction nocturne, un vélo électrique"})
+    index.ajouter(3, {"titre": "Cantines", "description": "Gaspillage alimentaire"})
+    assert [doc for doc, _ in index.rechercher(["vélos"], k=5)] == [1, 2]
+    assert index.rechercher("gaspillage alimentaire")[0][0] == 3
+    assert index.rechercher("inconnu") == []
+
+
+def test_mise_a_jour_incrementale():
+    index = IndexBM25()
+    index.ajouter_tous([(1, "compostage des biodéchets"), (2, "rénovation des écoles")])
+    index.ajouter(1, "covoiturage")
+    index.supprimer(2)
+    assert len(index) == 1
+    assert index.rechercher("compostage") == []
+    assert index.rechercher("covoiturage")[0][0] == 1
+    assert index.rechercher("écoles") == []
+
+
+def test_index_fiches_contrat_et_synchro_incrementale():
+    def lignes(*rows):
+        return pd.DataFrame(rows, columns=["id", "collectivite", "titre", "description", "deleted", "modified_at"])
+
+    index = IndexFiches(engine=None)
+    index.appliquer(lignes(
+        (1, "Lyon", "Plan vélo", "Pistes cyclables", False, pd.Timestamp("2025-01-01")),
+        (2, "Nantes", "Cantines", "Vélo-école pour les élèves", False, pd.Timestamp("2025-01-02")),
+    ))
+    assert [r["collectivite"] for r in index.rechercher(["vélo"])] == ["Lyon", "Nantes"]
+    assert set(index.rechercher(["vélo"])[0]) == {"collectivite", "titre", "description", "score"}
+
+    # Delta : fiche 1 supprimée, fiche 2 renommée.
+    index.appliquer(lignes(
+        (1, "Lyon", "Plan vélo", "", True, pd.Timestamp("2025-02-01")),
+        (2, "Nantes", "Restauration scolaire", "Menus", False, pd.Timestamp("2025-02-02")),
+    ))
+    assert index.rechercher(["vélo"]) == []
+    assert index.rechercher(["restauration"])[0]["titre"] == "Restauration scolaire"
+    assert index.derniere_modif == pd.Timestamp("2025-02-02")
+
+
+if __name__ == "__main__":
+    test_tokenisation_accents_pluriels_mots_vides()
+    test_classement_et_boost_du_titre()
+    test_mise_a_jour_incrementale()
+    test_index_fiches_contrat_et_synchro_incrementale()
+    print("OK - recherche texte")
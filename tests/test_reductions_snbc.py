@@ -0,0 +1,113 @@
+"""Tests du service de réductions SNBC (faux transport HTTP, cache temporaire).
+
+Exécutable avec pytest ou directement : `python tests/test_reductions_snbc.py`.
+"""
+
+import json
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import http_client as hc
+from utils import reductions_snbc as rs
+
+
+class _FausseAPI(BaseAdapter):
+    """API SNBC leviers : une réponse par collectivité, 404 pour `inconnues`."""
+
+    def __init__(self, inconnues=(), delai=0.1):
+        super().__init__()
+        self.inconnues = set(inconnues)
+        self.delai = delai
+        self.appels = []
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        cid = int(parse_qs(urlsplit(request.url).query)["collectiviteId"][0])
+        with self._lock:
+            self.appels.append(cid)
+        time.sleep(self.delai)
+        response = requests.Response()
+        response.url, response.request = request.url, request
+        response.status_code = 404 if cid in self.inconnues else 200
+        response._content = json.dumps({
+            "secteurs": [{"leviers": [
+                {"nom": "Covoiturage", "objectifReduction": cid},
+                {"nom": "Réduction des déplacements", "objectifReduction": None},
+            ]}],
+        }).encode()
+        return response
+
+    def close(self):
+        pass
+
+
+def _service(api, cache, **kwargs):
+    return rs.ServiceReductions(
+        "http://tet.test/api/v1", "token",
+        http=hc.ClientHTTP(api), cache=cache, requetes_par_minute=None, **kwargs,
+    )
+
+
+def test_appels_paralleles_et_cache_par_version():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = rs.CacheReductions(Path(tmp) / "reductions.sqlite")
+        api = _FausseAPI(inconnues={7})
+        service = _service(api, cache)
+
+        debut = time.perf_counter()
+        df, erreurs = service.reductions_plusieurs(range(1, 9))
+        assert time.perf_counter() - debut < 0.5  # 8 appels de 0,1 s en parallèle
+        assert list(erreurs) == [7] and service.nb_appels == 8
+        assert sorted(df["collectivite_id"].unique()) == [1, 2, 3, 4, 5, 6, 8]
+        assert df.set_index(["collectivite_id", "levier"]).loc[(3, "Covoiturage"), "reduction"] == 3.0
+
+        # Nouveau service (nouveau run) : seule la collectivité en erreur est redemandée.
+        api.appels.clear()
+        relance = _service(api, cache)
+        assert relance.reductions(2)[0]["reduction"].tolist() == [2.0, 0.0]
+        relance.precharger(range(1, 9))
+        assert api.appels == [7] and relance.nb_cache == 7
+
+        # Autre version des données : tout est redemandé.
+        api.appels.clear()
+        _service(api, cache, version="2").precharger([1, 2])
+        assert sorted(api.appels) == [1, 2]
+
+
+def test_limite_propre_au_service_et_rafraichissement():
+    """La limite SNBC ne bride pas les autres appels à l'hôte ; `rafraichir` ignore le cache."""
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = rs.CacheReductions(Path(tmp) / "reductions.sqlite")
+        api = _FausseAPI(delai=0)
+        http = hc.ClientHTTP(api)
+        service = rs.ServiceReductions(
+            "http://limite.test/api/v1", "token", http=http, cache=cache, requetes_par_minute=600,
+        )
+        assert http.adaptateur._limites == {}
+        # Un nouveau service (nouveau run) reprend le même seau, sans le remplir.
+        relance = rs.ServiceReductions(
+            "http://limite.test/api/v1", "token", http=http, cache=cache, requetes_par_minute=600,
+        )
+        assert relance.limiteur is service.limiteur
+
+        service.reductions_plusieurs([1, 2])
+        api.appels.clear()
+        relance.reductions_plusieurs([1, 2])
+        assert api.appels == []
+        relance.reductions_plusieurs([1, 2], rafraichir=True)
+        assert sorted(api.appels) == [1, 2]
+
+
+if __name__ == "__main__":
+    test_appels_paralleles_et_cache_par_version()
+    test_limite_propre_au_service_et_rafraichissement()
+    print("OK - réductions SNBC")
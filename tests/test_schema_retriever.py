@@ -0,0 +1,39 @@
+"""Tests du retriever de schéma de l'assistant stats (doc OLAP réelle du dépôt).
+
+Exécutable avec pytest ou directement : `python tests/test_schema_retriever.py`.
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.schema_retriever import RetrieverSchema
+
+
+def test_selection_dans_le_budget():
+    retriever = RetrieverSchema.depuis_fichiers(budget_caracteres=3000)
+    contexte = retriever.document_initial("Combien d'utilisateurs actifs à 12 mois ?")
+    assert not contexte.complet
+    assert "`user_actif_12_mois`" in contexte.sections
+    assert "Glossaire" in contexte.texte
+    assert len(contexte.texte) < len(retriever.doc) / 2
+    # Un nom de table cité tel quel est toujours retenu.
+    assert "`pap_note`" in retriever.selectionner("contenu de pap_note").sections
+
+
+def test_repli_sur_la_doc_complete_et_complements():
+    retriever = RetrieverSchema.depuis_fichiers()
+    assert retriever.document_initial("Bonjour").texte == retriever.doc
+
+    premier = retriever.document_initial("Évolution des PAP actifs sur 52 semaines")
+    deja = set(premier.sections) | set(premier.relations)
+    suite = retriever.selectionner("et les fiches action avec un budget ?", deja_envoyees=deja)
+    assert suite.sections and not deja & set(suite.sections)
+    assert "fiche_action_budget" in suite.relations
+
+
+if __name__ == "__main__":
+    test_selection_dans_le_budget()
+    test_repli_sur_la_doc_complete_et_complements()
+    print("OK - retriever de schéma")
@@ -0,0 +1,115 @@
+"""Tests de l'exécution SQL en lecture seule de l'assistant stats (SQLite en mémoire).
+
+Exécutable avec pytest ou directement : `python tests/test_sql_lecture.py`.
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.sql_lecture import (
+    CacheResultats,
+    JetonAnnulation,
+    RequeteAnnulee,
+    RequeteRefusee,
+    en_parallele,
+    executer_lecture,
+    normaliser_sql,
+)
+
+
+def _engine():
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (id INTEGER, nom TEXT)"))
+        conn.execute(text("INSERT INTO t VALUES " + ", ".join(f"({i}, 'n{i}')" for i in range(50))))
+    requetes = []
+    event.listen(engine, "before_cursor_execute", lambda *a: requetes.append(a[2]))
+    return engine, requetes
+
+
+def test_apercu_et_total_en_une_requete():
+    engine, requetes = _engine()
+    resultat = executer_lecture(engine, "```sql\nSELECT * FROM t WHERE id >= 10;\n```", 5, avec_total=True)
+    assert resultat.total == 40 and list(resultat.df.columns) == ["id", "nom"] and len(resultat.df) == 5
+    assert len(requetes) == 1
+    vide = executer_lecture(engine, "SELECT * FROM t WHERE id < 0", 5, avec_total=True)
+    assert vide.total == 0 and vide.df.empty
+    for sql in ("DELETE FROM t", "SELECT 1; SELECT 2", "PRAGMA table_info(t)"):
+        try:
+            executer_lecture(engine, sql, 5)
+        except RequeteRefusee:
+            continue
+        raise AssertionError(sql)
+
+
+def test_cache_par_sql_normalise():
+    assert normaliser_sql("SELECT  *\nFROM T where nom = 'A  B'") == "select * from t where nom = 'A  B'"
+    engine, requetes = _engine()
+    cache = CacheResultats()
+    executer_lecture(engine, "select * from t", 20, avec_total=True, cache=cache)
+    # Plafond plus bas, total deja connu : servi par le cache.
+    apercu = executer_lecture(engine, "SELECT *\n  FROM t", 5, avec_total=True, cache=cache)
+    assert apercu.depuis_cache and apercu.total == 50 and len(apercu.df) == 5
+    assert len(requetes) == 1
+    # Plafond plus haut sur un resultat tronque : nouvelle execution.
+    tableau = executer_lecture(engine, "select * from t", 1000, cache=cache)
+    assert not tableau.depuis_cache and len(tableau.df) == 50 and len(requetes) == 2
+    # Le resultat complet sert ensuite toute demande, total compris.
+    assert executer_lecture(engine, "select * from t", 100, avec_total=True, cache=cache).total == 50
+    assert len(requetes) == 2
+
+
+def test_parallele_ordonne_et_annulation():
+    # Resultats dans l'ordre des appels, meme si le premier finit le dernier.
+    debut = time.monotonic()
+    sorties = list(en_parallele([lambda j, d=d: time.sleep(d) or d for d in (0.3, 0.1, 0.2)], max_paralleles=3))
+    assert [r for r, _ in sorties] == [0.3, 0.1, 0.2] and time.monotonic() - debut < 0.55
+
+    # Requete trop longue : interrompue cote base (sqlite3.interrupt) au-dela du delai.
+    lente = (
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 100000000) "
+        "SELECT count(*) AS c FROM n"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{tmp}/t.sqlite")
+        debut = time.monotonic()
+        (_, err_lente), (rapide, err) = en_parallele(
+            [lambda j: executer_lecture(engine, lente, 1, annulation=j),
+             lambda j: executer_lecture(engine, "SELECT 1 AS un", 1, annulation=j)],
+            timeout_s=0.3,
+        )
+        assert isinstance(err_lente, TimeoutError) and err is None and rapide.df["un"].tolist() == [1]
+        assert time.monotonic() - debut < 5
+
+        # Meme SQL demande deux fois en parallele : une seule execution.
+        requetes = []
+        event.listen(engine, "before_cursor_execute", lambda *a: requetes.append(a[2]))
+        cache = CacheResultats()
+        sorties = list(en_parallele(
+            [lambda j, n=n: executer_lecture(engine, "SELECT 1 AS un", n, avec_total=True, cache=cache) for n in (10, 5)]
+        ))
+        assert len(requetes) == 1 and [r.total for r, _ in sorties] == [1, 1]
+
+        # Jeton du tour annule (nouveau message) : plus aucune requete lancee.
+        tour = JetonAnnulation()
+        tour.annuler()
+        try:
+            executer_lecture(engine, "SELECT 1", 1, annulation=tour.enfant())
+        except RequeteAnnulee:
+            pass
+        else:
+            raise AssertionError("requete non annulee")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    test_apercu_et_total_en_une_requete()
+    test_cache_par_sql_normalise()
+    test_parallele_ordonne_et_annulation()
+    print("OK - lecture SQL")
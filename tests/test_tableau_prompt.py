@@ -0,0 +1,64 @@
+"""Tests du rendu compact des fichiers CSV / Excel pour les prompts de l'Import Tool.
+
+Exécutable avec pytest ou directement : `python tests/test_tableau_prompt.py`.
+"""
+
+import io
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.tableau_prompt import encoder_csv, encoder_excel, encoder_tableau
+
+
+def _plan(nb=30):
+    return pd.DataFrame({
+        "Axe": [f"Axe {i // 10 + 1} : Mobilité durable" for i in range(nb)],
+        "Sous-axe": [f"{i // 10 + 1}.{i // 5 % 2 + 1} Vélo" for i in range(nb)],
+        "Titre": [f"Action  {i}\n| pilote" for i in range(nb)],
+        "Budget": [1200.0 if i % 2 else None for i in range(nb)],
+        "Unnamed: 4": [None] * nb,
+    })
+
+
+def test_enregistrements_compacts():
+    texte, rapport = encoder_tableau(_plan(), "Plan")
+    lignes = texte.splitlines()
+    assert lignes[0] == "Axe | Sous-axe | Titre | Budget"
+    assert lignes[1] == "Axe 1 : Mobilité durable | 1.1 Vélo | Action 0 / pilote"
+    assert lignes[2] == "^ | ^ | Action 1 / pilote | 1200"
+    assert lignes[11].startswith("Axe 2 : Mobilité durable | 2.1 Vélo")
+    assert rapport.colonnes_vides == ["Unnamed: 4"] and rapport.colonnes_abregees == ["Axe", "Sous-axe"]
+    assert not rapport.tronque
+
+    tronque, rapport = encoder_tableau(_plan(), "Plan", budget_tokens=60)
+    assert rapport.tronque and 0 < rapport.lignes_incluses < 30
+    assert len(tronque.splitlines()) == rapport.lignes_incluses + 1
+
+    csv = io.StringIO(_plan().to_csv(sep=";", index=False))
+    texte_csv, rapport_csv = encoder_csv(csv, sep=";")
+    assert texte_csv.startswith("# Fichier CSV") and "1 colonnes vides ignorées" in texte_csv
+    assert rapport_csv.tokens > 0
+
+
+def test_onglets_annexes_et_budget():
+    fichier = io.BytesIO()
+    with pd.ExcelWriter(fichier, engine="openpyxl") as writer:
+        pd.DataFrame({"Consigne": ["Remplir l'onglet suivant"]}).to_excel(writer, sheet_name="Mode d'emploi", index=False)
+        _plan().to_excel(writer, sheet_name="Plan", index=False)
+        pd.DataFrame({"Statut": ["En cours", "Réalisé"]}).to_excel(writer, sheet_name="Listes déroulantes", index=False)
+        _plan(2000).to_excel(writer, sheet_name="Annexe actions", index=False)
+    fichier.seek(0)
+    texte, rapport = encoder_excel(fichier, budget_tokens=800)
+    assert rapport.onglets_ignores == ["Mode d'emploi", "Listes déroulantes"]
+    assert "## Onglet : Plan" in texte and "Remplir" not in texte
+    assert rapport.tronque and ("Annexe actions" in rapport.resume())
+
+
+if __name__ == "__main__":
+    test_enregistrements_compacts()
+    test_onglets_annexes_et_budget()
+    print("OK - tableaux pour prompts")
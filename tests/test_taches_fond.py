@@ -0,0 +1,87 @@
+"""Tests de la file de tâches de fond (SQLite temporaire, workers dans le process).
+
+Exécutable avec pytest ou directement : `python tests/test_taches_fond.py`.
+"""
+
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import taches_fond as tf
+
+
+def tache_test(contexte, n: int, pause: float = 0.0):
+    for i in range(n):
+        contexte.progression((i + 1) / n, f"étape {i + 1}/{n}")
+        contexte.write(f"étape {i + 1}")
+        time.sleep(pause)
+    return {"somme": n * (n + 1) // 2}
+
+
+tf.TYPES_TACHES.setdefault("test", f"{__name__}:tache_test")
+
+
+def _attendre(condition, delai=5.0):
+    fin = time.monotonic() + delai
+    while not condition():
+        assert time.monotonic() < fin, "délai dépassé"
+        time.sleep(0.05)
+
+
+def test_pas_de_doublon_et_execution():
+    with tempfile.TemporaryDirectory() as tmp:
+        file = tf.FileTaches(Path(tmp) / "taches.sqlite")
+        premiere = file.soumettre("test", {"n": 3})
+        assert file.soumettre("test", {"n": 3}) == premiere
+        autre = file.soumettre("test", {"n": 4})
+        assert autre != premiere and file.active("test", {"n": 3}).id == premiere
+
+        assert tf.traiter_suivante(file, "w") == tf.TERMINEE
+        tache = file.lire(premiere)
+        assert tache.resultat == {"somme": 6} and tache.progression == 1 and not tache.active
+        assert [m for _, _, m in file.journal(premiere)] == ["étape 1", "étape 2", "étape 3"]
+        # Au-delà de la limite de `journal`, le suivi affiche bien les dernières lignes.
+        for i in range(600):
+            file.ajouter_journal(premiere, f"ligne {i}")
+        assert [m for _, _, m in file.dernieres_lignes(premiere, 2)] == ["ligne 598", "ligne 599"]
+        # Une fois terminée, la même demande relance un nouveau travail.
+        assert file.soumettre("test", {"n": 3}) not in (premiere, autre)
+
+
+def test_annulation_et_worker_perdu():
+    with tempfile.TemporaryDirectory() as tmp:
+        file = tf.FileTaches(Path(tmp) / "taches.sqlite")
+        arret = threading.Event()
+        serveur = threading.Thread(target=tf.servir, args=(file, 1, arret))
+        serveur.start()
+        try:
+            longue = file.soumettre("test", {"n": 100, "pause": 0.05})
+            en_attente = file.soumettre("test", {"n": 1})
+            _attendre(lambda: file.lire(longue).statut == tf.EN_COURS)
+            assert file.workers_actifs() == 1
+            assert file.annuler(en_attente) and file.lire(en_attente).statut == tf.ANNULEE
+            assert file.annuler(longue)
+            _attendre(lambda: file.lire(longue).statut == tf.ANNULEE)
+            assert file.lire(longue).progression < 1
+        finally:
+            arret.set()
+            serveur.join()
+        assert file.workers_actifs() == 0
+
+        # Tâche en cours dont le worker ne bat plus : passée en erreur, pas relancée.
+        orpheline = file.soumettre("test", {"n": 2})
+        file.reserver("disparu")
+        with sqlite3.connect(file.path) as conn:
+            conn.execute("UPDATE tache SET battement = 0 WHERE id = ?", (orpheline,))
+        assert file.recuperer_orphelines() == 1 and file.lire(orpheline).statut == tf.ERREUR
+
+
+if __name__ == "__main__":
+    test_pas_de_doublon_et_execution()
+    test_annulation_et_worker_perdu()
+    print("OK - tâches de fond")
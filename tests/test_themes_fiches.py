@@ -0,0 +1,67 @@
+"""Tests de la classification thématique des fiches (automate + synchro incrémentale).
+
+Source simulée par une base SQLite en mémoire. Exécutable avec pytest ou
+directement : `python tests/test_themes_fiches.py`.
+"""
+
+import sys
+import tempfile
+from pathlib import Path
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.themes_fiches import MatcheurMotsCles, StoreThemes
+
+THEMES_TEST = {"biodiversite": ["haie", "trame verte", "biodiversité"], "mobilite": ["vélo", "covoiturage"]}
+
+
+def test_matcheur_sous_chaines_sans_accents_ni_casse():
+    matcheur = MatcheurMotsCles(THEMES_TEST)
+    trouves = matcheur.correspondances("Plantation de HAIES et Trame Verte ; atelier vélo, Biodiversite")
+    assert trouves == {"biodiversite": {"haie", "trame verte", "biodiversite"}, "mobilite": {"velo"}}
+    # Faux départ sur « hax » : le lien d'échec retrouve « aie » dans « haie ».
+    assert MatcheurMotsCles({"t": ["hax", "aie"]}).correspondances("haie")["t"] == {"aie"}
+    assert matcheur.correspondances(None) == {}
+
+
+def test_synchronisation_incrementale():
+    source = create_engine("sqlite://")
+    with source.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE fiche_action (id INTEGER, titre TEXT, description TEXT, deleted BOOLEAN, modified_at TEXT)"
+        ))
+        conn.execute(text("""
+            INSERT INTO fiche_action VALUES
+              (1, 'Plantation de haies', NULL, 0, '2025-01-01T00:00:00'),
+              (2, 'Plan vélo', 'Covoiturage', 0, '2025-01-02T00:00:00'),
+              (3, 'Éclairage', 'Sobriété', 0, '2025-01-03T00:00:00')
+        """))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = StoreThemes(Path(tmp) / "themes.sqlite", themes=THEMES_TEST)
+        assert store.synchroniser(source) == 3
+        assert store.fiches("biodiversite") == [1]
+        assert store.fiches("mobilite") == [2]
+
+        with source.begin() as conn:
+            conn.execute(text(
+                "UPDATE fiche_action SET description = 'trame verte', modified_at = '2025-02-01T00:00:00' WHERE id = 3"
+            ))
+            conn.execute(text("UPDATE fiche_action SET deleted = 1, modified_at = '2025-02-02T00:00:00' WHERE id = 1"))
+        # Seules les deux fiches modifiées sont relues.
+        assert store.synchroniser(source) == 2
+        assert store.fiches("biodiversite") == [3]
+        assert store.tags("biodiversite")["motifs"].tolist() == [["trame verte"]]
+
+        # Nouveaux mots-clés : reclassification complète.
+        autre = StoreThemes(Path(tmp) / "themes.sqlite", themes={"eclairage": ["éclairage"]})
+        assert autre.synchroniser(source) == 3
+        assert autre.fiches("eclairage") == [3] and autre.fiches("mobilite") == []
+
+
+if __name__ == "__main__":
+    test_matcheur_sous_chaines_sans_accents_ni_casse()
+    test_synchronisation_incrementale()
+    print("OK - thèmes fiches")
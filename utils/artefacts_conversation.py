@@ -0,0 +1,155 @@
+"""Tableaux des artefacts d'une conversation de l'assistant stats (page 06).
+
+Chaque tableau ou graphe affiché garde son DataFrame dans l'historique de la
+conversation (`st.session_state`), pour être réaffiché à chaque rerun. Au-delà
+d'un budget mémoire par conversation, les plus anciens sont déversés sur
+disque au format Arrow IPC compressé (.cache/artefacts/<conversation>/) et
+relus à l'affichage : une longue session reste légère.
+
+Les dossiers de conversations abandonnées (session expirée) sont purgés à la
+création d'un nouveau magasin ; la page touche le dossier de sa conversation
+à chaque rendu (`toucher`). Un tableau dont le fichier a malgré tout disparu
+lève `ArtefactExpire` à la lecture. Sans pyarrow, tout reste en mémoire.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Optional
+
+import pandas as pd
+
+from utils.sql_lecture import taille_octets
+
+logger = logging.getLogger(__name__)
+
+DOSSIER_ARTEFACTS = Path(__file__).resolve().parent.parent / ".cache" / "artefacts"
+# Mémoire des tableaux d'une conversation au-delà de laquelle les plus anciens vont sur disque.
+BUDGET_MEMOIRE_MO = 32
+COMPRESSION = "zstd"
+# Âge au-delà duquel le dossier d'une autre conversation est considéré abandonné.
+CONSERVATION_S = 24 * 3600
+
+
+class ArtefactExpire(FileNotFoundError):
+    """Le fichier d'un tableau déversé a été purgé."""
+
+
+class TableauStocke:
+    """DataFrame d'un artefact, en mémoire ou déversé sur disque."""
+
+    def __init__(self, df: pd.DataFrame):
+        self._df: Optional[pd.DataFrame] = df
+        self.chemin: Optional[Path] = None
+        self.octets = taille_octets(df)
+        self.nb_lignes = len(df)
+
+    @property
+    def en_memoire(self) -> bool:
+        return self._df is not None
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """Le DataFrame (relu depuis le disque s'il a été déversé, sans être conservé).
+
+        Lève `ArtefactExpire` si le fichier a été purgé.
+        """
+        if self._df is not None:
+            return self._df
+        import pyarrow as pa
+
+        try:
+            # Conversation toujours active : son dossier n'est pas purgé.
+            os.utime(self.chemin.parent)
+            with pa.memory_map(str(self.chemin)) as source:
+                return pa.ipc.open_file(source).read_all().to_pandas()
+        except FileNotFoundError as exc:
+            raise ArtefactExpire(str(self.chemin)) from exc
+
+    def deverser(self, chemin: Path) -> bool:
+        """Écrit le DataFrame en Arrow IPC compressé et le libère ; False si impossible."""
+        if self._df is None:
+            return True
+        try:
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(self._df, preserve_index=False)
+            options = pa.ipc.IpcWriteOptions(compression=COMPRESSION)
+            chemin.parent.mkdir(parents=True, exist_ok=True)
+            with pa.OSFile(str(chemin), "wb") as sink, pa.ipc.new_file(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+        except Exception as exc:  # noqa: BLE001 - pyarrow absent, types non convertibles...
+            logger.warning("Artefact conservé en mémoire (%s)", exc)
+            return False
+        self.chemin = chemin
+        self._df = None
+        return True
+
+
+class MagasinArtefacts:
+    """Tableaux d'une conversation, bornés en mémoire à `budget_octets`."""
+
+    def __init__(
+        self,
+        dossier: Path | str | None = None,
+        *,
+        budget_octets: int = BUDGET_MEMOIRE_MO * 1024 * 1024,
+    ):
+        racine = DOSSIER_ARTEFACTS if dossier is None else Path(dossier)
+        purger_abandonnes(racine)
+        self.dossier = racine / uuid.uuid4().hex
+        self.budget_octets = budget_octets
+        self._tableaux: list[TableauStocke] = []
+        self._lock = threading.Lock()
+
+    @property
+    def octets_en_memoire(self) -> int:
+        return sum(t.octets for t in self._tableaux if t.en_memoire)
+
+    def stocker(self, df: pd.DataFrame) -> TableauStocke:
+        """Ajoute un tableau ; les plus anciens sont déversés si le budget est dépassé."""
+        tableau = TableauStocke(df)
+        with self._lock:
+            self._tableaux.append(tableau)
+            en_trop = self.octets_en_memoire - self.budget_octets
+            # Le dernier tableau (en cours d'affichage) reste en mémoire.
+            for numero, ancien in enumerate(self._tableaux[:-1]):
+                if en_trop <= 0:
+                    break
+                if ancien.en_memoire and ancien.deverser(self.dossier / f"{numero:04d}.arrow"):
+                    en_trop -= ancien.octets
+        return tableau
+
+    def toucher(self) -> None:
+        """Marque la conversation comme active (pas de purge de son dossier)."""
+        try:
+            os.utime(self.dossier)
+        except FileNotFoundError:
+            pass
+
+    def vider(self) -> None:
+        with self._lock:
+            self._tableaux.clear()
+            shutil.rmtree(self.dossier, ignore_errors=True)
+
+
+def purger_abandonnes(racine: Path = DOSSIER_ARTEFACTS, conservation_s: float = CONSERVATION_S) -> int:
+    """Supprime les dossiers de conversation non modifiés depuis `conservation_s` ; renvoie leur nombre."""
+    if not racine.is_dir():
+        return 0
+    limite = time.time() - conservation_s
+    supprimes = 0
+    for dossier in racine.iterdir():
+        try:
+            if dossier.is_dir() and dossier.stat().st_mtime < limite:
+                shutil.rmtree(dossier, ignore_errors=True)
+                supprimes += 1
+        except OSError:
+            continue
+    return supprimes
@@ -0,0 +1,127 @@
+"""Mise en concurrence de plusieurs modèles sur un même prompt (page 18).
+
+Les fournisseurs sélectionnés sont interrogés simultanément ; le texte reçu
+en streaming est transmis fragment par fragment (`on_fragment`) pour être
+affiché côte à côte au fil de l'eau. Deux modes :
+
+- `MODE_TOUS` : comparaison, on attend toutes les réponses (dans la limite
+  de `timeout_s`) ; le temps total est celui du plus lent, non la somme ;
+- `MODE_PREMIER` : course, la première réponse valide l'emporte et les
+  appels restants sont annulés.
+
+Latence, délai avant le premier fragment et tokens sont relevés par
+fournisseur (en plus de la télémétrie LLM, où un appel abandonné a l'issue
+`annule`).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+MODE_TOUS = "tous"
+MODE_PREMIER = "premier"
+
+EN_COURS = "en cours"
+TERMINE = "terminé"
+ERREUR = "erreur"
+ANNULE = "annulé"
+DELAI = "délai dépassé"
+
+# Une fonction concurrente reçoit le rappel de fragment et renvoie (réponse, temps, tokens).
+Concurrent = Callable[[Callable[[str], None]], Awaitable[tuple[str, float, int]]]
+
+
+@dataclass
+class ResultatConcurrent:
+    nom: str
+    reponse: str = ""
+    tokens: int = 0
+    duree_s: float = 0.0
+    # Délai avant le premier fragment streamé (None : pas de streaming ou cache).
+    premier_fragment_s: Optional[float] = None
+    statut: str = EN_COURS
+    erreur: str = ""
+
+    @property
+    def valide(self) -> bool:
+        return self.statut == TERMINE
+
+    def resume(self) -> str:
+        texte = f"{self.statut} en {self.duree_s:.1f} s"
+        if self.premier_fragment_s is not None:
+            texte += f" (1er fragment {self.premier_fragment_s:.1f} s)"
+        if self.tokens:
+            texte += f" | {self.tokens:,} tokens".replace(",", " ")
+        return texte
+
+
+async def courir(
+    concurrents: dict[str, Concurrent],
+    *,
+    mode: str = MODE_TOUS,
+    timeout_s: Optional[float] = None,
+    valide: Callable[[str], bool] = bool,
+    on_fragment: Optional[Callable[[ResultatConcurrent], None]] = None,
+    on_termine: Optional[Callable[[ResultatConcurrent], None]] = None,
+) -> dict[str, ResultatConcurrent]:
+    """Lance les concurrents ensemble ; renvoie leurs résultats, dans l'ordre de `concurrents`.
+
+    `valide(réponse)` distingue une réponse exploitable d'un texte d'erreur.
+    `on_fragment` reçoit le résultat partiel à chaque fragment streamé,
+    `on_termine` chaque résultat final (y compris annulé ou hors délai).
+    """
+    debut = time.perf_counter()
+    resultats = {nom: ResultatConcurrent(nom) for nom in concurrents}
+
+    def recepteur(resultat: ResultatConcurrent) -> Callable[[str], None]:
+        def recevoir(fragment: str) -> None:
+            if resultat.premier_fragment_s is None:
+                resultat.premier_fragment_s = time.perf_counter() - debut
+            resultat.reponse += fragment
+            if on_fragment:
+                on_fragment(resultat)
+
+        return recevoir
+
+    async def lancer(resultat: ResultatConcurrent, concurrent: Concurrent) -> ResultatConcurrent:
+        try:
+            reponse, _, tokens = await concurrent(recepteur(resultat))
+        except asyncio.CancelledError:
+            resultat.statut = ANNULE
+            raise
+        except Exception as exc:  # noqa: BLE001 - un concurrent en échec n'arrête pas les autres
+            resultat.statut, resultat.erreur = ERREUR, str(exc)
+        else:
+            resultat.reponse, resultat.tokens = reponse, tokens
+            resultat.statut = TERMINE if valide(reponse) else ERREUR
+        finally:
+            resultat.duree_s = time.perf_counter() - debut
+        if on_termine:
+            on_termine(resultat)
+        return resultat
+
+    taches = {asyncio.create_task(lancer(resultats[nom], c)): nom for nom, c in concurrents.items()}
+    en_attente = set(taches)
+    while en_attente:
+        reste = None if timeout_s is None else timeout_s - (time.perf_counter() - debut)
+        if reste is not None and reste <= 0:
+            break
+        finies, en_attente = await asyncio.wait(en_attente, timeout=reste, return_when=asyncio.FIRST_COMPLETED)
+        if mode == MODE_PREMIER and any(resultats[taches[t]].valide for t in finies):
+            break
+
+    for tache in en_attente:
+        tache.cancel()
+    if en_attente:
+        await asyncio.gather(*en_attente, return_exceptions=True)
+        hors_delai = timeout_s is not None and time.perf_counter() - debut >= timeout_s
+        for tache in en_attente:
+            resultat = resultats[taches[tache]]
+            if hors_delai:
+                resultat.statut = DELAI
+            if on_termine:
+                on_termine(resultat)
+    return resultats
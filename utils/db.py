@@ -3,6 +3,7 @@ from typing import Optional, Sequence, Mapping, Any
 
 import pandas as pd
 from sqlalchemy import create_engine, text
+from sqlalchemy import column as sa_column, insert as sa_insert, table as sa_table
 
 try:
     # streamlit is available at runtime; used for secrets and caching
@@ -150,3 +151,67 @@ def read_table(
     return df
 
 
+def dataframe_to_records(df: pd.DataFrame) -> list[dict[str, Any]]:
+    """Convertit un DataFrame en liste de dicts de scalaires Python, NaN/NaT -> None.
+
+    La conversion est faite une fois pour tout le frame (astype(object) + where)
+    plutôt que cellule par cellule dans une boucle Python.
+    """
+    df_obj = df.astype(object)
+    return df_obj.where(df.notna(), None).to_dict("records")
+
+
+def bulk_insert(
+    conn,
+    table_name: str,
+    df: pd.DataFrame,
+    *,
+    schema: Optional[str] = None,
+    returning: Optional[Sequence[str]] = None,
+    method: str = "executemany",
+) -> list[Any]:
+    """Insère un DataFrame en un seul aller de requêtes sur une connexion ouverte.
+
+    Paramètres
+    - conn : connexion SQLAlchemy, en général issue de `engine.begin()`
+    - table_name / schema : table cible
+    - returning : colonnes à renvoyer (ex. ["id"]), optionnel
+    - method : "executemany" (insertmanyvalues de SQLAlchemy : INSERT ... VALUES
+      multi-lignes par lots, compatible RETURNING) ou "copy" (COPY FROM STDIN
+      de psycopg, le plus rapide, sans RETURNING ni conversion côté serveur
+      des valeurs texte)
+
+    Renvoie les lignes retournées (directement les valeurs si une seule colonne
+    est demandée), ou une liste vide sans `returning`.
+    """
+    if df.empty:
+        return []
+
+    columns = [str(c) for c in df.columns]
+    records = dataframe_to_records(df)
+
+    if method == "copy":
+        if returning:
+            raise ValueError("COPY ne permet pas RETURNING : utilisez method='executemany'")
+        qualified = f'"{schema}"."{table_name}"' if schema else f'"{table_name}"'
+        cols_sql = ", ".join(f'"{c}"' for c in columns)
+        cursor = conn.connection.driver_connection.cursor()
+        with cursor.copy(f"COPY {qualified} ({cols_sql}) FROM STDIN") as copy:
+            for record in records:
+                copy.write_row([record[c] for c in columns])
+        return []
+
+    if method != "executemany":
+        raise ValueError(f"Méthode d'insertion inconnue : {method}")
+
+    target = sa_table(table_name, *[sa_column(c) for c in columns], schema=schema)
+    stmt = sa_insert(target)
+    if returning:
+        stmt = stmt.returning(*[sa_column(c) for c in returning])
+        rows = conn.execute(stmt, records).all()
+        if len(returning) == 1:
+            return [row[0] for row in rows]
+        return [tuple(row) for row in rows]
+
+    conn.execute(stmt, records)
+    return []
@@ -0,0 +1,237 @@
+"""Extraction du texte des PDF de plans (pages 18 et 22), parallèle et mise en cache.
+
+Les pages sont réparties par lots contigus sur un pool de processus
+(`extract_text` de pypdf est du pur Python, lié au GIL), puis recollées dans
+l'ordre. Chaque processus reçoit le PDF une seule fois, à son démarrage, et
+le parse une fois pour tous ses lots. Le pool est lancé en `forkserver` (ou
+`spawn`) : pas de fork du serveur Streamlit et de ses threads.
+
+Le texte obtenu est mis en cache dans une base SQLite locale (.cache/) sous
+l'empreinte SHA-256 du contenu du fichier : relancer l'analyse du même PDF,
+ou le déposer dans l'autre page, ne réextrait rien. Les entrées les moins
+récemment lues sont évincées au-delà d'une taille maximale.
+
+Le temps d'extraction de chaque page est conservé (y compris en cache) pour
+repérer les pages pathologiques (scans vectorisés, tableaux géants...).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from pathlib import Path
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache"
+CACHE_PDF_PATH = CACHE_DIR / "extraction_pdf.sqlite"
+
+MAX_MO = 100
+# En dessous, le démarrage du pool coûte plus qu'il ne rapporte.
+SEUIL_PAGES_PARALLELE = 16
+# Lots par processus : équilibre la charge quand quelques pages sont lentes.
+LOTS_PAR_PROCESSUS = 4
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS extraction_pdf (
+    cle TEXT PRIMARY KEY,
+    texte BLOB NOT NULL,
+    durees TEXT NOT NULL,
+    taille INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_extraction_pdf_access ON extraction_pdf(last_access);
+"""
+
+
+@dataclass
+class ResultatExtraction:
+    texte: str
+    # Durée d'extraction de chaque page, en secondes (index 0 = page 1).
+    durees_pages: list[float] = field(default_factory=list)
+    duree_s: float = 0.0
+    depuis_cache: bool = False
+
+    def pages_lentes(self, n: int = 5) -> list[tuple[int, float]]:
+        """Les `n` pages les plus longues à extraire : [(numéro de page, secondes)]."""
+        classees = sorted(enumerate(self.durees_pages, 1), key=lambda p: p[1], reverse=True)
+        return classees[:n]
+
+    def resume(self) -> str:
+        origine = "cache" if self.depuis_cache else f"{self.duree_s:.1f} s"
+        texte = f"{len(self.durees_pages)} pages ({origine})"
+        lentes = [f"p. {num} ({duree:.1f} s)" for num, duree in self.pages_lentes(3) if duree >= 0.5]
+        if lentes:
+            texte += " — pages les plus lentes : " + ", ".join(lentes)
+        return texte
+
+
+def empreinte(contenu: bytes) -> str:
+    """Clé de cache : contenu du fichier et version de pypdf (l'extraction en dépend)."""
+    import pypdf
+
+    h = hashlib.sha256(contenu)
+    h.update(f"pypdf={pypdf.__version__}".encode())
+    return h.hexdigest()
+
+
+class CacheExtraction:
+    """Cache SQLite des textes extraits, avec éviction LRU au-delà de `max_octets`."""
+
+    def __init__(self, path: Path | str = CACHE_PDF_PATH, *, max_octets: int = MAX_MO * 1024 * 1024):
+        self.path = Path(path)
+        self.max_octets = max_octets
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def lire(self, cle: str) -> ResultatExtraction | None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT texte, durees FROM extraction_pdf WHERE cle = ?", (cle,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE extraction_pdf SET last_access = ? WHERE cle = ?", (time.time(), cle))
+        return ResultatExtraction(zlib.decompress(row[0]).decode("utf-8"), json.loads(row[1]), depuis_cache=True)
+
+    def ecrire(self, cle: str, resultat: ResultatExtraction) -> int:
+        """Stocke un texte extrait ; renvoie le nombre d'entrées évincées."""
+        blob = zlib.compress(resultat.texte.encode("utf-8"))
+        maintenant = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO extraction_pdf VALUES (?, ?, ?, ?, ?, ?)",
+                (cle, blob, json.dumps(resultat.durees_pages), len(blob), maintenant, maintenant),
+            )
+            return self._evincer(conn)
+
+    def _evincer(self, conn: sqlite3.Connection) -> int:
+        total = conn.execute("SELECT COALESCE(SUM(taille), 0) FROM extraction_pdf").fetchone()[0]
+        if total <= self.max_octets:
+            return 0
+        # On redescend à 90 % de la limite pour ne pas évincer à chaque écriture.
+        a_liberer = total - int(self.max_octets * 0.9)
+        cles = []
+        for cle, taille in conn.execute("SELECT cle, taille FROM extraction_pdf ORDER BY last_access"):
+            cles.append((cle,))
+            a_liberer -= taille
+            if a_liberer <= 0:
+                break
+        conn.executemany("DELETE FROM extraction_pdf WHERE cle = ?", cles)
+        return len(cles)
+
+    def vider(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM extraction_pdf")
+
+
+_cache: CacheExtraction | None = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CacheExtraction:
+    """Cache partagé du process."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheExtraction()
+        return _cache
+
+
+def _lire_pages(reader, debut: int, fin: int) -> list[tuple[str, float]]:
+    """Texte et durée des pages [debut, fin[."""
+    pages = []
+    for i in range(debut, fin):
+        t0 = time.perf_counter()
+        texte = reader.pages[i].extract_text() or ""
+        pages.append((texte, time.perf_counter() - t0))
+    return pages
+
+
+# PDF ouvert dans chaque processus du pool par `_initialiser_processus`.
+_reader_processus = None
+
+
+def _initialiser_processus(contenu: bytes) -> None:
+    global _reader_processus
+    from pypdf import PdfReader
+
+    _reader_processus = PdfReader(io.BytesIO(contenu))
+
+
+def _extraire_plage(debut: int, fin: int) -> list[tuple[str, float]]:
+    """Pages [debut, fin[ du PDF du processus (exécuté dans le pool)."""
+    return _lire_pages(_reader_processus, debut, fin)
+
+
+def _contexte_pool():
+    """forkserver si disponible (Linux, macOS), sinon spawn : jamais fork."""
+    methode = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(methode)
+
+
+def _extraire(contenu: bytes, workers: int | None) -> list[tuple[str, float]]:
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(contenu))
+    nb_pages = len(reader.pages)
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or nb_pages < SEUIL_PAGES_PARALLELE:
+        return _lire_pages(reader, 0, nb_pages)
+
+    taille_lot = max(1, -(-nb_pages // (workers * LOTS_PAR_PROCESSUS)))
+    bornes = [(d, min(d + taille_lot, nb_pages)) for d in range(0, nb_pages, taille_lot)]
+    try:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(bornes)),
+            mp_context=_contexte_pool(),
+            initializer=_initialiser_processus,
+            initargs=(contenu,),
+        ) as pool:
+            lots = pool.map(_extraire_plage, *zip(*bornes))
+            return [page for lot in lots for page in lot]
+    except (BrokenProcessPool, OSError):
+        # Pool indisponible (environnement restreint) : extraction en série.
+        return _lire_pages(reader, 0, nb_pages)
+
+
+def extraire_texte_pdf(
+    contenu: bytes,
+    *,
+    workers: int | None = None,
+    cache: CacheExtraction | None = None,
+    utiliser_cache: bool = True,
+) -> ResultatExtraction:
+    """Texte d'un PDF (chaque page suivie d'un saut de ligne, comme l'extraction historique).
+
+    `workers` : nombre de processus (défaut : nombre de CPU).
+    """
+    cache = cache or (get_cache() if utiliser_cache else None)
+    cle = empreinte(contenu)
+    if cache is not None:
+        resultat = cache.lire(cle)
+        if resultat is not None:
+            return resultat
+
+    debut = time.perf_counter()
+    pages = _extraire(contenu, workers)
+    resultat = ResultatExtraction(
+        "".join(texte + "\n" for texte, _ in pages),
+        [duree for _, duree in pages],
+        time.perf_counter() - debut,
+    )
+    if cache is not None:
+        cache.ecrire(cle, resultat)
+    return resultat
@@ -0,0 +1,339 @@
+"""Client HTTP partagé pour les appels aux API externes (TET, indicateurs, SNBC).
+
+Toutes les requêtes du process passent par un même adaptateur requests :
+
+- pools keep-alive par hôte (urllib3), la poignée de main TCP+TLS n'est
+  payée qu'une fois par connexion ;
+- réponses compressées négociées et décodées par requests (Accept-Encoding) ;
+- timeout (connexion, lecture) appliqué par défaut à toute requête ;
+- limite de débit optionnelle par hôte (`TokenBucket`) ;
+- mesures par hôte : requêtes, erreurs, rejeux, latence, octets reçus
+  (décodés et sur le réseau), attente due à la limite.
+
+`ClientHTTP.request` rejoue les erreurs transitoires (réseau, 429, 5xx) avec
+un backoff exponentiel bruité, pour les méthodes idempotentes seulement
+(`rejouer=True` pour un POST de lecture, ex. requêtes cube.js).
+
+Le transport est un adaptateur requests (`HTTPAdapter` par défaut) : les tests
+en passent un faux qui répond sans réseau.
+"""
+
+from __future__ import annotations
+
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass, field
+from typing import Any
+from urllib.parse import urlsplit
+
+import pandas as pd
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+# Timeouts par défaut : (connexion, lecture) en secondes.
+TIMEOUT_CONNEXION = 5
+TIMEOUT_LECTURE = 60
+# Nombre d'hôtes gardés en pool et connexions keep-alive par hôte.
+POOLS_HOTES = 10
+CONNEXIONS_PAR_HOTE = 8
+MAX_TENTATIVES = 4
+# Latences conservées par hôte pour le p95.
+LATENCES_CONSERVEES = 500
+
+METHODES_IDEMPOTENTES = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+# Codes HTTP qui justifient un nouvel essai de la même requête.
+CODES_A_REJOUER = frozenset({408, 425, 429, 500, 502, 503, 504})
+# Parmi eux, ceux où le serveur n'a pas traité la requête : les seuls après
+# lesquels une écriture non idempotente (POST) peut être renvoyée sans risque
+# de doublon. Après 500/502/504, l'écriture a pu avoir lieu.
+CODES_NON_TRAITES = frozenset({408, 425, 429, 503})
+
+
+class TokenBucket:
+    """Seau à jetons thread-safe.
+
+    `capacite` jetons au plus, rechargés à `debit` jetons par seconde. Sur
+    toute fenêtre de `fenetre` secondes on n'émet jamais plus de
+    `capacite + debit * fenetre` requêtes : `pour_limite` règle le débit pour
+    que ce total reste sous la limite annoncée par l'API.
+    """
+
+    def __init__(self, capacite: float, debit: float):
+        if capacite < 1 or debit <= 0:
+            raise ValueError("capacite >= 1 et debit > 0 sont requis")
+        self.capacite = float(capacite)
+        self.debit = float(debit)
+        self._jetons = float(capacite)
+        self._dernier = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def pour_limite(
+        cls, requetes: int, fenetre: float = 60.0, capacite: int = 4
+    ) -> "TokenBucket":
+        """Seau garantissant au plus `requetes` requêtes par `fenetre` secondes."""
+        capacite = max(1, min(capacite, requetes - 1))
+        return cls(capacite, (requetes - capacite) / fenetre)
+
+    def _recharger(self) -> None:
+        maintenant = time.monotonic()
+        self._jetons = min(
+            self.capacite, self._jetons + (maintenant - self._dernier) * self.debit
+        )
+        self._dernier = maintenant
+
+    def acquire(self) -> float:
+        """Bloque jusqu'à obtenir un jeton ; renvoie le temps d'attente en secondes."""
+        attente_totale = 0.0
+        while True:
+            with self._lock:
+                self._recharger()
+                if self._jetons >= 1:
+                    self._jetons -= 1
+                    return attente_totale
+                attente = (1 - self._jetons) / self.debit
+            time.sleep(attente)
+            attente_totale += attente
+
+
+def delai_backoff(tentative: int, response: requests.Response | None = None) -> float:
+    """Délai avant la tentative suivante : Retry-After sinon exponentiel bruité."""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+    return random.uniform(0, min(30.0, 2.0 ** tentative))
+
+
+def hote(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+@dataclass
+class _MesuresHote:
+    requetes: int = 0
+    erreurs: int = 0
+    rejeux: int = 0
+    octets_envoyes: int = 0
+    octets_recus: int = 0
+    octets_reseau: int = 0
+    attente_limite_s: float = 0.0
+    latences: deque = field(default_factory=lambda: deque(maxlen=LATENCES_CONSERVEES))
+    latence_totale_s: float = 0.0
+
+
+class MesuresHTTP:
+    """Compteurs par hôte, depuis la création du client (thread-safe)."""
+
+    def __init__(self):
+        self._par_hote: dict[str, _MesuresHote] = defaultdict(_MesuresHote)
+        self._lock = threading.Lock()
+
+    def enregistrer(
+        self,
+        hote: str,
+        *,
+        latence_s: float,
+        erreur: bool,
+        octets_envoyes: int = 0,
+        octets_recus: int = 0,
+        octets_reseau: int = 0,
+        attente_limite_s: float = 0.0,
+    ) -> None:
+        with self._lock:
+            m = self._par_hote[hote]
+            m.requetes += 1
+            m.erreurs += int(erreur)
+            m.octets_envoyes += octets_envoyes
+            m.octets_recus += octets_recus
+            m.octets_reseau += octets_reseau
+            m.attente_limite_s += attente_limite_s
+            m.latences.append(latence_s)
+            m.latence_totale_s += latence_s
+
+    def rejeu(self, hote: str) -> None:
+        with self._lock:
+            self._par_hote[hote].rejeux += 1
+
+    def resume(self) -> pd.DataFrame:
+        """Une ligne par hôte : volumes, erreurs, latences (ms) et octets."""
+        with self._lock:
+            lignes = [
+                {
+                    "hote": h,
+                    "requetes": m.requetes,
+                    "erreurs": m.erreurs,
+                    "rejeux": m.rejeux,
+                    "latence_moy_ms": round(1000 * m.latence_totale_s / m.requetes) if m.requetes else None,
+                    "latence_p95_ms": round(1000 * pd.Series(list(m.latences)).quantile(0.95)) if m.latences else None,
+                    "ko_envoyes": round(m.octets_envoyes / 1024, 1),
+                    "ko_recus": round(m.octets_recus / 1024, 1),
+                    "ko_reseau": round(m.octets_reseau / 1024, 1),
+                    "attente_limite_s": round(m.attente_limite_s, 1),
+                }
+                for h, m in sorted(self._par_hote.items())
+            ]
+        return pd.DataFrame(lignes, columns=[
+            "hote", "requetes", "erreurs", "rejeux", "latence_moy_ms", "latence_p95_ms",
+            "ko_envoyes", "ko_recus", "ko_reseau", "attente_limite_s",
+        ])
+
+
+class AdaptateurPartage(BaseAdapter):
+    """Adaptateur requests monté sur toutes les sessions du client.
+
+    Délègue l'envoi au transport après la limite de débit de l'hôte, applique
+    le timeout par défaut et enregistre les mesures. Il n'est pas fermé par
+    `Session.close()` : les pools vivent autant que le client.
+    """
+
+    def __init__(self, transport: BaseAdapter, mesures: MesuresHTTP, timeout):
+        super().__init__()
+        self.transport = transport
+        self.mesures = mesures
+        self.timeout = timeout
+        self._limites: dict[str, TokenBucket] = {}
+
+    def limiter(self, hote: str, seau: TokenBucket | None) -> None:
+        if seau is None:
+            self._limites.pop(hote, None)
+        else:
+            self._limites[hote] = seau
+
+    def send(self, request, stream=False, timeout=None, **kwargs):
+        cle = hote(request.url)
+        seau = self._limites.get(cle)
+        attente = seau.acquire() if seau is not None else 0.0
+        corps = request.body or b""
+        debut = time.perf_counter()
+        try:
+            response = self.transport.send(
+                request, stream=stream, timeout=self.timeout if timeout is None else timeout, **kwargs
+            )
+            if not stream:
+                response.content  # lecture complète : la latence inclut le transfert
+        except Exception:
+            self.mesures.enregistrer(
+                cle, latence_s=time.perf_counter() - debut, erreur=True,
+                octets_envoyes=len(corps), attente_limite_s=attente,
+            )
+            raise
+        recus = 0 if stream else len(response.content)
+        brut = getattr(response.raw, "tell", None)
+        try:
+            reseau = brut() if callable(brut) and not stream else recus
+        except Exception:  # noqa: BLE001 - flux déjà libéré
+            reseau = recus
+        self.mesures.enregistrer(
+            cle,
+            latence_s=time.perf_counter() - debut,
+            erreur=response.status_code >= 400,
+            octets_envoyes=len(corps),
+            octets_recus=recus,
+            octets_reseau=reseau,
+            attente_limite_s=attente,
+        )
+        return response
+
+    def close(self):
+        pass
+
+
+class ClientHTTP:
+    """Session keep-alive partagée, avec timeouts, rejeux, limites et mesures."""
+
+    def __init__(
+        self,
+        transport: BaseAdapter | None = None,
+        *,
+        timeout: float | tuple[float, float] = (TIMEOUT_CONNEXION, TIMEOUT_LECTURE),
+        max_tentatives: int = MAX_TENTATIVES,
+        pools_hotes: int = POOLS_HOTES,
+        connexions_par_hote: int = CONNEXIONS_PAR_HOTE,
+    ):
+        self.transport = transport or HTTPAdapter(
+            pool_connections=pools_hotes, pool_maxsize=connexions_par_hote, max_retries=0
+        )
+        self.max_tentatives = max(1, max_tentatives)
+        self.mesures = MesuresHTTP()
+        self.adaptateur = AdaptateurPartage(self.transport, self.mesures, timeout)
+        self.session = self.session_dediee()
+
+    def session_dediee(self, headers: dict[str, str] | None = None) -> requests.Session:
+        """Session aux en-têtes propres (ex. jeton d'API) partageant les pools du client."""
+        session = requests.Session()
+        session.mount("https://", self.adaptateur)
+        session.mount("http://", self.adaptateur)
+        if headers:
+            session.headers.update(headers)
+        return session
+
+    def limiter(self, url_ou_hote: str, requetes_par_minute: int | None, capacite: int = 4) -> None:
+        """Limite le débit vers un hôte (None : retire la limite)."""
+        cle = hote(url_ou_hote) if "://" in url_ou_hote else url_ou_hote.lower()
+        seau = (
+            TokenBucket.pour_limite(requetes_par_minute, capacite=capacite)
+            if requetes_par_minute
+            else None
+        )
+        self.adaptateur.limiter(cle, seau)
+
+    _backoff = staticmethod(delai_backoff)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        rejouer: bool | None = None,
+        max_tentatives: int | None = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """`Session.request` avec rejeux des erreurs transitoires.
+
+        Par défaut seules les méthodes idempotentes sont rejouées. La dernière
+        réponse est renvoyée telle quelle (pas de `raise_for_status`) ; une
+        erreur réseau persistante est relevée.
+        """
+        if rejouer is None:
+            rejouer = method.upper() in METHODES_IDEMPOTENTES
+        tentatives = (max_tentatives or self.max_tentatives) if rejouer else 1
+        tentative = 1
+        while True:
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if tentative >= tentatives:
+                    raise
+            else:
+                if response.status_code not in CODES_A_REJOUER or tentative >= tentatives:
+                    return response
+                response.close()
+            self.mesures.rejeu(hote(url))
+            time.sleep(self._backoff(tentative, response))
+            tentative += 1
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs: Any) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def fermer(self) -> None:
+        self.transport.close()
+
+
+_client: ClientHTTP | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ClientHTTP:
+    """Client partagé du process (créé au premier appel)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ClientHTTP()
+        return _client
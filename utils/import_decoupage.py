@@ -0,0 +1,198 @@
+"""Découpage des longs plans d'actions pour l'extraction par morceaux (page 22).
+
+Au-delà d'un budget de tokens, le texte extrait est découpé sur ses titres
+(axes en priorité, puis sous-axes ; à défaut, entre deux lignes) en morceaux
+traités en parallèle par le modèle, chacun vérifié sur son propre texte.
+Chaque morceau rappelle l'axe en cours à son début, pour que le modèle
+conserve la hiérarchie du document.
+
+Les actions des différents morceaux sont ensuite fusionnées : une action à
+cheval sur la frontière de deux morceaux consécutifs (même axe, même sous-axe,
+même titre, numérotation comprise) n'est gardée qu'une fois, avec les champs
+les plus complets. Deux actions homonymes d'un même morceau, ou de morceaux
+non contigus, restent distinctes.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import math
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Iterable
+
+from utils.recherche_texte import normaliser
+
+# Budget d'entrée par morceau : la sortie JSON croît avec le texte et bute sur
+# la limite de tokens de sortie du modèle au-delà.
+BUDGET_TOKENS_MORCEAU = 30_000
+CARACTERES_PAR_TOKEN = 4
+# Appels simultanés au modèle.
+CONCURRENCE_MAX = 4
+# Champs de hiérarchie : ceux de la première occurrence d'une action sont conservés.
+_CHAMPS_HIERARCHIE = ("axe", "sous-axe", "titre")
+
+_AXE_RE = re.compile(
+    r"^\s*(?:axe|orientation|partie|chapitre|volet|ambition|enjeu)\s*"
+    r"(?:strat[ée]gique\s*)?(?:n\s*[°o]\s*)?(?:\d{1,2}|[IVX]{1,4})\b",
+    re.IGNORECASE,
+)
+_SOUS_AXE_RE = re.compile(r"^\s*\d{1,2}\.\d{1,2}\.?\s+\S")
+_NUMEROTATION_RE = re.compile(r"^\s*(?:axe\s*)?\d+(?:\.\d+)*\.?\s*[:\-–]?\s*", re.IGNORECASE)
+
+
+@dataclass
+class Morceau:
+    texte: str
+    # Titre de l'axe en cours au début du morceau ("" si aucun ou si le morceau commence par un axe).
+    axe_en_cours: str = ""
+
+    def texte_prompt(self, position: int, nb_morceaux: int) -> str:
+        """Texte envoyé au modèle : le morceau, précédé de sa position dans le document."""
+        if nb_morceaux <= 1:
+            return self.texte
+        entete = (
+            f"[Partie {position}/{nb_morceaux} d'un document plus long. "
+            "Extraire uniquement les actions de cette partie, en conservant la numérotation du document source"
+        )
+        if self.axe_en_cours:
+            entete += f". Le texte commence au milieu de : {self.axe_en_cours}"
+        return entete + ".]\n\n" + self.texte
+
+
+def estimer_tokens(texte: str) -> int:
+    return math.ceil(len(texte) / CARACTERES_PAR_TOKEN)
+
+
+def _sections(lignes: list[str]) -> list[tuple[list[str], str, bool]]:
+    """Sections commençant à chaque titre : (lignes, axe en cours avant la section, débute par un axe)."""
+    sections: list[tuple[list[str], str, bool]] = []
+    courante: list[str] = []
+    axe, axe_avant, debut_axe = "", "", False
+    for ligne in lignes:
+        est_axe = bool(_AXE_RE.match(ligne))
+        if (est_axe or _SOUS_AXE_RE.match(ligne)) and courante:
+            sections.append((courante, axe_avant, debut_axe))
+            courante, axe_avant, debut_axe = [], axe, est_axe
+        elif not courante:
+            axe_avant, debut_axe = axe, est_axe
+        if est_axe:
+            axe = ligne.strip()
+        courante.append(ligne)
+    if courante:
+        sections.append((courante, axe_avant, debut_axe))
+    return sections
+
+
+def decouper_document(texte: str, budget_tokens: int = BUDGET_TOKENS_MORCEAU) -> list[Morceau]:
+    """Morceaux de `texte` d'au plus `budget_tokens` (estimés), coupés sur les titres si possible."""
+    if estimer_tokens(texte) <= budget_tokens:
+        return [Morceau(texte)]
+    budget = budget_tokens * CARACTERES_PAR_TOKEN
+
+    # Une section plus grosse que le budget est coupée entre deux lignes.
+    blocs: list[tuple[list[str], str, bool]] = []
+    for lignes, axe_avant, debut_axe in _sections(texte.split("\n")):
+        partie: list[str] = []
+        taille = 0
+        for ligne in lignes:
+            if partie and taille + len(ligne) + 1 > budget:
+                blocs.append((partie, axe_avant, debut_axe))
+                axe_avant = next((l.strip() for l in reversed(partie) if _AXE_RE.match(l)), axe_avant)
+                partie, taille, debut_axe = [], 0, False
+            partie.append(ligne)
+            taille += len(ligne) + 1
+        blocs.append((partie, axe_avant, debut_axe))
+
+    morceaux: list[Morceau] = []
+    courant: list[str] = []
+    taille = 0
+    axe_morceau = ""
+    for lignes, axe_avant, debut_axe in blocs:
+        taille_bloc = sum(len(l) + 1 for l in lignes)
+        if courant and taille + taille_bloc > budget:
+            morceaux.append(Morceau("\n".join(courant).strip(), axe_morceau))
+            courant, taille = [], 0
+        if not courant:
+            axe_morceau = "" if debut_axe else axe_avant
+        courant.extend(lignes)
+        taille += taille_bloc
+    if courant:
+        morceaux.append(Morceau("\n".join(courant).strip(), axe_morceau))
+    return [m for m in morceaux if m.texte]
+
+
+async def rassembler(coroutines: Iterable[Awaitable[Any]], limite: int = CONCURRENCE_MAX) -> list[Any]:
+    """`asyncio.gather` avec au plus `limite` coroutines en cours ; résultats dans l'ordre,
+    exceptions renvoyées à la place du résultat."""
+    semaphore = asyncio.Semaphore(max(1, limite))
+
+    async def borne(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*(borne(c) for c in coroutines), return_exceptions=True)
+
+
+def _cle_libelle(valeur: Any) -> str:
+    if not isinstance(valeur, str):
+        return ""
+    return normaliser(_NUMEROTATION_RE.sub("", valeur.strip()))
+
+
+def _cle_action(action: dict) -> tuple[str, ...]:
+    """Axe, sous-axe et titre normalisés, numérotation comprise."""
+    return tuple(
+        normaliser(v.strip()) if isinstance(v, str) else ""
+        for v in (action.get(c) for c in _CHAMPS_HIERARCHIE)
+    )
+
+
+def _completer(action: dict, autre: dict) -> None:
+    """Complète `action` avec les champs plus riches d'un doublon."""
+    for champ, valeur in autre.items():
+        if champ in _CHAMPS_HIERARCHIE:
+            continue
+        actuelle = action.get(champ)
+        if isinstance(valeur, list):
+            liste = list(actuelle) if isinstance(actuelle, list) else []
+            connus = {_cle_libelle(v) for v in liste}
+            for v in valeur:
+                if _cle_libelle(v) not in connus:
+                    liste.append(v)
+                    connus.add(_cle_libelle(v))
+            action[champ] = liste
+        elif valeur not in (None, "") and len(str(valeur)) > len(str(actuelle or "")):
+            action[champ] = valeur
+
+
+def fusionner_actions(extractions: Iterable[tuple[int, list[dict]]]) -> tuple[list[dict], list[int]]:
+    """Fusionne les actions extraites par morceau, dans l'ordre du document.
+
+    `extractions` : [(numéro du morceau, [action, ...])]. Une action n'est
+    fusionnée qu'avec une action identique du morceau précédent (chevauchement
+    à la frontière). Renvoie les actions et, pour chacune, le numéro du
+    morceau qui l'a produite en premier.
+    """
+    actions: list[dict] = []
+    origines: list[int] = []
+    precedent: int | None = None
+    positions_precedent: dict[tuple[str, ...], int] = {}
+    for numero, liste in extractions:
+        contigu = precedent is not None and numero == precedent + 1
+        positions: dict[tuple[str, ...], int] = {}
+        for action in liste:
+            if not isinstance(action, dict):
+                continue
+            cle = _cle_action(action)
+            if cle[2] and contigu and cle in positions_precedent:
+                position = positions_precedent[cle]
+                _completer(actions[position], action)
+                positions.setdefault(cle, position)
+                continue
+            if cle[2]:
+                positions.setdefault(cle, len(actions))
+            actions.append(dict(action))
+            origines.append(numero)
+        precedent, positions_precedent = numero, positions
+    return actions, origines
@@ -0,0 +1,243 @@
+"""Génération du fichier d'import TET (modèle utils/template_pa.xlsx) depuis un DataFrame.
+
+Le modèle n'est plus ouvert puis réenregistré par openpyxl (lecture de tout
+le classeur, une affectation de cellule par valeur, puis réécriture complète) :
+son archive est lue une fois par process, et seule la feuille d'import est
+régénérée, en flux, colonne par colonne depuis les tableaux du DataFrame.
+Les lignes de données reprennent le style des lignes préformatées du modèle ;
+toutes les autres parties (autres onglets, styles, listes déroulantes,
+fusions) sont recopiées telles quelles.
+
+Benchmark (et contrôle d'équivalence avec le remplissage openpyxl) :
+`python -m utils.import_excel --bench 5000`.
+"""
+
+from __future__ import annotations
+
+import io
+import re
+import sys
+import time
+import zipfile
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+from xml.sax.saxutils import escape
+
+import pandas as pd
+
+TEMPLATE_PATH = Path(__file__).resolve().parent / "template_pa.xlsx"
+FEUILLE_IMPORT = "Fichier dimport"
+# Première ligne de données (les lignes 1 à 4 sont les en-têtes du modèle).
+LIGNE_DEBUT = 5
+
+# Colonnes Excel (lettre -> colonne du DataFrame)
+COLONNES_IMPORT = {
+    "A": "axe",
+    "B": "sous-axe",
+    "D": "titre",
+    "E": "titre de la sous-action",
+    "F": "description",
+    "H": "objectifs",
+    "J": "structure pilote",
+    "M": "direction ou service pilote",
+    "N": "personne pilote",
+    "X": "budget",
+    "Y": "statut",
+    "AA": "date de début",
+    "AB": "date de fin",
+}
+
+_ROW_RE = re.compile(r'<row r="(\d+)"([^>]*?)(?:/>|>(.*?)</row>)', re.S)
+_CELL_RE = re.compile(r'<c r="([A-Z]+)\d+"([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+_STYLE_RE = re.compile(r'\ss="(\d+)"')
+_DIMENSION_RE = re.compile(r'<dimension ref="([A-Z]+)(\d+):([A-Z]+)(\d+)"/>')
+# Caractères de contrôle interdits en XML (openpyxl les refusait).
+_ILLEGAL_XML_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+def _index_colonne(lettres: str) -> int:
+    index = 0
+    for ch in lettres:
+        index = index * 26 + ord(ch) - 64
+    return index
+
+
+@dataclass
+class _Modele:
+    parties: dict[str, bytes]
+    chemin_feuille: str
+    avant: str
+    apres: str
+    # Lignes du modèle : numéro -> (attributs de <row>, {colonne: (xml de la cellule, style)})
+    lignes: dict[int, tuple[str, dict[str, tuple[str, str]]]]
+    derniere_colonne: str
+
+
+@lru_cache(maxsize=4)
+def _charger_modele(path: str) -> _Modele:
+    """Archive du modèle et feuille d'import découpée, une fois par process."""
+    with zipfile.ZipFile(path) as zf:
+        parties = {nom: zf.read(nom) for nom in zf.namelist()}
+
+    workbook = parties["xl/workbook.xml"].decode("utf-8")
+    rels = parties["xl/_rels/workbook.xml.rels"].decode("utf-8")
+    m = re.search(rf'<sheet name="{re.escape(FEUILLE_IMPORT)}"[^>]*r:id="([^"]+)"', workbook)
+    if m is None:
+        raise ValueError(f"Onglet « {FEUILLE_IMPORT} » absent du modèle {path}")
+    cible = re.search(rf'Id="{m.group(1)}"[^>]*Target="([^"]+)"', rels).group(1)
+    chemin_feuille = cible.lstrip("/") if cible.startswith("/") else f"xl/{cible}"
+
+    feuille = parties[chemin_feuille].decode("utf-8")
+    debut = feuille.index("<sheetData>") + len("<sheetData>")
+    fin = feuille.index("</sheetData>")
+    lignes = {}
+    for row in _ROW_RE.finditer(feuille[debut:fin]):
+        cellules = {}
+        for cell in _CELL_RE.finditer(row.group(3) or ""):
+            style = _STYLE_RE.search(cell.group(2))
+            cellules[cell.group(1)] = (cell.group(0), f' s="{style.group(1)}"' if style else "")
+        lignes[int(row.group(1))] = (row.group(2), cellules)
+    dimension = _DIMENSION_RE.search(feuille)
+    return _Modele(
+        parties, chemin_feuille, feuille[:debut], feuille[fin:], lignes,
+        dimension.group(3) if dimension else "A",
+    )
+
+
+def _cellule(ref: str, style: str, valeur: Any) -> str:
+    """XML d'une cellule (chaînes en ligne : sharedStrings.xml du modèle inchangé)."""
+    if valeur is None:
+        return f'<c r="{ref}"{style}/>'
+    if isinstance(valeur, bool):
+        return f'<c r="{ref}"{style} t="b"><v>{int(valeur)}</v></c>'
+    if isinstance(valeur, (int, float)):
+        return f'<c r="{ref}"{style}><v>{valeur!r}</v></c>'
+    texte = _ILLEGAL_XML_RE.sub("", str(valeur))
+    espace = ' xml:space="preserve"' if texte != texte.strip() else ""
+    return f'<c r="{ref}"{style} t="inlineStr"><is><t{espace}>{escape(texte)}</t></is></c>'
+
+
+def _colonnes(df: pd.DataFrame) -> dict[str, list]:
+    """Valeurs par colonne Excel ("" pour les manquantes, comme l'ancien remplissage)."""
+    valeurs = {}
+    for lettre, colonne in COLONNES_IMPORT.items():
+        if colonne in df.columns:
+            serie = df[colonne].astype(object)
+            valeurs[lettre] = serie.where(serie.notna(), "").tolist()
+        else:
+            valeurs[lettre] = [""] * len(df)
+    return valeurs
+
+
+def remplir_fichier_import(df: pd.DataFrame, template: Path | str = TEMPLATE_PATH) -> io.BytesIO:
+    """Remplit le fichier import avec les données du dataframe et retourne un BytesIO"""
+    modele = _charger_modele(str(template))
+    valeurs = _colonnes(df)
+    ordre = sorted(COLONNES_IMPORT, key=_index_colonne)
+    nb = len(df)
+    derniere_ligne = LIGNE_DEBUT + nb - 1
+
+    morceaux = [modele.avant]
+    numeros = sorted(set(modele.lignes) | set(range(LIGNE_DEBUT, derniere_ligne + 1)))
+    for r in numeros:
+        attributs, cellules = modele.lignes.get(r, ("", {}))
+        if not LIGNE_DEBUT <= r <= derniere_ligne:
+            xml = "".join(c for c, _ in cellules.values())
+            morceaux.append(f'<row r="{r}"{attributs}>{xml}</row>' if xml else f'<row r="{r}"{attributs}/>')
+            continue
+        i = r - LIGNE_DEBUT
+        remplies = {
+            lettre: _cellule(f"{lettre}{r}", cellules.get(lettre, ("", ""))[1], valeurs[lettre][i])
+            for lettre in ordre
+        }
+        lettres = sorted(set(cellules) | set(remplies), key=_index_colonne)
+        xml = "".join(remplies[l] if l in remplies else cellules[l][0] for l in lettres)
+        morceaux.append(f'<row r="{r}"{attributs}>{xml}</row>')
+    morceaux.append(modele.apres)
+
+    feuille = "".join(morceaux)
+    if numeros:
+        feuille = _DIMENSION_RE.sub(
+            lambda m: f'<dimension ref="{m.group(1)}{m.group(2)}:{modele.derniere_colonne}{numeros[-1]}"/>',
+            feuille, count=1,
+        )
+
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as zf:
+        for nom, contenu in modele.parties.items():
+            zf.writestr(nom, feuille.encode("utf-8") if nom == modele.chemin_feuille else contenu)
+    output.seek(0)
+    return output
+
+
+def _remplir_openpyxl(df: pd.DataFrame, template: Path | str = TEMPLATE_PATH) -> io.BytesIO:
+    """Remplissage historique (cellule par cellule avec openpyxl), référence du benchmark."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(template)
+    ws = wb[FEUILLE_IMPORT]
+    for i, (_, row) in enumerate(df.iterrows(), start=LIGNE_DEBUT):
+        for col_letter, df_col in COLONNES_IMPORT.items():
+            value = row.get(df_col, "")
+            ws[f"{col_letter}{i}"] = "" if pd.isna(value) else value
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
+
+
+def _valeurs(excel: io.BytesIO) -> dict[str, list[tuple]]:
+    """Contenu de chaque onglet (lecture openpyxl), "" et cellule vide confondus."""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(excel)
+    return {
+        ws.title: [tuple("" if v is None else v for v in row) for row in ws.iter_rows(values_only=True)]
+        for ws in wb.worksheets
+    }
+
+
+def _plan_factice(nb_lignes: int) -> pd.DataFrame:
+    lignes = []
+    for i in range(nb_lignes):
+        axe, sous_axe = i // 500 + 1, i // 50 % 10 + 1
+        lignes.append({
+            "axe": f"Axe {axe} : Orientation {axe}",
+            "sous-axe": f"{axe}.{sous_axe} Sous-axe {sous_axe}",
+            "titre": f"{axe}.{sous_axe}.{i % 50 + 1} Action n°{i} <pilote> & co",
+            "titre de la sous-action": "" if i % 4 else f"Sous-action {i}",
+            "description": "Développer la pratique du covoiturage " * 4,
+            "objectifs": "",
+            "structure pilote": "DDT",
+            "direction ou service pilote": "Service mobilité",
+            "personne pilote": "Jean Dupont",
+            "budget": i * 100 if i % 3 else None,
+            "statut": "En cours",
+            "date de début": "01/01/2025",
+            "date de fin": "",
+        })
+    return pd.DataFrame(lignes)
+
+
+def _main(argv: list[str]) -> int:
+    nb = int(argv[argv.index("--bench") + 1]) if "--bench" in argv else 5000
+    df = _plan_factice(nb)
+    remplir_fichier_import(df.head(1))  # modèle en cache, comme après le premier export
+
+    debut = time.perf_counter()
+    reference = _remplir_openpyxl(df)
+    duree_reference = time.perf_counter() - debut
+    debut = time.perf_counter()
+    nouveau = remplir_fichier_import(df)
+    duree = time.perf_counter() - debut
+
+    identiques = _valeurs(reference) == _valeurs(nouveau)
+    print(f"{nb} lignes : openpyxl {duree_reference:.2f} s, flux {duree:.2f} s (x{duree_reference / duree:.0f})")
+    print(f"Contenu identique : {'oui' if identiques else 'NON'}")
+    return 0 if identiques else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main(sys.argv[1:]))
@@ -0,0 +1,260 @@
+"""Client de livraison des valeurs d'indicateurs vers l'API TET (indicateurs-valeurs).
+
+Partagé par les pages 10 (pré-prod), 11 (prod) et 13 (groupements). L'API est
+limitée à 90 requêtes par minute : plutôt qu'envoyer les batches un par un et
+dormir 60 s tous les 90 batches, le client garde quelques requêtes en vol sur
+une session keep-alive (pools du client HTTP partagé, utils.http_client) et
+les cadence avec un seau à jetons.
+
+Les batches que l'API n'a pas traités (connexion impossible, 408, 425, 429,
+503) sont renvoyés avec un backoff exponentiel bruité, qui respecte
+Retry-After. Les erreurs de contenu (4xx), les 500/502/504 et les délais de
+lecture dépassés (le batch a pu être inséré) ne sont pas rejoués : ils
+restent en échec, à rejouer explicitement depuis le journal.
+"""
+
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+import requests
+
+from utils.http_client import CODES_NON_TRAITES, TokenBucket, delai_backoff, get_client
+from utils.livraison_payload import serialiser
+
+# Limite de l'API TET et paramètres par défaut des envois.
+REQUETES_PAR_MINUTE = 90
+MAX_CONCURRENCE = 4
+MAX_LIGNES_PAR_BATCH = 500
+MAX_OCTETS_PAR_BATCH = 512 * 1024
+MAX_TENTATIVES = 4
+TIMEOUT_SECONDES = 60
+
+
+@dataclass
+class ResultatBatch:
+    """Issue de l'envoi d'un batch (après retries éventuels)."""
+
+    index: int
+    nb_lignes: int
+    status_code: int | None
+    nb_inseres: int = 0
+    tentatives: int = 1
+    latence: float = 0.0
+    erreur: str | None = None
+    batch: list[dict[str, Any]] = field(default_factory=list, repr=False)
+
+    @property
+    def succes(self) -> bool:
+        return self.status_code == 201
+
+
+def taille_batch_adaptee(
+    valeurs: list[dict[str, Any]],
+    max_lignes: int = MAX_LIGNES_PAR_BATCH,
+    max_octets: int = MAX_OCTETS_PAR_BATCH,
+    echantillon: int = 200,
+) -> int:
+    """Nombre de lignes par batch pour rester sous `max_octets` par requête.
+
+    La taille moyenne d'une ligne est estimée sur un échantillon sérialisé,
+    pour ne pas encoder tout le payload juste pour le découper.
+    """
+    if not valeurs:
+        return max_lignes
+    pas = max(1, len(valeurs) // echantillon)
+    extrait = valeurs[::pas][:echantillon]
+    octets_par_ligne = len(serialiser(extrait)) / len(extrait)
+    return max(1, min(max_lignes, int(max_octets // max(octets_par_ligne, 1))))
+
+
+def _message_erreur(response: requests.Response) -> str:
+    """Extrait le message d'erreur d'une réponse API (JSON ou texte brut)."""
+    try:
+        error_json = response.json()
+    except ValueError:
+        return response.text[:500]
+    if isinstance(error_json, dict):
+        return str(
+            error_json.get("message")
+            or error_json.get("error")
+            or error_json.get("detail")
+            or error_json
+        )
+    return str(error_json)
+
+
+class ClientLivraison:
+    """Envoie des valeurs d'indicateurs à l'API par batches concurrents."""
+
+    def __init__(
+        self,
+        api_url: str,
+        api_token: str,
+        *,
+        requetes_par_minute: int = REQUETES_PAR_MINUTE,
+        max_concurrence: int = MAX_CONCURRENCE,
+        max_lignes_par_batch: int = MAX_LIGNES_PAR_BATCH,
+        max_octets_par_batch: int = MAX_OCTETS_PAR_BATCH,
+        max_tentatives: int = MAX_TENTATIVES,
+        timeout: float = TIMEOUT_SECONDES,
+        session: requests.Session | None = None,
+    ):
+        self.api_url = api_url
+        self.max_concurrence = max(1, max_concurrence)
+        self.max_lignes_par_batch = max_lignes_par_batch
+        self.max_octets_par_batch = max_octets_par_batch
+        self.max_tentatives = max(1, max_tentatives)
+        self.timeout = timeout
+        self.limiteur = TokenBucket.pour_limite(
+            requetes_par_minute, capacite=self.max_concurrence
+        )
+        # Session propre (jeton d'API) sur les pools keep-alive du client HTTP partagé.
+        self.session = session or get_client().session_dediee()
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_token}",
+            "Content-Type": "application/json",
+        })
+
+    def decouper(self, valeurs: list[dict[str, Any]]) -> list[list[dict[str, Any]]]:
+        """Découpe les valeurs en batches dont la taille suit le poids des lignes."""
+        taille = taille_batch_adaptee(
+            valeurs, self.max_lignes_par_batch, self.max_octets_par_batch
+        )
+        return [valeurs[i : i + taille] for i in range(0, len(valeurs), taille)]
+
+    _backoff = staticmethod(delai_backoff)
+
+    def envoyer_batch(self, index: int, batch: list[dict[str, Any]]) -> ResultatBatch:
+        """Envoie un batch, avec retries sur les erreurs transitoires."""
+        resultat = ResultatBatch(
+            index=index, nb_lignes=len(batch), status_code=None, batch=batch
+        )
+        corps = serialiser({"valeurs": batch})
+        debut = time.monotonic()
+
+        for tentative in range(1, self.max_tentatives + 1):
+            resultat.tentatives = tentative
+            self.limiteur.acquire()
+            response = None
+            try:
+                response = self.session.post(
+                    self.api_url, data=corps, timeout=self.timeout
+                )
+                resultat.status_code = response.status_code
+                if response.status_code == 201:
+                    try:
+                        resultat.nb_inseres = len(response.json().get("valeurs", []))
+                    except (ValueError, AttributeError):
+                        resultat.nb_inseres = len(batch)
+                    resultat.erreur = None
+                    break
+                resultat.erreur = _message_erreur(response)
+                # 500/502/504 : l'API ou la passerelle a pu insérer le batch, pas de renvoi.
+                if response.status_code not in CODES_NON_TRAITES:
+                    break
+            except requests.ConnectionError as e:
+                # Connexion impossible (ConnectTimeout compris) : rien n'a été reçu par l'API.
+                resultat.status_code = None
+                resultat.erreur = f"{type(e).__name__}: {e}"
+            except requests.RequestException as e:
+                # Délai de lecture dépassé... : l'API a pu insérer le batch, le renvoyer
+                # risquerait de le livrer deux fois. Échec, à rejouer explicitement.
+                resultat.status_code = None
+                resultat.erreur = f"{type(e).__name__}: {e}"
+                break
+
+            if tentative < self.max_tentatives:
+                time.sleep(self._backoff(tentative, response))
+
+        resultat.latence = time.monotonic() - debut
+        return resultat
+
+    def livrer(
+        self,
+        valeurs: list[dict[str, Any]],
+        on_batch: Callable[[ResultatBatch, int, int], None] | None = None,
+    ) -> dict[str, Any]:
+        """Découpe puis envoie toutes les valeurs ; voir `livrer_batches`."""
+        batches = list(enumerate(self.decouper(valeurs), 1))
+        return self.livrer_batches(batches, on_batch)
+
+    def livrer_batches(
+        self,
+        batches: list[tuple[int, list[dict[str, Any]]]],
+        on_batch: Callable[[ResultatBatch, int, int], None] | None = None,
+    ) -> dict[str, Any]:
+        """Envoie des batches déjà découpés `(index, valeurs)` et renvoie les statistiques.
+
+        `on_batch(resultat, nb_termines, nb_batches)` est appelé depuis le
+        thread appelant à chaque batch terminé (les éléments Streamlit ne
+        peuvent pas être mis à jour depuis les threads du pool).
+        """
+        resultats: list[ResultatBatch] = []
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrence) as pool:
+            futures = [
+                pool.submit(self.envoyer_batch, index, batch)
+                for index, batch in batches
+            ]
+            for nb_termines, future in enumerate(as_completed(futures), 1):
+                resultat = future.result()
+                resultats.append(resultat)
+                if not resultat.succes:
+                    print(
+                        f"❌ ERREUR - Batch {resultat.index}/{len(batches)} échoué "
+                        f"(HTTP {resultat.status_code}, {resultat.tentatives} tentative(s)) : "
+                        f"{resultat.erreur}"
+                    )
+                if on_batch is not None:
+                    on_batch(resultat, nb_termines, len(batches))
+
+        resultats.sort(key=lambda r: r.index)
+        failed = [r for r in resultats if not r.succes]
+        return {
+            'nb_total': sum(len(batch) for _, batch in batches),
+            'nb_inserted': sum(r.nb_inseres for r in resultats),
+            'nb_batches': len(batches),
+            'failed_batches': len(failed),
+            'success': not failed,
+            'resultats': resultats,
+        }
+
+
+def livrer_avec_progression(
+    client: ClientLivraison,
+    batches: list[tuple[int, list[dict[str, Any]]]],
+    progress_container=None,
+    on_resultat: Callable[[ResultatBatch], None] | None = None,
+) -> dict[str, Any]:
+    """`client.livrer_batches` avec barre de progression dans un container Streamlit.
+
+    `on_resultat(resultat)` est appelé pour chaque batch terminé (journal).
+    """
+    progress_bar = progress_container.progress(0) if progress_container else None
+    status_text = progress_container.empty() if progress_container else None
+
+    def _on_batch(resultat: ResultatBatch, nb_termines: int, nb_batches: int) -> None:
+        if on_resultat is not None:
+            on_resultat(resultat)
+        if progress_container is None:
+            return
+        if resultat.succes:
+            status_text.success(
+                f"✅ Batch {resultat.index}/{nb_batches} OK ({resultat.nb_inseres} lignes)"
+            )
+        else:
+            status_text.error(
+                f"❌ Batch {resultat.index}/{nb_batches} échoué "
+                f"(HTTP {resultat.status_code}) - voir console pour détails"
+            )
+        progress_bar.progress(nb_termines / nb_batches)
+
+    stats = client.livrer_batches(batches, on_batch=_on_batch)
+    if progress_container:
+        status_text.empty()
+        progress_bar.empty()
+    return stats
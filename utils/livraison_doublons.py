@@ -0,0 +1,90 @@
+"""Détection vectorisée des doublons de clé primaire dans les données staging.
+
+Utilisé par les pages 10 et 11 avant toute comparaison : les lignes
+identiques sont simplement supprimées, les lignes qui partagent une clé
+primaire avec des valeurs différentes sont des conflits qui bloquent la
+livraison. Tout passe par `duplicated` et un `groupby().nunique()`, sans
+boucle Python sur les groupes.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import pandas as pd
+
+# Nombre maximum de lignes en conflit stylées dans l'aperçu Streamlit.
+MAX_LIGNES_APERCU = 500
+
+
+@dataclass
+class RapportDoublons:
+    """Résultat de la détection.
+
+    - df : données sans les doublons complets
+    - nb_doublons_complets : lignes strictement identiques supprimées
+    - conflits : une ligne par clé en conflit (clé, nb_lignes, colonnes_en_conflit)
+    - lignes_en_conflit : masque booléen des lignes de `df` concernées
+    """
+
+    df: pd.DataFrame
+    nb_doublons_complets: int
+    conflits: pd.DataFrame
+    lignes_en_conflit: pd.Series
+
+    @property
+    def has_conflicts(self) -> bool:
+        return not self.conflits.empty
+
+    @property
+    def nb_lignes_en_conflit(self) -> int:
+        return int(self.lignes_en_conflit.sum())
+
+
+def detecter_doublons(df: pd.DataFrame, pk_cols: list[str]) -> RapportDoublons:
+    """Supprime les doublons complets et repère les conflits sur `pk_cols`.
+
+    Deux lignes de même clé sont en conflit si au moins une autre colonne a
+    plus d'une valeur distincte (NaN ignorés, comme `nunique`).
+    """
+    duplicates_full = df.duplicated(keep="first")
+    nb_doublons_complets = int(duplicates_full.sum())
+    if nb_doublons_complets:
+        df = df[~duplicates_full].copy()
+
+    autres_cols = [col for col in df.columns if col not in pk_cols]
+    vide = pd.DataFrame(columns=pk_cols + ["nb_lignes", "colonnes_en_conflit"])
+    duplicates_pk = df.duplicated(subset=pk_cols, keep=False)
+    if not duplicates_pk.any() or not autres_cols:
+        return RapportDoublons(df, nb_doublons_complets, vide, pd.Series(False, index=df.index))
+
+    df_dup = df[duplicates_pk]
+    grouped = df_dup.groupby(pk_cols)
+    nunique = grouped[autres_cols].nunique()
+    en_conflit = nunique > 1
+    cles_conflit = en_conflit.any(axis=1)
+    if not cles_conflit.any():
+        return RapportDoublons(df, nb_doublons_complets, vide, pd.Series(False, index=df.index))
+
+    en_conflit = en_conflit[cles_conflit]
+    conflits = pd.DataFrame({
+        "nb_lignes": grouped.size()[cles_conflit],
+        "colonnes_en_conflit": en_conflit.dot(pd.Index(autres_cols) + ", ").str.rstrip(", "),
+    }).reset_index()
+
+    # Lignes de df dont la clé figure dans le rapport de conflits
+    cles = pd.MultiIndex.from_frame(conflits[pk_cols])
+    lignes_en_conflit = pd.Series(False, index=df.index)
+    lignes_en_conflit[df_dup.index] = pd.MultiIndex.from_frame(df_dup[pk_cols]).isin(cles)
+
+    return RapportDoublons(df, nb_doublons_complets, conflits, lignes_en_conflit)
+
+
+def apercu_conflits(
+    rapport: RapportDoublons,
+    pk_cols: list[str],
+    max_lignes: int = MAX_LIGNES_APERCU,
+):
+    """Styler des premières lignes en conflit, triées par clé (aperçu borné)."""
+    df_conflits = rapport.df[rapport.lignes_en_conflit].sort_values(pk_cols).head(max_lignes)
+    return df_conflits.style.set_properties(**{"background-color": "#ffcccc"})
@@ -0,0 +1,353 @@
+"""Journal des livraisons indicateurs-valeurs et rejeu des batches en échec.
+
+Chaque livraison (pages 10, 11, 13) ouvre un run dans une base SQLite locale
+en y inscrivant tous ses batches `en_attente` (index, plage de clés, payload)
+avant le premier envoi. Chaque batch terminé met à jour sa ligne : statut,
+code HTTP, latence ; le payload n'est gardé que pour les batches en échec.
+Si le process s'arrête en cours de livraison (crash, page rafraîchie), les
+batches jamais envoyés restent `en_attente` et sont rejoués avec les échecs,
+sans refaire la comparaison staging / cible.
+
+Les runs sont en ajout seul : un rejeu crée un nouveau run rattaché au run
+d'origine (`parent_run_id`) et l'état d'un batch est celui de sa dernière
+tentative, tous runs confondus.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+
+try:
+    import streamlit as st
+except Exception:  # pragma: no cover - permet l'import hors contexte Streamlit
+    st = None  # type: ignore
+
+from utils.livraison_api import ClientLivraison, ResultatBatch, livrer_avec_progression
+from utils.livraison_payload import serialiser
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache"
+JOURNAL_PATH = CACHE_DIR / "journal_livraisons.sqlite"
+
+EN_ATTENTE = "en_attente"
+SUCCES = "succes"
+ECHEC = "echec"
+
+# Colonnes du payload qui identifient une valeur (clé primaire côté API).
+CLE_PAYLOAD = ("indicateurId", "collectiviteId", "dateValeur")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS livraison_run (
+    run_id TEXT PRIMARY KEY,
+    parent_run_id TEXT,
+    cible TEXT NOT NULL,
+    api_url TEXT NOT NULL,
+    nb_lignes INTEGER NOT NULL,
+    nb_batches INTEGER NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS livraison_batch (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL REFERENCES livraison_run(run_id),
+    batch_index INTEGER NOT NULL,
+    cle_min TEXT,
+    cle_max TEXT,
+    nb_lignes INTEGER NOT NULL,
+    statut TEXT NOT NULL,
+    http_code INTEGER,
+    latence_ms INTEGER,
+    tentatives INTEGER,
+    erreur TEXT,
+    payload TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_livraison_batch_run ON livraison_batch(run_id, batch_index);
+CREATE INDEX IF NOT EXISTS idx_livraison_run_parent ON livraison_run(parent_run_id);
+"""
+
+
+def _plage_cles(batch: list[dict[str, Any]]) -> tuple[str | None, str | None]:
+    """Plus petite et plus grande clé (indicateur/collectivité/date) du batch."""
+    if not batch:
+        return None, None
+    cles = [tuple(str(v.get(c)) for c in CLE_PAYLOAD) for v in batch]
+    return "/".join(min(cles)), "/".join(max(cles))
+
+
+class JournalLivraison:
+    """Journal SQLite append-only des runs de livraison et de leurs batches."""
+
+    def __init__(self, path: Path | str = JOURNAL_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def demarrer_run(
+        self,
+        cible: str,
+        api_url: str,
+        nb_lignes: int,
+        nb_batches: int,
+        parent_run_id: str | None = None,
+        batches: list[tuple[int, list[dict[str, Any]]]] | None = None,
+    ) -> str:
+        """Enregistre un nouveau run et ses `batches` en attente ; renvoie son identifiant."""
+        run_id = datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO livraison_run VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (run_id, parent_run_id, cible, api_url, nb_lignes, nb_batches, now),
+            )
+            conn.executemany(
+                """
+                INSERT INTO livraison_batch (
+                    run_id, batch_index, cle_min, cle_max, nb_lignes, statut, payload, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (run_id, index, *_plage_cles(batch), len(batch), EN_ATTENTE,
+                     serialiser(batch).decode("utf-8"), now)
+                    for index, batch in batches or []
+                ],
+            )
+        return run_id
+
+    def enregistrer_batch(self, run_id: str, resultat: ResultatBatch) -> None:
+        """Met à jour (ou ajoute) la ligne du batch ; le payload n'est gardé qu'en cas d'échec."""
+        statut = SUCCES if resultat.succes else ECHEC
+        payload = None if resultat.succes else serialiser(resultat.batch).decode("utf-8")
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._connect() as conn:
+            maj = conn.execute(
+                """
+                UPDATE livraison_batch
+                SET statut = ?, http_code = ?, latence_ms = ?, tentatives = ?,
+                    erreur = ?, payload = ?, created_at = ?
+                WHERE run_id = ? AND batch_index = ? AND statut = ?
+                """,
+                (
+                    statut, resultat.status_code, int(resultat.latence * 1000),
+                    resultat.tentatives, resultat.erreur, payload, now,
+                    run_id, resultat.index, EN_ATTENTE,
+                ),
+            )
+            if maj.rowcount:
+                return
+            cle_min, cle_max = _plage_cles(resultat.batch)
+            conn.execute(
+                """
+                INSERT INTO livraison_batch (
+                    run_id, batch_index, cle_min, cle_max, nb_lignes, statut,
+                    http_code, latence_ms, tentatives, erreur, payload, created_at
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    run_id,
+                    resultat.index,
+                    cle_min,
+                    cle_max,
+                    resultat.nb_lignes,
+                    statut,
+                    resultat.status_code,
+                    int(resultat.latence * 1000),
+                    resultat.tentatives,
+                    resultat.erreur,
+                    payload,
+                    now,
+                ),
+            )
+
+    def _run_racine(self, run_id: str) -> str:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT parent_run_id FROM livraison_run WHERE run_id = ?", (run_id,)
+            ).fetchone()
+        return row["parent_run_id"] if row and row["parent_run_id"] else run_id
+
+    def run_racine(self, run_id: str) -> dict[str, Any]:
+        """Run d'origine d'un run (lui-même s'il ne s'agit pas d'un rejeu)."""
+        racine = self._run_racine(run_id)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM livraison_run WHERE run_id = ?", (racine,)
+            ).fetchone()
+        return dict(row)
+
+    def batches_en_echec(self, run_id: str) -> list[tuple[int, list[dict[str, Any]]]]:
+        """Batches `(index, valeurs)` dont la dernière tentative est un échec ou jamais envoyés."""
+        racine = self._run_racine(run_id)
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT b.batch_index, b.statut, b.payload
+                FROM livraison_batch b
+                JOIN livraison_run r ON r.run_id = b.run_id
+                WHERE r.run_id = :racine OR r.parent_run_id = :racine
+                ORDER BY b.id
+                """,
+                {"racine": racine},
+            ).fetchall()
+        dernier: dict[int, sqlite3.Row] = {}
+        for row in rows:
+            dernier[row["batch_index"]] = row
+        return [
+            (index, json.loads(row["payload"]))
+            for index, row in sorted(dernier.items())
+            if row["statut"] in (ECHEC, EN_ATTENTE) and row["payload"]
+        ]
+
+    def runs(self, cible: str | None = None, limit: int = 20) -> pd.DataFrame:
+        """Runs récents (hors rejeux) avec leur nombre de batches en échec ou non envoyés.
+
+        Même règle que `batches_en_echec` (dernière tentative par batch, tous
+        rejeux confondus), comptée en SQL sans lire les payloads.
+        """
+        where = "WHERE parent_run_id IS NULL" + (" AND cible = :cible" if cible else "")
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                f"""
+                WITH recents AS (
+                    SELECT run_id, cible, api_url, nb_lignes, nb_batches, created_at
+                    FROM livraison_run
+                    {where}
+                    ORDER BY created_at DESC
+                    LIMIT :limit
+                ),
+                dernieres AS (
+                    SELECT COALESCE(r.parent_run_id, r.run_id) AS racine, MAX(b.id) AS id
+                    FROM livraison_batch b
+                    JOIN livraison_run r ON r.run_id = b.run_id
+                    WHERE r.run_id IN (SELECT run_id FROM recents)
+                       OR r.parent_run_id IN (SELECT run_id FROM recents)
+                    GROUP BY racine, b.batch_index
+                )
+                SELECT rec.run_id, rec.cible, rec.api_url, rec.nb_lignes, rec.nb_batches,
+                       rec.created_at, COUNT(b.id) AS batches_en_echec
+                FROM recents rec
+                LEFT JOIN dernieres d ON d.racine = rec.run_id
+                LEFT JOIN livraison_batch b
+                    ON b.id = d.id
+                    AND b.statut IN (:echec, :en_attente)
+                    AND b.payload IS NOT NULL
+                GROUP BY rec.run_id
+                ORDER BY rec.created_at DESC
+                """,
+                conn,
+                params={"cible": cible, "limit": limit, "echec": ECHEC, "en_attente": EN_ATTENTE},
+            )
+
+    def batches(self, run_id: str) -> pd.DataFrame:
+        """Toutes les lignes du journal d'un run et de ses rejeux (sans payload)."""
+        racine = self._run_racine(run_id)
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                """
+                SELECT b.run_id, b.batch_index, b.cle_min, b.cle_max, b.nb_lignes,
+                       b.statut, b.http_code, b.latence_ms, b.tentatives, b.erreur,
+                       b.created_at
+                FROM livraison_batch b
+                JOIN livraison_run r ON r.run_id = b.run_id
+                WHERE r.run_id = :racine OR r.parent_run_id = :racine
+                ORDER BY b.id
+                """,
+                conn,
+                params={"racine": racine},
+            )
+
+
+def livrer_et_journaliser(
+    client: ClientLivraison,
+    valeurs: list[dict[str, Any]],
+    cible: str,
+    progress_container=None,
+    journal: JournalLivraison | None = None,
+) -> dict[str, Any]:
+    """Livre les valeurs en journalisant chaque batch ; ajoute `run_id` aux stats."""
+    journal = journal or JournalLivraison()
+    batches = list(enumerate(client.decouper(valeurs), 1))
+    run_id = journal.demarrer_run(
+        cible, client.api_url, len(valeurs), len(batches), batches=batches
+    )
+    stats = livrer_avec_progression(
+        client, batches, progress_container,
+        on_resultat=lambda resultat: journal.enregistrer_batch(run_id, resultat),
+    )
+    stats['run_id'] = run_id
+    return stats
+
+
+def rejouer_echecs(
+    client: ClientLivraison,
+    run_id: str,
+    progress_container=None,
+    journal: JournalLivraison | None = None,
+) -> dict[str, Any]:
+    """Renvoie uniquement les batches en échec ou non envoyés d'un run (et de ses rejeux)."""
+    journal = journal or JournalLivraison()
+    batches = journal.batches_en_echec(run_id)
+    if not batches:
+        return {'nb_total': 0, 'nb_inserted': 0, 'nb_batches': 0,
+                'failed_batches': 0, 'success': True, 'run_id': None}
+    racine = journal.run_racine(run_id)
+    rejeu_id = journal.demarrer_run(
+        racine["cible"], client.api_url, sum(len(b) for _, b in batches), len(batches),
+        parent_run_id=racine["run_id"], batches=batches,
+    )
+    stats = livrer_avec_progression(
+        client, batches, progress_container,
+        on_resultat=lambda resultat: journal.enregistrer_batch(rejeu_id, resultat),
+    )
+    stats['run_id'] = rejeu_id
+    return stats
+
+
+def render_rejeu_livraisons(cible: str, api_token: str, key: str = "rejeu") -> None:
+    """Section Streamlit : runs récents de la cible et rejeu des batches en échec."""
+    journal = JournalLivraison()
+    df_runs = journal.runs(cible)
+
+    with st.expander("🧾 Journal des livraisons et rejeu des batches en échec"):
+        if df_runs.empty:
+            st.info("ℹ️ Aucune livraison journalisée pour cet environnement")
+            return
+
+        st.dataframe(df_runs.drop(columns=["api_url"]), use_container_width=True, hide_index=True)
+
+        run_id = st.selectbox(
+            "Run à inspecter",
+            options=df_runs["run_id"].tolist(),
+            key=f"{key}_run",
+        )
+        st.dataframe(journal.batches(run_id), use_container_width=True, hide_index=True)
+
+        nb_echecs = int(df_runs.loc[df_runs["run_id"] == run_id, "batches_en_echec"].iloc[0])
+        if st.button(
+            f"🔁 Rejouer les {nb_echecs} batch(s) en échec ou non envoyé(s)",
+            disabled=nb_echecs == 0,
+            key=f"{key}_bouton",
+        ):
+            api_url = df_runs.loc[df_runs["run_id"] == run_id, "api_url"].iloc[0]
+            progress_container = st.container()
+            stats = rejouer_echecs(
+                ClientLivraison(api_url, api_token), run_id, progress_container, journal
+            )
+            if stats['success']:
+                st.success(f"✅ Rejeu réussi : {stats['nb_inserted']:,} lignes insérées")
+            else:
+                st.error(
+                    f"❌ {stats['failed_batches']} batch(s) toujours en échec "
+                    f"sur {stats['nb_batches']} rejoué(s)"
+                )
@@ -0,0 +1,111 @@
+"""Construction et sérialisation des payloads indicateurs-valeurs.
+
+Les pages 10, 11 et 13 transforment un DataFrame de valeurs en liste de dicts
+au format de l'API (`collectiviteId`, `indicateurId`, `dateValeur`,
+`metadonneeId`, `resultat`). Les colonnes sont converties une seule fois
+(entiers, dates ISO, flottants nullables) au lieu d'un `apply` ligne à ligne,
+et les batches sont sérialisés directement en bytes avec orjson s'il est
+installé (json de la bibliothèque standard sinon).
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson est optionnel
+    orjson = None  # type: ignore
+
+# Colonne DataFrame -> clé du payload API, dans l'ordre attendu par l'API.
+COLONNES_PAYLOAD = {
+    "collectivite_id": "collectiviteId",
+    "indicateur_id": "indicateurId",
+    "date_valeur": "dateValeur",
+    "metadonnee_id": "metadonneeId",
+    "resultat": "resultat",
+}
+
+# Variable d'environnement activant le log échantillonné des payloads.
+ENV_DEBUG_PAYLOAD = "LIVRAISON_DEBUG_PAYLOAD"
+
+
+def serialiser(obj: Any) -> bytes:
+    """Sérialise en JSON compact (bytes UTF-8)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _dates_iso(dates: pd.Series) -> list[str]:
+    """Dates au format `Timestamp.isoformat()`, vectorisé dans le cas courant.
+
+    Les dates naïves sans fraction de seconde (le cas des valeurs annuelles)
+    passent par `strftime` ; les autres gardent `isoformat` pour un résultat
+    identique à l'ancien encodage ligne à ligne. Les dates manquantes sont
+    refusées, comme avec l'ancien encodage.
+    """
+    dates = pd.to_datetime(dates)
+    if dates.isna().any():
+        raise ValueError("date_valeur manquante dans les valeurs à livrer")
+    # Peu de dates distinctes (une par année) : on formate les valeurs uniques.
+    codes, uniques = pd.factorize(dates)
+    if uniques.tz is None and not (uniques.microsecond != 0).any():
+        formatees = np.asarray(uniques.strftime("%Y-%m-%dT%H:%M:%S"), dtype=object)
+    else:
+        formatees = np.asarray([d.isoformat() for d in uniques], dtype=object)
+    return formatees[codes].tolist()
+
+
+def _floats_nullables(values: pd.Series) -> list[float | None]:
+    """Flottants Python, NaN remplacés par None (null JSON)."""
+    arr = pd.to_numeric(values, errors="coerce").astype("float64").to_numpy()
+    return np.where(np.isnan(arr), None, arr).tolist()
+
+
+def construire_valeurs(df: pd.DataFrame) -> list[dict[str, Any]]:
+    """Liste de valeurs au format API à partir d'un DataFrame.
+
+    `metadonnee_id` n'est inclus que si la colonne est présente (page 13).
+    """
+    if df.empty:
+        return []
+
+    colonnes: dict[str, list[Any]] = {}
+    for col, cle in COLONNES_PAYLOAD.items():
+        if col not in df.columns:
+            if col == "metadonnee_id":
+                continue
+            raise KeyError(f"Colonne requise absente du DataFrame : {col}")
+        if col == "date_valeur":
+            colonnes[cle] = _dates_iso(df[col])
+        elif col == "resultat":
+            colonnes[cle] = _floats_nullables(df[col])
+        else:
+            colonnes[cle] = df[col].astype("int64").tolist()
+
+    cles = list(colonnes)
+    return [dict(zip(cles, ligne)) for ligne in zip(*colonnes.values())]
+
+
+def log_echantillon(valeurs: list[dict[str, Any]], n: int = 5, force: bool = False) -> None:
+    """Affiche en console quelques valeurs du payload, sur demande uniquement.
+
+    Remplace l'ancien `print` du payload complet : actif si `force` ou si la
+    variable d'environnement LIVRAISON_DEBUG_PAYLOAD est définie.
+    """
+    if not (force or os.getenv(ENV_DEBUG_PAYLOAD)):
+        return
+    if len(valeurs) <= n:
+        echantillon = valeurs
+    else:
+        pas = len(valeurs) // n
+        echantillon = valeurs[::pas][:n]
+    print(f"📦 Payload : {len(valeurs):,} valeurs, échantillon :")
+    for valeur in echantillon:
+        print(f"  {valeur}")
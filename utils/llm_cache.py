@@ -0,0 +1,401 @@
+"""Cache persistant des réponses LLM, partagé par les pages IA (06, 07, 18, 22, 26, 28).
+
+Une réponse est identifiée par l'empreinte SHA-256 de (fournisseur, modèle,
+prompt, paramètres) : deux appels identiques, même depuis deux pages ou deux
+sessions, ne paient qu'une fois la latence et les tokens. Les entrées vivent
+dans une base SQLite locale (.cache/), expirent après un TTL et les moins
+récemment lues sont évincées au-delà d'une taille maximale.
+
+Trois modes, choisis par la variable d'environnement LLM_CACHE_MODE :
+- `lecture_ecriture` (défaut) : sert le cache, appelle le modèle sinon ;
+- `replay` : ne sert que le cache, un appel absent lève `CacheMiss` (bench
+  et tests sans réseau) ;
+- `desactive` : appelle toujours le modèle, sans lire ni écrire.
+
+Seules des valeurs sérialisables en JSON sont stockées ; les objets
+`Response` d'OpenAI passent par `response_vers_cache` / `response_depuis_cache`.
+
+Chaque appel (hit compris) est mesuré par utils.llm_telemetrie.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterator
+
+from utils.llm_telemetrie import ISSUE_CACHE, mesurer, signaler_premier_token, signaler_usage
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache"
+CACHE_PATH = CACHE_DIR / "llm_cache.sqlite"
+
+MODE_LECTURE_ECRITURE = "lecture_ecriture"
+MODE_REPLAY = "replay"
+MODE_DESACTIVE = "desactive"
+MODES = (MODE_LECTURE_ECRITURE, MODE_REPLAY, MODE_DESACTIVE)
+
+# Valeurs par défaut, surchargées par LLM_CACHE_MODE / LLM_CACHE_TTL_HEURES / LLM_CACHE_MAX_MO.
+TTL_HEURES = 24 * 7
+MAX_MO = 200
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    cle TEXT PRIMARY KEY,
+    provider TEXT NOT NULL,
+    modele TEXT,
+    feature TEXT,
+    valeur BLOB NOT NULL,
+    taille INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_created ON llm_cache(created_at);
+"""
+
+
+class CacheMiss(RuntimeError):
+    """Appel absent du cache en mode replay."""
+
+
+def cle_requete(provider: str, modele: str | None, prompt: Any, params: dict[str, Any] | None = None) -> str:
+    """Empreinte SHA-256 canonique d'un appel (clés JSON triées)."""
+    canonique = json.dumps(
+        {"provider": provider, "modele": modele, "prompt": prompt, "params": params or {}},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonique.encode("utf-8")).hexdigest()
+
+
+class CacheLLM:
+    """Cache SQLite des réponses LLM avec TTL, éviction LRU et compteurs par feature."""
+
+    def __init__(
+        self,
+        path: Path | str = CACHE_PATH,
+        *,
+        mode: str = MODE_LECTURE_ECRITURE,
+        ttl_heures: float = TTL_HEURES,
+        max_octets: int = MAX_MO * 1024 * 1024,
+    ):
+        if mode not in MODES:
+            raise ValueError(f"Mode de cache inconnu : {mode} (attendu : {', '.join(MODES)})")
+        self.path = Path(path)
+        self.mode = mode
+        self.ttl_secondes = ttl_heures * 3600
+        self.max_octets = max_octets
+        self._lock = threading.Lock()
+        self._compteurs: dict[str, dict[str, int]] = defaultdict(
+            lambda: {"hits": 0, "misses": 0, "ecritures": 0, "evictions": 0}
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @classmethod
+    def depuis_env(cls, path: Path | str = CACHE_PATH) -> "CacheLLM":
+        """Cache configuré par LLM_CACHE_MODE, LLM_CACHE_TTL_HEURES et LLM_CACHE_MAX_MO."""
+        return cls(
+            path,
+            mode=os.getenv("LLM_CACHE_MODE", MODE_LECTURE_ECRITURE),
+            ttl_heures=float(os.getenv("LLM_CACHE_TTL_HEURES", TTL_HEURES)),
+            max_octets=int(float(os.getenv("LLM_CACHE_MAX_MO", MAX_MO)) * 1024 * 1024),
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _compter(self, feature: str, evenement: str, n: int = 1) -> None:
+        with self._lock:
+            self._compteurs[feature or "?"][evenement] += n
+
+    def lire(self, cle: str, feature: str = "") -> Any | None:
+        """Valeur en cache (None si absente ou expirée) ; lève `CacheMiss` en replay."""
+        if self.mode == MODE_DESACTIVE:
+            return None
+        maintenant = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT valeur, created_at FROM llm_cache WHERE cle = ?", (cle,)
+            ).fetchone()
+            if row is not None and self.mode != MODE_REPLAY and maintenant - row[1] > self.ttl_secondes:
+                conn.execute("DELETE FROM llm_cache WHERE cle = ?", (cle,))
+                row = None
+            if row is not None:
+                conn.execute(
+                    "UPDATE llm_cache SET last_access = ?, hits = hits + 1 WHERE cle = ?",
+                    (maintenant, cle),
+                )
+        if row is None:
+            self._compter(feature, "misses")
+            if self.mode == MODE_REPLAY:
+                raise CacheMiss(f"Appel absent du cache LLM ({feature or cle[:12]})")
+            return None
+        self._compter(feature, "hits")
+        return json.loads(zlib.decompress(row[0]))
+
+    def ecrire(self, cle: str, provider: str, modele: str | None, feature: str, valeur: Any) -> None:
+        """Stocke une valeur JSON puis applique TTL et taille maximale."""
+        if self.mode != MODE_LECTURE_ECRITURE:
+            return
+        blob = zlib.compress(json.dumps(valeur, ensure_ascii=False, default=str).encode("utf-8"))
+        maintenant = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)",
+                (cle, provider, modele, feature, blob, len(blob), maintenant, maintenant),
+            )
+            evictions = self._evincer(conn, maintenant)
+        self._compter(feature, "ecritures")
+        if evictions:
+            self._compter(feature, "evictions", evictions)
+
+    def _evincer(self, conn: sqlite3.Connection, maintenant: float) -> int:
+        """Supprime les entrées expirées puis les moins récemment lues au-delà de la taille max."""
+        nb = conn.execute(
+            "DELETE FROM llm_cache WHERE created_at < ?", (maintenant - self.ttl_secondes,)
+        ).rowcount
+        total = conn.execute("SELECT COALESCE(SUM(taille), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_octets:
+            return nb
+        # On redescend à 90 % de la limite pour ne pas évincer à chaque écriture.
+        a_liberer = total - int(self.max_octets * 0.9)
+        cles = []
+        for cle, taille in conn.execute("SELECT cle, taille FROM llm_cache ORDER BY last_access"):
+            cles.append((cle,))
+            a_liberer -= taille
+            if a_liberer <= 0:
+                break
+        conn.executemany("DELETE FROM llm_cache WHERE cle = ?", cles)
+        return nb + len(cles)
+
+    def invalider(self, cle: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache WHERE cle = ?", (cle,))
+
+    def vider(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def compteurs(self) -> dict[str, dict[str, int]]:
+        """Hits / misses / écritures / évictions par feature depuis le démarrage du process."""
+        with self._lock:
+            return {feature: dict(c) for feature, c in self._compteurs.items()}
+
+    def stats(self) -> list[dict[str, Any]]:
+        """Contenu du cache par feature : entrées, taille et hits cumulés."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT feature, provider, COUNT(*), SUM(taille), SUM(hits), MAX(last_access)
+                FROM llm_cache GROUP BY feature, provider ORDER BY SUM(taille) DESC
+                """
+            ).fetchall()
+        return [
+            {
+                "feature": r[0], "provider": r[1], "entrees": r[2], "octets": r[3],
+                "hits": r[4], "dernier_acces": time.strftime("%Y-%m-%d %H:%M", time.localtime(r[5])),
+            }
+            for r in rows
+        ]
+
+
+_cache: CacheLLM | None = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> CacheLLM:
+    """Cache partagé par toutes les pages et sessions du process."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CacheLLM.depuis_env()
+        return _cache
+
+
+def appel_cache(
+    provider: str,
+    modele: str | None,
+    prompt: Any,
+    params: dict[str, Any] | None,
+    appel: Callable[[], Any],
+    *,
+    feature: str,
+    etape: str = "",
+    tentative: int = 1,
+    rafraichir: bool = False,
+    cache: CacheLLM | None = None,
+) -> Any:
+    """Renvoie la réponse en cache, sinon `appel()` (valeur JSON) mise en cache.
+
+    `rafraichir` ignore l'entrée existante et la remplace : à utiliser pour
+    les nouvelles tentatives après une réponse invalide, qui sinon serait
+    resservie à l'identique. Une exception de `appel` n'est pas mise en cache.
+    `appel` renseigne ses tokens avec `llm_telemetrie.signaler_usage`.
+    """
+    cache = cache or get_cache()
+    cle = cle_requete(provider, modele, prompt, params)
+    with mesurer(provider, modele, feature=feature, etape=etape, tentative=tentative) as mesure:
+        if not rafraichir or cache.mode == MODE_REPLAY:
+            valeur = cache.lire(cle, feature)
+            if valeur is not None:
+                mesure.issue = ISSUE_CACHE
+                return valeur
+        valeur = appel()
+        cache.ecrire(cle, provider, modele, feature, valeur)
+        return valeur
+
+
+async def appel_cache_async(
+    provider: str,
+    modele: str | None,
+    prompt: Any,
+    params: dict[str, Any] | None,
+    appel: Callable[[], Awaitable[Any]],
+    *,
+    feature: str,
+    etape: str = "",
+    tentative: int = 1,
+    rafraichir: bool = False,
+    cache: CacheLLM | None = None,
+) -> Any:
+    """Version asynchrone de `appel_cache` (pages 18 et 22)."""
+    cache = cache or get_cache()
+    cle = cle_requete(provider, modele, prompt, params)
+    with mesurer(provider, modele, feature=feature, etape=etape, tentative=tentative) as mesure:
+        if not rafraichir or cache.mode == MODE_REPLAY:
+            valeur = cache.lire(cle, feature)
+            if valeur is not None:
+                mesure.issue = ISSUE_CACHE
+                return valeur
+        valeur = await appel()
+        cache.ecrire(cle, provider, modele, feature, valeur)
+        return valeur
+
+
+def response_vers_cache(response: Any) -> dict[str, Any]:
+    """Objet `Response` OpenAI -> dict JSON ; renseigne l'usage de l'appel mesuré."""
+    usage = getattr(response, "usage", None)
+    signaler_usage(getattr(usage, "input_tokens", None), getattr(usage, "output_tokens", None))
+    return response.model_dump(mode="json")
+
+
+def response_depuis_cache(data: dict[str, Any]) -> Any:
+    """dict JSON -> objet `Response` OpenAI (mêmes attributs, dont `output_text`)."""
+    from openai.types.responses import Response
+
+    return Response.model_validate(data)
+
+
+def parametres_openai(create_kwargs: dict[str, Any]) -> tuple[str | None, Any, dict[str, Any]]:
+    """(modèle, prompt, paramètres) d'un appel `responses.create`, hors options de transport."""
+    params = {
+        k: v for k, v in create_kwargs.items()
+        if k not in ("model", "input", "stream", "timeout", "extra_headers")
+    }
+    return create_kwargs.get("model"), create_kwargs.get("input"), params
+
+
+def responses_create(
+    client: Any,
+    *,
+    feature: str,
+    etape: str = "",
+    rafraichir: bool = False,
+    **create_kwargs,
+) -> Any:
+    """`client.responses.create(**create_kwargs)` (sans streaming) via le cache."""
+    modele, prompt, params = parametres_openai(create_kwargs)
+    data = appel_cache(
+        "openai", modele, prompt, params,
+        lambda: response_vers_cache(client.responses.create(**create_kwargs)),
+        feature=feature,
+        etape=etape,
+        rafraichir=rafraichir,
+    )
+    return response_depuis_cache(data)
+
+
+def responses_stream(
+    client: Any,
+    *,
+    feature: str,
+    consommer: Callable[[Any], tuple[Any, str]],
+    etape: str = "",
+    rafraichir: bool = False,
+    **create_kwargs,
+) -> tuple[Any, str, bool]:
+    """`client.responses.create(stream=True, ...)` via le cache -> (response, texte, depuis_cache).
+
+    Sur un miss, `consommer(stream)` lit les événements (affichage progressif,
+    signal d'appel d'outil) et renvoie (réponse finale, texte accumulé) ; la
+    réponse n'est mise en cache que si elle est complète. Sur un hit, le
+    stream n'existe pas : l'appelant rejoue ses callbacks à partir de la
+    réponse renvoyée.
+    """
+    cache = get_cache()
+    modele, prompt, params = parametres_openai(create_kwargs)
+    cle = cle_requete("openai", modele, prompt, params)
+    with mesurer("openai", modele, feature=feature, etape=etape) as mesure:
+        if not rafraichir or cache.mode == MODE_REPLAY:
+            data = cache.lire(cle, feature)
+            if data is not None:
+                mesure.issue = ISSUE_CACHE
+                response = response_depuis_cache(data)
+                return response, (getattr(response, "output_text", "") or ""), True
+
+        stream = client.responses.create(stream=True, **create_kwargs)
+        final_response, texte = consommer(_avec_ttft(stream))
+        if final_response is None:
+            return final_response, texte, False
+        data = response_vers_cache(final_response)
+        if getattr(final_response, "status", None) == "completed":
+            cache.ecrire(cle, "openai", modele, feature, data)
+        return final_response, texte, False
+
+
+def _avec_ttft(stream: Any) -> Iterator[Any]:
+    """Relaie les événements d'un stream en notant le premier delta (TTFT)."""
+    for event in stream:
+        if getattr(event, "type", "").endswith(".delta"):
+            signaler_premier_token()
+        yield event
+
+
+def _main(argv: list[str]) -> int:
+    """`python -m utils.llm_cache [stats|vider]`."""
+    commande = argv[0] if argv else "stats"
+    cache = CacheLLM.depuis_env()
+    if commande == "vider":
+        cache.vider()
+        print("🧹 Cache LLM vidé")
+        return 0
+    if commande != "stats":
+        print("Usage : python -m utils.llm_cache [stats|vider]", file=sys.stderr)
+        return 2
+    lignes = cache.stats()
+    if not lignes:
+        print("Cache LLM vide")
+    for ligne in lignes:
+        print(
+            f"{ligne['feature'] or '?':<32} {ligne['provider']:<10} {ligne['entrees']:>6} entrées "
+            f"{ligne['octets'] / 1024:>10.1f} Ko {ligne['hits']:>6} hits  {ligne['dernier_acces']}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
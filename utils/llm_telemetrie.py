@@ -0,0 +1,257 @@
+"""Télémétrie des appels LLM : latence, tokens et coût par page et par étape.
+
+Chaque appel passé par le cache LLM (utils.llm_cache) est mesuré : fournisseur,
+modèle, feature (page) et étape du pipeline, tokens d'entrée et de sortie,
+délai avant le premier token (TTFT, streaming uniquement), latence totale,
+numéro de tentative et issue (`ok`, `cache`, `erreur`, `annule`). Les mesures sont
+écrites dans une base SQLite locale (.cache/, ou `LLM_TELEMETRIE_PATH`)
+et lues par la page « Télémétrie LLM ».
+
+La mesure en cours est portée par une `ContextVar` : le code qui lit un
+stream ou une réponse (pages 18, 22, run_impact...) la complète avec
+`signaler_premier_token()` et `signaler_usage()` sans avoir à la transmettre,
+y compris dans une coroutine asyncio.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+
+import pandas as pd
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache"
+TELEMETRIE_PATH = CACHE_DIR / "llm_telemetrie.sqlite"
+# Variable d'environnement qui remplace TELEMETRIE_PATH (tests, instances multiples).
+ENV_TELEMETRIE_PATH = "LLM_TELEMETRIE_PATH"
+
+ISSUE_OK = "ok"
+ISSUE_CACHE = "cache"
+ISSUE_ERREUR = "erreur"
+# Appel abandonné en cours de route (course entre modèles, délai dépassé).
+ISSUE_ANNULE = "annule"
+
+# Tarifs publics en USD par million de tokens (entrée, sortie), à tenir à jour.
+# Un modèle absent a un coût inconnu (NaN) dans le tableau de bord.
+TARIFS_USD_PAR_MTOKENS: dict[str, tuple[float, float]] = {
+    "gpt-5": (1.25, 10.0),
+    "gpt-5.1": (1.25, 10.0),
+    "gpt-5-mini": (0.25, 2.0),
+    "claude-sonnet-4-5": (3.0, 15.0),
+    "gemini-3-pro-preview": (2.0, 12.0),
+    "gemini-3.1-pro-preview": (2.0, 12.0),
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_appel (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts TEXT NOT NULL,
+    feature TEXT NOT NULL,
+    etape TEXT,
+    provider TEXT NOT NULL,
+    modele TEXT,
+    tokens_entree INTEGER,
+    tokens_sortie INTEGER,
+    ttft_ms INTEGER,
+    latence_ms INTEGER NOT NULL,
+    tentative INTEGER NOT NULL,
+    issue TEXT NOT NULL,
+    erreur TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_llm_appel_ts ON llm_appel(ts);
+"""
+
+_mesure_courante: ContextVar["MesureAppel | None"] = ContextVar("mesure_llm", default=None)
+
+
+class MesureAppel:
+    """Mesure d'un appel en cours, complétée par le code qui lit la réponse."""
+
+    def __init__(self, provider: str, modele: str | None, feature: str, etape: str, tentative: int):
+        self.provider = provider
+        self.modele = modele
+        self.feature = feature
+        self.etape = etape
+        self.tentative = tentative
+        self.debut = time.perf_counter()
+        self.ttft: float | None = None
+        self.tokens_entree: int | None = None
+        self.tokens_sortie: int | None = None
+        self.issue = ISSUE_OK
+        self.erreur: str | None = None
+
+    def premier_token(self) -> None:
+        if self.ttft is None:
+            self.ttft = time.perf_counter() - self.debut
+
+    def usage(self, tokens_entree: int | None, tokens_sortie: int | None) -> None:
+        self.tokens_entree = tokens_entree
+        self.tokens_sortie = tokens_sortie
+
+
+class TelemetrieLLM:
+    """Store SQLite des mesures d'appels LLM."""
+
+    def __init__(self, path: Path | str = TELEMETRIE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def enregistrer(self, mesure: MesureAppel, latence: float) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                """
+                INSERT INTO llm_appel (
+                    ts, feature, etape, provider, modele, tokens_entree, tokens_sortie,
+                    ttft_ms, latence_ms, tentative, issue, erreur
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    datetime.now().isoformat(timespec="seconds"),
+                    mesure.feature,
+                    mesure.etape or None,
+                    mesure.provider,
+                    mesure.modele,
+                    mesure.tokens_entree,
+                    mesure.tokens_sortie,
+                    None if mesure.ttft is None else int(mesure.ttft * 1000),
+                    int(latence * 1000),
+                    mesure.tentative,
+                    mesure.issue,
+                    mesure.erreur,
+                ),
+            )
+
+    def charger(self, depuis: timedelta | None = None) -> pd.DataFrame:
+        """Mesures brutes, éventuellement limitées aux dernières `depuis`."""
+        where, params = "", {}
+        if depuis is not None:
+            where = "WHERE ts >= :depuis"
+            params["depuis"] = (datetime.now() - depuis).isoformat(timespec="seconds")
+        with self._connect() as conn:
+            df = pd.read_sql_query(f"SELECT * FROM llm_appel {where} ORDER BY ts", conn, params=params)
+        df["ts"] = pd.to_datetime(df["ts"])
+        return df
+
+
+_telemetrie: TelemetrieLLM | None = None
+
+
+def get_telemetrie() -> TelemetrieLLM:
+    """Store partagé du process (créé au premier appel mesuré).
+
+    Écrit dans `$LLM_TELEMETRIE_PATH` si la variable est définie, sinon dans
+    `TELEMETRIE_PATH` ; un changement de la variable ouvre le nouveau store.
+    """
+    global _telemetrie
+    path = Path(os.getenv(ENV_TELEMETRIE_PATH) or TELEMETRIE_PATH)
+    if _telemetrie is None or _telemetrie.path != path:
+        _telemetrie = TelemetrieLLM(path)
+    return _telemetrie
+
+
+@contextmanager
+def mesurer(
+    provider: str,
+    modele: str | None,
+    *,
+    feature: str,
+    etape: str = "",
+    tentative: int = 1,
+    telemetrie: TelemetrieLLM | None = None,
+) -> Iterator[MesureAppel]:
+    """Mesure le bloc et l'enregistre à la sortie (issue `erreur` si exception,
+    `annule` si la coroutine est annulée).
+
+    Une erreur d'écriture de la télémétrie n'interrompt jamais l'appel.
+    """
+    mesure = MesureAppel(provider, modele, feature, etape, tentative)
+    jeton = _mesure_courante.set(mesure)
+    try:
+        yield mesure
+    except asyncio.CancelledError:
+        mesure.issue = ISSUE_ANNULE
+        raise
+    except BaseException as e:
+        mesure.issue = ISSUE_ERREUR
+        mesure.erreur = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        _mesure_courante.reset(jeton)
+        try:
+            (telemetrie or get_telemetrie()).enregistrer(mesure, time.perf_counter() - mesure.debut)
+        except Exception as e:  # pragma: no cover - la télémétrie est best-effort
+            print(f"⚠️ Télémétrie LLM non enregistrée : {e}")
+
+
+def signaler_premier_token() -> None:
+    """Note le TTFT de l'appel en cours (premier chunk d'un stream)."""
+    mesure = _mesure_courante.get()
+    if mesure is not None:
+        mesure.premier_token()
+
+
+def signaler_usage(tokens_entree: int | None, tokens_sortie: int | None) -> None:
+    """Renseigne les tokens consommés par l'appel en cours."""
+    mesure = _mesure_courante.get()
+    if mesure is not None:
+        mesure.usage(tokens_entree, tokens_sortie)
+
+
+def _tarif(modele: str | None) -> tuple[float, float] | None:
+    """Tarif du modèle, en acceptant les suffixes de version (ex. gpt-5.1-2025-11-13)."""
+    if not modele:
+        return None
+    candidats = [m for m in TARIFS_USD_PAR_MTOKENS if modele == m or modele.startswith(m + "-")]
+    return TARIFS_USD_PAR_MTOKENS[max(candidats, key=len)] if candidats else None
+
+
+def cout_usd(df: pd.DataFrame) -> pd.Series:
+    """Coût estimé de chaque appel (0 pour les hits de cache, NaN si tarif inconnu)."""
+    tarifs = df["modele"].map(_tarif)
+    entree = tarifs.map(lambda t: t[0] if t else float("nan"))
+    sortie = tarifs.map(lambda t: t[1] if t else float("nan"))
+    cout = (df["tokens_entree"].fillna(0) * entree + df["tokens_sortie"].fillna(0) * sortie) / 1e6
+    return cout.where(df["issue"] != ISSUE_CACHE, 0.0)
+
+
+def resume(df: pd.DataFrame, par: list[str] | None = None) -> pd.DataFrame:
+    """Agrégats par feature (ou `par`) : volumes, p50/p95 de latence et TTFT, tokens, coût.
+
+    Les percentiles de latence ne portent que sur les appels réels menés à
+    terme (hors cache et hors appels annulés).
+    """
+    par = par or ["feature"]
+    if df.empty:
+        return pd.DataFrame(columns=par)
+    df = df.assign(cout_usd=cout_usd(df))
+    reels = df[~df["issue"].isin([ISSUE_CACHE, ISSUE_ANNULE])]
+    groupes = df.groupby(par)
+    resultat = pd.DataFrame({
+        "appels": groupes.size(),
+        "hits_cache": groupes["issue"].apply(lambda s: int((s == ISSUE_CACHE).sum())),
+        "erreurs": groupes["issue"].apply(lambda s: int((s == ISSUE_ERREUR).sum())),
+        "annules": groupes["issue"].apply(lambda s: int((s == ISSUE_ANNULE).sum())),
+        "retries": groupes["tentative"].apply(lambda s: int((s > 1).sum())),
+        "tokens_entree": groupes["tokens_entree"].sum(),
+        "tokens_sortie": groupes["tokens_sortie"].sum(),
+        "cout_usd": groupes["cout_usd"].sum(min_count=1),
+    })
+    latences = reels.groupby(par)["latence_ms"]
+    ttft = reels.groupby(par)["ttft_ms"].median()
+    resultat["latence_p50_s"] = latences.quantile(0.5) / 1000
+    resultat["latence_p95_s"] = latences.quantile(0.95) / 1000
+    resultat["ttft_p50_s"] = ttft / 1000
+    return resultat.reset_index().sort_values("cout_usd", ascending=False, na_position="last")
@@ -0,0 +1,1095 @@
+"""Pipeline de priorisation levier × catégorie (page 26 et exécution batch).
+
+Étapes pour une collectivité : plan d'actions (prod, lecture seule) →
+réductions SNBC par levier (API TET) → classification des actions par levier
+× catégorie (étape 1, LLM) → notation d'activation par levier (étape 2, LLM)
+→ une ligne par case levier × catégorie, écrite dans `priorisation` (OLAP).
+
+Le module ne dépend pas de Streamlit : la page 26 y ajoute l'interface, le
+runner `utils.priorisation_impact_batch` l'enchaîne sur plusieurs
+collectivités. Les appels LLM passent par un `ClientLLM` qui porte le client
+OpenAI, le seau à jetons partagé et le décompte des tokens consommés.
+"""
+
+from __future__ import annotations
+
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+import requests
+from sqlalchemy import text
+
+from utils.db import bulk_insert
+from utils.http_client import ClientHTTP, TokenBucket, get_client
+from utils.llm_cache import appel_cache
+from utils.llm_telemetrie import signaler_usage
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+RATIOS_CSV = DATA_DIR / "leviers_sgpe_region.csv"
+
+# Appels LLM concurrents : plafond de parallélisme et débit partagé
+LLM_MAX_CONCURRENCE = 4
+LLM_REQUETES_PAR_MINUTE = 120
+LLM_MODELE = "gpt-5.1-2025-11-13"
+
+# Classification par lots : budget de tokens (estimés) du plan par appel
+CLASSIF_CHUNK_TOKENS = 6000
+CLASSIF_CHUNK_MAX_OUTPUT_TOKENS = 32000
+
+
+# ==========================
+# Constantes
+# ==========================
+
+LEVIERS = """
+Changement chaudières fioul + rénovation (résidentiel)
+Changement chaudières gaz + rénovation (résidentiel)
+Sobriété des bâtiments (résidentiel)
+Changement de chaudière à fioul (tertiaire)
+Changement de chaudière à gaz (tertiaire)
+Sobriété et isolation des bâtiments (tertiaire)
+Réduction des déplacements
+Covoiturage
+Vélo et transport en commun
+Véhicules électriques
+Efficacité et carburants décarbonés des véhicules privés
+Bus et cars décarbonés
+Fret décarboné et multimodalité
+Efficacité et sobriété logistique
+Bâtiments & Machines agricoles
+Elevage durable
+Changements de pratiques de fertilisation azotée
+Production Industrielle
+Captage de méthane dans les ISDND
+Prévention des déchets
+Valorisation matière des déchets
+Gestion des forêts et produits bois
+Pratiques stockantes
+Gestion des haies
+Gestion des prairies
+Sobriété foncière
+Electricité renouvelable
+Biogaz
+Réseaux de chaleur décarbonés
+"""
+
+LEVIERS_LIST = [l.strip() for l in LEVIERS.strip().split("\n") if l.strip()]
+LEVIERS_SET = set(LEVIERS_LIST)
+API_LEVIER_NAME_MAP = {
+    "Production industrielle": "Production Industrielle",
+}
+VALID_CATEGORIES = {1, 2, 3, 4, 5, 6}
+
+CATEGORIES = {
+    1: "Aménagement & infrastructures",
+    2: "Réglementation & planification",
+    3: "Financement & fiscalité",
+    4: "Gouvernance & partenariats",
+    5: "Exemplarité interne",
+    6: "Sensibilisation & accompagnement",
+}
+
+D_MAP_SECTEUR = {
+    'Résidentiel': 'cae_1.c',
+    'Tertiaire': 'cae_1.d',
+    'Transport ': 'cae_1.k',
+    'Agriculture': 'cae_1.g',
+    'Industrie': 'cae_1.i',
+    'Déchets': 'cae_1.h',
+    'UTCATF': 'cae_1.csc',
+    'Branche énergie': 'cae_1.j',
+}
+
+# Codes INSEE région → libellés colonnes de data/leviers_sgpe_region.csv
+REGION_CODE_TO_LABEL = {
+    '84': 'Auvergne-Rhône-Alpes',
+    '27': 'Bourgogne-Franche-Comté',
+    '53': 'Bretagne',
+    '24': 'Centre-Val de Loire',
+    '94': 'Corse',
+    '44': 'Grand Est',
+    '32': 'Hauts-de-France',
+    '11': 'Île-de-France',
+    '28': 'Normandie',
+    '75': 'Nouvelle-Aquitaine',
+    '76': 'Occitanie',
+    '52': 'Pays de la Loire',
+    '93': "Provence-Alpes-Côte d'Azur",
+}
+
+
+def region_label_from_code(region_code: str | None) -> str | None:
+    """Retourne le libellé région CSV à partir du region_code collectivité."""
+    if region_code is None or pd.isna(region_code):
+        return None
+    return REGION_CODE_TO_LABEL.get(str(region_code).strip())
+
+
+def _normalize_levier_name(api_name: str) -> str:
+    """Mappe un libellé API vers le libellé canonique du référentiel local."""
+    name = API_LEVIER_NAME_MAP.get(api_name, api_name)
+    if name not in LEVIERS_SET:
+        raise ValueError(f"Levier API inconnu : {api_name!r}")
+    return name
+
+
+# ==========================
+# Client LLM
+# ==========================
+
+def new_rate_limiter() -> TokenBucket:
+    """Seau à jetons à partager entre tous les appels faits avec la même clé API."""
+    return TokenBucket.pour_limite(LLM_REQUETES_PAR_MINUTE, capacite=LLM_MAX_CONCURRENCE)
+
+
+def strip_json_fences(text: str) -> str:
+    """Enlève les ```json ... ``` si présents."""
+    if not text:
+        return ""
+    t = text.strip()
+    if t.startswith("```"):
+        t = t.replace("```json", "").replace("```JSON", "").replace("```", "").strip()
+    return t
+
+
+class ClientLLM:
+    """Appels JSON au LLM, cadencés par un seau à jetons, avec décompte des tokens.
+
+    Le client OpenAI et le limiteur peuvent être partagés entre plusieurs
+    `ClientLLM` (un par collectivité en batch) : chacun garde son propre
+    décompte d'appels et de tokens. Les réponses passent par le cache LLM
+    partagé (utils.llm_cache) : relancer un plan inchangé ne coûte rien, et
+    seuls les appels réels consomment un jeton du limiteur.
+    """
+
+    def __init__(
+        self,
+        openai_client,
+        limiteur: TokenBucket | None = None,
+        effort: str = "medium",
+        modele: str = LLM_MODELE,
+        feature: str = "26_run_impact",
+    ):
+        self.openai_client = openai_client
+        self.feature = feature
+        self.limiteur = limiteur
+        self.effort = effort
+        self.modele = modele
+        self.nb_appels = 0
+        self.nb_cache = 0
+        self.tokens_entree = 0
+        self.tokens_sortie = 0
+        self._lock = threading.Lock()
+
+    def _creer(self, kwargs: dict[str, Any]) -> dict[str, Any]:
+        """Appel réel au modèle ; renvoie le texte et l'usage (valeur mise en cache)."""
+        if self.limiteur is not None:
+            self.limiteur.acquire()
+        try:
+            response = self.openai_client.responses.create(**kwargs)
+        except TypeError:
+            kwargs = {k: v for k, v in kwargs.items() if k != "text"}
+            response = self.openai_client.responses.create(**kwargs)
+        usage = getattr(response, "usage", None)
+        resultat = {
+            "texte": response.output_text or "",
+            "tokens_entree": int(getattr(usage, "input_tokens", 0) or 0),
+            "tokens_sortie": int(getattr(usage, "output_tokens", 0) or 0),
+        }
+        with self._lock:
+            self.nb_appels += 1
+            self.tokens_entree += resultat["tokens_entree"]
+            self.tokens_sortie += resultat["tokens_sortie"]
+        signaler_usage(resultat["tokens_entree"], resultat["tokens_sortie"])
+        return resultat
+
+    def appeler_json(
+        self,
+        prompt: str,
+        label: str,
+        status_container,
+        max_retries: int = 3,
+        max_output_tokens: int | None = None,
+        rafraichir: bool = False,
+        etape: str = "",
+        tentative: int = 1,
+    ) -> Any:
+        """Appelle le LLM avec sortie JSON forcée, parse et retry en cas d'échec.
+
+        Les nouvelles tentatives (et `rafraichir`, utilisé par les appelants
+        après une réponse rejetée à la validation) ignorent le cache.
+        `etape` et `tentative` (rang de la première tentative, pour les
+        appelants qui relancent eux-mêmes) alimentent la télémétrie.
+        """
+        last_error = None
+
+        for attempt in range(1, max_retries + 1):
+            try:
+                if attempt > 1:
+                    status_container.write(f"🔄 Retry {attempt}/{max_retries} ({label})...")
+
+                params: dict[str, Any] = {
+                    "reasoning": {"effort": self.effort},
+                    "text": {"format": {"type": "json_object"}},
+                }
+                if max_output_tokens:
+                    params["max_output_tokens"] = max_output_tokens
+
+                appel_reel = []
+                resultat = appel_cache(
+                    "openai", self.modele, prompt, params,
+                    lambda: appel_reel.append(True) or self._creer(
+                        {"model": self.modele, "input": prompt, **params}
+                    ),
+                    feature=self.feature,
+                    etape=etape,
+                    tentative=tentative + attempt - 1,
+                    rafraichir=rafraichir or attempt > 1,
+                )
+                if not appel_reel:
+                    with self._lock:
+                        self.nb_cache += 1
+
+                raw_text = strip_json_fences(resultat["texte"])
+                return json.loads(raw_text)
+            except json.JSONDecodeError as e:
+                last_error = f"json_parse_error: {e}"
+            except Exception as e:
+                last_error = f"generation_error: {type(e).__name__}: {e}"
+
+        raise RuntimeError(f"Échec LLM ({label}) après {max_retries} tentatives: {last_error}")
+
+    def rapport(self) -> dict[str, int]:
+        """Appels et tokens consommés depuis la création du client."""
+        with self._lock:
+            return {
+                "appels_llm": self.nb_appels,
+                "appels_cache": self.nb_cache,
+                "tokens_entree": self.tokens_entree,
+                "tokens_sortie": self.tokens_sortie,
+            }
+
+
+# ==========================
+# Données : référentiel, plans, réductions SNBC
+# ==========================
+
+def load_leviers_ref(df_ratios: pd.DataFrame | None = None) -> pd.DataFrame | None:
+    """Référentiel leviers / secteurs depuis data/leviers_sgpe_region.csv."""
+    if df_ratios is None:
+        try:
+            df_ratios = pd.read_csv(RATIOS_CSV, sep=';')
+        except FileNotFoundError:
+            return None
+    df_ref = df_ratios[['Secteur', 'Leviers SGPE']].copy()
+    df_ref['identifiant_referentiel'] = df_ref['Secteur'].map(D_MAP_SECTEUR)
+    return df_ref
+
+
+
+def fetch_snbc_leviers(
+    collectivite_id: int,
+    api_url: str,
+    api_token: str,
+    session: requests.Session | ClientHTTP | None = None,
+) -> dict:
+    """Appelle l'API TET trajectoires SNBC leviers (`api_url` = URL de l'API prod).
+
+    Par défaut via le client HTTP partagé (keep-alive, rejeux des erreurs transitoires).
+    """
+    if not api_token:
+        raise ValueError(
+            "Token API manquant : configurez api_prod_token dans secrets.toml"
+        )
+    base = api_url.split("/api/v1")[0]
+    url = f"{base}/api/v1/trajectoires/snbc/leviers"
+    headers = {
+        "Authorization": f"Bearer {api_token}",
+        "Content-Type": "application/json",
+    }
+    response = (session or get_client()).get(
+        url,
+        headers=headers,
+        params={"collectiviteId": collectivite_id},
+        timeout=60,
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+def parse_reductions(data: dict) -> tuple[pd.DataFrame, list[str]]:
+    """Réductions par levier (`levier`, `reduction`) à partir de la réponse SNBC."""
+    rows: list[dict[str, Any]] = []
+    for secteur in data.get("secteurs", []):
+        for levier in secteur.get("leviers", []):
+            objectif = levier.get("objectifReduction")
+            reduction = round(float(objectif), 1) if objectif is not None else 0.0
+            rows.append({
+                "levier": _normalize_levier_name(levier["nom"]),
+                "reduction": reduction,
+            })
+    df_result = pd.DataFrame(rows, columns=["levier", "reduction"])
+    identifiants_manquants = data.get("identifiantManquants", []) or []
+    return df_result, identifiants_manquants
+
+
+def reductions_mock(rng: random.Random | None = None) -> tuple[pd.DataFrame, list[str]]:
+    """Version mock — réductions aléatoires sur tous les leviers, sans appel API."""
+    rng = rng or random
+    df_result = pd.DataFrame({
+        "levier": LEVIERS_LIST,
+        "reduction": [round(rng.uniform(0, 50), 1) for _ in LEVIERS_LIST],
+    })
+    return df_result, []
+
+
+def _plans_query(full_access: bool, plusieurs: bool) -> str:
+    filtre_id = (
+        "fa.collectivite_id = ANY(:collectivite_ids)"
+        if plusieurs
+        else "fa.collectivite_id = :collectivite_id"
+    )
+    restreint = "" if full_access else "\n          AND fa.restreint = False"
+    colonnes = "fa.collectivite_id, fa.id" if plusieurs else "fa.id"
+    return f"""
+        SELECT DISTINCT {colonnes}, fa.titre, fa.description
+        FROM fiche_action fa
+        JOIN fiche_action_axe faa ON faa.fiche_id = fa.id
+        WHERE {filtre_id} and parent_id is null{restreint}
+    """
+
+
+def fetch_plan_actions(engine_prod, collectivite_id: int, full_access: bool = False) -> pd.DataFrame:
+    """Récupère le plan d'actions d'une collectivité (base prod, lecture seule)."""
+    with engine_prod.connect() as conn:
+        return pd.read_sql_query(
+            text(_plans_query(full_access, plusieurs=False)),
+            conn,
+            params={"collectivite_id": collectivite_id},
+        )
+
+
+def fetch_plans_actions(
+    engine_prod,
+    collectivite_ids: list[int],
+    full_access: bool = False,
+) -> dict[int, pd.DataFrame]:
+    """Plans d'actions de plusieurs collectivités en une requête, par collectivité."""
+    with engine_prod.connect() as conn:
+        df = pd.read_sql_query(
+            text(_plans_query(full_access, plusieurs=True)),
+            conn,
+            params={"collectivite_ids": [int(i) for i in collectivite_ids]},
+        )
+    return {
+        int(cid): groupe.drop(columns="collectivite_id").reset_index(drop=True)
+        for cid, groupe in df.groupby("collectivite_id")
+    }
+
+
+def fetch_collectivites_avec_plan(engine_prod, full_access: bool = False) -> list[int]:
+    """Identifiants des collectivités (hors test) ayant au moins une action de plan."""
+    restreint = "" if full_access else " AND fa.restreint = False"
+    with engine_prod.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT DISTINCT fa.collectivite_id
+            FROM fiche_action fa
+            JOIN fiche_action_axe faa ON faa.fiche_id = fa.id
+            JOIN collectivite c ON c.id = fa.collectivite_id
+            WHERE fa.parent_id is null AND c.type != 'test'{restreint}
+            ORDER BY fa.collectivite_id
+        """)).all()
+    return [int(row[0]) for row in rows]
+
+
+# ==========================
+# Traitement LLM
+# ==========================
+
+def build_prompt_classification(plan_texte: str) -> str:
+    """Construit le prompt pour classifier les actions par levier."""
+    return f"""
+Tu es un expert en analyse d'impact carbone des politiques publiques et en modélisation par leviers CO2.
+
+# Contexte
+On te fournit trois éléments :
+
+1. Un plan d'actions sous forme de texte structuré. Chaque action est identifiée par un id unique et décrite par un titre et une description.
+
+2. Une liste fermée de leviers CO2. Chaque levier correspond à un mécanisme d'impact direct ou quasi direct sur les émissions de CO2.
+
+3. Une liste fermée de 6 catégories de TYPE D'ACTION. La catégorie ne décrit pas l'impact carbone mais le MOYEN par lequel la collectivité agit.
+
+# Les 6 catégories
+1. Aménagement & infrastructures — Actions physiques sur le territoire à destination des habitants et des acteurs économiques : urbanisme, mobilités douces, espaces verts, réseaux (eau, chaleur, assainissement), renaturation, équipements publics ouverts au public.
+2. Réglementation & planification — Documents cadres et actes juridiques qui orientent l'action du territoire : PLU/PLUi, PCAET, SCoT, règlements locaux, zones à faibles émissions, arrêtés municipaux.
+3. Financement & fiscalité — Orientation des flux économiques : subventions aux particuliers et entreprises, tarification incitative, budgets participatifs écologiques, fiscalité locale verte.
+4. Gouvernance & partenariats — Pilotage de la politique de transition : élu référent, service dédié, stratégie et feuille de route, coopération intercommunale, partenariats privés/associatifs, concertation citoyenne, suivi-évaluation.
+5. Exemplarité interne — Transition écologique appliquée au fonctionnement PROPRE de la collectivité : rénovation du patrimoine bâti public, flotte de véhicules, restauration collective, achats et commande publique responsables, numérique responsable, formation des agents.
+6. Sensibilisation & accompagnement — Information, éducation et conseil aux habitants, entreprises et associations : guichet unique rénovation, animations scolaires, ateliers, communication, accompagnement de projets citoyens.
+
+# Distinctions à respecter impérativement
+- Catégorie 1 vs 5 : une action sur un bâtiment ou un véhicule relève de la 5 si elle porte sur le patrimoine ou les moyens PROPRES de la collectivité, et de la 1 seulement si l'équipement est destiné aux habitants/acteurs du territoire.
+- Catégorie 2 vs 4 : la 2 concerne l'acte juridique ou le document opposable lui-même ; la 4 concerne la manière de piloter, décider et coopérer. Adopter un PLU = 2. Créer un comité de suivi = 4.
+- Catégorie 3 vs 6 : verser une subvention = 3 ; informer, orienter ou accompagner sans flux financier = 6.
+- Une action peut relever de plusieurs catégories AU SEIN d'un même levier si elle agit réellement par plusieurs de ces mécanismes (ex : créer une piste cyclable + la subventionner). N'attribue une catégorie que si l'action agit CONCRÈTEMENT par ce mécanisme, pas si elle l'évoque seulement.
+
+# Objectif
+Pour chaque action, identifier de manière SÛRE :
+- les leviers CO2 auxquels elle correspond ;
+- pour chaque levier retenu, la ou les catégories de type d'action correspondantes.
+
+# Règles fondamentales
+- Une action peut correspondre à zéro, un ou plusieurs leviers.
+- N'associe un levier que si le lien avec un mécanisme d'impact CO2 est clair, direct ou très fortement plausible.
+- Si le lien est trop indirect, spéculatif ou dépend d'hypothèses non explicites, ne pas associer le levier.
+- En cas de doute sur un levier, s'abstenir : la précision prime sur l'exhaustivité.
+- Pour chaque levier retenu, il doit y avoir AU MOINS une catégorie. Une liste de catégories vide pour un levier retenu est interdite.
+- Ne jamais inventer de levier hors de la liste fournie. Ne pas reformuler les leviers : utiliser exactement les libellés fournis.
+- Les catégories sont des entiers de 1 à 6 uniquement.
+
+# Format de sortie attendu
+Réponds UNIQUEMENT avec un JSON valide, sans texte ni balise additionnels.
+Chaque action est une clé. Sa valeur est un objet associant chaque levier retenu à la liste (entiers, 1 à 6) de ses catégories.
+Si aucun levier sûr n'existe pour une action, la valeur est un objet vide {{}}.
+
+Exemple de format :
+{{
+  "id_action_1": {{ "levier_A": [1, 3], "levier_B": [4] }},
+  "id_action_2": {{}},
+  "id_action_3": {{ "levier_C": [2] }}
+}}
+
+# Entrées
+Plan d'actions :
+{plan_texte}
+
+Liste des leviers CO2 :
+{LEVIERS}
+"""
+
+
+def build_prompt_implication(
+    actions_par_categorie: str,
+    levier: str,
+    collectivite_nom: str,
+    population: int,
+    references_par_categorie: str | None = None,
+) -> str:
+    """Construit le prompt pour évaluer l'activation d'un levier, catégorie par catégorie.
+
+    `actions_par_categorie` : actions de la collectivité regroupées par catégorie (1 à 6).
+        Une catégorie sans action doit apparaître explicitement comme vide.
+    `references_par_categorie` : actions de référence par catégorie, si disponibles.
+    """
+    bloc_reference = (
+        f"\n# Actions de référence par catégorie\n"
+        f"Pour chaque catégorie, voici à quoi ressemblerait une mobilisation exemplaire. "
+        f"Sers-t'en comme étalon du niveau 3.\n{references_par_categorie}\n"
+        if references_par_categorie
+        else "\n# Référentiel\nAucune liste de référence fournie : pour chaque catégorie, "
+        "raisonne à partir de ce qu'une collectivité comparable et volontariste ferait.\n"
+    )
+
+    return f"""Tu es un expert en politiques publiques locales et en évaluation qualitative d'impact climat.
+
+# Contexte
+On te fournit :
+1. Le nom d'une collectivité et sa population.
+2. UN levier d'action climat (ex : « Co-voiturage »).
+3. Les actions de la collectivité rattachées à ce levier, déjà regroupées par catégorie de type d'action.
+
+# Les 6 catégories de type d'action
+La catégorie ne décrit pas l'impact carbone mais le MOYEN par lequel la collectivité agit.
+1. Aménagement & infrastructures — Actions physiques sur le territoire à destination des habitants et acteurs économiques : urbanisme, mobilités douces, espaces verts, réseaux, renaturation, équipements publics ouverts au public.
+2. Réglementation & planification — Documents cadres et actes juridiques : PLU/PLUi, PCAET, SCoT, règlements locaux, zones à faibles émissions, arrêtés.
+3. Financement & fiscalité — Orientation des flux économiques : subventions, tarification incitative, budgets participatifs écologiques, fiscalité locale verte.
+4. Gouvernance & partenariats — Pilotage de la transition : élu référent, service dédié, stratégie et feuille de route, coopération intercommunale, partenariats, concertation, suivi-évaluation.
+5. Exemplarité interne — Transition appliquée au fonctionnement propre de la collectivité : patrimoine bâti public, flotte, restauration collective, commande publique responsable, numérique responsable, formation des agents.
+6. Sensibilisation & accompagnement — Information, éducation et conseil aux habitants, entreprises et associations : guichet unique rénovation, animations, ateliers, communication, accompagnement de projets citoyens.
+
+# Objectif
+Pour CHACUNE des 6 catégories, évaluer à quel point la collectivité mobilise ce type d'action SUR CE levier,
+comparé à ce qui serait raisonnablement attendu d'une collectivité de taille comparable.
+
+# Cadrage important
+Tu évalues 6 cases « levier x catégorie », une note par catégorie.
+Tu n'évalues pas le levier dans son ensemble, ni un impact CO2 chiffré.
+Une catégorie seule ne peut pas activer tout le potentiel d'un levier — ce n'est pas la question.
+La question, pour chaque catégorie, est : sur ce type précis d'action, la collectivité fait-elle peu,
+ou fait-elle ce qu'on peut raisonnablement attendre de mieux ?
+{bloc_reference}
+# Échelle d'évaluation — 4 niveaux
+Pour chaque catégorie, un entier parmi [0, 1, 2, 3] :
+
+- 0 — non couvert : aucune action crédible sur cette case, ou actions hors sujet.
+- 1 — amorcé : actions ponctuelles, symboliques ou expérimentales ; intention visible mais portée très limitée.
+- 2 — partiel : actions réelles et concrètes mais incomplètes ; une part significative de l'attendu est faite, des pans importants manquent.
+- 3 — pleinement activé : mobilisation structurée, cohérente et à large portée ; l'essentiel de l'attendu est fait.
+
+# Principes d'évaluation
+- Raisonner relativement à la taille et à la population de la collectivité.
+- Juger la portée réelle (couverture, intensité, durée, public touché), pas le nombre d'actions ni leur formulation.
+- Une catégorie sans aucune action rattachée reçoit obligatoirement 0.
+- Ne pas surévaluer les actions purement incitatives, communicationnelles ou expérimentales — SAUF pour la catégorie 6 (Sensibilisation & accompagnement), où ces actions sont précisément le cœur du sujet.
+- Une action seulement annoncée, non financée ou non engagée, ne peut pas porter un niveau 3.
+- En cas de doute entre deux niveaux, retenir le plus bas.
+
+# Méthode attendue
+Pour chaque catégorie, raisonne en interne (portée réelle vs attendu) puis fixe la note.
+Ne fais PAS apparaître ce raisonnement dans la réponse : la sortie ne contient que les notes.
+
+# Format de sortie attendu
+Réponds UNIQUEMENT avec un JSON valide, sans texte ni balise additionnels.
+Les 6 catégories doivent toutes être présentes, clés "1" à "6", même si la note est 0.
+Format exact :
+{{
+  "1": <0-3>,
+  "2": <0-3>,
+  "3": <0-3>,
+  "4": <0-3>,
+  "5": <0-3>,
+  "6": <0-3>
+}}
+
+# Entrées
+Collectivité : {collectivite_nom}
+Population : {population}
+Levier évalué : {levier}
+
+Actions de la collectivité, regroupées par catégorie :
+{actions_par_categorie}
+"""
+
+
+class _StatusBuffer:
+    """Collecte les messages d'un worker pour les écrire depuis le thread Streamlit.
+
+    Les threads du pool n'ont pas de contexte de script : ils ne peuvent pas
+    écrire directement dans le container de statut.
+    """
+
+    def __init__(self):
+        self.messages: list[str] = []
+
+    def write(self, message: str) -> None:
+        self.messages.append(message)
+
+
+def _run_concurrently(
+    taches: dict[Any, Any],
+    worker,
+    status_container,
+    max_concurrence: int,
+    label: str,
+) -> dict[Any, Any]:
+    """Exécute `worker(cle, valeur, status)` en parallèle ; résultat ordonné comme `taches`.
+
+    Le worker gère lui-même validation et retries. Ses messages et la
+    progression sont écrits au fil des tâches terminées ; la première erreur
+    annule les tâches en attente et est relevée.
+    """
+    total = len(taches)
+    if total == 0:
+        return {}
+
+    results: dict[Any, Any] = {}
+    status_container.write(f"{label} : {total} tâche(s), {max_concurrence} en parallèle...")
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrence)) as pool:
+        futures = {}
+        for cle, valeur in taches.items():
+            buffer = _StatusBuffer()
+            futures[pool.submit(worker, cle, valeur, buffer)] = (cle, buffer)
+
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                cle, buffer = futures[future]
+                for message in buffer.messages:
+                    status_container.write(message)
+                results[cle] = future.result()
+                status_container.write(f"✅ ({done}/{total}) {cle}")
+        except Exception:
+            for pending in futures:
+                pending.cancel()
+            raise
+
+    return {cle: results[cle] for cle in taches}
+
+
+def validate_classification(
+    data: Any,
+    known_action_ids: set[int],
+    known_leviers: set[str],
+) -> dict[int, dict[str, list[int]]]:
+    """Valide et normalise la sortie JSON de l'étape 1."""
+    if not isinstance(data, dict):
+        raise ValueError("La classification doit être un objet JSON")
+
+    result: dict[int, dict[str, list[int]]] = {}
+    for action_key, leviers_map in data.items():
+        try:
+            action_id = int(action_key)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Identifiant d'action invalide: {action_key}") from e
+
+        if action_id not in known_action_ids:
+            raise ValueError(f"Action inconnue: {action_id}")
+
+        if not leviers_map:
+            result[action_id] = {}
+            continue
+
+        if not isinstance(leviers_map, dict):
+            raise ValueError(f"Valeur invalide pour l'action {action_id}")
+
+        parsed_leviers: dict[str, list[int]] = {}
+        for levier, categories in leviers_map.items():
+            if levier not in known_leviers:
+                raise ValueError(f"Levier inconnu: {levier}")
+            if not isinstance(categories, list) or len(categories) == 0:
+                raise ValueError(
+                    f"Catégories vides pour le levier « {levier} » (action {action_id})"
+                )
+            cats: list[int] = []
+            for cat in categories:
+                cat_int = int(cat)
+                if cat_int not in VALID_CATEGORIES:
+                    raise ValueError(
+                        f"Catégorie invalide {cat} pour l'action {action_id}"
+                    )
+                cats.append(cat_int)
+            parsed_leviers[levier] = sorted(set(cats))
+
+        result[action_id] = parsed_leviers
+
+    return result
+
+
+def validate_activation_scores(data: Any) -> dict[int, int]:
+    """Valide et normalise la sortie JSON de l'étape 2."""
+    if not isinstance(data, dict):
+        raise ValueError("Les scores d'activation doivent être un objet JSON")
+
+    scores: dict[int, int] = {}
+    for cat_key in ("1", "2", "3", "4", "5", "6"):
+        if cat_key not in data:
+            raise ValueError(f"Catégorie manquante: {cat_key}")
+        note = int(data[cat_key])
+        if note not in {0, 1, 2, 3}:
+            raise ValueError(f"Note invalide pour la catégorie {cat_key}: {note}")
+        scores[int(cat_key)] = note
+
+    return scores
+
+
+def build_actions_text(plan: pd.DataFrame, ids: list) -> str:
+    """Construit un texte d'actions pour une liste d'ids."""
+    df = plan[plan["id"].isin(ids)].copy()
+    if df.empty:
+        return ""
+
+    df["titre"] = df["titre"].fillna("").astype(str)
+    df["description"] = df["description"].fillna("").astype(str)
+
+    return "\n\n".join(
+        f"{row.id} | {row.titre} : {row.description}".strip()
+        for _, row in df.iterrows()
+    ).strip()
+
+
+def group_actions_by_lever_and_category(
+    classification: dict[int, dict[str, list[int]]],
+) -> dict[str, dict[int, list[int]]]:
+    """Regroupe les actions classées par levier puis par catégorie."""
+    grouped: dict[str, dict[int, list[int]]] = defaultdict(
+        lambda: {cat: [] for cat in range(1, 7)}
+    )
+
+    for action_id, leviers_map in classification.items():
+        for levier, categories in leviers_map.items():
+            for cat in categories:
+                grouped[levier][cat].append(action_id)
+
+    result: dict[str, dict[int, list[int]]] = {}
+    for levier, actions_by_cat in grouped.items():
+        result[levier] = {
+            cat: sorted(set(actions_by_cat[cat])) for cat in range(1, 7)
+        }
+
+    return result
+
+
+def classification_debug(
+    lever_category_actions: dict[str, dict[int, list[int]]],
+) -> pd.DataFrame:
+    """Tableau de contrôle de l'étape 1 : actions par levier × catégorie."""
+    return pd.DataFrame(
+        [
+            {
+                "Levier": levier,
+                "Catégorie": cat,
+                "Nb actions": len(ids),
+                "IDs": str(ids),
+            }
+            for levier, cats in lever_category_actions.items()
+            for cat, ids in cats.items()
+            if ids
+        ],
+        columns=["Levier", "Catégorie", "Nb actions", "IDs"],
+    )
+
+
+def scores_debug(lever_scores: dict[str, dict[int, int]]) -> pd.DataFrame:
+    """Tableau de contrôle de l'étape 2 : une ligne par levier, une colonne par catégorie."""
+    return pd.DataFrame(
+        [
+            {
+                "Levier": levier,
+                **{CATEGORIES[cat]: scores.get(cat, 0) for cat in range(1, 7)},
+            }
+            for levier, scores in lever_scores.items()
+        ],
+        columns=["Levier", *CATEGORIES.values()],
+    )
+
+
+def format_actions_by_category(
+    plan: pd.DataFrame,
+    actions_by_cat: dict[int, list[int]],
+) -> str:
+    """Formate les actions regroupées par catégorie pour le prompt étape 2."""
+    blocks: list[str] = []
+    for cat in range(1, 7):
+        label = CATEGORIES[cat]
+        blocks.append(f"Catégorie {cat} — {label} :")
+        ids = actions_by_cat.get(cat, [])
+        if ids:
+            blocks.append(build_actions_text(plan, ids))
+        else:
+            blocks.append("(aucune action)")
+        blocks.append("")
+    return "\n".join(blocks).strip()
+
+
+def estimate_tokens(texte: str) -> int:
+    """Estimation grossière du nombre de tokens (≈ 4 caractères par token)."""
+    return len(texte) // 4 + 1
+
+
+def _plan_texte(plan: pd.DataFrame) -> str:
+    """Sérialise les actions d'un plan pour le prompt de classification."""
+    return "{" + ", ".join(
+        f"{row.id}:{row.titre} - {row.description}"
+        for _, row in plan.iterrows()
+    ) + "}"
+
+
+def chunk_plan(plan: pd.DataFrame, max_tokens: int = CLASSIF_CHUNK_TOKENS) -> list[pd.DataFrame]:
+    """Découpe le plan en lots d'actions consécutives d'au plus `max_tokens` (estimés).
+
+    Une action plus longue que le budget forme un lot à elle seule.
+    """
+    if plan.empty:
+        return []
+    tokens = [
+        estimate_tokens(f"{row.id}:{row.titre} - {row.description}")
+        for _, row in plan.iterrows()
+    ]
+    chunks: list[pd.DataFrame] = []
+    debut, cumul = 0, 0
+    for i, nb in enumerate(tokens):
+        if i > debut and cumul + nb > max_tokens:
+            chunks.append(plan.iloc[debut:i])
+            debut, cumul = i, 0
+        cumul += nb
+    chunks.append(plan.iloc[debut:])
+    return chunks
+
+
+def _classify_chunk(
+    llm: ClientLLM,
+    plan: pd.DataFrame,
+    status_container,
+    label: str,
+    max_output_tokens: int,
+) -> dict[int, dict[str, list[int]]]:
+    """Classifie un lot d'actions, avec validation et 3 tentatives."""
+    prompt = build_prompt_classification(_plan_texte(plan))
+    known_ids = set(plan["id"].astype(int))
+    for attempt in range(1, 4):
+        try:
+            data = llm.appeler_json(
+                prompt,
+                label,
+                status_container,
+                max_retries=1,
+                max_output_tokens=max_output_tokens,
+                rafraichir=attempt > 1,
+                etape="classification",
+                tentative=attempt,
+            )
+            return validate_classification(data, known_ids, LEVIERS_SET)
+        except (ValueError, RuntimeError) as e:
+            if attempt == 3:
+                raise
+            status_container.write(f"🔄 Validation échouée ({label}), retry {attempt + 1}/3: {e}")
+
+    raise RuntimeError("Classification impossible")
+
+
+def classify_actions(
+    llm: ClientLLM,
+    plan: pd.DataFrame,
+    status_container,
+    chunked: bool = True,
+    max_concurrence: int = LLM_MAX_CONCURRENCE,
+) -> dict[int, dict[str, list[int]]]:
+    """Appelle l'API OpenAI pour classifier les actions (étape 1).
+
+    En mode `chunked`, le plan est découpé en lots de ~CLASSIF_CHUNK_TOKENS
+    classés en parallèle : seule la validation d'un lot en échec est
+    rejouée, et les résultats sont fusionnés dans la même structure
+    `{action_id: {levier: [catégories]}}`.
+    """
+    if not chunked:
+        status_container.write("🤖 Classification des actions (étape 1)...")
+        return _classify_chunk(llm, plan, status_container, "classification", 120000)
+
+    chunks = chunk_plan(plan)
+    taches = {
+        f"lot {i}/{len(chunks)} ({len(chunk)} actions)": chunk
+        for i, chunk in enumerate(chunks, 1)
+    }
+    resultats = _run_concurrently(
+        taches,
+        lambda label, chunk, status: _classify_chunk(
+            llm, chunk, status, f"classification {label}", CLASSIF_CHUNK_MAX_OUTPUT_TOKENS
+        ),
+        status_container,
+        max_concurrence,
+        "🤖 Classification des actions (étape 1)",
+    )
+
+    classification: dict[int, dict[str, list[int]]] = {}
+    for resultat in resultats.values():
+        classification.update(resultat)
+    return classification
+
+
+def classify_actions_mock(
+    plan: pd.DataFrame,
+    status_container,
+    rng: random.Random | None = None,
+) -> dict[int, dict[str, list[int]]]:
+    """Version mock — classification aléatoire levier × catégorie.
+
+    `rng` permet une classification reproductible (batch hors ligne, tests).
+    """
+    status_container.write("🎲 Mode débogage — Classification aléatoire...")
+    rng = rng or random
+
+    result: dict[int, dict[str, list[int]]] = {}
+    for _, row in plan.iterrows():
+        num_leviers = rng.randint(0, min(3, len(LEVIERS_LIST)))
+        if num_leviers == 0:
+            result[int(row.id)] = {}
+        else:
+            mapping: dict[str, list[int]] = {}
+            for levier in rng.sample(LEVIERS_LIST, num_leviers):
+                num_cats = rng.randint(1, 3)
+                mapping[levier] = sorted(rng.sample(list(range(1, 7)), num_cats))
+            result[int(row.id)] = mapping
+
+    return result
+
+
+def _apply_empty_category_override(
+    scores: dict[int, int],
+    actions_by_cat: dict[int, list[int]],
+) -> dict[int, int]:
+    """Force la note à 0 pour les catégories sans action rattachée."""
+    result = dict(scores)
+    for cat in range(1, 7):
+        if not actions_by_cat.get(cat, []):
+            result[cat] = 0
+    return result
+
+
+def score_all_levers(
+    llm: ClientLLM,
+    plan: pd.DataFrame,
+    lever_category_actions: dict[str, dict[int, list[int]]],
+    collectivite_nom: str,
+    population: int,
+    status_container,
+    max_concurrence: int = LLM_MAX_CONCURRENCE,
+) -> dict[str, dict[int, int]]:
+    """Évalue l'activation catégorie par catégorie pour chaque levier actif (étape 2)."""
+
+    def score_levier(levier, actions_by_cat, status):
+        actions_par_categorie = format_actions_by_category(plan, actions_by_cat)
+        prompt = build_prompt_implication(
+            actions_par_categorie,
+            levier,
+            collectivite_nom,
+            population,
+        )
+
+        for attempt in range(1, 4):
+            try:
+                data = llm.appeler_json(
+                    prompt,
+                    f"activation_{levier}",
+                    status,
+                    max_retries=1,
+                    rafraichir=attempt > 1,
+                    etape="notation",
+                    tentative=attempt,
+                )
+                scores = validate_activation_scores(data)
+                return _apply_empty_category_override(scores, actions_by_cat)
+            except (ValueError, RuntimeError) as e:
+                if attempt == 3:
+                    raise RuntimeError(f"Notation impossible pour « {levier} »: {e}") from e
+                status.write(f"🔄 Validation échouée ({levier}), retry {attempt + 1}/3: {e}")
+
+    return _run_concurrently(
+        lever_category_actions, score_levier, status_container, max_concurrence, "📊 Notation"
+    )
+
+
+def score_all_levers_mock(
+    plan: pd.DataFrame,
+    lever_category_actions: dict[str, dict[int, list[int]]],
+    collectivite_nom: str,
+    population: int,
+    status_container,
+    max_concurrence: int = LLM_MAX_CONCURRENCE,
+    rng: random.Random | None = None,
+    delai: float = 0.05,
+) -> dict[str, dict[int, int]]:
+    """Version mock — notes aléatoires 0-3 par catégorie, même chemin concurrent.
+
+    Les notes sont tirées dans l'ordre des leviers (reproductibles avec `rng`),
+    `delai` simule la latence d'un appel.
+    """
+    rng = rng or random
+    notes = {
+        levier: {cat: rng.randint(0, 3) for cat in range(1, 7)}
+        for levier in lever_category_actions
+    }
+
+    def score_levier(levier, actions_by_cat, status):
+        if delai:
+            time.sleep(delai)
+        scores = notes[levier]
+        return _apply_empty_category_override(scores, actions_by_cat)
+
+    return _run_concurrently(
+        lever_category_actions, score_levier, status_container, max_concurrence,
+        "🎲 Notation aléatoire",
+    )
+
+
+def build_priorisation_dataframe(
+    collectivite_id: int,
+    df_leviers_ref: pd.DataFrame,
+    lever_scores: dict[str, dict[int, int]],
+    lever_category_actions: dict[str, dict[int, list[int]]],
+) -> pd.DataFrame:
+    """Construit le dataframe final : une ligne par case levier × catégorie."""
+    rows: list[dict[str, Any]] = []
+    created_at = datetime.now()
+    zero_scores = {cat: 0 for cat in range(1, 7)}
+    empty_actions = {cat: [] for cat in range(1, 7)}
+
+    for _, row in df_leviers_ref.iterrows():
+        levier = row["Leviers SGPE"]
+        scores = lever_scores.get(levier, zero_scores)
+        actions = lever_category_actions.get(levier, empty_actions)
+
+        for cat in range(1, 7):
+            rows.append({
+                "collectivite_id": collectivite_id,
+                "secteur": row["Secteur"],
+                "identifiant_referentiel": row["identifiant_referentiel"],
+                "levier": levier,
+                "categorie": cat,
+                "note": scores.get(cat, 0),
+                "ids": actions.get(cat, []),
+                "created_at": created_at,
+            })
+
+    return pd.DataFrame(rows)
+
+
+def priorisation_to_records(df: pd.DataFrame) -> pd.DataFrame:
+    """Prépare le résultat pour l'écriture : `ids` sérialisé en JSON."""
+    df_to_save = df.copy()
+    if "ids" in df_to_save.columns:
+        df_to_save["ids"] = df_to_save["ids"].apply(
+            lambda x: json.dumps(x) if isinstance(x, list) else x
+        )
+    return df_to_save
+
+
+def _remplacer(conn, table: str, df: pd.DataFrame) -> None:
+    """Supprime les lignes des collectivités de `df` puis les réinsère en bulk."""
+    ids = sorted({int(i) for i in df["collectivite_id"].unique()})
+    conn.execute(
+        text(f"DELETE FROM {table} WHERE collectivite_id = ANY(:ids)"),
+        {"ids": ids},
+    )
+    bulk_insert(conn, table, df, method="copy")
+
+
+def save_priorisation(engine, df: pd.DataFrame) -> None:
+    """Remplace les lignes `priorisation` des collectivités présentes dans `df`.
+
+    Une seule transaction pour toutes les collectivités : suppression par
+    `ANY(:ids)` puis COPY. À n'appeler qu'avec l'engine OLAP (get_engine).
+    """
+    if df.empty:
+        return
+    with engine.begin() as conn:
+        _remplacer(conn, "priorisation", priorisation_to_records(df))
+
+
+def save_reductions(engine, df: pd.DataFrame) -> None:
+    """Remplace les lignes `priorisation_reduction_levier` des collectivités de `df`.
+
+    `df` contient `collectivite_id`, `levier`, `reduction`. Même principe que
+    `save_priorisation` : une transaction, OLAP uniquement.
+    """
+    if df.empty:
+        return
+    with engine.begin() as conn:
+        _remplacer(
+            conn, "priorisation_reduction_levier",
+            df[["collectivite_id", "levier", "reduction"]],
+        )
+
+
+def save_resultats(engine, df_priorisation: pd.DataFrame, df_reductions: pd.DataFrame) -> None:
+    """Remplace réductions et priorisation des collectivités en une seule transaction.
+
+    Un échec de l'une des deux écritures annule l'autre : l'OLAP ne mélange
+    jamais nouvelles réductions et ancienne priorisation. OLAP uniquement.
+    """
+    with engine.begin() as conn:
+        if not df_reductions.empty:
+            _remplacer(
+                conn, "priorisation_reduction_levier",
+                df_reductions[["collectivite_id", "levier", "reduction"]],
+            )
+        if not df_priorisation.empty:
+            _remplacer(conn, "priorisation", priorisation_to_records(df_priorisation))
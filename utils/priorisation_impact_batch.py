@@ -0,0 +1,664 @@
+"""Exécution batch de la priorisation levier × catégorie (hors Streamlit).
+
+Enchaîne le pipeline de la page 26 sur une liste de collectivités avec un
+pool de workers :
+
+    python -m utils.priorisation_impact_batch 1234 5678 --workers 4
+    python -m utils.priorisation_impact_batch --all
+    python -m utils.priorisation_impact_batch --mock --plans-csv plans.csv --sortie-csv out/
+    python -m utils.priorisation_impact_batch --all --reductions-seules
+
+Chaque collectivité écrite est notée dans un checkpoint SQLite (.cache/) :
+une relance ne refait que les collectivités manquantes ou en échec
+(`--force` pour tout refaire, réductions SNBC comprises). Les résultats sont écrits en bulk sur l'OLAP
+(get_engine), par paquets de `--flush-every` collectivités, chaque paquet
+dans une transaction. Un rapport (durées par étape, appels et tokens LLM)
+est affiché en fin de run et peut être écrit en CSV.
+
+Les réductions SNBC de toutes les collectivités du run sont récupérées en
+amont, en parallèle, et gardées en cache disque (utils.reductions_snbc).
+`--reductions-seules` s'arrête là : les réductions de toutes les
+collectivités sont écrites en une seule transaction, sans appel LLM.
+
+Avec `--mock`, classification, notation et réductions SNBC sont aléatoires
+(graine fixe) : combiné à `--plans-csv` et `--sortie-csv`, le run ne touche
+ni base, ni API, ni LLM (CI).
+
+`tache_priorisation` exécute le même pipeline pour une collectivité comme
+tâche de fond (utils.taches_fond), soumise par la page 26. Son mode
+débogage garde les vraies réductions SNBC et le hors-compétence, avec une
+classification et une notation aléatoires, et n'écrit rien.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils import priorisation_impact as pi
+from utils.reductions_snbc import ServiceReductions
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache"
+CHECKPOINT_PATH = CACHE_DIR / "priorisation_impact_checkpoint.sqlite"
+NB_WORKERS = 2
+FLUSH_EVERY = 20
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint (
+    collectivite_id INTEGER NOT NULL,
+    mode TEXT NOT NULL,
+    statut TEXT NOT NULL,
+    nb_actions INTEGER,
+    nb_cases INTEGER,
+    duree_s REAL,
+    appels_llm INTEGER,
+    tokens_entree INTEGER,
+    tokens_sortie INTEGER,
+    erreur TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (collectivite_id, mode)
+);
+"""
+
+
+class _Console:
+    """Container de statut minimal : préfixe les messages par la collectivité."""
+
+    def __init__(self, prefixe: str, verbeux: bool):
+        self.prefixe = prefixe
+        self.verbeux = verbeux
+
+    def write(self, message: str) -> None:
+        if self.verbeux:
+            print(f"[{self.prefixe}] {message}", flush=True)
+
+
+class Checkpoint:
+    """État par collectivité des runs batch, dans une base SQLite locale."""
+
+    def __init__(self, path: Path | str = CHECKPOINT_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path)
+
+    def terminees(self, mode: str) -> set[int]:
+        """Collectivités déjà écrites avec succès dans ce mode."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT collectivite_id FROM checkpoint WHERE mode = ? AND statut = 'ok'",
+                (mode,),
+            ).fetchall()
+        return {int(row[0]) for row in rows}
+
+    def enregistrer(self, mode: str, resultats: list[ResultatCollectivite]) -> None:
+        """Enregistre (ou remplace) l'état des collectivités d'un paquet."""
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO checkpoint VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        r.collectivite_id, mode, r.statut, r.nb_actions, r.nb_cases,
+                        round(r.duree_s, 3), r.appels_llm, r.tokens_entree,
+                        r.tokens_sortie, r.erreur, now,
+                    )
+                    for r in resultats
+                ],
+            )
+
+
+@dataclass
+class ResultatCollectivite:
+    """Issue du pipeline pour une collectivité, avec ses mesures."""
+
+    collectivite_id: int
+    statut: str = "ok"
+    nb_actions: int = 0
+    nb_cases: int = 0
+    duree_s: float = 0.0
+    durees: dict[str, float] = field(default_factory=dict)
+    appels_llm: int = 0
+    appels_cache: int = 0
+    tokens_entree: int = 0
+    tokens_sortie: int = 0
+    erreur: str | None = None
+    # Indicateurs SNBC absents pour la collectivité (`identifiantManquants` de l'API).
+    identifiants_manquants: list[str] = field(default_factory=list)
+    df_priorisation: pd.DataFrame | None = field(default=None, repr=False)
+    df_reductions: pd.DataFrame | None = field(default=None, repr=False)
+    # Sorties intermédiaires des étapes 1 et 2, pour les tableaux de contrôle.
+    lever_category_actions: dict[str, dict[int, list[int]]] | None = field(default=None, repr=False)
+    lever_scores: dict[str, dict[int, int]] | None = field(default=None, repr=False)
+
+
+@dataclass
+class ContexteBatch:
+    """Paramètres et ressources partagés par tous les workers."""
+
+    df_leviers_ref: pd.DataFrame
+    plans: dict[int, pd.DataFrame]
+    collectivites: dict[int, dict[str, Any]]
+    mock: bool = False
+    graine: int = 0
+    llm_concurrence: int = pi.LLM_MAX_CONCURRENCE
+    chunked: bool = True
+    effort: str = "medium"
+    openai_client: Any = None
+    limiteur: Any = None
+    # ServiceReductions (utils.reductions_snbc) : API SNBC avec cache disque.
+    # Absent en mode mock : réductions aléatoires.
+    reductions: Any = None
+    verbeux: bool = False
+
+
+def traiter_collectivite(ctx: ContexteBatch, collectivite_id: int, status=None) -> ResultatCollectivite:
+    """Pipeline complet pour une collectivité, sans écriture (faite par paquets).
+
+    `status` reçoit les messages d'avancement (`write`) ; par défaut la console.
+    """
+    resultat = ResultatCollectivite(collectivite_id)
+    status = status or _Console(str(collectivite_id), ctx.verbeux)
+    debut = time.perf_counter()
+
+    def etape(nom: str, t0: float) -> float:
+        t1 = time.perf_counter()
+        resultat.durees[nom] = round(t1 - t0, 3)
+        return t1
+
+    llm = None
+    try:
+        t = time.perf_counter()
+        plan = ctx.plans.get(collectivite_id)
+        if plan is None or plan.empty:
+            raise ValueError("aucune action dans le plan")
+        resultat.nb_actions = len(plan)
+        infos = ctx.collectivites.get(collectivite_id, {})
+        nom = str(infos.get("nom") or collectivite_id)
+        population = int(infos.get("population") or 0)
+
+        rng = random.Random(f"{ctx.graine}-{collectivite_id}")
+        if ctx.mock and ctx.reductions is None:
+            df_reductions, identifiants_manquants = pi.reductions_mock(rng)
+        else:
+            df_reductions, identifiants_manquants = ctx.reductions.reductions(collectivite_id)
+        resultat.identifiants_manquants = list(identifiants_manquants)
+        df_reductions = df_reductions.assign(collectivite_id=collectivite_id)
+        t = etape("reductions", t)
+
+        if ctx.mock:
+            classification = pi.classify_actions_mock(plan, status, rng=rng)
+        else:
+            llm = pi.ClientLLM(ctx.openai_client, ctx.limiteur, effort=ctx.effort)
+            classification = pi.classify_actions(
+                llm, plan, status, chunked=ctx.chunked, max_concurrence=ctx.llm_concurrence
+            )
+        lever_category_actions = pi.group_actions_by_lever_and_category(classification)
+        resultat.lever_category_actions = lever_category_actions
+        t = etape("classification", t)
+
+        if ctx.mock:
+            lever_scores = pi.score_all_levers_mock(
+                plan, lever_category_actions, nom, population, status,
+                max_concurrence=ctx.llm_concurrence, rng=rng, delai=0,
+            )
+        else:
+            lever_scores = pi.score_all_levers(
+                llm, plan, lever_category_actions, nom, population, status,
+                max_concurrence=ctx.llm_concurrence,
+            )
+        resultat.lever_scores = lever_scores
+        t = etape("notation", t)
+
+        df_priorisation = pi.build_priorisation_dataframe(
+            collectivite_id, ctx.df_leviers_ref, lever_scores, lever_category_actions
+        )
+        etape("construction", t)
+
+        resultat.nb_cases = len(df_priorisation)
+        resultat.df_priorisation = df_priorisation
+        resultat.df_reductions = df_reductions
+    except Exception as e:
+        resultat.statut = "echec"
+        resultat.erreur = f"{type(e).__name__}: {e}"
+
+    if llm is not None:
+        for cle, valeur in llm.rapport().items():
+            setattr(resultat, cle, valeur)
+    resultat.duree_s = time.perf_counter() - debut
+    return resultat
+
+
+def ecrire_paquet(resultats: list[ResultatCollectivite], engine=None, sortie_csv: Path | None = None) -> None:
+    """Écrit les résultats réussis d'un paquet : OLAP en bulk, ou CSV hors ligne."""
+    ok = [r for r in resultats if r.statut == "ok"]
+    if not ok:
+        return
+    df_priorisation = pd.concat([r.df_priorisation for r in ok], ignore_index=True)
+    df_reductions = pd.concat([r.df_reductions for r in ok], ignore_index=True)
+
+    if sortie_csv is not None:
+        sortie_csv.mkdir(parents=True, exist_ok=True)
+        for nom, df in (
+            ("priorisation.csv", pi.priorisation_to_records(df_priorisation)),
+            ("priorisation_reduction_levier.csv", df_reductions),
+        ):
+            chemin = sortie_csv / nom
+            df.to_csv(chemin, mode="a", header=not chemin.exists(), index=False)
+        return
+
+    pi.save_resultats(engine, df_priorisation, df_reductions)
+
+
+def ecrire_reductions(ids: list[int], sortie_csv: Path | None = None, *, rafraichir: bool = False) -> int:
+    """Réductions SNBC de toutes les collectivités, écrites en une transaction (OLAP) ou en CSV."""
+    service = ServiceReductions(_secret("api_prod_url"), _secret("api_prod_token"))
+    debut = time.perf_counter()
+    df_reductions, erreurs = service.reductions_plusieurs(ids, rafraichir=rafraichir)
+    print(
+        f"📉 {len(ids) - len(erreurs)}/{len(ids)} collectivité(s) en {time.perf_counter() - debut:.1f}s — "
+        f"{service.nb_cache} en cache, {service.nb_appels} appel(s) API",
+        flush=True,
+    )
+    for cid, e in sorted(erreurs.items()):
+        print(f"❌ {cid} : {type(e).__name__}: {e}", flush=True)
+
+    if sortie_csv is not None:
+        sortie_csv.mkdir(parents=True, exist_ok=True)
+        df_reductions.to_csv(sortie_csv / "priorisation_reduction_levier.csv", index=False)
+    else:
+        # Écriture uniquement sur l'OLAP, jamais sur la base de prod.
+        from utils.db import get_engine
+
+        pi.save_reductions(get_engine(), df_reductions)
+    return 0 if not erreurs else 1
+
+
+def rapport(resultats: list[ResultatCollectivite]) -> pd.DataFrame:
+    """Une ligne par collectivité : statut, volumes, durées par étape, appels et tokens."""
+    lignes = []
+    for r in resultats:
+        ligne = asdict(r)
+        for cle in ("df_priorisation", "df_reductions", "lever_category_actions", "lever_scores"):
+            ligne.pop(cle)
+        ligne["identifiants_manquants"] = ", ".join(ligne["identifiants_manquants"])
+        durees = ligne.pop("durees")
+        ligne["duree_s"] = round(ligne["duree_s"], 3)
+        ligne.update({f"t_{etape}": duree for etape, duree in durees.items()})
+        lignes.append(ligne)
+    return pd.DataFrame(lignes)
+
+
+def executer_batch(
+    ctx: ContexteBatch,
+    collectivite_ids: list[int],
+    *,
+    checkpoint: Checkpoint,
+    workers: int = NB_WORKERS,
+    flush_every: int = FLUSH_EVERY,
+    force: bool = False,
+    engine=None,
+    sortie_csv: Path | None = None,
+) -> pd.DataFrame:
+    """Traite les collectivités en parallèle et renvoie le rapport du run.
+
+    Les collectivités déjà `ok` dans le checkpoint sont sautées (sauf
+    `force`, qui redemande aussi les réductions SNBC en cache). Un paquet n'est marqué `ok` qu'après son écriture : en cas
+    d'interruption, la relance reprend au premier paquet non écrit.
+    """
+    mode = "mock" if ctx.mock else "llm"
+    deja_faites = set() if force else checkpoint.terminees(mode)
+    a_traiter = [cid for cid in collectivite_ids if cid not in deja_faites]
+    print(
+        f"🚀 {len(a_traiter)} collectivité(s) à traiter "
+        f"({len(collectivite_ids) - len(a_traiter)} déjà faite(s)), {workers} worker(s)",
+        flush=True,
+    )
+
+    if ctx.reductions is not None and a_traiter:
+        # Réductions SNBC de tout le run en amont, en parallèle (cache disque) ;
+        # une collectivité en erreur est retentée, puis mise en échec, par son worker.
+        erreurs = ctx.reductions.precharger(a_traiter, rafraichir=force)
+        print(
+            f"📉 Réductions SNBC : {ctx.reductions.nb_cache} en cache, "
+            f"{ctx.reductions.nb_appels} appel(s) API, {len(erreurs)} erreur(s)",
+            flush=True,
+        )
+
+    resultats: list[ResultatCollectivite] = []
+    paquet: list[ResultatCollectivite] = []
+
+    def flush() -> None:
+        if not paquet:
+            return
+        try:
+            ecrire_paquet(paquet, engine, sortie_csv)
+        except Exception as e:
+            for r in paquet:
+                if r.statut == "ok":
+                    r.statut, r.erreur = "echec", f"écriture: {type(e).__name__}: {e}"
+        checkpoint.enregistrer(mode, paquet)
+        paquet.clear()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(traiter_collectivite, ctx, cid) for cid in a_traiter]
+        for done, future in enumerate(as_completed(futures), 1):
+            r = future.result()
+            resultats.append(r)
+            paquet.append(r)
+            icone = "✅" if r.statut == "ok" else "❌"
+            print(
+                f"{icone} ({done}/{len(a_traiter)}) {r.collectivite_id} : "
+                f"{r.nb_actions} actions, {r.duree_s:.1f}s"
+                + (f" — {r.erreur}" if r.erreur else ""),
+                flush=True,
+            )
+            if len(paquet) >= flush_every:
+                flush()
+        flush()
+
+    # Libère les DataFrames : seul le rapport est conservé.
+    for r in resultats:
+        r.df_priorisation = r.df_reductions = None
+        r.lever_category_actions = r.lever_scores = None
+    df_rapport = rapport(resultats)
+    if not df_rapport.empty:
+        df_rapport = df_rapport.sort_values("collectivite_id").reset_index(drop=True)
+    return df_rapport
+
+
+_limiteur: Any = None
+_limiteur_lock = threading.Lock()
+
+
+def _limiteur_process():
+    """Seau à jetons partagé par toutes les tâches du process de workers (même clé API)."""
+    global _limiteur
+    with _limiteur_lock:
+        if _limiteur is None:
+            _limiteur = pi.new_rate_limiter()
+        return _limiteur
+
+
+def tache_priorisation(
+    contexte,
+    collectivite_id: int,
+    *,
+    mock: bool = False,
+    ecrire: bool = True,
+    full_access: bool = False,
+    rafraichir_snbc: bool = False,
+    chunked: bool = True,
+    effort: str = "medium",
+    llm_concurrence: int = pi.LLM_MAX_CONCURRENCE,
+) -> dict[str, Any]:
+    """Tâche de fond de la page 26 : pipeline complet puis écriture sur l'OLAP.
+
+    `contexte` est le `ContexteTache` (progression, journal, annulation).
+    `mock` rend classification et notation aléatoires ; les réductions SNBC
+    et le hors-compétence restent calculés. `rafraichir_snbc` redemande les
+    réductions à l'API au lieu du cache disque. Renvoie les résultats affichés
+    par la page (plan, réductions et indicateurs manquants, tableaux de
+    contrôle des étapes 1 et 2, priorisation, rapport d'exécution).
+    """
+    from utils.db import get_engine, get_engine_prod
+
+    contexte.progression(0.02, "📋 Récupération du plan d'actions...")
+    df_leviers_ref = pi.load_leviers_ref()
+    if df_leviers_ref is None:
+        raise FileNotFoundError(f"Référentiel introuvable : {pi.RATIOS_CSV}")
+    engine_prod = get_engine_prod()
+    plans = pi.fetch_plans_actions(engine_prod, [collectivite_id], full_access)
+    ctx = ContexteBatch(
+        df_leviers_ref=df_leviers_ref,
+        plans=plans,
+        collectivites=_charger_collectivites(engine_prod, [collectivite_id]),
+        mock=mock,
+        llm_concurrence=llm_concurrence,
+        chunked=chunked,
+        effort=effort,
+    )
+    # Même en mode débogage, les réductions viennent de l'API SNBC.
+    ctx.reductions = ServiceReductions(_secret("api_prod_url"), _secret("api_prod_token"))
+    if not mock:
+        from openai import OpenAI
+
+        ctx.openai_client = OpenAI(api_key=_secret("OPENAI_API_KEY"))
+        ctx.limiteur = _limiteur_process()
+    nb_actions = len(plans.get(collectivite_id, []))
+    contexte.log(f"✅ {nb_actions} actions récupérées")
+
+    if rafraichir_snbc:
+        contexte.progression(0.05, "📉 Rafraîchissement des réductions SNBC...")
+        _, erreurs = ctx.reductions.reductions_plusieurs([collectivite_id], rafraichir=True)
+        if erreurs:
+            raise erreurs[collectivite_id]
+
+    contexte.progression(0.1, "🤖 Réductions SNBC, classification et notation...")
+    resultat = traiter_collectivite(ctx, collectivite_id, status=contexte)
+    # Une annulation pendant le pipeline y est vue comme un échec : on la relève ici.
+    contexte.verifier_annulation()
+    if resultat.statut != "ok":
+        raise RuntimeError(resultat.erreur)
+    if resultat.identifiants_manquants:
+        contexte.log(
+            "⚠️ Indicateurs SNBC manquants pour cette collectivité : "
+            + ", ".join(resultat.identifiants_manquants)
+        )
+
+    if ecrire:
+        contexte.progression(0.9, "💾 Sauvegarde dans la base de données OLAP...")
+        # Écriture uniquement sur l'OLAP, jamais sur la base de prod.
+        ecrire_paquet([resultat], get_engine())
+        contexte.log("✅ Données sauvegardées dans `priorisation` et `priorisation_reduction_levier` (OLAP)")
+    else:
+        contexte.log("ℹ️ Mode débogage — priorisation et réductions non sauvegardées.")
+
+    contexte.progression(0.95, "🧭 Calcul du hors-compétence (compétences BANATIC)...")
+    try:
+        from utils import priorisation_competence as pc
+
+        hors_competence = pc.compute_hors_competence_for_collectivite(collectivite_id)
+        anomalies = pc.check_invariants(hors_competence)
+        if anomalies:
+            contexte.log("⚠️ Anomalies sur les invariants hors-compétence :\n- " + "\n- ".join(anomalies))
+        contexte.log(f"✅ {len(hors_competence)} volets hors compétence calculés")
+        if ecrire:
+            nb = pc.save_hors_competence(collectivite_id, hors_competence)
+            contexte.log(f"✅ {nb} volets sauvegardés dans `priorisation_hors_competence` (OLAP)")
+        else:
+            contexte.log("ℹ️ Mode débogage — hors-compétence non sauvegardé.")
+    except Exception as e:
+        # Étape secondaire : ne bloque pas le diagnostic déjà enregistré.
+        contexte.log(f"⚠️ Hors-compétence non calculé/sauvegardé : {e}")
+
+    contexte.progression(1.0, "✅ Exécution terminée")
+    # to_json : types numpy convertis (résultat stocké en JSON dans la file).
+    tableaux = {
+        "plan": plans[collectivite_id],
+        "reductions": resultat.df_reductions,
+        "classification": pi.classification_debug(resultat.lever_category_actions),
+        "notes": pi.scores_debug(resultat.lever_scores),
+        "priorisation": resultat.df_priorisation,
+    }
+    return {
+        **{cle: json.loads(df.to_json(orient="records")) for cle, df in tableaux.items()},
+        "identifiants_manquants": resultat.identifiants_manquants,
+        "rapport": json.loads(rapport([resultat]).to_json(orient="records"))[0],
+    }
+
+
+def _secret(cle: str, defaut: str = "") -> str:
+    """Secret Streamlit si disponible, sinon variable d'environnement."""
+    try:
+        import streamlit as st
+
+        valeur = st.secrets.get(cle)
+        if valeur:
+            return str(valeur)
+    except Exception:
+        pass
+    return os.getenv(cle, defaut)
+
+
+def _charger_plans_csv(path: Path) -> tuple[dict[int, pd.DataFrame], dict[int, dict[str, Any]]]:
+    """Plans et infos collectivités depuis un CSV (collectivite_id, id, titre, description[, nom, population])."""
+    df = pd.read_csv(path)
+    plans = {
+        int(cid): groupe[["id", "titre", "description"]].reset_index(drop=True)
+        for cid, groupe in df.groupby("collectivite_id")
+    }
+    infos_cols = [c for c in ("nom", "population") if c in df.columns]
+    collectivites = {
+        int(cid): groupe[infos_cols].iloc[0].to_dict() if infos_cols else {}
+        for cid, groupe in df.groupby("collectivite_id")
+    }
+    return plans, collectivites
+
+
+def _charger_collectivites(engine_prod, ids: list[int]) -> dict[int, dict[str, Any]]:
+    with engine_prod.connect() as conn:
+        df = pd.read_sql_query(
+            text("SELECT id, nom, population FROM collectivite WHERE id = ANY(:ids)"),
+            conn,
+            params={"ids": ids},
+        )
+    return {int(row.id): {"nom": row.nom, "population": row.population} for row in df.itertuples()}
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m utils.priorisation_impact_batch",
+        description="Priorisation levier × catégorie pour plusieurs collectivités.",
+    )
+    parser.add_argument("collectivite_ids", nargs="*", type=int, help="Identifiants à traiter")
+    parser.add_argument("--all", action="store_true", help="Toutes les collectivités ayant un plan")
+    parser.add_argument("--mock", action="store_true", help="Classification/notation/réductions aléatoires")
+    parser.add_argument("--graine", type=int, default=0, help="Graine des tirages mock")
+    parser.add_argument("--plans-csv", type=Path, help="Plans d'actions depuis un CSV (hors ligne)")
+    parser.add_argument("--sortie-csv", type=Path, help="Écrit les résultats en CSV au lieu de l'OLAP")
+    parser.add_argument("--workers", type=int, default=NB_WORKERS, help="Collectivités en parallèle")
+    parser.add_argument("--llm-concurrence", type=int, default=pi.LLM_MAX_CONCURRENCE,
+                        help="Appels LLM en parallèle par collectivité")
+    parser.add_argument("--sans-lots", action="store_true", help="Classification en un seul prompt")
+    parser.add_argument("--low-reasoning", action="store_true", help="Effort de raisonnement bas")
+    parser.add_argument("--inclure-restreintes", action="store_true", help="Inclut les fiches restreintes")
+    parser.add_argument("--flush-every", type=int, default=FLUSH_EVERY,
+                        help="Collectivités par écriture bulk")
+    parser.add_argument("--checkpoint", type=Path, default=CHECKPOINT_PATH)
+    parser.add_argument("--force", action="store_true", help="Ignore le checkpoint et le cache SNBC")
+    parser.add_argument("--rapport", type=Path, help="Écrit le rapport en CSV")
+    parser.add_argument("--reductions-seules", action="store_true",
+                        help="Écrit seulement les réductions SNBC (une transaction, sans LLM)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Affiche le détail des étapes")
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = _parser().parse_args(argv)
+    if not args.collectivite_ids and not args.all and not args.plans_csv:
+        _parser().error("indiquez des identifiants, --all ou --plans-csv")
+    if args.reductions_seules and args.mock:
+        _parser().error("--reductions-seules interroge l'API SNBC : incompatible avec --mock")
+
+    df_leviers_ref = pi.load_leviers_ref()
+    if df_leviers_ref is None:
+        print(f"❌ Référentiel introuvable : {pi.RATIOS_CSV}", file=sys.stderr)
+        return 2
+
+    engine_prod = None
+    if args.plans_csv:
+        plans, collectivites = _charger_plans_csv(args.plans_csv)
+        ids = args.collectivite_ids or sorted(plans)
+    else:
+        from utils.db import get_engine_prod
+
+        engine_prod = get_engine_prod()
+        ids = args.collectivite_ids or pi.fetch_collectivites_avec_plan(
+            engine_prod, args.inclure_restreintes
+        )
+        if not args.reductions_seules:
+            plans = pi.fetch_plans_actions(engine_prod, ids, args.inclure_restreintes)
+            collectivites = _charger_collectivites(engine_prod, ids)
+
+    if args.reductions_seules:
+        return ecrire_reductions(ids, args.sortie_csv, rafraichir=args.force)
+
+    ctx = ContexteBatch(
+        df_leviers_ref=df_leviers_ref,
+        plans=plans,
+        collectivites=collectivites,
+        mock=args.mock,
+        graine=args.graine,
+        llm_concurrence=args.llm_concurrence,
+        chunked=not args.sans_lots,
+        effort="low" if args.low_reasoning else "medium",
+        verbeux=args.verbose,
+    )
+    if not args.mock:
+        from openai import OpenAI
+
+        ctx.openai_client = OpenAI(api_key=_secret("OPENAI_API_KEY"))
+        ctx.limiteur = pi.new_rate_limiter()
+        ctx.reductions = ServiceReductions(_secret("api_prod_url"), _secret("api_prod_token"))
+
+    engine = None
+    if args.sortie_csv is None:
+        # Écriture uniquement sur l'OLAP, jamais sur la base de prod.
+        from utils.db import get_engine
+
+        engine = get_engine()
+
+    debut = time.perf_counter()
+    df_rapport = executer_batch(
+        ctx,
+        ids,
+        checkpoint=Checkpoint(args.checkpoint),
+        workers=args.workers,
+        flush_every=args.flush_every,
+        force=args.force,
+        engine=engine,
+        sortie_csv=args.sortie_csv,
+    )
+    duree = time.perf_counter() - debut
+
+    if df_rapport.empty:
+        print("ℹ️ Rien à faire : toutes les collectivités sont déjà traitées.")
+        return 0
+
+    nb_ok = int((df_rapport["statut"] == "ok").sum())
+    print("\n📊 Rapport")
+    print(df_rapport.drop(columns=["erreur"]).to_string(index=False))
+    print(
+        f"\n{nb_ok}/{len(df_rapport)} collectivité(s) OK en {duree:.1f}s — "
+        f"{int(df_rapport['appels_llm'].sum())} appels LLM, "
+        f"{int(df_rapport['tokens_entree'].sum()):,} tokens en entrée, "
+        f"{int(df_rapport['tokens_sortie'].sum()):,} en sortie"
+    )
+    if args.rapport:
+        args.rapport.parent.mkdir(parents=True, exist_ok=True)
+        df_rapport.to_csv(args.rapport, index=False)
+        print(f"💾 Rapport écrit dans {args.rapport}")
+    return 0 if nb_ok == len(df_rapport) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Index plein texte en mémoire des fiches action (benchmark, page 28).
+
+Remplace les recherches `ILIKE '%mot%'` (un scan séquentiel de
+public.fiche_action par recherche) : les titres et descriptions sont chargés
+une fois depuis la base, indexés en BM25 (utils.recherche_texte, titre
+pondéré x3 comme l'ancien score) puis tenus à jour en relisant seulement les
+fiches dont `modified_at` a avancé depuis la dernière synchronisation.
+Les fiches supprimées (`deleted`) sortent de l'index au passage.
+"""
+
+from __future__ import annotations
+
+import heapq
+import threading
+import time
+from typing import Any, Iterable
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.recherche_texte import IndexBM25
+
+POIDS_TITRE = 3.0
+POIDS_DESCRIPTION = 1.0
+# Délai minimal entre deux synchronisations incrémentales.
+INTERVALLE_SYNCHRO_S = 300
+
+_SQL_FICHES = """
+    SELECT
+        fa.id,
+        c.nom AS collectivite,
+        fa.titre,
+        COALESCE(fa.description, '') AS description,
+        COALESCE(fa.deleted, FALSE) AS deleted,
+        fa.modified_at
+    FROM public.fiche_action fa
+    JOIN public.collectivite c ON c.id = fa.collectivite_id
+    WHERE c.type != 'test'
+      {filtre}
+"""
+
+
+class IndexFiches:
+    """Index BM25 des fiches action d'une base, synchronisé par `modified_at`.
+
+    Partagé entre sessions (st.cache_resource) : synchronisation et recherche
+    sont protégées par un verrou.
+    """
+
+    def __init__(self, engine, intervalle_synchro_s: float = INTERVALLE_SYNCHRO_S):
+        self.engine = engine
+        self.intervalle_synchro_s = intervalle_synchro_s
+        self.index = IndexBM25({"titre": POIDS_TITRE, "description": POIDS_DESCRIPTION})
+        self.fiches: dict[int, tuple[str, str, str]] = {}
+        self.derniere_modif: pd.Timestamp | None = None
+        self._derniere_synchro = 0.0
+        self._lock = threading.Lock()
+
+    def _charger(self) -> pd.DataFrame:
+        if self.derniere_modif is None:
+            filtre, params = "", {}
+        else:
+            filtre, params = "AND fa.modified_at > :depuis", {"depuis": self.derniere_modif.to_pydatetime()}
+        with self.engine.connect() as conn:
+            return pd.read_sql_query(text(_SQL_FICHES.format(filtre=filtre)), conn, params=params)
+
+    def appliquer(self, df: pd.DataFrame) -> int:
+        """Intègre des lignes (id, collectivite, titre, description, deleted, modified_at)."""
+        for row in df.itertuples(index=False):
+            fiche_id = int(row.id)
+            if row.deleted:
+                self.index.supprimer(fiche_id)
+                self.fiches.pop(fiche_id, None)
+                continue
+            titre, description = str(row.titre or ""), str(row.description or "")
+            self.index.ajouter(fiche_id, {"titre": titre, "description": description})
+            self.fiches[fiche_id] = (str(row.collectivite or ""), titre, description)
+        if not df.empty and df["modified_at"].notna().any():
+            plus_recente = pd.Timestamp(df["modified_at"].max())
+            if self.derniere_modif is None or plus_recente > self.derniere_modif:
+                self.derniere_modif = plus_recente
+        return len(df)
+
+    def synchroniser(self, forcer: bool = False) -> int:
+        """Charge tout au premier appel, puis les seules fiches modifiées ; renvoie le nb de lignes lues."""
+        with self._lock:
+            if not forcer and self.fiches and time.monotonic() - self._derniere_synchro < self.intervalle_synchro_s:
+                return 0
+            nb = self.appliquer(self._charger())
+            self._derniere_synchro = time.monotonic()
+            return nb
+
+    def rechercher(self, mots_cles: Iterable[str], limite: int = 50) -> list[dict[str, Any]]:
+        """Fiches les plus pertinentes : [{collectivite, titre, description, score}], score décroissant."""
+        with self._lock:
+            scores = self.index.scores(list(mots_cles))
+            meilleurs = heapq.nsmallest(
+                limite, scores.items(), key=lambda item: (-item[1], self.fiches[item[0]][1])
+            )
+            return [
+                {
+                    "collectivite": self.fiches[fiche_id][0],
+                    "titre": self.fiches[fiche_id][1],
+                    "description": self.fiches[fiche_id][2],
+                    "score": round(score, 2),
+                }
+                for fiche_id, score in meilleurs
+            ]
@@ -0,0 +1,166 @@
+"""Recherche plein texte locale : tokenisation française et index BM25.
+
+Utilisé pour pré-sélectionner des candidats avant un appel LLM (page 07,
+indicateurs) et pour la recherche de fiches action du benchmark (page 28),
+sans aller-retour base ni dépendance externe.
+
+Les textes sont mis en minuscules, désaccentués, découpés en mots, filtrés
+des mots vides puis réduits par une racinisation légère (pluriels et
+suffixes courants) : « Mobilités douces » et « mobilité douce » donnent les
+mêmes termes. L'index pondère les champs (ex. titre x3, description x1),
+façon BM25F, et se met à jour document par document.
+"""
+
+from __future__ import annotations
+
+import heapq
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from functools import lru_cache
+from typing import Hashable, Iterable, Mapping
+
+STOPWORDS_FR = frozenset(
+    """
+    a au aux avec ce ces dans de des du elle en et eux il ils je la le les leur
+    leurs lui ma mais me meme mes moi mon ne nos notre nous on ou par pas pour
+    qu que qui sa se ses son sur ta te tes toi ton tu un une vos votre vous
+    c d j l m n s t y ete etre est sont cette cet ainsi afin plus tout tous
+    toute toutes selon entre vers chez sous sans
+    """.split()
+)
+
+# Suffixes retirés (le plus long d'abord), si la racine garde au moins 4 lettres.
+_SUFFIXES = sorted(
+    [
+        "issement", "issements", "ement", "ements", "ation", "ations", "ateur",
+        "ateurs", "atrice", "atrices", "ance", "ances", "ence", "ences", "isme",
+        "ismes", "iste", "istes", "ite", "ites", "ique", "iques", "euse", "euses",
+        "eur", "eurs", "ive", "ives", "if", "ifs", "ment", "ee", "ees", "e",
+    ],
+    key=len,
+    reverse=True,
+)
+_MOT = re.compile(r"[a-z0-9]+")
+
+
+def normaliser(texte: str) -> str:
+    """Minuscules sans accents (œ -> oe, æ -> ae)."""
+    texte = unicodedata.normalize("NFD", str(texte).lower().replace("œ", "oe").replace("æ", "ae"))
+    return "".join(ch for ch in texte if unicodedata.category(ch) != "Mn")
+
+
+@lru_cache(maxsize=200_000)
+def raciniser(mot: str) -> str:
+    """Racinisation légère : pluriels puis un suffixe courant."""
+    if len(mot) <= 3 or mot.isdigit():
+        return mot
+    if mot.endswith("eaux"):
+        mot = mot[:-1]
+    elif mot.endswith("aux") and len(mot) > 5:
+        mot = mot[:-3] + "al"
+    elif mot[-1] in "sx":
+        mot = mot[:-1]
+    for suffixe in _SUFFIXES:
+        if mot.endswith(suffixe) and len(mot) - len(suffixe) >= 4:
+            return mot[: -len(suffixe)]
+    return mot
+
+
+def tokeniser(texte: str | None) -> list[str]:
+    """Termes indexables d'un texte (ordre conservé, doublons inclus)."""
+    if not texte:
+        return []
+    return [
+        raciniser(mot)
+        for mot in _MOT.findall(normaliser(texte))
+        if mot not in STOPWORDS_FR and (len(mot) > 1 or mot.isdigit())
+    ]
+
+
+class IndexBM25:
+    """Index inversé BM25 en mémoire, multi-champs pondérés, mis à jour par document.
+
+    `ajouter` remplace un document déjà présent : une mise à jour incrémentale
+    consiste à ré-ajouter les documents modifiés et `supprimer` les disparus.
+    """
+
+    def __init__(self, poids_champs: Mapping[str, float] | None = None, k1: float = 1.2, b: float = 0.75):
+        self.poids_champs = dict(poids_champs or {"texte": 1.0})
+        self.k1 = k1
+        self.b = b
+        self._postings: dict[str, dict[Hashable, float]] = defaultdict(dict)
+        self._termes_doc: dict[Hashable, dict[str, float]] = {}
+        self._longueurs: dict[Hashable, float] = {}
+        self._longueur_totale = 0.0
+
+    def __len__(self) -> int:
+        return len(self._longueurs)
+
+    def __contains__(self, doc_id: Hashable) -> bool:
+        return doc_id in self._longueurs
+
+    def ajouter(self, doc_id: Hashable, champs: Mapping[str, str | None] | str) -> None:
+        """Indexe (ou ré-indexe) un document ; une chaîne seule va dans le premier champ."""
+        if isinstance(champs, str):
+            champs = {next(iter(self.poids_champs)): champs}
+        if doc_id in self._longueurs:
+            self.supprimer(doc_id)
+        frequences: dict[str, float] = defaultdict(float)
+        longueur = 0.0
+        for champ, valeur in champs.items():
+            poids = self.poids_champs.get(champ, 0.0)
+            if not poids:
+                continue
+            for terme in tokeniser(valeur):
+                frequences[terme] += poids
+                longueur += poids
+        for terme, tf in frequences.items():
+            self._postings[terme][doc_id] = tf
+        self._termes_doc[doc_id] = dict(frequences)
+        self._longueurs[doc_id] = longueur
+        self._longueur_totale += longueur
+
+    def ajouter_tous(self, documents: Iterable[tuple[Hashable, Mapping[str, str | None] | str]]) -> None:
+        for doc_id, champs in documents:
+            self.ajouter(doc_id, champs)
+
+    def supprimer(self, doc_id: Hashable) -> None:
+        if doc_id not in self._longueurs:
+            return
+        for terme in self._termes_doc.pop(doc_id):
+            postings = self._postings[terme]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self._postings[terme]
+        self._longueur_totale -= self._longueurs.pop(doc_id)
+
+    def scores(self, requete: str | Iterable[str]) -> dict[Hashable, float]:
+        """Score BM25 de chaque document contenant au moins un terme de la requête.
+
+        Une requête en liste (mots-clés) compte chaque terme une seule fois.
+        """
+        if isinstance(requete, str):
+            requete = [requete]
+        termes = {terme for morceau in requete for terme in tokeniser(morceau)}
+        n = len(self._longueurs)
+        if not n or not termes:
+            return {}
+        longueur_moyenne = self._longueur_totale / n or 1.0
+        scores: dict[Hashable, float] = defaultdict(float)
+        for terme in termes:
+            postings = self._postings.get(terme)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for doc_id, tf in postings.items():
+                norme = self.k1 * (1 - self.b + self.b * self._longueurs[doc_id] / longueur_moyenne)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norme)
+        return scores
+
+    def rechercher(self, requete: str | Iterable[str], k: int = 10) -> list[tuple[Hashable, float]]:
+        """Les `k` meilleurs documents, par score décroissant."""
+        return heapq.nlargest(k, self.scores(requete).items(), key=lambda item: item[1])
+
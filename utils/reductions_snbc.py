@@ -0,0 +1,205 @@
+"""Réductions SNBC par levier pour plusieurs collectivités (API TET trajectoires).
+
+L'API renvoie les leviers d'une seule collectivité par appel. Le service
+récupère les collectivités manquantes en parallèle via le client HTTP
+partagé (keep-alive, rejeux), à un débit plafonné par un seau à jetons propre
+au service, partagé par tous les services du process vers le même hôte. Les
+réponses brutes sont gardées dans un cache SQLite local (.cache/) par
+instance d'API, collectivité et version des données : relancer une analyse
+dans l'heure ne refait pas les appels.
+
+Les réponses plus anciennes que `DUREE_VALIDITE_S` (1 h, comme l'ancien cache
+de la page 26) sont redemandées ; `rafraichir=True` ignore le cache, pour
+une trajectoire recalculée entre-temps. `VERSION_DONNEES` est à incrémenter
+quand le format des réponses change.
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Iterable
+
+import pandas as pd
+
+from utils import priorisation_impact as pi
+from utils.http_client import ClientHTTP, TokenBucket, get_client, hote
+
+CACHE_PATH = Path(__file__).resolve().parent.parent / ".cache" / "reductions_snbc.sqlite"
+VERSION_DONNEES = "1"
+DUREE_VALIDITE_S = 3600
+MAX_CONCURRENCE = 8
+# Limite de l'API TET.
+REQUETES_PAR_MINUTE = 90
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reduction_snbc (
+    hote TEXT NOT NULL,
+    collectivite_id INTEGER NOT NULL,
+    version TEXT NOT NULL,
+    donnees TEXT NOT NULL,
+    recupere_le REAL NOT NULL,
+    PRIMARY KEY (hote, collectivite_id, version)
+);
+"""
+
+
+class CacheReductions:
+    """Réponses brutes de l'API SNBC leviers, dans une base SQLite locale."""
+
+    def __init__(self, path: Path | str = CACHE_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def lire(self, hote: str, version: str, ids: list[int], age_max_s: float) -> dict[int, dict]:
+        """Réponses en cache, plus récentes que `age_max_s`, pour les `ids` demandés."""
+        if not ids:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT collectivite_id, donnees FROM reduction_snbc "
+                "WHERE hote = ? AND version = ? AND recupere_le >= ? "
+                "AND collectivite_id IN (SELECT value FROM json_each(?))",
+                (hote, version, time.time() - age_max_s, json.dumps(ids)),
+            ).fetchall()
+        return {int(cid): json.loads(donnees) for cid, donnees in rows}
+
+    def ecrire(self, hote: str, version: str, reponses: dict[int, dict]) -> None:
+        if not reponses:
+            return
+        maintenant = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO reduction_snbc VALUES (?, ?, ?, ?, ?)",
+                [
+                    (hote, int(cid), version, json.dumps(donnees), maintenant)
+                    for cid, donnees in reponses.items()
+                ],
+            )
+
+
+_limiteurs: dict[str, TokenBucket] = {}
+_limiteurs_lock = threading.Lock()
+
+
+def _limiteur_hote(hote_api: str, requetes_par_minute: int, capacite: int) -> TokenBucket:
+    """Seau à jetons des appels SNBC vers un hôte, créé une fois par process.
+
+    Les services successifs (un par run) le partagent : un nouveau service ne
+    repart pas d'un seau plein, et les autres appels à l'hôte ne sont pas bridés.
+    """
+    with _limiteurs_lock:
+        if hote_api not in _limiteurs:
+            _limiteurs[hote_api] = TokenBucket.pour_limite(requetes_par_minute, capacite=capacite)
+        return _limiteurs[hote_api]
+
+
+class ServiceReductions:
+    """Réductions SNBC d'une instance de l'API, avec cache et appels concurrents."""
+
+    def __init__(
+        self,
+        api_url: str,
+        api_token: str,
+        *,
+        version: str = VERSION_DONNEES,
+        cache: CacheReductions | None = None,
+        http: ClientHTTP | None = None,
+        max_concurrence: int = MAX_CONCURRENCE,
+        requetes_par_minute: int | None = REQUETES_PAR_MINUTE,
+        duree_validite_s: float = DUREE_VALIDITE_S,
+    ):
+        self.api_url = api_url
+        self.api_token = api_token
+        self.version = version
+        self.cache = cache or CacheReductions()
+        self.http = http or get_client()
+        self.max_concurrence = max(1, max_concurrence)
+        self.duree_validite_s = duree_validite_s
+        self.hote = hote(api_url)
+        self.limiteur = (
+            _limiteur_hote(self.hote, requetes_par_minute, self.max_concurrence)
+            if requetes_par_minute
+            else None
+        )
+        self.nb_appels = 0
+        self.nb_cache = 0
+        self._reponses: dict[int, dict] = {}
+        self._lock = threading.Lock()
+
+    def _appeler(self, collectivite_id: int) -> dict:
+        if self.limiteur is not None:
+            self.limiteur.acquire()
+        return pi.fetch_snbc_leviers(collectivite_id, self.api_url, self.api_token, self.http)
+
+    def precharger(self, ids: Iterable[int], *, rafraichir: bool = False) -> dict[int, Exception]:
+        """Récupère les réponses absentes du cache, en parallèle ; renvoie les erreurs par collectivité."""
+        with self._lock:
+            manquants = list(dict.fromkeys(int(i) for i in ids if rafraichir or int(i) not in self._reponses))
+        if not rafraichir:
+            trouvees = self.cache.lire(self.hote, self.version, manquants, self.duree_validite_s)
+            manquants = [cid for cid in manquants if cid not in trouvees]
+            with self._lock:
+                self._reponses.update(trouvees)
+                self.nb_cache += len(trouvees)
+        if not manquants:
+            return {}
+
+        recues: dict[int, dict] = {}
+        erreurs: dict[int, Exception] = {}
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrence, len(manquants))) as pool:
+            futures = {
+                pool.submit(self._appeler, cid): cid
+                for cid in manquants
+            }
+            for future in as_completed(futures):
+                cid = futures[future]
+                try:
+                    recues[cid] = future.result()
+                except Exception as e:
+                    erreurs[cid] = e
+        self.cache.ecrire(self.hote, self.version, recues)
+        with self._lock:
+            self._reponses.update(recues)
+            self.nb_appels += len(manquants)
+        return erreurs
+
+    def reponse(self, collectivite_id: int, *, rafraichir: bool = False) -> dict:
+        """Réponse brute de l'API pour une collectivité (cache ou appel)."""
+        erreurs = self.precharger([collectivite_id], rafraichir=rafraichir)
+        if collectivite_id in erreurs:
+            raise erreurs[collectivite_id]
+        return self._reponses[collectivite_id]
+
+    def reductions(
+        self, collectivite_id: int, *, rafraichir: bool = False
+    ) -> tuple[pd.DataFrame, list[str]]:
+        """Réductions par levier et identifiants manquants, comme `pi.parse_reductions`."""
+        return pi.parse_reductions(self.reponse(collectivite_id, rafraichir=rafraichir))
+
+    def reductions_plusieurs(
+        self, ids: Iterable[int], *, rafraichir: bool = False
+    ) -> tuple[pd.DataFrame, dict[int, Exception]]:
+        """Réductions de toutes les collectivités (`collectivite_id`, `levier`, `reduction`) et erreurs."""
+        ids = list(dict.fromkeys(int(i) for i in ids))
+        erreurs = self.precharger(ids, rafraichir=rafraichir)
+        frames = [
+            pi.parse_reductions(self._reponses[cid])[0].assign(collectivite_id=cid)
+            for cid in ids
+            if cid not in erreurs
+        ]
+        colonnes = ["collectivite_id", "levier", "reduction"]
+        if not frames:
+            return pd.DataFrame(columns=colonnes), erreurs
+        return pd.concat(frames, ignore_index=True)[colonnes], erreurs
@@ -0,0 +1,206 @@
+"""Sélection des tables utiles au prompt de l'assistant stats (page 06).
+
+Plutôt que d'envoyer toute la documentation OLAP (data/bdd_olap.md) à chaque
+conversation, le document est découpé par table (sections `####`), indexé en
+BM25 (utils.recherche_texte, nom de table pondéré) et, pour chaque question,
+seules les sections les mieux classées sont gardées dans un budget de
+caractères. Les clés étrangères de la base applicative (`relations_text` de
+utils.db_text) sont sélectionnées de la même façon.
+
+Le socle (introduction, glossaire, cas d'usage, notes) est toujours inclus.
+Quand la question ne ressemble clairement à aucune section (meilleur score
+sous le seuil de confiance), on revient à la documentation complète.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from utils.recherche_texte import IndexBM25
+
+OLAP_DOC_PATH = Path(__file__).resolve().parent.parent / "data" / "bdd_olap.md"
+
+# Budget par défaut des sections sélectionnées (hors socle), en caractères.
+BUDGET_CARACTERES = 6000
+# Sous ce score BM25 pour la meilleure section, la question est jugée hors
+# de portée de l'index : documentation complète.
+SEUIL_CONFIANCE = 3.0
+# Une section (ou relation) sous cette fraction du meilleur score est du bruit.
+RATIO_SCORE_MIN = 0.3
+MAX_RELATIONS = 6
+
+# Parties `##` sans tables : toujours envoyées (socle) ou jamais sélectionnées.
+_TITRES_SOCLE = ("glossaire", "cas d'usage", "notes importantes")
+_TITRES_EXCLUS = ("tables à ignorer",)
+_TABLE_RE = re.compile(r"`([A-Za-z_][A-Za-z0-9_]*)`")
+_RELATION_RE = re.compile(r"^(\S+) — relations :$")
+
+
+@dataclass
+class Section:
+    cle: str
+    tables: list[str]
+    texte: str
+
+
+@dataclass
+class ContexteSchema:
+    """Documentation retenue pour une question."""
+
+    texte: str
+    sections: list[str] = field(default_factory=list)
+    relations: list[str] = field(default_factory=list)
+    complet: bool = False
+    score_max: float = 0.0
+
+
+def decouper_doc(doc: str) -> tuple[str, list[Section]]:
+    """Sépare le socle (toujours envoyé) des sections par table (`####`)."""
+    socle: list[str] = []
+    sections: list[Section] = []
+    titre_partie = titre_groupe = ""
+    courante: list[str] | None = None
+
+    def fermer() -> None:
+        nonlocal courante
+        if courante is not None:
+            entete = courante[0]
+            tables = _TABLE_RE.findall(entete)
+            texte = "\n".join(courante).strip().removesuffix("---").strip()
+            contexte = f"### {titre_groupe}\n" if titre_groupe else ""
+            sections.append(Section(entete.lstrip("# ").strip(), tables, contexte + texte))
+        courante = None
+
+    for ligne in doc.splitlines():
+        if ligne.startswith("## "):
+            fermer()
+            titre_partie, titre_groupe = ligne[3:].strip().lower(), ""
+        elif ligne.startswith("### ") and not any(t in titre_partie for t in _TITRES_SOCLE):
+            fermer()
+            titre_groupe = ligne[4:].strip()
+            continue
+        elif ligne.startswith("#### "):
+            fermer()
+            if not any(t in titre_partie for t in _TITRES_EXCLUS):
+                courante = [ligne]
+            continue
+
+        if courante is not None:
+            courante.append(ligne)
+        elif not titre_partie or any(t in titre_partie for t in _TITRES_SOCLE):
+            socle.append(ligne)
+
+    fermer()
+    return "\n".join(socle).strip(), sections
+
+
+def decouper_relations(relations_text: str) -> dict[str, str]:
+    """Blocs « <table> — relations : » de utils.db_text, par nom de table."""
+    blocs: dict[str, list[str]] = {}
+    courant: list[str] | None = None
+    for ligne in relations_text.strip().splitlines():
+        m = _RELATION_RE.match(ligne.strip())
+        if m:
+            courant = blocs.setdefault(m.group(1), [ligne.strip()])
+        elif courant is not None and ligne.strip():
+            courant.append(ligne)
+    # Une table sans clé étrangère n'apporte rien au prompt.
+    return {table: "\n".join(lignes) for table, lignes in blocs.items() if len(lignes) > 1}
+
+
+def _termes_table(nom: str) -> str:
+    return nom.replace("_", " ")
+
+
+class RetrieverSchema:
+    """Index des sections OLAP et des relations, interrogé question par question."""
+
+    def __init__(
+        self,
+        doc: str,
+        relations_text: str = "",
+        *,
+        budget_caracteres: int = BUDGET_CARACTERES,
+        seuil_confiance: float = SEUIL_CONFIANCE,
+    ):
+        self.doc = doc
+        self.budget_caracteres = budget_caracteres
+        self.seuil_confiance = seuil_confiance
+        self.socle, sections = decouper_doc(doc)
+        self.sections = {s.cle: s for s in sections}
+        self.relations = decouper_relations(relations_text)
+
+        self._index_sections = IndexBM25({"table": 3.0, "texte": 1.0})
+        for s in sections:
+            self._index_sections.ajouter(s.cle, {"table": " ".join(map(_termes_table, s.tables)), "texte": s.texte})
+        self._index_relations = IndexBM25({"table": 3.0, "texte": 0.5})
+        for table, bloc in self.relations.items():
+            self._index_relations.ajouter(table, {"table": _termes_table(table), "texte": bloc})
+
+    @classmethod
+    def depuis_fichiers(cls, path: Path | str = OLAP_DOC_PATH, **kwargs) -> "RetrieverSchema":
+        from utils.db_text import relations_text
+
+        return cls(Path(path).read_text(encoding="utf-8"), relations_text, **kwargs)
+
+    def _tables_citees(self, question: str) -> list[str]:
+        """Sections dont un nom de table apparaît tel quel dans la question."""
+        mots = set(re.findall(r"[A-Za-z_][A-Za-z0-9_]*", question.lower()))
+        return [cle for cle, s in self.sections.items() if any(t.lower() in mots for t in s.tables)]
+
+    def selectionner(
+        self,
+        question: str,
+        *,
+        budget_caracteres: int | None = None,
+        deja_envoyees: set[str] | None = None,
+    ) -> ContexteSchema:
+        """Sections et relations pertinentes pour `question`, dans le budget.
+
+        `deja_envoyees` (clés de sections et de relations) permet, en cours de
+        conversation, de n'ajouter que ce que le modèle n'a pas encore reçu.
+        """
+        budget = self.budget_caracteres if budget_caracteres is None else budget_caracteres
+        deja_envoyees = deja_envoyees or set()
+        classement = self._index_sections.rechercher(question, k=len(self.sections))
+        score_max = classement[0][1] if classement else 0.0
+        citees = self._tables_citees(question)
+        if score_max < self.seuil_confiance and not citees:
+            texte = "" if deja_envoyees.issuperset(self.sections) else self.doc
+            return ContexteSchema(texte, list(self.sections), [], True, score_max)
+
+        retenues: list[str] = []
+        taille = 0
+        pertinentes = [cle for cle, score in classement if score >= RATIO_SCORE_MIN * score_max]
+        for cle in citees + [cle for cle in pertinentes if cle not in citees]:
+            longueur = len(self.sections[cle].texte)
+            if retenues and taille + longueur > budget:
+                continue
+            retenues.append(cle)
+            taille += longueur
+        classement_relations = self._index_relations.rechercher(question, k=MAX_RELATIONS)
+        relations = [
+            table for table, score in classement_relations
+            if score >= RATIO_SCORE_MIN * classement_relations[0][1]
+        ]
+        nouvelles = [cle for cle in retenues if cle not in deja_envoyees]
+        nouvelles_relations = [table for table in relations if table not in deja_envoyees]
+
+        parties = []
+        if nouvelles:
+            parties.append("\n\n".join(self.sections[cle].texte for cle in nouvelles))
+        if nouvelles_relations:
+            parties.append(
+                "Cles etrangeres utiles (base applicative, le schema `public` de l'app correspond a `prod.` ici) :\n"
+                + "\n".join(self.relations[table] for table in nouvelles_relations)
+            )
+        return ContexteSchema("\n\n".join(parties), nouvelles, nouvelles_relations, False, score_max)
+
+    def document_initial(self, question: str, *, budget_caracteres: int | None = None) -> ContexteSchema:
+        """Documentation du premier tour : socle + sélection (ou doc complète)."""
+        contexte = self.selectionner(question, budget_caracteres=budget_caracteres)
+        if not contexte.complet:
+            contexte.texte = f"{self.socle}\n\n{contexte.texte}".strip()
+        return contexte
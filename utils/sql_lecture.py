@@ -0,0 +1,399 @@
+"""Exécution en lecture seule des requêtes SQL générées par l'assistant stats (page 06).
+
+Garde-fous (en dur) : une seule instruction SELECT / WITH, aucun mot-clé de
+modification, plafond de lignes par emballage dans un sous-select. En
+PostgreSQL s'y ajoutent un `statement_timeout` par requête et un plafond de
+coût estimé (`EXPLAIN`) : une requête trop chère est refusée avant d'être
+exécutée, avec un message que le modèle peut exploiter pour la reformuler.
+
+L'aperçu et le nombre total de lignes sont obtenus en une seule requête
+(`count(*) OVER ()`), et les résultats sont mis en cache par conversation
+sous la forme normalisée du SQL : une même requête relancée par le modèle
+(aperçu puis tableau, relance après une erreur de rendu...) ne repart pas en
+base. Deux appels simultanés sur le même SQL n'exécutent la requête qu'une
+fois ; le cache est borné en mémoire (éviction des moins récemment lus).
+
+Les requêtes indépendantes d'un même tour peuvent être exécutées en parallèle
+(`en_parallele`, connexions du pool de l'engine) ; un `JetonAnnulation`
+interrompt côté serveur celles encore en cours (délai dépassé, nouveau
+message de l'utilisateur).
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional, Sequence
+
+import pandas as pd
+from sqlalchemy import text
+
+# Mots-cles interdits (detection par word-boundary pour ne pas matcher des
+# colonnes comme "created_at" qui contient "create").
+FORBIDDEN = (
+    "insert",
+    "update",
+    "delete",
+    "drop",
+    "alter",
+    "create",
+    "truncate",
+    "grant",
+    "revoke",
+)
+_FORBIDDEN_REGEX = re.compile(r"\b(" + "|".join(FORBIDDEN) + r")\b", re.IGNORECASE)
+
+TIMEOUT_MS = 30_000
+# Cout estime par le planificateur PostgreSQL au-dela duquel la requete est refusee.
+COUT_MAX = 5_000_000
+COLONNE_TOTAL = "_total_rows"
+# Memoire maximale des resultats mis en cache pour une conversation.
+CACHE_MAX_MO = 64
+
+# Chaines '...', identifiants "..." ou blancs (hors chaines) : base de la normalisation.
+_JETONS_SQL = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\s+")
+
+
+class RequeteRefusee(ValueError):
+    """Requete rejetee par les garde-fous (message destine au modele)."""
+
+
+class RequeteAnnulee(RuntimeError):
+    """Requete interrompue (delai depasse ou tour de conversation abandonne)."""
+
+
+def _interrompre(connexion_dbapi) -> None:
+    """Annule la requete en cours sur une connexion DBAPI (psycopg : cancel, sqlite3 : interrupt)."""
+    for methode in ("cancel_safe", "cancel", "interrupt"):
+        annuler = getattr(connexion_dbapi, methode, None)
+        if annuler is not None:
+            try:
+                annuler()
+            except Exception:  # noqa: BLE001 - connexion deja liberee
+                pass
+            return
+
+
+class JetonAnnulation:
+    """Annulation cooperative des requetes d'un tour (ou d'un appel d'outil).
+
+    Les connexions en cours d'utilisation sont suivies ; `annuler()` les
+    interrompt cote serveur et propage l'annulation aux jetons enfants.
+    """
+
+    def __init__(self):
+        self._evenement = threading.Event()
+        self._lock = threading.Lock()
+        self._connexions: set = set()
+        self._enfants: list["JetonAnnulation"] = []
+
+    @property
+    def annule(self) -> bool:
+        return self._evenement.is_set()
+
+    def enfant(self) -> "JetonAnnulation":
+        jeton = JetonAnnulation()
+        with self._lock:
+            self._enfants.append(jeton)
+            if self.annule:
+                jeton.annuler()
+        return jeton
+
+    def annuler(self) -> None:
+        with self._lock:
+            self._evenement.set()
+            connexions, enfants = list(self._connexions), list(self._enfants)
+        for connexion in connexions:
+            _interrompre(connexion)
+        for enfant in enfants:
+            enfant.annuler()
+
+    @contextmanager
+    def suivre(self, connexion_dbapi):
+        """Rend la connexion interruptible pendant le bloc."""
+        with self._lock:
+            if self.annule:
+                raise RequeteAnnulee("Requete annulee.")
+            self._connexions.add(connexion_dbapi)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._connexions.discard(connexion_dbapi)
+
+
+@dataclass
+class ResultatSQL:
+    df: pd.DataFrame
+    # Nombre total de lignes de la requete (None si non demande).
+    total: Optional[int]
+    # Plafond de lignes applique lors de l'execution.
+    limite: int
+    duree_s: float
+    depuis_cache: bool = False
+
+    @property
+    def complet(self) -> bool:
+        """Toutes les lignes de la requete sont dans `df`."""
+        return len(self.df) < self.limite or (self.total is not None and len(self.df) >= self.total)
+
+    def tranche(self, limite: int) -> "ResultatSQL":
+        """Les `limite` premieres lignes (meme total), sans copie si rien n'est coupe."""
+        if len(self.df) <= limite:
+            return ResultatSQL(self.df, self.total, limite, self.duree_s, self.depuis_cache)
+        return ResultatSQL(self.df.head(limite), self.total, limite, self.duree_s, self.depuis_cache)
+
+
+def taille_octets(df: pd.DataFrame) -> int:
+    """Memoire occupee par un DataFrame (chaines comprises)."""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+
+def valider_sql(sql: str) -> str:
+    """Nettoie puis valide une requete ; renvoie le SQL nettoye ou leve `RequeteRefusee`.
+
+    - Retire un eventuel formatage markdown (```sql ... ```) et le ';' final.
+    - Une seule instruction, commencant par SELECT ou WITH.
+    - Aucun mot-cle de modification (FORBIDDEN).
+    """
+    if not sql or not sql.strip():
+        raise RequeteRefusee("Requete SQL vide.")
+
+    cleaned = sql.strip()
+    if cleaned.startswith("```"):
+        cleaned = re.sub(r"^```[a-zA-Z]*", "", cleaned).strip()
+        if cleaned.endswith("```"):
+            cleaned = cleaned[:-3].strip()
+
+    cleaned = cleaned.rstrip().rstrip(";").rstrip()
+
+    # Anti multi-statement : un ';' restant signifie plusieurs instructions
+    if ";" in cleaned:
+        raise RequeteRefusee(
+            "Plusieurs instructions SQL detectees : une seule requete SELECT est autorisee."
+        )
+    if not re.match(r"^\s*(select|with)\b", cleaned, re.IGNORECASE):
+        raise RequeteRefusee("Seules les requetes SELECT (ou WITH ... SELECT) sont autorisees.")
+    match = _FORBIDDEN_REGEX.search(cleaned)
+    if match:
+        raise RequeteRefusee(
+            f"Requete refusee : commande de modification non autorisee ({match.group(1).upper()})."
+        )
+    return cleaned
+
+
+def normaliser_sql(sql: str) -> str:
+    """Forme canonique d'une requete deja validee : blancs reduits et mots en minuscules
+    hors chaines et identifiants entre guillemets."""
+    morceaux = []
+    position = 0
+    for m in _JETONS_SQL.finditer(sql):
+        morceaux.append(sql[position:m.start()].lower())
+        jeton = m.group(0)
+        morceaux.append(" " if jeton.isspace() else jeton)
+        position = m.end()
+    morceaux.append(sql[position:].lower())
+    return "".join(morceaux).strip()
+
+
+class CacheResultats:
+    """Resultats d'une conversation, par SQL normalise.
+
+    Un resultat obtenu avec un plafond plus haut (ou complet) sert aussi les
+    demandes plus petites ; une demande de total n'est servie que si le total
+    est connu. Au-dela de `max_octets`, les resultats les moins recemment lus
+    sont evinces (le dernier ecrit est toujours conserve).
+    """
+
+    def __init__(self, max_octets: int = CACHE_MAX_MO * 1024 * 1024):
+        self.max_octets = max_octets
+        self._resultats: OrderedDict[str, tuple[ResultatSQL, int]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._verrous: dict[str, threading.Lock] = {}
+
+    def __len__(self) -> int:
+        return len(self._resultats)
+
+    @property
+    def octets(self) -> int:
+        return sum(taille for _, taille in self._resultats.values())
+
+    def verrou(self, cle: str) -> threading.Lock:
+        """Verrou d'une requete : un appel concurrent sur le meme SQL attend le premier."""
+        with self._lock:
+            return self._verrous.setdefault(cle, threading.Lock())
+
+    def lire(self, cle: str, limite: int, avec_total: bool) -> Optional[ResultatSQL]:
+        with self._lock:
+            entree = self._resultats.get(cle)
+            if entree is None:
+                return None
+            self._resultats.move_to_end(cle)
+        resultat = entree[0]
+        if resultat.limite < limite and not resultat.complet:
+            return None
+        total = resultat.total if resultat.total is not None else (len(resultat.df) if resultat.complet else None)
+        if avec_total and total is None:
+            return None
+        return ResultatSQL(resultat.df.head(limite), total, limite, 0.0, depuis_cache=True)
+
+    def ecrire(self, cle: str, resultat: ResultatSQL) -> None:
+        with self._lock:
+            actuel = self._resultats.get(cle, (None, 0))[0]
+            # On garde le resultat le plus riche (plus de lignes, total connu).
+            if actuel is None or resultat.limite > actuel.limite or (
+                resultat.limite == actuel.limite and resultat.total is not None
+            ):
+                self._resultats[cle] = (resultat, taille_octets(resultat.df))
+            elif actuel.total is None and resultat.total is not None:
+                actuel.total = resultat.total
+            self._resultats.move_to_end(cle)
+            while len(self._resultats) > 1 and self.octets > self.max_octets:
+                self._resultats.popitem(last=False)
+
+    def vider(self) -> None:
+        with self._lock:
+            self._resultats.clear()
+            self._verrous.clear()
+
+
+def _cout_estime(conn, sql: str) -> Optional[float]:
+    """Cout total estime par EXPLAIN (PostgreSQL), None si indisponible."""
+    plan: Any = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    try:
+        return float(plan[0]["Plan"]["Total Cost"])
+    except (TypeError, KeyError, IndexError, ValueError):
+        return None
+
+
+def executer_lecture(
+    engine,
+    sql: str,
+    limite: int,
+    *,
+    avec_total: bool = False,
+    timeout_ms: Optional[int] = TIMEOUT_MS,
+    cout_max: Optional[float] = COUT_MAX,
+    cache: Optional[CacheResultats] = None,
+    annulation: Optional[JetonAnnulation] = None,
+) -> ResultatSQL:
+    """Valide puis execute `sql` avec au plus `limite` lignes.
+
+    `avec_total` ajoute le nombre total de lignes, calcule dans la meme
+    requete (`count(*) OVER ()`). Leve `RequeteRefusee` (garde-fous, cout),
+    `RequeteAnnulee` si `annulation` est declenche ; les erreurs d'execution
+    de la base remontent telles quelles.
+    """
+    cleaned = valider_sql(sql)
+    if cache is None:
+        return _executer(engine, cleaned, limite, avec_total, timeout_ms, cout_max, annulation)
+    cle = normaliser_sql(cleaned)
+    with cache.verrou(cle):
+        resultat = cache.lire(cle, limite, avec_total)
+        if resultat is None:
+            resultat = _executer(engine, cleaned, limite, avec_total, timeout_ms, cout_max, annulation)
+            cache.ecrire(cle, resultat)
+    return resultat
+
+
+def _executer(
+    engine,
+    cleaned: str,
+    limite: int,
+    avec_total: bool,
+    timeout_ms: Optional[int],
+    cout_max: Optional[float],
+    annulation: Optional[JetonAnnulation],
+) -> ResultatSQL:
+    if avec_total:
+        wrapped = (
+            f"SELECT *, count(*) OVER () AS {COLONNE_TOTAL} FROM (\n{cleaned}\n) AS _sub LIMIT {int(limite)}"
+        )
+    else:
+        wrapped = f"SELECT * FROM (\n{cleaned}\n) AS _sub LIMIT {int(limite)}"
+
+    debut = time.perf_counter()
+    postgres = engine.dialect.name == "postgresql"
+    annulation = annulation or JetonAnnulation()
+    with engine.connect() as conn, annulation.suivre(conn.connection.driver_connection):
+        try:
+            if postgres and timeout_ms:
+                # SET LOCAL : limite a la transaction de cette requete.
+                conn.execute(text(f"SET LOCAL statement_timeout = {int(timeout_ms)}"))
+            if postgres and cout_max:
+                cout = _cout_estime(conn, wrapped)
+                if cout is not None and cout > cout_max:
+                    raise RequeteRefusee(
+                        f"Requete refusee : cout estime trop eleve ({cout:,.0f} > {cout_max:,.0f}). "
+                        "Ajoute des filtres, agrege davantage ou privilegie les tables pre-agregees du schema public."
+                    )
+            df = pd.read_sql_query(text(wrapped), conn)
+        except RequeteRefusee:
+            raise
+        except Exception as exc:
+            if annulation.annule:
+                raise RequeteAnnulee("Requete annulee.") from exc
+            raise
+
+    total = None
+    if avec_total:
+        total = int(df[COLONNE_TOTAL].iloc[0]) if not df.empty else 0
+        df = df.drop(columns=COLONNE_TOTAL)
+    return ResultatSQL(df, total, int(limite), time.perf_counter() - debut)
+
+
+def en_parallele(
+    fonctions: Sequence[Callable[[JetonAnnulation], Any]],
+    *,
+    max_paralleles: int = 4,
+    timeout_s: Optional[float] = None,
+    annulation: Optional[JetonAnnulation] = None,
+) -> Iterator[tuple[Any, Optional[BaseException]]]:
+    """Execute les fonctions sur un pool de threads, au plus `max_paralleles` a la fois.
+
+    Chaque fonction recoit son propre jeton d'annulation (enfant de
+    `annulation`). Produit (resultat, exception) dans l'ordre des fonctions,
+    des que chacune est terminee ; au-dela de `timeout_s` depuis son
+    demarrage, un appel est annule et produit une `TimeoutError`. Fermer le
+    generateur avant la fin (`contextlib.closing`) annule les appels restants.
+    """
+    annulation = annulation or JetonAnnulation()
+    jetons = [annulation.enfant() for _ in fonctions]
+    debuts: list[Optional[float]] = [None] * len(fonctions)
+
+    def lancer(i: int) -> Any:
+        if jetons[i].annule:
+            raise RequeteAnnulee("Requete annulee.")
+        debuts[i] = time.monotonic()
+        return fonctions[i](jetons[i])
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(max_paralleles, len(fonctions) or 1)))
+    try:
+        futures = [pool.submit(lancer, i) for i in range(len(fonctions))]
+        for i, future in enumerate(futures):
+            while True:
+                try:
+                    sortie = (future.result(timeout=0.1), None)
+                    break
+                except FuturesTimeout:
+                    if timeout_s is not None and debuts[i] is not None and time.monotonic() - debuts[i] > timeout_s:
+                        jetons[i].annuler()
+                        sortie = (None, TimeoutError(f"Delai depasse ({timeout_s:.0f} s)."))
+                        break
+                except Exception as exc:  # noqa: BLE001 - transmis a l'appelant
+                    sortie = (None, exc)
+                    break
+            yield sortie
+    finally:
+        for jeton in jetons:
+            jeton.annuler()
+        pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,196 @@
+"""Rendu compact de fichiers tabulaires (CSV, Excel) pour les prompts (page 22).
+
+Remplace `df.to_string()` suivi d'un écrasement des blancs par regex : chaque
+ligne devient un enregistrement délimité (`a | b | c`), les colonnes vides
+disparaissent et une valeur répétée d'une ligne à l'autre dans une colonne
+hiérarchique (axe, sous-axe...) est remplacée par `^`. Le texte produit
+respecte un budget de tokens : au-delà, les lignes suivantes sont écartées et
+un rapport de troncature l'indique.
+
+Les classeurs sont lus onglet par onglet : les onglets annexes (listes
+déroulantes, mode d'emploi...) et masqués ne sont pas chargés, ni ceux qui
+suivent l'épuisement du budget.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+
+import pandas as pd
+
+from utils.import_decoupage import CARACTERES_PAR_TOKEN, estimer_tokens
+from utils.recherche_texte import normaliser
+
+# Budget par défaut d'un fichier (tous onglets confondus).
+BUDGET_TOKENS = 200_000
+SEPARATEUR = " | "
+# Valeur identique à celle de la ligne précédente (colonnes répétitives).
+IDEM = "^"
+# Part minimale de répétitions consécutives pour abréger une colonne.
+RATIO_REPETITION = 0.5
+
+_HIERARCHIE_RE = re.compile(r"\b(axe|sous axe|orientation|thematique|theme|chapitre|enjeu|ambition|volet|domaine|secteur)\b")
+_ONGLETS_ANNEXES_RE = re.compile(r"liste|mode d ?emploi|parametre|instruction|lisez|read ?me|notice|legende")
+
+
+@dataclass
+class RapportTableau:
+    nom: str
+    lignes_totales: int
+    lignes_incluses: int
+    colonnes_totales: int
+    colonnes_vides: list[str] = field(default_factory=list)
+    colonnes_abregees: list[str] = field(default_factory=list)
+
+    @property
+    def tronque(self) -> bool:
+        return self.lignes_incluses < self.lignes_totales
+
+
+@dataclass
+class RapportFichier:
+    tableaux: list[RapportTableau] = field(default_factory=list)
+    onglets_ignores: list[str] = field(default_factory=list)
+    onglets_non_lus: list[str] = field(default_factory=list)
+    tokens: int = 0
+
+    @property
+    def tronque(self) -> bool:
+        return bool(self.onglets_non_lus) or any(t.tronque for t in self.tableaux)
+
+    def resume(self) -> str:
+        parties = []
+        for t in self.tableaux:
+            if t.tronque:
+                parties.append(f"{t.nom} : {t.lignes_incluses}/{t.lignes_totales} lignes incluses")
+        if self.onglets_non_lus:
+            parties.append("onglets non lus (budget atteint) : " + ", ".join(self.onglets_non_lus))
+        return "; ".join(parties)
+
+
+def _cellule(valeur: Any) -> str:
+    if valeur is None or (isinstance(valeur, float) and math.isnan(valeur)):
+        return ""
+    if isinstance(valeur, float) and valeur.is_integer():
+        return str(int(valeur))
+    if isinstance(valeur, pd.Timestamp):
+        return valeur.strftime("%d/%m/%Y") if valeur == valeur.normalize() else valeur.isoformat(" ")
+    texte = str(valeur)
+    if texte in ("NaT", "nan"):
+        return ""
+    return " ".join(texte.split()).replace("|", "/")
+
+
+def _abreger(nom: str, valeurs: list[str]) -> bool:
+    """Colonne hiérarchique, ou dont la valeur se répète souvent d'une ligne à l'autre."""
+    if len(valeurs) < 2:
+        return False
+    repetitions = sum(1 for a, b in zip(valeurs, valeurs[1:]) if b and a == b)
+    if _HIERARCHIE_RE.search(normaliser(nom).replace("-", " ")):
+        return repetitions > 0
+    longueur = sum(map(len, valeurs)) / len(valeurs)
+    return longueur > len(IDEM) + 2 and repetitions >= RATIO_REPETITION * (len(valeurs) - 1)
+
+
+def encoder_tableau(df: pd.DataFrame, nom: str, budget_tokens: int = BUDGET_TOKENS) -> tuple[str, RapportTableau]:
+    """En-tête puis une ligne `a | b | c` par enregistrement, dans `budget_tokens`."""
+    colonnes = {}
+    vides = []
+    for position, colonne in enumerate(df.columns):
+        valeurs = [_cellule(v) for v in df.iloc[:, position].tolist()]
+        if any(valeurs):
+            colonnes[_cellule(colonne) or f"colonne {position + 1}"] = valeurs
+        else:
+            vides.append(str(colonne))
+    abregees = [c for c, valeurs in colonnes.items() if _abreger(c, valeurs)]
+    for c in abregees:
+        valeurs = colonnes[c]
+        colonnes[c] = [v if i == 0 or not v or v != valeurs[i - 1] else IDEM for i, v in enumerate(valeurs)]
+
+    rapport = RapportTableau(nom, len(df), 0, len(df.columns), vides, abregees)
+    if not colonnes:
+        return "", rapport
+    lignes = [SEPARATEUR.join(colonnes)]
+    budget_caracteres = budget_tokens * CARACTERES_PAR_TOKEN - len(lignes[0])
+    for enregistrement in zip(*colonnes.values()):
+        ligne = SEPARATEUR.join(enregistrement).rstrip(" |")
+        if not ligne:
+            rapport.lignes_incluses += 1
+            continue
+        budget_caracteres -= len(ligne) + 1
+        if budget_caracteres < 0:
+            break
+        lignes.append(ligne)
+        rapport.lignes_incluses += 1
+    return "\n".join(lignes), rapport
+
+
+def _entete(rapport: RapportTableau) -> str:
+    nb_colonnes = rapport.colonnes_totales - len(rapport.colonnes_vides)
+    texte = f"**Dimensions :** {rapport.lignes_totales} lignes × {nb_colonnes} colonnes"
+    if rapport.colonnes_vides:
+        texte += f" ({len(rapport.colonnes_vides)} colonnes vides ignorées)"
+    texte += "\n\n**Format :** une ligne par enregistrement, champs séparés par « | »"
+    if rapport.colonnes_abregees:
+        texte += f", « {IDEM} » = même valeur que la ligne précédente ({', '.join(rapport.colonnes_abregees)})"
+    if rapport.tronque:
+        texte += f"\n\n**Tronqué :** {rapport.lignes_incluses} lignes sur {rapport.lignes_totales} incluses"
+    return texte + "\n\n"
+
+
+def encoder_csv(fichier, budget_tokens: int = BUDGET_TOKENS, **read_csv_kwargs) -> tuple[str, RapportFichier]:
+    df = pd.read_csv(fichier, **read_csv_kwargs)
+    contenu, rapport = encoder_tableau(df, "CSV", budget_tokens)
+    texte = "# Fichier CSV\n\n" + _entete(rapport) + "**Contenu :**\n\n" + contenu
+    return texte, RapportFichier([rapport], tokens=estimer_tokens(texte))
+
+
+def _onglet_masque(classeur: pd.ExcelFile, nom: str) -> bool:
+    try:
+        return classeur.book[nom].sheet_state != "visible"
+    except Exception:
+        return False
+
+
+def onglets_pertinents(noms: Iterable[str]) -> tuple[list[str], list[str]]:
+    """(onglets à lire, onglets annexes ignorés) ; si tout est annexe, tout est lu."""
+    noms = list(noms)
+    annexes = [n for n in noms if _ONGLETS_ANNEXES_RE.search(re.sub(r"['’]", " ", normaliser(n)))]
+    retenus = [n for n in noms if n not in annexes]
+    return (retenus, annexes) if retenus else (noms, [])
+
+
+def encoder_excel(fichier, budget_tokens: int = BUDGET_TOKENS) -> tuple[str, RapportFichier]:
+    """Onglets pertinents lus un à un, jusqu'à épuisement du budget."""
+    rapport = RapportFichier()
+    parties = []
+    with pd.ExcelFile(fichier, engine="openpyxl") as classeur:
+        retenus, rapport.onglets_ignores = onglets_pertinents(classeur.sheet_names)
+        masques = [n for n in retenus if _onglet_masque(classeur, n)]
+        if len(masques) < len(retenus):
+            rapport.onglets_ignores += masques
+            retenus = [n for n in retenus if n not in masques]
+        reste = budget_tokens
+        for position, nom in enumerate(retenus):
+            if reste <= 0:
+                rapport.onglets_non_lus = retenus[position:]
+                break
+            df = classeur.parse(nom)
+            contenu, rapport_onglet = encoder_tableau(df, nom, reste)
+            if not contenu:
+                continue
+            partie = f"## Onglet : {nom}\n\n" + _entete(rapport_onglet) + "**Contenu :**\n\n" + contenu
+            reste -= estimer_tokens(partie)
+            rapport.tableaux.append(rapport_onglet)
+            parties.append(partie)
+
+    total = sum(t.lignes_totales for t in rapport.tableaux)
+    entete = f"# Fichier Excel — {len(rapport.tableaux)} onglet(s), {total} lignes au total\n\n"
+    if rapport.onglets_ignores:
+        entete += f"Onglets annexes non transmis : {', '.join(rapport.onglets_ignores)}\n\n"
+    texte = entete + "\n\n---\n\n".join(parties)
+    rapport.tokens = estimer_tokens(texte)
+    return texte, rapport
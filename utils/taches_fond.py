@@ -0,0 +1,494 @@
+"""Tâches longues exécutées hors du script Streamlit (file SQLite + process de workers).
+
+Une page soumet une tâche (`soumettre`) puis en suit l'état, la progression et
+le journal par polling (`st.fragment(run_every=...)`, voir utils.taches_suivi).
+La tâche est exécutée par un process séparé, lancé à la demande
+(`demarrer_workers`) ou à la main :
+
+    python -m utils.taches_fond --workers 2
+
+Ce process fait tourner `--workers` threads (les pipelines sont limités par
+les appels API/LLM, et partagent ainsi un même limiteur de débit). La tâche
+survit aux reruns et aux rafraîchissements du navigateur ; elle est annulable
+(`annuler`) : le code de la tâche le constate au prochain `progression`,
+`write` ou `verifier_annulation`.
+
+Une tâche identique (même type, mêmes paramètres) déjà en attente ou en
+cours n'est pas dupliquée : `soumettre` renvoie son identifiant, pour que
+plusieurs utilisateurs suivent le même travail.
+
+Les types de tâches sont déclarés dans `TYPES_TACHES` (nom -> "module:fonction")
+et importés par le worker ; la fonction reçoit un `ContexteTache` puis les
+paramètres de la tâche, et renvoie un résultat sérialisable en JSON.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache"
+TACHES_PATH = CACHE_DIR / "taches.sqlite"
+
+NB_WORKERS = 2
+# Battement de cœur des workers et des tâches en cours (s).
+BATTEMENT_S = 5
+# Sans battement depuis ce délai, un worker est considéré arrêté et ses tâches échouées.
+WORKER_PERDU_S = 60
+# Écritures de progression et lectures de l'annulation espacées d'au moins ce délai (s).
+INTERVALLE_ECRITURE_S = 0.5
+
+EN_ATTENTE = "en_attente"
+EN_COURS = "en_cours"
+TERMINEE = "terminee"
+ERREUR = "erreur"
+ANNULEE = "annulee"
+STATUTS_ACTIFS = (EN_ATTENTE, EN_COURS)
+
+TYPES_TACHES: dict[str, str] = {
+    "priorisation_impact": "utils.priorisation_impact_batch:tache_priorisation",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tache (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT NOT NULL,
+    cle TEXT NOT NULL,
+    params TEXT NOT NULL,
+    statut TEXT NOT NULL,
+    progression REAL NOT NULL DEFAULT 0,
+    message TEXT,
+    resultat TEXT,
+    erreur TEXT,
+    annulation_demandee INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    cree_le REAL NOT NULL,
+    debut REAL,
+    fin REAL,
+    battement REAL
+);
+CREATE INDEX IF NOT EXISTS idx_tache_cle ON tache(cle, statut);
+CREATE INDEX IF NOT EXISTS idx_tache_statut ON tache(statut, id);
+CREATE TABLE IF NOT EXISTS tache_journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tache_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tache_journal ON tache_journal(tache_id, id);
+CREATE TABLE IF NOT EXISTS worker (
+    nom TEXT PRIMARY KEY,
+    pid INTEGER,
+    battement REAL NOT NULL
+);
+"""
+
+
+class TacheAnnulee(Exception):
+    """Levée dans le code d'une tâche dont l'annulation a été demandée."""
+
+
+@dataclass
+class Tache:
+    id: int
+    type: str
+    params: dict[str, Any]
+    statut: str
+    progression: float
+    message: Optional[str]
+    resultat: Any
+    erreur: Optional[str]
+    annulation_demandee: bool
+    cree_le: float
+    debut: Optional[float]
+    fin: Optional[float]
+
+    @property
+    def active(self) -> bool:
+        return self.statut in STATUTS_ACTIFS
+
+    @property
+    def duree_s(self) -> Optional[float]:
+        if self.debut is None:
+            return None
+        return (self.fin or time.time()) - self.debut
+
+
+def cle_tache(type_tache: str, params: dict[str, Any]) -> str:
+    """Empreinte (type, paramètres) : deux soumissions identiques ont la même clé."""
+    contenu = json.dumps([type_tache, params], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(contenu.encode("utf-8")).hexdigest()
+
+
+class FileTaches:
+    """File persistante des tâches, partagée entre les sessions Streamlit et les workers."""
+
+    def __init__(self, path: Path | str = TACHES_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None : transactions explicites (BEGIN IMMEDIATE) pour les réservations.
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    @staticmethod
+    def _tache(row: tuple) -> Tache:
+        (id_, type_, params, statut, progression, message, resultat, erreur,
+         annulation, cree_le, debut, fin) = row
+        return Tache(
+            id_, type_, json.loads(params), statut, progression, message,
+            None if resultat is None else json.loads(resultat), erreur,
+            bool(annulation), cree_le, debut, fin,
+        )
+
+    _COLONNES = (
+        "id, type, params, statut, progression, message, resultat, erreur, "
+        "annulation_demandee, cree_le, debut, fin"
+    )
+
+    # --- Côté pages ---
+
+    def soumettre(self, type_tache: str, params: dict[str, Any]) -> int:
+        """Met une tâche en file, ou renvoie l'identifiant de la tâche identique encore active."""
+        if type_tache not in TYPES_TACHES:
+            raise ValueError(f"Type de tâche inconnu : {type_tache}")
+        cle = cle_tache(type_tache, params)
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                f"SELECT id FROM tache WHERE cle = ? AND statut IN {STATUTS_ACTIFS} ORDER BY id LIMIT 1",
+                (cle,),
+            ).fetchone()
+            if row is None:
+                curseur = conn.execute(
+                    "INSERT INTO tache (type, cle, params, statut, cree_le) VALUES (?, ?, ?, ?, ?)",
+                    (type_tache, cle, json.dumps(params, ensure_ascii=False, default=str), EN_ATTENTE, time.time()),
+                )
+                row = (curseur.lastrowid,)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return int(row[0])
+
+    def lire(self, tache_id: int) -> Optional[Tache]:
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {self._COLONNES} FROM tache WHERE id = ?", (tache_id,)).fetchone()
+        return None if row is None else self._tache(row)
+
+    def active(self, type_tache: str, params: dict[str, Any]) -> Optional[Tache]:
+        """Tâche identique en attente ou en cours (pour la retrouver après un rafraîchissement)."""
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {self._COLONNES} FROM tache WHERE cle = ? AND statut IN {STATUTS_ACTIFS} ORDER BY id LIMIT 1",
+                (cle_tache(type_tache, params),),
+            ).fetchone()
+        return None if row is None else self._tache(row)
+
+    def lister(self, type_tache: Optional[str] = None, limite: int = 50) -> list[Tache]:
+        """Tâches les plus récentes, éventuellement d'un seul type."""
+        where, params = ("WHERE type = ?", (type_tache,)) if type_tache else ("", ())
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {self._COLONNES} FROM tache {where} ORDER BY id DESC LIMIT ?", (*params, limite)
+            ).fetchall()
+        return [self._tache(row) for row in rows]
+
+    def journal(self, tache_id: int, depuis_id: int = 0, limite: int = 500) -> list[tuple[int, float, str]]:
+        """Lignes de journal (id, horodatage, message) postérieures à `depuis_id`."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT id, ts, message FROM tache_journal WHERE tache_id = ? AND id > ? ORDER BY id LIMIT ?",
+                (tache_id, depuis_id, limite),
+            ).fetchall()
+
+    def dernieres_lignes(self, tache_id: int, n: int) -> list[tuple[int, float, str]]:
+        """Les `n` dernières lignes de journal (id, horodatage, message), dans l'ordre."""
+        with self._connect() as conn:
+            lignes = conn.execute(
+                "SELECT id, ts, message FROM tache_journal WHERE tache_id = ? ORDER BY id DESC LIMIT ?",
+                (tache_id, n),
+            ).fetchall()
+        return lignes[::-1]
+
+    def annuler(self, tache_id: int) -> bool:
+        """Annule une tâche en attente, ou demande l'arrêt d'une tâche en cours."""
+        with self._connect() as conn:
+            en_attente = conn.execute(
+                "UPDATE tache SET statut = ?, fin = ?, annulation_demandee = 1 WHERE id = ? AND statut = ?",
+                (ANNULEE, time.time(), tache_id, EN_ATTENTE),
+            ).rowcount
+            en_cours = conn.execute(
+                "UPDATE tache SET annulation_demandee = 1 WHERE id = ? AND statut = ?",
+                (tache_id, EN_COURS),
+            ).rowcount
+        return bool(en_attente or en_cours)
+
+    def workers_actifs(self) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM worker WHERE battement >= ?", (time.time() - WORKER_PERDU_S,)
+            ).fetchone()[0]
+
+    # --- Côté workers ---
+
+    def reserver(self, worker: str) -> Optional[Tache]:
+        """Passe la plus ancienne tâche en attente à `en_cours` pour ce worker (atomique)."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id FROM tache WHERE statut = ? ORDER BY id LIMIT 1", (EN_ATTENTE,)
+            ).fetchone()
+            if row is not None:
+                maintenant = time.time()
+                conn.execute(
+                    "UPDATE tache SET statut = ?, worker = ?, debut = ?, battement = ? WHERE id = ?",
+                    (EN_COURS, worker, maintenant, maintenant, row[0]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return None if row is None else self.lire(row[0])
+
+    def ecrire_progression(self, tache_id: int, progression: Optional[float], message: Optional[str]) -> bool:
+        """Met à jour la progression ; renvoie True si l'annulation est demandée."""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tache SET progression = COALESCE(?, progression), message = COALESCE(?, message), "
+                "battement = ? WHERE id = ?",
+                (progression, message, time.time(), tache_id),
+            )
+            return bool(conn.execute(
+                "SELECT annulation_demandee FROM tache WHERE id = ?", (tache_id,)
+            ).fetchone()[0])
+
+    def ajouter_journal(self, tache_id: int, message: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO tache_journal (tache_id, ts, message) VALUES (?, ?, ?)",
+                (tache_id, time.time(), str(message)),
+            )
+
+    def finir(self, tache_id: int, statut: str, *, resultat: Any = None, erreur: Optional[str] = None) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tache SET statut = ?, resultat = ?, erreur = ?, fin = ?, "
+                "progression = CASE WHEN ? = ? THEN 1 ELSE progression END WHERE id = ?",
+                (
+                    statut,
+                    None if resultat is None else json.dumps(resultat, ensure_ascii=False, default=str),
+                    erreur, time.time(), statut, TERMINEE, tache_id,
+                ),
+            )
+
+    def battre(self, worker: str, taches_en_cours: list[int]) -> None:
+        maintenant = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO worker VALUES (?, ?, ?)", (worker, os.getpid(), maintenant))
+            conn.executemany("UPDATE tache SET battement = ? WHERE id = ?", [(maintenant, t) for t in taches_en_cours])
+
+    def retirer_worker(self, worker: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM worker WHERE nom = ?", (worker,))
+
+    def recuperer_orphelines(self) -> int:
+        """Passe en erreur les tâches en cours dont le worker ne bat plus ; renvoie leur nombre.
+
+        Elles ne sont pas relancées automatiquement : une tâche interrompue a
+        pu écrire une partie de ses résultats.
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE tache SET statut = ?, erreur = ?, fin = ? WHERE statut = ? AND battement < ?",
+                (ERREUR, "Worker interrompu en cours de tâche", time.time(), EN_COURS, time.time() - WORKER_PERDU_S),
+            ).rowcount
+
+
+class ContexteTache:
+    """Transmis au code d'une tâche : progression, journal et annulation.
+
+    `write()` permet de le passer là où un container de statut Streamlit est
+    attendu (pipelines de priorisation) : chaque message va au journal.
+    """
+
+    def __init__(self, file: FileTaches, tache: Tache):
+        self.file = file
+        self.tache = tache
+        self._annulee = tache.annulation_demandee
+        self._derniere_ecriture = 0.0
+        # Dernières valeurs pas encore écrites (écritures espacées).
+        self._fraction: Optional[float] = None
+        self._message: Optional[str] = None
+        self._lock = threading.Lock()
+
+    @property
+    def annulee(self) -> bool:
+        self._rafraichir(None, None, force=False)
+        return self._annulee
+
+    def verifier_annulation(self) -> None:
+        if self.annulee:
+            raise TacheAnnulee(f"Tâche {self.tache.id} annulée")
+
+    def progression(self, fraction: Optional[float] = None, message: Optional[str] = None) -> None:
+        """Avancement (0 à 1) et message courant ; lève `TacheAnnulee` si l'annulation est demandée."""
+        self._rafraichir(fraction, message, force=fraction is not None and fraction >= 1)
+        if self._annulee:
+            raise TacheAnnulee(f"Tâche {self.tache.id} annulée")
+
+    def log(self, message: str) -> None:
+        self.file.ajouter_journal(self.tache.id, message)
+
+    def write(self, message: Any) -> None:
+        self.log(str(message))
+        self.verifier_annulation()
+
+    def _rafraichir(self, fraction: Optional[float], message: Optional[str], *, force: bool) -> None:
+        with self._lock:
+            if fraction is not None:
+                self._fraction = fraction
+            if message is not None:
+                self._message = message
+            maintenant = time.monotonic()
+            if not force and maintenant - self._derniere_ecriture < INTERVALLE_ECRITURE_S:
+                return
+            self._derniere_ecriture = maintenant
+            annulee = self.file.ecrire_progression(self.tache.id, self._fraction, self._message)
+            self._fraction = self._message = None
+            self._annulee = self._annulee or annulee
+
+
+def _fonction(type_tache: str) -> Callable[..., Any]:
+    module, _, nom = TYPES_TACHES[type_tache].partition(":")
+    return getattr(importlib.import_module(module), nom)
+
+
+def executer(file: FileTaches, tache: Tache) -> str:
+    """Exécute une tâche réservée et enregistre son issue ; renvoie le statut final."""
+    contexte = ContexteTache(file, tache)
+    try:
+        resultat = _fonction(tache.type)(contexte, **tache.params)
+    except TacheAnnulee:
+        statut, resultat, erreur = ANNULEE, None, None
+        contexte.log("⛔ Tâche annulée")
+    except Exception as exc:  # noqa: BLE001 - l'erreur est rapportée à la page
+        statut, resultat, erreur = ERREUR, None, f"{type(exc).__name__}: {exc}"
+        contexte.log(traceback.format_exc(limit=5))
+    else:
+        statut, erreur = TERMINEE, None
+    file.finir(tache.id, statut, resultat=resultat, erreur=erreur)
+    return statut
+
+
+def traiter_suivante(file: FileTaches, worker: str) -> Optional[str]:
+    """Réserve et exécute la prochaine tâche en attente ; None si la file est vide."""
+    tache = file.reserver(worker)
+    return None if tache is None else executer(file, tache)
+
+
+def servir(file: FileTaches, nb_workers: int = NB_WORKERS, arret: Optional[threading.Event] = None) -> None:
+    """Boucle du process de workers : `nb_workers` threads qui vident la file jusqu'à `arret`."""
+    arret = arret or threading.Event()
+    nom = f"{socket.gethostname()}:{os.getpid()}"
+    en_cours: dict[str, int] = {}
+
+    def boucle(numero: int) -> None:
+        worker = f"{nom}#{numero}"
+        while not arret.is_set():
+            tache = file.reserver(worker)
+            if tache is None:
+                arret.wait(1)
+                continue
+            en_cours[worker] = tache.id
+            try:
+                executer(file, tache)
+            finally:
+                en_cours.pop(worker, None)
+
+    threads = [threading.Thread(target=boucle, args=(i,), daemon=True) for i in range(max(1, nb_workers))]
+    for thread in threads:
+        thread.start()
+    try:
+        while not arret.is_set():
+            file.battre(nom, list(en_cours.values()))
+            file.recuperer_orphelines()
+            arret.wait(BATTEMENT_S)
+    finally:
+        arret.set()
+        for thread in threads:
+            thread.join(timeout=BATTEMENT_S)
+        file.retirer_worker(nom)
+
+
+_lancement_lock = threading.Lock()
+_dernier_lancement = 0.0
+
+
+def demarrer_workers(file: Optional[FileTaches] = None, nb_workers: int = NB_WORKERS) -> bool:
+    """Lance le process de workers s'il ne tourne pas ; renvoie True s'il a été lancé.
+
+    Appelé par les pages à la soumission : plusieurs sessions simultanées ne
+    lancent qu'un process (verrou local, puis battement de cœur en base).
+    """
+    global _dernier_lancement
+    file = file or FileTaches()
+    with _lancement_lock:
+        if file.workers_actifs() or time.monotonic() - _dernier_lancement < WORKER_PERDU_S:
+            return False
+        _dernier_lancement = time.monotonic()
+    racine = Path(__file__).resolve().parent.parent
+    subprocess.Popen(
+        [sys.executable, "-m", "utils.taches_fond", "--workers", str(nb_workers), "--file", str(file.path)],
+        cwd=racine,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    return True
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m utils.taches_fond", description="Process de workers des tâches de fond.")
+    parser.add_argument("--workers", type=int, default=NB_WORKERS, help="Tâches exécutées en parallèle")
+    parser.add_argument("--file", type=Path, default=TACHES_PATH, help="Base SQLite de la file")
+    args = parser.parse_args(argv)
+
+    file = FileTaches(args.file)
+    if file.workers_actifs():
+        print("ℹ️ Un process de workers tourne déjà sur cette file.")
+        return 0
+    arret = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: arret.set())
+    print(f"🚀 {args.workers} worker(s) sur {file.path}", flush=True)
+    servir(file, args.workers, arret)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,76 @@
+"""Suivi, dans une page Streamlit, d'une tâche de fond (utils.taches_fond).
+
+Le bloc de suivi est un fragment rafraîchi toutes les `intervalle_s`
+secondes tant que la tâche est active : seul lui est réexécuté, pas la page.
+À la fin de la tâche, la page entière est relancée pour afficher le résultat.
+"""
+
+from __future__ import annotations
+
+from datetime import datetime
+from typing import Optional
+
+import streamlit as st
+
+from utils.taches_fond import ANNULEE, EN_ATTENTE, EN_COURS, ERREUR, TERMINEE, FileTaches, Tache
+
+INTERVALLE_S = 2
+LIGNES_JOURNAL = 30
+
+_LIBELLES = {
+    EN_ATTENTE: "⏳ En attente d'un worker",
+    EN_COURS: "🔄 En cours",
+    TERMINEE: "✅ Terminée",
+    ERREUR: "❌ En erreur",
+    ANNULEE: "⛔ Annulée",
+}
+
+
+def _rendu(file: FileTaches, tache: Tache, lignes_journal: int) -> None:
+    libelle = _LIBELLES.get(tache.statut, tache.statut)
+    if tache.annulation_demandee and tache.active:
+        libelle += " (annulation demandée)"
+    duree = f" — {tache.duree_s:.0f} s" if tache.duree_s is not None else ""
+    st.markdown(f"**Tâche n°{tache.id}** : {libelle}{duree}")
+    st.progress(min(max(tache.progression, 0.0), 1.0), text=tache.message or None)
+    if tache.erreur:
+        st.error(tache.erreur)
+    if tache.active and not tache.annulation_demandee:
+        if st.button("⛔ Annuler la tâche", key=f"annuler_tache_{tache.id}"):
+            file.annuler(tache.id)
+            st.rerun(scope="fragment")
+
+    journal = file.dernieres_lignes(tache.id, lignes_journal)
+    if journal:
+        with st.expander(f"📜 Journal ({len(journal)} dernière(s) ligne(s))", expanded=tache.active):
+            st.code(
+                "\n".join(f"{datetime.fromtimestamp(ts):%H:%M:%S} {message}" for _, ts, message in journal),
+                language=None,
+            )
+
+
+def afficher_suivi(
+    file: FileTaches,
+    tache_id: int,
+    *,
+    intervalle_s: float = INTERVALLE_S,
+    lignes_journal: int = LIGNES_JOURNAL,
+) -> Optional[Tache]:
+    """Affiche l'état de la tâche, rafraîchi tant qu'elle est active ; renvoie la tâche lue."""
+    tache = file.lire(tache_id)
+    if tache is None:
+        st.warning(f"Tâche n°{tache_id} introuvable.")
+        return None
+    if not tache.active:
+        _rendu(file, tache, lignes_journal)
+        return tache
+
+    @st.fragment(run_every=intervalle_s)
+    def _suivi() -> None:
+        courante = file.lire(tache_id)
+        _rendu(file, courante, lignes_journal)
+        if not courante.active:
+            st.rerun()
+
+    _suivi()
+    return tache
@@ -0,0 +1,250 @@
+"""Classification thématique des fiches action par mots-clés, précalculée.
+
+Chaque thématique (biodiversité, ...) est une liste de mots-clés cherchés
+comme sous-chaînes, sans casse ni accents, dans le titre et la description
+des fiches. Tous les mots-clés de toutes les thématiques sont compilés dans
+un seul automate d'Aho-Corasick : chaque texte est parcouru une seule fois,
+quel que soit le nombre de mots-clés.
+
+Les thématiques trouvées sont stockées par fiche dans une base SQLite locale
+(.cache/), synchronisée de façon incrémentale sur `fiche_action.modified_at`
+(lecture seule en base) : un dashboard thématique n'a plus qu'à joindre sur
+`StoreThemes.fiches(theme)` au lieu de relancer des dizaines de `LIKE`.
+Modifier les mots-clés d'une thématique déclenche une reclassification
+complète au synchronisation suivante.
+
+Usage en ligne de commande : `python -m utils.themes_fiches [--complet]`.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import sqlite3
+import sys
+import threading
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Iterable, Mapping
+
+import pandas as pd
+from sqlalchemy import text
+
+from utils.recherche_texte import normaliser
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / ".cache"
+THEMES_PATH = CACHE_DIR / "themes_fiches.sqlite"
+
+# Mots-clés inclusifs par thématique (titre ou description), sans se soucier
+# des accents ni de la casse.
+THEMES: dict[str, list[str]] = {
+    "biodiversite": [
+        "trame verte",
+        "trame bleue",
+        "trame bleu",
+        "trame noire",
+        "haie",
+        "pollution sonore",
+        "biodiversité",
+        "biodiv",
+        "artificialisation",
+        "phytosanitaire",
+        "pesticide",
+        "engrais",
+        "espèce exotique",
+        "exotique envahissant",
+        "captage d'eau",
+        "zone de captage",
+        "renaturation",
+        "restauration de milieu",
+        "milieux naturels",
+        "aire protégée",
+        "aires protégées",
+        "natura 2000",
+    ],
+}
+
+_SQL_FICHES = """
+    SELECT
+        fa.id AS fiche_id,
+        fa.titre,
+        fa.description,
+        COALESCE(fa.deleted, FALSE) AS deleted,
+        fa.modified_at
+    FROM fiche_action fa
+    {filtre}
+"""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fiche_theme (
+    fiche_id INTEGER NOT NULL,
+    theme TEXT NOT NULL,
+    motifs TEXT NOT NULL,
+    PRIMARY KEY (fiche_id, theme)
+);
+CREATE INDEX IF NOT EXISTS idx_fiche_theme_theme ON fiche_theme(theme);
+CREATE TABLE IF NOT EXISTS meta (
+    cle TEXT PRIMARY KEY,
+    valeur TEXT
+);
+"""
+
+
+class MatcheurMotsCles:
+    """Automate d'Aho-Corasick sur des mots-clés normalisés (sans casse ni accents).
+
+    Les transitions sont résolues à la construction (automate déterministe) :
+    le parcours d'un texte coûte une consultation de dictionnaire par caractère.
+    """
+
+    def __init__(self, motifs: Mapping[str, Iterable[str]]):
+        # motifs : {étiquette: [mot-clé, ...]}
+        transitions: list[dict[str, int]] = [{}]
+        sorties: list[set[tuple[str, str]]] = [set()]
+        for etiquette, mots in motifs.items():
+            for mot in mots:
+                mot_normalise = normaliser(mot)
+                if not mot_normalise:
+                    continue
+                etat = 0
+                for ch in mot_normalise:
+                    suivant = transitions[etat].get(ch)
+                    if suivant is None:
+                        suivant = len(transitions)
+                        transitions[etat][ch] = suivant
+                        transitions.append({})
+                        sorties.append(set())
+                    etat = suivant
+                sorties[etat].add((etiquette, mot_normalise))
+
+        # Liens d'échec en largeur, transitions manquantes héritées du lien d'échec.
+        echecs = [0] * len(transitions)
+        file = deque(transitions[0].values())
+        while file:
+            etat = file.popleft()
+            sorties[etat] |= sorties[echecs[etat]]
+            for ch, suivant in transitions[etat].items():
+                file.append(suivant)
+                repli = echecs[etat]
+                while repli and ch not in transitions[repli]:
+                    repli = echecs[repli]
+                echecs[suivant] = transitions[repli].get(ch, 0) if etat else 0
+            for ch, cible in transitions[echecs[etat]].items():
+                transitions[etat].setdefault(ch, cible)
+
+        self._transitions = transitions
+        self._sorties = [frozenset(s) for s in sorties]
+
+    def correspondances(self, texte: str | None) -> dict[str, set[str]]:
+        """{étiquette: mots-clés trouvés} pour un texte."""
+        trouves: dict[str, set[str]] = defaultdict(set)
+        if not texte:
+            return trouves
+        transitions, sorties = self._transitions, self._sorties
+        etat = 0
+        for ch in normaliser(texte):
+            etat = transitions[etat].get(ch, 0)
+            if sorties[etat]:
+                for etiquette, mot in sorties[etat]:
+                    trouves[etiquette].add(mot)
+        return trouves
+
+
+def version_themes(themes: Mapping[str, Iterable[str]] = THEMES) -> str:
+    """Empreinte des mots-clés : une modification impose une reclassification."""
+    canonique = json.dumps({k: sorted(v) for k, v in themes.items()}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonique.encode("utf-8")).hexdigest()[:16]
+
+
+class StoreThemes:
+    """Thématiques par fiche (SQLite local), alimentées depuis fiche_action."""
+
+    def __init__(self, path: Path | str = THEMES_PATH, themes: Mapping[str, Iterable[str]] = THEMES):
+        self.path = Path(path)
+        self.themes = {k: list(v) for k, v in themes.items()}
+        self.version = version_themes(self.themes)
+        self.matcheur = MatcheurMotsCles(self.themes)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _meta(self, conn: sqlite3.Connection, cle: str) -> str | None:
+        row = conn.execute("SELECT valeur FROM meta WHERE cle = ?", (cle,)).fetchone()
+        return row[0] if row else None
+
+    def classer(self, titre: str | None, description: str | None) -> dict[str, set[str]]:
+        trouves = self.matcheur.correspondances(titre)
+        for theme, mots in self.matcheur.correspondances(description).items():
+            trouves[theme] |= mots
+        return trouves
+
+    def appliquer(self, df: pd.DataFrame, conn: sqlite3.Connection) -> None:
+        """Reclasse des fiches (fiche_id, titre, description, deleted) ; une fiche supprimée perd ses thèmes."""
+        ids = [(int(i),) for i in df["fiche_id"]]
+        conn.executemany("DELETE FROM fiche_theme WHERE fiche_id = ?", ids)
+        lignes = []
+        for row in df.itertuples(index=False):
+            if row.deleted:
+                continue
+            for theme, mots in self.classer(row.titre, row.description).items():
+                lignes.append((int(row.fiche_id), theme, json.dumps(sorted(mots), ensure_ascii=False)))
+        conn.executemany("INSERT INTO fiche_theme VALUES (?, ?, ?)", lignes)
+
+    def synchroniser(self, engine, complet: bool = False) -> int:
+        """Classe les fiches modifiées depuis la dernière synchronisation ; renvoie le nb de fiches lues.
+
+        `engine` n'est utilisé qu'en lecture. La première synchronisation, ou
+        un changement de mots-clés, reclasse toutes les fiches.
+        """
+        with self._lock, self._connect() as conn:
+            depuis = self._meta(conn, "modified_at")
+            if complet or self._meta(conn, "version") != self.version:
+                depuis = None
+            filtre, params = "", {}
+            if depuis is not None:
+                filtre, params = "WHERE fa.modified_at > :depuis", {"depuis": depuis}
+            with engine.connect() as conn_source:
+                df = pd.read_sql_query(text(_SQL_FICHES.format(filtre=filtre)), conn_source, params=params)
+
+            if depuis is None:
+                conn.execute("DELETE FROM fiche_theme")
+            self.appliquer(df, conn)
+            if df["modified_at"].notna().any():
+                plus_recente = pd.Timestamp(df["modified_at"].max()).isoformat()
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('modified_at', ?)", (plus_recente,))
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (self.version,))
+            return len(df)
+
+    def fiches(self, theme: str) -> list[int]:
+        """Identifiants des fiches rattachées à une thématique."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT fiche_id FROM fiche_theme WHERE theme = ? ORDER BY fiche_id", (theme,))
+            return [r[0] for r in rows]
+
+    def tags(self, theme: str | None = None) -> pd.DataFrame:
+        """Table (fiche_id, theme, motifs) pour jointure, éventuellement limitée à un thème."""
+        where, params = ("WHERE theme = ?", (theme,)) if theme else ("", ())
+        with self._connect() as conn:
+            df = pd.read_sql_query(f"SELECT fiche_id, theme, motifs FROM fiche_theme {where}", conn, params=params)
+        df["motifs"] = df["motifs"].map(json.loads)
+        return df
+
+
+def _main(argv: list[str]) -> int:
+    from utils.db import get_engine_prod
+
+    store = StoreThemes()
+    nb = store.synchroniser(get_engine_prod(), complet="--complet" in argv)
+    print(f"{nb} fiches classées")
+    for theme in store.themes:
+        print(f"  {theme} : {len(store.fiches(theme))} fiches")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(_main(sys.argv[1:]))